@@ -10,17 +10,38 @@ Author: Namah Shrestha
 
 # builtins
 import asyncio
+import functools
+import logging
+import math
+import os
+import socket
 import typing
 import json
 
 # third party
 import websockets
+import websockets.exceptions
+import websockets.legacy.server
 
 # modules
-import src
+import src.admission as admission
 import src.instance_manager as im
 import src.instance_exec as ie
 import src.constants as constants
+import src.container_events as ce
+import src.container_index as ci
+import src.container_pool as cp
+import src.exec_limits as el
+import src.executor as executor
+import src.message as msg
+import src.metrics as metrics
+import src.reaper as rp
+import src.session as ss
+import src.session_registry as sr
+import src.session_snapshot as sn
+import src.single_flight as sf
+import src.tracing as tracing
+import src.workers as wk
 
 
 """
@@ -41,72 +62,517 @@ command_switch: dict = {
 """
 We will have one change directory handler.
 This change directory handler should be specific to a session.
+Every websocket connection is a session, see src.session.
 
 Author: Namah Shrestha
 """
 
+INVALID_MESSAGE_ERROR: str = msg.INVALID_MESSAGE_ERROR
 
-async def socket_handler(websocket) -> None:
-    try:
-        """
-        Handle socket connection asynchronusly and return the response.
-
-        This is the core controller of the application.
-
-        Author: Namah Shrestha
-        """
-        message: str = await websocket.recv()
-        if src.InstanceMessage.is_schema_valid(message):
-            json_message: dict = src.InstanceMessage.decode_message(message)
-            instance_os: str = json_message.get(constants.INSTANCE_OS)
-            if instance_os not in constants.SUPPORTED_OS:
-                raise ValueError(f"Unsupported instance os: {instance_os}")
-            command: str = json_message.get(constants.COMMAND)
-            if command not in constants.SUPPORTED_COMMANDS:
-                raise ValueError(f"Unsupported command: {command}")
-            instance_hash: str = json_message[constants.INSTANCE_HASH]
-            instance_class: typing.Union[
-                im.InstanceManager, ie.InstanceExec
-            ] = command_switch.get(command).get(instance_os)
-            instance_obj: typing.Union[
-                im.InstanceManager, ie.InstanceExec
-            ] = instance_class(command, instance_hash)
-            exec_command: typing.Optional[str] = json_message.get(
-                constants.EXEC_COMMAND
+
+"""
+Deletes the sessions of users who left without DELETE.
+
+Author: Namah Shrestha
+"""
+reaper: rp.SessionReaper = rp.SessionReaper(instance_manager_switch)
+
+
+"""
+The warm pools, the reaper, the container events watcher, the tracer,
+the admission controller and the lifecycle flights report their stats
+on every scrape of the metrics endpoint.
+
+Author: Namah Shrestha
+"""
+metrics.registry.register_collector(
+    metrics.stats_collector(
+        "zod_pool",
+        "Warm container pool stats.",
+        ("instance_os",),
+        lambda: [((stats["instance_os"],), stats) for stats in cp.pool_stats()],
+    )
+)
+metrics.registry.register_collector(
+    metrics.stats_collector(
+        "zod_reaper",
+        "Idle session reaper stats.",
+        (),
+        lambda: [((), reaper.stats())],
+    )
+)
+metrics.registry.register_collector(
+    metrics.stats_collector(
+        "zod_events",
+        "Container events watcher stats.",
+        (),
+        lambda: [((), ce.watcher.stats())],
+    )
+)
+metrics.registry.register_collector(
+    metrics.stats_collector(
+        "zod_tracing",
+        "Request tracing stats.",
+        (),
+        lambda: [((), tracing.tracer.stats())],
+    )
+)
+metrics.registry.register_collector(
+    metrics.stats_collector(
+        "zod_lifecycle_flights",
+        "Single flight stats of CREATE and DELETE.",
+        (),
+        lambda: [((), sf.lifecycle_flights.stats())],
+    )
+)
+metrics.registry.register_collector(
+    metrics.stats_collector(
+        "zod_admission",
+        "Admission control stats per command.",
+        ("command",),
+        lambda: [
+            ((command,), stats)
+            for command, stats in admission.admission_controller.stats().items()
+        ],
+    )
+)
+
+
+async def handle_message(
+    session: ss.Session,
+    message: str,
+    websocket,
+    message_obj: typing.Optional[msg.Message] = None,
+) -> None:
+    """
+    Validate one message, dispatch it to the instance and send the response.
+
+    The session is bound to the instance hash of the first message.
+    The container id is kept in the session so that consecutive EXEC
+    commands go straight to the container.
+
+    The message is decoded and validated once, on the event loop,
+    unless the socket handler passes it parsed already.
+    Every docker call is awaited
+    from the executor pools, so a slow CREATE never blocks other sessions.
+
+    An EXEC with "stream": true sends output frames while the command
+    runs and a final exit frame, instead of one response at the end.
+    An EXEC with "exec_commands" runs the list in one round trip and
+    answers with the output and exit code of every command.
+
+    Every command is admitted by the admission controller first.
+    Raise admission.BusyError when the server is too busy to take it.
+    The latency of every valid message is recorded per command and os.
+    A sampled share of the messages is traced, from validation to the
+    response, see src.tracing.
+
+    Every EXEC runs within the limits of src.exec_limits. A CANCEL
+    stops the EXEC running in the session, whose response then tells
+    it was cancelled. It is answered only if there is nothing to cancel.
+
+    Author: Namah Shrestha
+    """
+    with tracing.tracer.trace("request") as trace:
+        if message_obj is None:
+            with tracing.span("parse_message"):
+                message_obj = msg.parse_message(message)
+        command: str = message_obj.command
+        if trace is not None:
+            trace.set(
+                command=command,
+                instance_os=message_obj.instance_os,
+                instance_hash=message_obj.instance_hash,
+            )
+        with metrics.track_request(command, message_obj.instance_os):
+            await dispatch_message(session, message_obj, websocket)
+
+
+async def dispatch_message(
+    session: ss.Session, message_obj: msg.Message, websocket
+) -> None:
+    """
+    Run the command of a valid message and send the response.
+
+    A CREATE of a session that runs already is answered right away.
+    Concurrent CREATE and DELETE of one instance hash share one flight,
+    see src.single_flight, and a CREATE is claimed in the session registry
+    across worker processes. A session paused or saved by the reaper is
+    resumed or restored before an EXEC or CREATE, see src.session_pause
+    and src.session_snapshot.
+
+    Author: Namah Shrestha
+    """
+    command: str = message_obj.command
+    if session.bind(message_obj.instance_hash, message_obj.instance_os):
+        await executor.run_blocking(command, session.load_cwd)
+    if command == constants.CANCEL:
+        if not await executor.run_blocking(command, session.cancel_exec):
+            await websocket.send(constants.NOTHING_TO_CANCEL)
+        return
+    instance_class: typing.Union[
+        im.InstanceManager, ie.InstanceExec
+    ] = command_switch.get(command).get(message_obj.instance_os)
+    instance_obj: typing.Union[im.InstanceManager, ie.InstanceExec] = instance_class(
+        command, message_obj.instance_hash
+    )
+    if command != constants.EXECUTE:
+        response: list
+        if command == constants.CREATE:
+            await resume_session(session, message_obj.instance_hash)
+        if command == constants.CREATE and await executor.run_blocking(
+            command, instance_obj.running_container
+        ):
+            response = [0]
+        else:
+            await executor.run_blocking(command, session.invalidate_container)
+            response = await sf.lifecycle_flights.run(
+                message_obj.instance_hash,
+                command,
+                functools.partial(handle_lifecycle, instance_obj),
             )
-            """ Now we need to calculate the current working directory """
-            response: list = instance_obj.handle(exec_command)
+        with tracing.span("send_response"):
             await websocket.send(json.dumps(response))
+        return
+    async with admission.admission_controller.admit(command):
+        await executor.run_blocking(
+            command, reaper.begin_exec, message_obj.instance_hash
+        )
+        try:
+            await resume_session(session, message_obj.instance_hash)
+            await run_exec(session, message_obj, instance_obj, websocket)
+        finally:
+            await executor.run_blocking(command, end_exec, session)
+
+
+async def run_exec(
+    session: ss.Session,
+    message_obj: msg.Message,
+    instance_obj: ie.InstanceExec,
+    websocket,
+) -> None:
+    """
+    Run the EXEC of a valid message in the container and shell of the
+    session and send the response.
+
+    Author: Namah Shrestha
+    """
+    command: str = message_obj.command
+    exec_command: typing.Optional[str] = message_obj.exec_command
+    instance_obj.container_id = session.container_id
+    instance_obj.keep_shell = constants.PERSISTENT_SHELL
+    instance_obj.shell = session.shell
+    instance_obj.change_directory_handler = session.change_directory_handler
+    instance_obj.limits = el.requested_limits(
+        message_obj.timeout, message_obj.max_output
+    )
+    session.limits = instance_obj.limits
+    try:
+        if message_obj.stream:
+            await stream_exec(instance_obj, exec_command, websocket)
+            return
+        if message_obj.exec_commands:
+            response = await executor.run_blocking(
+                command,
+                instance_obj.exec_batch,
+                message_obj.exec_commands,
+                message_obj.stop_on_error,
+            )
         else:
-            error_message: str = (
-                "Invalid message body format."
-                "Message should have 'instance_os',"
-                " 'command', 'instance_hash', 'exec_command<optional>'"
+            response = await instance_obj.async_handle(exec_command)
+    finally:
+        session.limits = None
+        session.container_id = instance_obj.container_id
+        session.shell = instance_obj.shell
+    with tracing.span("send_response"):
+        await websocket.send(json.dumps(response))
+
+
+def end_exec(session: ss.Session) -> None:
+    """
+    Record the working directory the EXEC left the session in and the
+    end of the EXEC, in one executor call.
+
+    Author: Namah Shrestha
+    """
+    session.record_cwd()
+    reaper.end_exec(session.instance_hash)
+
+
+async def resume_session(session: ss.Session, instance_hash: str) -> None:
+    """
+    Restore the session if the reaper saved it, unpause it if the reaper
+    paused it. A restored session starts a new shell in its new container.
+    An EXEC is recorded as running first, so the session cannot be paused
+    or saved again before its command ends.
+
+    Author: Namah Shrestha
+    """
+    with tracing.span("resume_session"):
+        if await reaper.restore(instance_hash):
+            await executor.run_blocking(constants.EXECUTE, session.forget_container)
+        await reaper.resume(instance_hash)
+
+
+async def handle_lifecycle(instance_obj: im.InstanceManager) -> list:
+    """
+    Create or delete the instance once it is admitted.
+
+    Author: Namah Shrestha
+    """
+    async with admission.admission_controller.admit(instance_obj.command):
+        response: list = await instance_obj.async_handle()
+    if instance_obj.command == constants.CREATE:
+        reaper.wake()
+    return response
+
+
+async def stream_exec(
+    instance_obj: ie.InstanceExec,
+    exec_command: typing.Optional[str],
+    websocket,
+) -> None:
+    """
+    Send the output of the command as output frames while it runs,
+    then the exit frame with its exit code, and the flag of the limit
+    that stopped the command, if any.
+
+    Author: Namah Shrestha
+    """
+
+    async def send_chunk(chunk: list) -> None:
+        await websocket.send(
+            json.dumps(
+                {
+                    constants.FRAME_TYPE: constants.OUTPUT_FRAME,
+                    constants.FRAME_DATA: chunk,
+                }
             )
-            await websocket.send(error_message)
-            raise ValueError(error_message)
+        )
+
+    exit_code: typing.Optional[int] = await instance_obj.async_stream(
+        send_chunk, exec_command
+    )
+    await websocket.send(
+        json.dumps(
+            {
+                constants.FRAME_TYPE: constants.EXIT_FRAME,
+                constants.FRAME_EXIT_CODE: exit_code,
+                **instance_obj.limits.flags(),
+            }
+        )
+    )
+
+
+async def serve_message(
+    session: ss.Session,
+    message: str,
+    websocket,
+    message_obj: typing.Optional[msg.Message] = None,
+) -> None:
+    """
+    Handle one message of the session.
+
+    Invalid messages are answered with the error and the session goes on,
+    like an EXEC on a container that stopped or a failed restore.
+    Anything unexpected raises and closes the session.
+
+    Author: Namah Shrestha
+    """
+    try:
+        await handle_message(session, message, websocket, message_obj)
     except TypeError as te:
-        type_error_message: str = str(te)
-        await websocket.send(type_error_message)
-        raise TypeError(te)
+        metrics.invalid_messages.inc()
+        await websocket.send(str(te))
     except ValueError as ve:
-        value_error_message: str = str(ve)
-        await websocket.send(value_error_message)
-        raise ValueError(ve)
+        metrics.invalid_messages.inc()
+        await websocket.send(str(ve))
+    except admission.BusyError as be:
+        await websocket.send(str(be))
+    except ce.ContainerGoneError as ge:
+        await executor.run_blocking(constants.EXECUTE, session.invalidate_container)
+        await websocket.send(str(ge))
+    except sn.SnapshotError as se:
+        await websocket.send(str(se))
+    except websockets.exceptions.ConnectionClosed:
+        raise
     except Exception:
         exception_message: str = "Something went wrong"
         await websocket.send(exception_message)
         raise Exception(exception_message)
 
 
+async def socket_handler(websocket) -> None:
+    """
+    Handle socket connection asynchronusly and return the response.
+
+    This is the core controller of the application.
+    One connection is one session. We keep receiving messages until
+    the client closes the connection, so that clients do not pay a
+    handshake for every command.
+
+    Messages are handled one after the other. We keep receiving while a
+    message is handled, so that a CANCEL stops the running EXEC right
+    away. Any other message waits for the running one, and so does a
+    CANCEL behind it.
+    The persistent shell of the session ends with it.
+
+    Author: Namah Shrestha
+    """
+    session: ss.Session = ss.Session()
+    running: typing.Optional[asyncio.Task] = None
+    try:
+        while True:
+            receive: asyncio.Future = asyncio.ensure_future(websocket.recv())
+            try:
+                if running is not None:
+                    await asyncio.wait(
+                        {receive, running}, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if running.done():
+                        finished, running = running, None
+                        finished.result()
+                message: str = await receive
+                message_obj: typing.Optional[msg.Message] = None
+                if running is not None:
+                    try:
+                        message_obj = msg.parse_message(message)
+                    except ValueError:
+                        pass
+                    if not msg.is_cancel(message_obj):
+                        finished, running = running, None
+                        await finished
+                if running is None:
+                    running = asyncio.ensure_future(
+                        serve_message(session, message, websocket, message_obj)
+                    )
+                else:
+                    await serve_message(session, message, websocket, message_obj)
+            except websockets.exceptions.ConnectionClosed:
+                return
+            finally:
+                receive.cancel()
+    finally:
+        if running is not None:
+            try:
+                await running
+            except websockets.exceptions.ConnectionClosed:
+                pass
+        if session.shell is not None:
+            await executor.run_blocking(constants.EXECUTE, session.close_shell)
+
+
+async def main(
+    worker: typing.Optional[int] = None, sock: typing.Optional[socket.socket] = None
+) -> None:
+    """
+    Start the background tasks, the metrics endpoint and serve the web socket.
+
+    A worker of the multi process mode serves on the listening socket of
+    the supervisor, or binds the port with SO_REUSEPORT if there is none.
+    Every worker gets its share of the warm pools of the served oses and
+    of the create and delete limits, which add up to the limits of the
+    server, and its metrics endpoint on the metrics port plus its index.
+    The sessions are shared in the session registry, so only the first
+    worker rebuilds it from the labelled containers, removing the orphans
+    of every shard, and reaps them. Every worker follows the container
+    events itself and writes its traces to a file of its own.
+
+    Author: Namah Shrestha
+    """
+    workers: int = 1 if worker is None else constants.WORKERS
+    shards: list = (
+        [""] if worker is None else [f"w{index}_" for index in range(workers)]
+    )
+    if not worker:
+        await executor.run_blocking(
+            constants.CREATE, ci.container_index.rebuild, shards
+        )
+    if constants.WATCH_EVENTS:
+        ce.watcher.start()
+    if constants.TRACE_SAMPLE_RATE > 0:
+        trace_file: str = constants.TRACE_FILE
+        if worker is not None:
+            root, extension = os.path.splitext(trace_file)
+            trace_file = f"{root}.w{worker}{extension}"
+        tracing.exporter.start(trace_file)
+    cp.setup_pools(
+        math.ceil(constants.POOL_SIZE / workers),
+        shards[worker or 0],
+        instance_manager_switch,
+    )
+    if workers > 1:
+        admission.admission_controller = admission.AdmissionController(
+            {
+                constants.CREATE: wk.worker_share(
+                    constants.CREATE_CONCURRENCY, workers, worker
+                ),
+                constants.DELETE: wk.worker_share(
+                    constants.DELETE_CONCURRENCY, workers, worker
+                ),
+                constants.EXECUTE: constants.EXEC_CONCURRENCY,
+            }
+        )
+    refill_task: asyncio.Task = asyncio.ensure_future(cp.refill_pools())
+    reaper_task: typing.Optional[asyncio.Task] = None
+    if not worker:
+        reaper_task = asyncio.ensure_future(reaper.run())
+    metrics_server: metrics.MetricsServer = metrics.MetricsServer()
+    if constants.METRICS_PORT:
+        await metrics_server.start(
+            constants.METRICS_HOST, constants.METRICS_PORT + (worker or 0)
+        )
+    server: websockets.legacy.server.Serve
+    if sock is not None:
+        server = websockets.serve(socket_handler, sock=sock)
+    else:
+        server = websockets.serve(
+            socket_handler,
+            constants.SERVER_HOST,
+            constants.SERVER_PORT,
+            reuse_port=workers > 1,
+            backlog=constants.LISTEN_BACKLOG,
+        )
+    try:
+        async with server:
+            await asyncio.Future()
+    finally:
+        refill_task.cancel()
+        if reaper_task is not None:
+            reaper_task.cancel()
+        if constants.WATCH_EVENTS:
+            ce.watcher.stop()
+        tracing.exporter.stop()
+        await metrics_server.stop()
+
+
+def run_worker(index: int, sock: typing.Optional[socket.socket]) -> None:
+    """
+    Run one worker process of the multi process mode until it is interrupted.
+
+    Author: Namah Shrestha
+    """
+    logging.basicConfig(
+        level=logging.INFO, format=f"worker {index} %(levelname)s:%(name)s:%(message)s"
+    )
+    try:
+        asyncio.run(main(index, sock))
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
     """
     Server creation and service.
+    With ZOD_WORKERS above 1 the supervisor runs that many worker processes.
+    They share the session registry in a file.
 
     Author: Namah Shrestha
     """
-    start_server: websockets.legacy.server.Serve = websockets.serve(
-        socket_handler, "0.0.0.0", 8888
-    )
-    asyncio.get_event_loop().run_until_complete(start_server)
-    asyncio.get_event_loop().run_forever()
+    logging.basicConfig(level=logging.INFO)
+    if constants.WORKERS > 1:
+        if constants.SESSION_REGISTRY_PATH == ":memory:":
+            sr.session_registry.path = constants.SESSION_REGISTRY_SHARED_PATH
+        wk.WorkerSupervisor(run_worker).run()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,300 @@
+"""
+Load test of the web socket server.
+
+Opens many concurrent web socket clients. Every client runs sessions of
+CREATE, a number of EXEC and DELETE, one message at a time like the
+browser does, each session on a connection of its own. The latency of
+every message is measured from sending it to receiving its response.
+The report shows the throughput and the p50, p95 and p99 latency per
+command.
+
+With --fake the server runs in this process on the fake docker backend,
+so the load test needs no docker daemon and measures the server alone.
+
+Run with: python -m benchmarks.load_test --fake --clients 500
+Or against a running server: python -m benchmarks.load_test --url ws://localhost:8888
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import time
+import typing
+import uuid
+
+# third party
+import websockets
+
+# modules
+import app
+import src.admission as admission
+import src.constants as constants
+import src.docker_backend as db
+
+
+class LoadStats:
+    """
+    Latencies and failures per command.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self) -> None:
+        self.latencies: dict = {command: [] for command in constants.SUPPORTED_COMMANDS}
+        self.errors: dict = {command: 0 for command in constants.SUPPORTED_COMMANDS}
+        self.busy: dict = {command: 0 for command in constants.SUPPORTED_COMMANDS}
+        self.duration: float = 0.0
+
+    def record(self, command: str, latency: float, ok: bool, busy: bool) -> None:
+        """
+        Record the outcome of one message.
+
+        Author: Namah Shrestha
+        """
+        self.latencies[command].append(latency)
+        if busy:
+            self.busy[command] += 1
+        elif not ok:
+            self.errors[command] += 1
+
+    def summary(self) -> dict:
+        """
+        Count, failures, throughput and latency percentiles per command.
+        Latencies are in milliseconds.
+
+        Author: Namah Shrestha
+        """
+        summary: dict = {}
+        for command, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            ordered: list = sorted(latencies)
+            summary[command] = {
+                "count": len(ordered),
+                "errors": self.errors[command],
+                "busy": self.busy[command],
+                "throughput": len(ordered) / self.duration if self.duration else 0.0,
+                "p50": percentile(ordered, 50) * 1000,
+                "p95": percentile(ordered, 95) * 1000,
+                "p99": percentile(ordered, 99) * 1000,
+                "max": ordered[-1] * 1000,
+            }
+        return summary
+
+
+def percentile(ordered: list, percent: float) -> float:
+    """
+    Nearest rank percentile of sorted values.
+
+    Author: Namah Shrestha
+    """
+    rank: int = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+async def request(
+    websocket, stats: LoadStats, message: dict, stream: bool = False
+) -> bool:
+    """
+    Send one message and wait for its response.
+    A streamed EXEC is answered when its exit frame arrives.
+    Returns True if the response is not an error.
+
+    Author: Namah Shrestha
+    """
+    start: float = time.perf_counter()
+    await websocket.send(json.dumps(message))
+    response: str = await websocket.recv()
+    try:
+        decoded: typing.Any = json.loads(response)
+        ok: bool = not isinstance(decoded, str)
+        while (
+            stream and ok and decoded.get(constants.FRAME_TYPE) != constants.EXIT_FRAME
+        ):
+            decoded = json.loads(await websocket.recv())
+    except (ValueError, AttributeError):
+        ok = False
+    stats.record(
+        message[constants.COMMAND],
+        time.perf_counter() - start,
+        ok,
+        response == admission.BUSY_ERROR,
+    )
+    return ok
+
+
+async def run_client(
+    url: str, client_id: str, options: argparse.Namespace, stats: LoadStats
+) -> None:
+    """
+    Run the sessions of one client one after another.
+    A connection is bound to one instance hash, so every session
+    opens a connection of its own.
+    A session whose CREATE failed skips its EXEC messages.
+
+    Author: Namah Shrestha
+    """
+    for session in range(options.sessions):
+        message: dict = {
+            constants.INSTANCE_OS: options.instance_os,
+            constants.INSTANCE_HASH: f"load_{client_id}_{session}",
+        }
+        async with websockets.connect(url, max_size=None) as websocket:
+            if await request(
+                websocket, stats, {**message, constants.COMMAND: constants.CREATE}
+            ):
+                for index in range(options.execs):
+                    exec_message: dict = {
+                        **message,
+                        constants.COMMAND: constants.EXECUTE,
+                        constants.EXEC_COMMAND: options.exec_command[
+                            index % len(options.exec_command)
+                        ],
+                    }
+                    if options.stream:
+                        exec_message[constants.STREAM] = True
+                    await request(websocket, stats, exec_message, options.stream)
+            await request(
+                websocket, stats, {**message, constants.COMMAND: constants.DELETE}
+            )
+
+
+@contextlib.asynccontextmanager
+async def fake_server(
+    latency: typing.Optional[dict] = None,
+) -> typing.AsyncIterator[str]:
+    """
+    Serve the application on the fake docker backend on a free local port.
+    Yields the url of the server.
+
+    Author: Namah Shrestha
+    """
+    db.set_backend(db.DockerFakeBackend(latency))
+    try:
+        async with websockets.serve(app.socket_handler, "127.0.0.1", 0) as server:
+            yield f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    finally:
+        db.set_backend(None)
+
+
+async def run_load(options: argparse.Namespace) -> LoadStats:
+    """
+    Run every client at once and collect their stats.
+
+    Author: Namah Shrestha
+    """
+    stats: LoadStats = LoadStats()
+    run_id: str = uuid.uuid4().hex[:8]
+    async with contextlib.AsyncExitStack() as stack:
+        url: str = options.url
+        if options.fake:
+            url = await stack.enter_async_context(
+                fake_server(db.parse_latency(options.fake_latency))
+            )
+        start: float = time.perf_counter()
+        results: list = await asyncio.gather(
+            *(
+                run_client(url, f"{run_id}_{client}", options, stats)
+                for client in range(options.clients)
+            ),
+            return_exceptions=True,
+        )
+        stats.duration = time.perf_counter() - start
+    failed: list = [result for result in results if isinstance(result, Exception)]
+    if failed:
+        print(f"{len(failed)} clients failed, first error: {failed[0]!r}")
+    return stats
+
+
+def report(stats: LoadStats) -> str:
+    """
+    The summary as a table.
+
+    Author: Namah Shrestha
+    """
+    columns: tuple = (
+        "count",
+        "errors",
+        "busy",
+        "throughput",
+        "p50",
+        "p95",
+        "p99",
+        "max",
+    )
+    lines: list = [
+        f"{'command':<8}" + "".join(f"{column:>12}" for column in columns),
+    ]
+    for command, row in stats.summary().items():
+        lines.append(
+            f"{command:<8}"
+            + "".join(
+                f"{row[column]:>12.2f}"
+                if isinstance(row[column], float)
+                else f"{row[column]:>12}"
+                for column in columns
+            )
+        )
+    total: int = sum(len(latencies) for latencies in stats.latencies.values())
+    lines.append(
+        f"{total} messages in {stats.duration:.2f} s, "
+        f"{total / stats.duration if stats.duration else 0.0:.2f} messages/s, "
+        "throughput in messages/s, latencies in ms"
+    )
+    return "\n".join(lines)
+
+
+def parse_options(arguments: typing.Optional[list] = None) -> argparse.Namespace:
+    """
+    Command line options.
+
+    Author: Namah Shrestha
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="Load test of the web socket server."
+    )
+    parser.add_argument("--url", default="ws://localhost:8888")
+    parser.add_argument(
+        "--fake", action="store_true", help="serve in process on the fake backend"
+    )
+    parser.add_argument(
+        "--fake-latency",
+        default=constants.FAKE_LATENCY,
+        help=(
+            "seconds per docker operation of the fake backend,"
+            ' like "build=2,exec=0.01"'
+        ),
+    )
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=1, help="sessions per client")
+    parser.add_argument("--execs", type=int, default=5, help="EXEC per session")
+    parser.add_argument(
+        "--exec-command",
+        action="append",
+        help="command of the EXEC messages, repeat to cycle through several",
+    )
+    parser.add_argument("--stream", action="store_true", help="stream the EXEC output")
+    parser.add_argument(
+        "--instance-os", default=constants.CENTOS, choices=constants.SUPPORTED_OS
+    )
+    options: argparse.Namespace = parser.parse_args(arguments)
+    options.exec_command = options.exec_command or ["echo hello"]
+    return options
+
+
+def main(arguments: typing.Optional[list] = None) -> None:
+    """
+    Run the load test and print the report.
+
+    Author: Namah Shrestha
+    """
+    print(report(asyncio.run(run_load(parse_options(arguments)))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Microbenchmark of the per message parsing cost.
+
+Compares the old two step path, is_schema_valid followed by
+decode_message, with the single parse_message step, using orjson
+when installed and the json module otherwise.
+
+Run with: python -m benchmarks.message_parsing
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import json
+import timeit
+import typing
+import unittest.mock as mock
+
+# modules
+import src
+import src.constants as constants
+import src.message as msg
+
+
+MESSAGE: str = json.dumps(
+    {
+        constants.INSTANCE_OS: constants.CENTOS,
+        constants.COMMAND: constants.EXECUTE,
+        constants.INSTANCE_HASH: "0123456789abcdef",
+        constants.EXEC_COMMAND: "ls -la /",
+    }
+)
+
+
+def two_step(message: str) -> typing.Any:
+    """
+    The path of the application before parse_message.
+
+    Author: Namah Shrestha
+    """
+    if not src.InstanceMessage.is_schema_valid(message):
+        raise ValueError(msg.INVALID_MESSAGE_ERROR)
+    json_message: dict = src.InstanceMessage.decode_message(message)
+    if json_message.get(constants.INSTANCE_OS) not in constants.SUPPORTED_OS:
+        raise ValueError()
+    if json_message.get(constants.COMMAND) not in constants.SUPPORTED_COMMANDS:
+        raise ValueError()
+    return json_message
+
+
+def per_message(func: typing.Callable, number: int) -> float:
+    """
+    Best of five runs, in microseconds per message.
+
+    Author: Namah Shrestha
+    """
+    return min(timeit.repeat(lambda: func(MESSAGE), number=number, repeat=5)) / (
+        number / 1e6
+    )
+
+
+def main(number: int = 100000) -> None:
+    """
+    Print the cost of every variant.
+
+    Author: Namah Shrestha
+    """
+    print(f"is_schema_valid + decode_message: {per_message(two_step, number):.2f} us")
+    with mock.patch.object(msg, "loads", json.loads):
+        print(
+            f"parse_message (json):            "
+            f"{per_message(msg.parse_message, number):.2f} us"
+        )
+    if msg.loads is not json.loads:
+        print(
+            f"parse_message (orjson):          "
+            f"{per_message(msg.parse_message, number):.2f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,7 @@ import typing
 
 # modules
 import src.constants as constants
+import src.executor as executor
 
 
 class Instance:
@@ -28,6 +29,7 @@ class Instance:
 
     def __init__(self, instance_hash: str) -> None:
         self.instance_hash: str = instance_hash
+        self.command: typing.Optional[str] = None
 
     def handle(self, exec_command: typing.Optional[str] = None) -> list:
         """
@@ -39,6 +41,15 @@ class Instance:
         """
         pass
 
+    async def async_handle(self, exec_command: typing.Optional[str] = None) -> list:
+        """
+        Await the handle method without blocking the event loop.
+        It runs in the executor pool of the command.
+
+        Author: Namah Shrestha
+        """
+        return await executor.run_blocking(self.command, self.handle, exec_command)
+
 
 class InstanceMessage:
     @staticmethod
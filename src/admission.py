@@ -0,0 +1,190 @@
+"""
+This is the admission control of the application.
+
+A burst of CREATE messages would start as many image builds and
+container runs as there are messages, and the docker daemon falls over.
+Every command has a concurrency limit of its own. Requests above the
+limit wait in a bounded queue for at most the queue timeout. When the
+queue is full, or the wait times out, the request is rejected with a
+busy response right away, instead of piling up on the daemon.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import asyncio
+import collections
+import contextlib
+import time
+import typing
+
+# modules
+import src.constants as constants
+import src.tracing as tracing
+
+
+BUSY_ERROR: str = "Server is busy, please try again later."
+
+
+class BusyError(Exception):
+    """
+    Raised when a request is not admitted.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, command: str, reason: str) -> None:
+        super().__init__(BUSY_ERROR)
+        self.command: str = command
+        self.reason: str = reason
+
+
+class Limiter:
+    """
+    Concurrency limit with a bounded first in first out wait queue.
+
+    The limiter is only used from the event loop, so it needs no lock.
+    A released slot is handed to the first waiter directly, so a new
+    request can never overtake the queue.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, command: str, limit: int, queue_size: int, timeout: float):
+        """
+        Create a limiter of the command. A limit of 0 disables it.
+
+        Author: Namah Shrestha
+        """
+        self.command: str = command
+        self.limit: int = limit
+        self.queue_size: int = queue_size
+        self.timeout: float = timeout
+        self.active: int = 0
+        self.waiters: collections.deque = collections.deque()
+        self.admitted: int = 0
+        self.rejected: int = 0
+        self.timed_out: int = 0
+        self.queue_time: float = 0.0
+
+    async def acquire(self) -> None:
+        """
+        Take a slot, waiting in the queue if every slot is taken.
+        Raise BusyError if the queue is full or the wait times out.
+
+        Author: Namah Shrestha
+        """
+        if self.limit <= 0 or (self.active < self.limit and not self.waiters):
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self.waiters) >= self.queue_size:
+            self.rejected += 1
+            raise BusyError(self.command, "queue full")
+        waiter: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        start: float = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except BaseException as error:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            if isinstance(error, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise BusyError(self.command, "queue timeout")
+            raise
+        finally:
+            self.queue_time += time.monotonic() - start
+        self.admitted += 1
+
+    def release(self) -> None:
+        """
+        Give the slot to the first waiter, or free it.
+
+        Author: Namah Shrestha
+        """
+        while self.waiters:
+            waiter: asyncio.Future = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        """
+        Admission metrics of the command.
+
+        Author: Namah Shrestha
+        """
+        return {
+            "active": self.active,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "queue_time": self.queue_time,
+        }
+
+
+class AdmissionController:
+    """
+    One limiter per command.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        limits: typing.Optional[dict] = None,
+        queue_size: int = constants.ADMISSION_QUEUE_SIZE,
+        timeout: float = constants.ADMISSION_QUEUE_TIMEOUT,
+    ) -> None:
+        """
+        Create the limiters. Limits map a command to its concurrency limit.
+
+        Author: Namah Shrestha
+        """
+        if limits is None:
+            limits = {
+                constants.CREATE: constants.CREATE_CONCURRENCY,
+                constants.DELETE: constants.DELETE_CONCURRENCY,
+                constants.EXECUTE: constants.EXEC_CONCURRENCY,
+            }
+        self.limiters: dict = {
+            command: Limiter(command, limit, queue_size, timeout)
+            for command, limit in limits.items()
+        }
+
+    @contextlib.asynccontextmanager
+    async def admit(self, command: str) -> typing.AsyncIterator[None]:
+        """
+        Hold a slot of the command while the block runs.
+        Raise BusyError if the request is not admitted.
+        The wait for the slot is a span of the trace.
+
+        Author: Namah Shrestha
+        """
+        limiter: typing.Optional[Limiter] = self.limiters.get(command)
+        if limiter is None:
+            yield
+            return
+        with tracing.span("admission", command=command):
+            await limiter.acquire()
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def stats(self) -> dict:
+        """
+        Admission metrics per command.
+
+        Author: Namah Shrestha
+        """
+        return {command: limiter.stats() for command, limiter in self.limiters.items()}
+
+
+admission_controller: AdmissionController = AdmissionController()
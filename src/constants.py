@@ -4,6 +4,7 @@ Constants for the applicationsrc/instance_exec.py
 Author: Namah Shrestha
 """
 import os
+import tempfile
 
 # Keys
 INSTANCE_OS: str = "instance_os"
@@ -15,7 +16,8 @@ EXEC_COMMAND: str = "exec_command"
 CREATE: str = "CREATE"
 EXECUTE: str = "EXEC"
 DELETE: str = "DELETE"
-SUPPORTED_COMMANDS: list = [CREATE, EXECUTE, DELETE]
+CANCEL: str = "CANCEL"
+SUPPORTED_COMMANDS: list = [CREATE, EXECUTE, DELETE, CANCEL]
 
 # SUPPORTED OS
 CENTOS: str = "centos"
@@ -23,8 +25,10 @@ UBUNTU: str = "ubuntu"
 SUPPORTED_OS: list = [CENTOS, UBUNTU]
 
 # Directory constants
-CHANGE_DIRECTORY_CMD_PATTERN: str = "^cd [/a-zA-Z0-9.+~]+$"
-MAIN_WORKING_DIRECTORY: str = os.path.abspath("")
+# Directories are the directories of the container, never of the host.
+CHANGE_DIRECTORY_CMD_PATTERN: str = "^cd [/a-zA-Z0-9._+~-]+$"
+CONTAINER_WORKING_DIRECTORY: str = "/"
+CONTAINER_HOME_DIRECTORY: str = "/root"
 
 # GENERAL IMAGE DEVELOPMENT
 FILTER_CONTAINER_COMMAND: str = "docker container ls -q --filter 'name={}'"
@@ -42,3 +46,241 @@ UBUNTU_IMAGE_TAG: str = "latest"
 UBUNTU_DOCKERFILE_NAME: str = "Dockerfile.ubuntu"
 UBUNTU_CONTAINER_NAME: str = "ubuntu_demo_{}"
 UBUNTU_FILTER_CONTAINER: str = "docker container ls -q --filter 'name={}'"
+
+# EXECUTION
+# Blocking docker operations run in bounded thread pools off the event loop.
+# Lifecycle (create/delete) and exec have separate pools so that a slow
+# image build never delays commands of other sessions.
+LIFECYCLE_WORKERS: int = int(os.environ.get("ZOD_LIFECYCLE_WORKERS", "4"))
+EXEC_WORKERS: int = int(os.environ.get("ZOD_EXEC_WORKERS", "32"))
+# A cancel kills a command that holds an exec thread, so it gets its own.
+CANCEL_WORKERS: int = int(os.environ.get("ZOD_CANCEL_WORKERS", "2"))
+
+# WARM CONTAINER POOL
+# Pre-started, unassigned containers per os. CREATE renames one of them.
+POOL_SIZE: int = int(os.environ.get("ZOD_POOL_SIZE", "2"))
+POOL_REFILL_INTERVAL: float = float(os.environ.get("ZOD_POOL_REFILL_INTERVAL", "5"))
+POOL_CONTAINER_NAME: str = "zod_pool_{}_{}"
+
+# CONTAINER LABELS
+# Every container of the server is labelled with its os and creation time,
+# containers created for a session also with its instance hash. At startup
+# one listing of the labelled containers rebuilds the session index.
+LABEL_INSTANCE_OS: str = "zod.instance_os"
+LABEL_INSTANCE_HASH: str = "zod.instance_hash"
+LABEL_CREATED_AT: str = "zod.created_at"
+
+# CONTAINER EVENTS
+# Every server process follows the docker events of the labelled containers
+# and keeps their lifecycle in memory. A broken events stream is opened
+# again after the retry delay. Removed containers are remembered up to
+# the history size.
+WATCH_EVENTS: bool = os.environ.get("ZOD_WATCH_EVENTS", "1") == "1"
+CONTAINER_EVENTS: tuple = ("create", "start", "die", "destroy")
+EVENTS_RETRY_DELAY: float = 1.0
+EVENTS_REMOVED_HISTORY: int = 1024
+CONTAINER_CREATED: str = "created"
+CONTAINER_RUNNING: str = "running"
+CONTAINER_DEAD: str = "dead"
+CONTAINER_REMOVED: str = "removed"
+
+# IMAGE BUILD CACHE
+# Images are tagged with this many characters of their content digest.
+IMAGE_DIGEST_LENGTH: int = 12
+
+# DOCKER BACKEND
+# cli forks the docker cli, api talks to the daemon over its unix socket.
+# fake keeps containers in memory and runs nothing, for load tests.
+CLI_BACKEND: str = "cli"
+API_BACKEND: str = "api"
+FAKE_BACKEND: str = "fake"
+DOCKER_BACKEND: str = os.environ.get("ZOD_DOCKER_BACKEND", CLI_BACKEND)
+DOCKER_SOCKET_PATH: str = os.environ.get("ZOD_DOCKER_SOCKET", "/var/run/docker.sock")
+DOCKER_API_VERSION: str = "v1.41"
+DOCKER_API_POOL_SIZE: int = int(os.environ.get("ZOD_DOCKER_API_POOL_SIZE", "32"))
+DOCKER_API_TIMEOUT: float = float(os.environ.get("ZOD_DOCKER_API_TIMEOUT", "600"))
+# Seconds per operation of the fake backend, like "build=2,run=0.5,exec=0.01".
+FAKE_LATENCY: str = os.environ.get("ZOD_FAKE_LATENCY", "")
+
+# STREAMING EXEC
+# With "stream": true an EXEC sends its output in chunks while it runs,
+# followed by a final frame with the exit code.
+STREAM: str = "stream"
+FRAME_TYPE: str = "type"
+FRAME_DATA: str = "data"
+FRAME_EXIT_CODE: str = "exit_code"
+OUTPUT_FRAME: str = "output"
+EXIT_FRAME: str = "exit"
+STREAM_READ_SIZE: int = 65536
+STREAM_CHUNK_LINES: int = int(os.environ.get("ZOD_STREAM_CHUNK_LINES", "100"))
+STREAM_CHUNK_BYTES: int = int(os.environ.get("ZOD_STREAM_CHUNK_BYTES", "16384"))
+STREAM_QUEUE_SIZE: int = 16
+
+# PERSISTENT SHELL
+# Every session keeps one shell running in its container.
+# EXEC commands are written into it instead of starting a docker exec each.
+PERSISTENT_SHELL: bool = os.environ.get("ZOD_PERSISTENT_SHELL", "1") == "1"
+SHELL_COMMAND: str = os.environ.get("ZOD_SHELL_COMMAND", "/bin/bash")
+SHELL_MARKER: str = "__zod_{}__"
+
+# BATCH EXEC
+# An EXEC with "exec_commands" runs the whole list in one round trip.
+EXEC_COMMANDS: str = "exec_commands"
+ON_ERROR: str = "on_error"
+STOP_ON_ERROR: str = "stop"
+CONTINUE_ON_ERROR: str = "continue"
+MAX_BATCH_COMMANDS: int = int(os.environ.get("ZOD_MAX_BATCH_COMMANDS", "100"))
+BATCH_SHELL_COMMAND: str = "/bin/sh"
+BATCH_OUTPUT: str = "output"
+BATCH_EXIT_CODE: str = "exit_code"
+
+# EXEC LIMITS
+# Every EXEC runs under a wall clock timeout and an output byte cap.
+# A message can ask for lower limits with "timeout" and "max_output".
+# A command that hits a limit, or is cancelled with a CANCEL message, is
+# killed inside the container: every exec is tagged with an environment
+# variable and the processes carrying the tag are killed.
+EXEC_TIMEOUT: float = float(os.environ.get("ZOD_EXEC_TIMEOUT", "300"))
+EXEC_MAX_OUTPUT: int = int(os.environ.get("ZOD_EXEC_MAX_OUTPUT", "1048576"))
+TIMEOUT: str = "timeout"
+MAX_OUTPUT: str = "max_output"
+EXEC_TAG_VARIABLE: str = "ZOD_EXEC_ID"
+EXEC_KILL_COMMAND: str = (
+    "for attempt in 1 2 3; do "
+    "pids=$(grep -lzx {}={} /proc/[0-9]*/environ 2>/dev/null | cut -d/ -f3); "
+    '[ -n "$pids" ] || break; kill -KILL $pids 2>/dev/null; done'
+)
+TIMED_OUT: str = "timed_out"
+TRUNCATED: str = "truncated"
+CANCELLED: str = "cancelled"
+NOTHING_TO_CANCEL: str = "Nothing to cancel."
+
+# IDLE SESSION REAPER
+# Sessions idle for longer than the ttl are deleted.
+# Above the container cap the least recently used sessions are deleted.
+SESSION_IDLE_TTL: float = float(os.environ.get("ZOD_SESSION_IDLE_TTL", "1800"))
+MAX_CONTAINERS: int = int(os.environ.get("ZOD_MAX_CONTAINERS", "50"))
+REAPER_INTERVAL: float = float(os.environ.get("ZOD_REAPER_INTERVAL", "30"))
+
+# IDLE SESSION PAUSE
+# With a pause idle time, sessions idle for longer are paused in every
+# reaper round: the cgroup freezer stops their processes, the memory
+# stays allocated but the container uses no cpu and can be swapped out.
+# The next EXEC or CREATE of a paused session unpauses it.
+# Sessions running an EXEC, in any worker process, are never paused.
+# 0 disables pausing.
+# An EXEC waits at most the pause wait for a pause in progress to end.
+PAUSE_IDLE_AFTER: float = float(os.environ.get("ZOD_PAUSE_IDLE_AFTER", "0"))
+PAUSE_WAIT: float = 5.0
+PAUSE_POLL_INTERVAL: float = 0.01
+
+# IDLE SESSION SNAPSHOTS
+# With a snapshot idle time, sessions idle for longer are committed to an
+# image, saved as a gzip compressed archive in the snapshot directory,
+# keyed by instance hash, and their container is removed. The next EXEC
+# or CREATE of the session restores its container from the snapshot,
+# with the files of the user but without the processes it ran.
+# Like pausing, sessions running an EXEC are never saved. Snapshots
+# unused for longer than the snapshot ttl are deleted.
+# 0 disables snapshots. A request waits at most the snapshot wait for
+# a snapshot or restore in progress to end.
+SNAPSHOT_IDLE_AFTER: float = float(os.environ.get("ZOD_SNAPSHOT_IDLE_AFTER", "0"))
+SNAPSHOT_TTL: float = float(os.environ.get("ZOD_SNAPSHOT_TTL", "604800"))
+SNAPSHOT_DIRECTORY: str = os.environ.get(
+    "ZOD_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "zod_snapshots")
+)
+SNAPSHOT_COMPRESSION: int = int(os.environ.get("ZOD_SNAPSHOT_COMPRESSION", "6"))
+SNAPSHOT_IMAGE_NAME: str = "zod-snapshot"
+SNAPSHOT_FILE_SUFFIX: str = ".tar.gz"
+SNAPSHOT_WAIT: float = 600.0
+SNAPSHOT_POLL_INTERVAL: float = 0.1
+
+# SESSION REGISTRY
+# Every session is recorded in SQLite in WAL mode, so that every worker
+# process, and replicas on the same host, share one view of the sessions.
+# ":memory:" keeps the registry private to the process, so with more than
+# one worker the shared file in the temp directory is used instead.
+SESSION_REGISTRY_PATH: str = os.environ.get("ZOD_SESSION_REGISTRY", ":memory:")
+SESSION_REGISTRY_SHARED_PATH: str = os.path.join(
+    tempfile.gettempdir(), "zod_sessions.db"
+)
+SESSION_REGISTRY_TIMEOUT: float = 5.0
+SESSION_CREATING: str = "creating"
+SESSION_RUNNING: str = "running"
+SESSION_DELETING: str = "deleting"
+SESSION_DEAD: str = "dead"
+SESSION_PAUSING: str = "pausing"
+SESSION_PAUSED: str = "paused"
+SESSION_SAVING: str = "saving"
+SESSION_SAVED: str = "saved"
+SESSION_RESTORING: str = "restoring"
+# A CREATE waits at most the create wait for the creation or deletion
+# of the session by another worker process to end.
+CREATE_WAIT: float = float(os.environ.get("ZOD_CREATE_WAIT", "600"))
+CREATE_POLL_INTERVAL: float = 0.05
+
+# ADMISSION CONTROL
+# Concurrency limits per command. Requests above the limit wait in a
+# bounded queue for at most the queue timeout, then they are rejected busy.
+# The create and delete limits are split between the workers, every worker
+# gets at least 1 of them.
+CREATE_CONCURRENCY: int = int(os.environ.get("ZOD_CREATE_CONCURRENCY", "2"))
+DELETE_CONCURRENCY: int = int(os.environ.get("ZOD_DELETE_CONCURRENCY", "2"))
+EXEC_CONCURRENCY: int = int(os.environ.get("ZOD_EXEC_CONCURRENCY", "32"))
+ADMISSION_QUEUE_SIZE: int = int(os.environ.get("ZOD_ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_QUEUE_TIMEOUT: float = float(
+    os.environ.get("ZOD_ADMISSION_QUEUE_TIMEOUT", "30")
+)
+
+# METRICS
+# Prometheus text format, served on GET /metrics. A port of 0 disables it.
+METRICS_HOST: str = os.environ.get("ZOD_METRICS_HOST", "127.0.0.1")
+METRICS_PORT: int = int(os.environ.get("ZOD_METRICS_PORT", "8889"))
+METRICS_CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_LATENCY_BUCKETS: tuple = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+)
+
+# TRACING
+# A sampled share of the requests is traced with a trace id and nested
+# timed spans. Spans are written in batches to a JSONL file, rotated at
+# the max size, one file per worker. A sample rate of 0 disables tracing.
+TRACE_SAMPLE_RATE: float = float(os.environ.get("ZOD_TRACE_SAMPLE_RATE", "0.01"))
+TRACE_FILE: str = os.environ.get(
+    "ZOD_TRACE_FILE", os.path.join(tempfile.gettempdir(), "zod_traces.jsonl")
+)
+TRACE_MAX_BYTES: int = int(os.environ.get("ZOD_TRACE_MAX_BYTES", "10485760"))
+TRACE_BACKUPS: int = 3
+TRACE_BATCH_SIZE: int = 256
+TRACE_FLUSH_INTERVAL: float = 1.0
+TRACE_QUEUE_SIZE: int = 10000
+
+# SERVER
+SERVER_HOST: str = os.environ.get("ZOD_HOST", "0.0.0.0")
+SERVER_PORT: int = int(os.environ.get("ZOD_PORT", "8888"))
+LISTEN_BACKLOG: int = int(os.environ.get("ZOD_LISTEN_BACKLOG", "1024"))
+
+# WORKERS
+# With more than one worker the server runs that many processes on the
+# same port, with SO_REUSEPORT if available, else on a pre-forked listener.
+# Dead workers are restarted, with a growing delay if they die right away.
+WORKERS: int = int(os.environ.get("ZOD_WORKERS", "1"))
+REUSE_PORT: bool = os.environ.get("ZOD_REUSE_PORT", "1") == "1"
+WORKER_RESTART_DELAY: float = 1.0
+WORKER_RESTART_MAX_DELAY: float = 30.0
+WORKER_RESTART_WINDOW: float = 10.0
+WORKER_STOP_TIMEOUT: float = 10.0
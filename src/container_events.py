@@ -0,0 +1,317 @@
+"""
+This is the container lifecycle tracker.
+
+Every server process follows the docker events of the labelled containers
+and keeps the state of every container in memory: created, running, dead
+or removed. EXEC, CREATE and DELETE check the state of the container of
+the session in memory instead of asking docker.
+
+A container that dies outside of our control marks its session dead in
+the session registry right away. The next EXEC of the session is answered
+with an error telling the client to CREATE again, instead of an empty
+output, and the reaper deletes the session.
+
+The state of a container that is not known yet, or any container while
+the events stream is down, is None. Callers then fall back to docker.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import collections
+import logging
+import threading
+import typing
+
+# modules
+import src.constants as constants
+import src.docker_backend as db
+import src.session_registry as sr
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+CONTAINER_GONE_ERROR: str = (
+    "Session container has stopped, send CREATE to start a new one."
+)
+
+
+class ContainerGoneError(Exception):
+    """
+    Raised when the container of a session is known to be dead or removed.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, instance_hash: str) -> None:
+        super().__init__(CONTAINER_GONE_ERROR)
+        self.instance_hash: str = instance_hash
+
+
+"""
+State of a container after each of the followed events.
+
+Author: Namah Shrestha
+"""
+event_states: dict = {
+    "create": constants.CONTAINER_CREATED,
+    "start": constants.CONTAINER_RUNNING,
+    "die": constants.CONTAINER_DEAD,
+    "destroy": constants.CONTAINER_REMOVED,
+}
+
+
+def short_id(container_id: str) -> str:
+    """
+    The short form of the container id, so that short and full ids match.
+
+    Author: Namah Shrestha
+    """
+    return container_id[:12]
+
+
+class ContainerStates:
+    """
+    Lifecycle state of the labelled containers, by container id.
+
+    The states are written by the events thread and read by the executor
+    threads, behind a lock. Removed containers are remembered up to
+    constants.EVENTS_REMOVED_HISTORY of them.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, history: int = constants.EVENTS_REMOVED_HISTORY) -> None:
+        """
+        Create an empty tracker. It knows nothing until it is reset live.
+
+        Author: Namah Shrestha
+        """
+        self.history: int = history
+        self.states: dict = {}
+        self.removed: collections.OrderedDict = collections.OrderedDict()
+        self.live: bool = False
+        self.lock: threading.Lock = threading.Lock()
+
+    def reset(self, containers: typing.Iterable[db.ContainerInfo], live: bool) -> None:
+        """
+        Start over from a listing of the containers.
+        Not live, the tracker knows nothing.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            self.states = {
+                short_id(container.container_id): (
+                    constants.CONTAINER_RUNNING
+                    if container.running
+                    else constants.CONTAINER_DEAD
+                )
+                for container in containers
+            }
+            self.removed.clear()
+            self.live = live
+
+    def apply(self, event: db.ContainerEvent) -> typing.Optional[str]:
+        """
+        Apply the event. Returns the new state of its container,
+        None if the event is not followed.
+
+        Author: Namah Shrestha
+        """
+        state: typing.Optional[str] = event_states.get(event.action)
+        if state is None:
+            return None
+        container_id: str = short_id(event.container_id)
+        with self.lock:
+            self.states[container_id] = state
+            if state == constants.CONTAINER_REMOVED:
+                self.removed[container_id] = None
+                while len(self.removed) > self.history:
+                    old_id, _ = self.removed.popitem(last=False)
+                    if self.states.get(old_id) == constants.CONTAINER_REMOVED:
+                        del self.states[old_id]
+        return state
+
+    def state(self, container_id: str) -> typing.Optional[str]:
+        """
+        State of the container, None if it is unknown.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            if not self.live:
+                return None
+            return self.states.get(short_id(container_id))
+
+    def is_gone(self, container_id: typing.Optional[str]) -> bool:
+        """
+        Check if the container is known to be dead or removed.
+
+        Author: Namah Shrestha
+        """
+        return bool(container_id) and self.state(container_id) in (
+            constants.CONTAINER_DEAD,
+            constants.CONTAINER_REMOVED,
+        )
+
+    def is_removed(self, container_id: typing.Optional[str]) -> bool:
+        """
+        Check if the container is known to be removed.
+
+        Author: Namah Shrestha
+        """
+        return (
+            bool(container_id)
+            and self.state(container_id) == constants.CONTAINER_REMOVED
+        )
+
+    def stats(self) -> dict:
+        """
+        Number of known containers of every state.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            counts: collections.Counter = collections.Counter(self.states.values())
+        return {state: counts[state] for state in event_states.values()}
+
+
+class ContainerEventWatcher:
+    """
+    Follows the docker events in a background thread and keeps the
+    container states up to date.
+
+    The stream is opened before the containers are listed, so that no
+    event between the listing and the stream is missed. A broken stream
+    is opened again after constants.EVENTS_RETRY_DELAY.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        states: ContainerStates,
+        registry: typing.Optional[sr.SessionRegistry] = None,
+    ) -> None:
+        """
+        Create a watcher of the states, marking the sessions of dead
+        containers in the registry, the shared session registry if none
+        is given.
+
+        Author: Namah Shrestha
+        """
+        self.states: ContainerStates = states
+        self.registry: sr.SessionRegistry = (
+            sr.session_registry if registry is None else registry
+        )
+        self.stream: typing.Optional[db.EventStream] = None
+        self.thread: typing.Optional[threading.Thread] = None
+        self.stopping: threading.Event = threading.Event()
+        self.lock: threading.Lock = threading.Lock()
+        self.events: int = 0
+        self.invalidated: int = 0
+        self.reconnects: int = 0
+
+    def invalidate(self, container_id: str) -> None:
+        """
+        Mark the sessions of the stopped container dead.
+
+        Author: Namah Shrestha
+        """
+        invalidated: int = self.registry.mark_dead(container_id)
+        if invalidated:
+            logger.warning("Container %s stopped", short_id(container_id))
+            self.invalidated += invalidated
+
+    def watch_once(self) -> None:
+        """
+        Follow the events until the stream ends or is closed.
+
+        Author: Namah Shrestha
+        """
+        stream: db.EventStream = db.get_backend().watch_events(
+            constants.LABEL_INSTANCE_OS, constants.CONTAINER_EVENTS
+        )
+        with self.lock:
+            self.stream = stream
+        try:
+            if self.stopping.is_set():
+                return
+            containers: list = db.get_backend().list_labelled_containers(
+                constants.LABEL_INSTANCE_OS
+            )
+            self.states.reset(containers, live=True)
+            for container in containers:
+                if not container.running:
+                    self.invalidate(container.container_id)
+            for event in stream:
+                self.events += 1
+                if self.states.apply(event) in (
+                    constants.CONTAINER_DEAD,
+                    constants.CONTAINER_REMOVED,
+                ):
+                    self.invalidate(event.container_id)
+        finally:
+            self.states.reset((), live=False)
+            with self.lock:
+                self.stream = None
+            stream.close()
+
+    def run(self) -> None:
+        """
+        Follow the events until the watcher is stopped.
+
+        Author: Namah Shrestha
+        """
+        while not self.stopping.is_set():
+            try:
+                self.watch_once()
+            except Exception:
+                logger.exception("Container events stream failed")
+            if self.stopping.wait(constants.EVENTS_RETRY_DELAY):
+                return
+            self.reconnects += 1
+
+    def start(self) -> None:
+        """
+        Start following the events in a daemon thread.
+
+        Author: Namah Shrestha
+        """
+        self.stopping.clear()
+        self.thread = threading.Thread(
+            target=self.run, name="zod_container_events", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self, timeout: float = constants.EVENTS_RETRY_DELAY) -> None:
+        """
+        Stop following the events and wait for the thread.
+
+        Author: Namah Shrestha
+        """
+        self.stopping.set()
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def stats(self) -> dict:
+        """
+        Events metrics.
+
+        Author: Namah Shrestha
+        """
+        return {
+            "watching": int(self.states.live),
+            "events": self.events,
+            "invalidated": self.invalidated,
+            "reconnects": self.reconnects,
+            **self.states.stats(),
+        }
+
+
+container_states: ContainerStates = ContainerStates()
+watcher: ContainerEventWatcher = ContainerEventWatcher(container_states)
@@ -0,0 +1,204 @@
+"""
+This is the container id index.
+
+Maps the instance hash of every session to the id of its container.
+It is filled at CREATE, cleared at DELETE and rebuilt from the labelled
+containers when the server starts. EXEC goes straight to the known id
+instead of listing the containers before every command.
+
+The index is the container id view of the shared session registry,
+so a container created by one worker is known to every other worker.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import logging
+import re
+import time
+import typing
+
+# modules
+import src.constants as constants
+import src.docker_backend as db
+import src.session_registry as sr
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+"""
+Name of a pooled container after its pool prefix, with the shard
+of the worker in the multi process mode.
+
+Author: Namah Shrestha
+"""
+POOL_SUFFIX_PATTERN: re.Pattern = re.compile(r"^(w\d+_)?[0-9a-f]{12}$")
+
+
+"""
+Container name pattern of every supported os.
+
+Author: Namah Shrestha
+"""
+container_name_switch: dict = {
+    constants.CENTOS: constants.CENTOS_CONTAINER_NAME,
+    constants.UBUNTU: constants.UBUNTU_CONTAINER_NAME,
+}
+
+
+def container_labels(
+    instance_os: str, instance_hash: typing.Optional[str] = None
+) -> dict:
+    """
+    Labels of a new container of the os, created for the instance
+    hash if given, or for the warm pool.
+
+    Author: Namah Shrestha
+    """
+    labels: dict = {
+        constants.LABEL_INSTANCE_OS: instance_os,
+        constants.LABEL_CREATED_AT: f"{time.time():.3f}",
+    }
+    if instance_hash is not None:
+        labels[constants.LABEL_INSTANCE_HASH] = instance_hash
+    return labels
+
+
+def is_pooled(name: str, instance_os: str, shards: typing.Iterable[str]) -> bool:
+    """
+    Check if the container name is a pooled container of one of the shards.
+
+    Author: Namah Shrestha
+    """
+    prefix: str = constants.POOL_CONTAINER_NAME.format(instance_os, "")
+    match: typing.Optional[re.Match] = POOL_SUFFIX_PATTERN.match(name[len(prefix) :])
+    return (
+        name.startswith(prefix)
+        and match is not None
+        and (match.group(1) or "") in shards
+    )
+
+
+class ContainerIndex:
+    """
+    Map of instance hash to container id, kept in the session registry.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, registry: typing.Optional[sr.SessionRegistry] = None) -> None:
+        """
+        Create an index in the registry, the shared session registry
+        if none is given.
+
+        Author: Namah Shrestha
+        """
+        self.registry: sr.SessionRegistry = (
+            sr.session_registry if registry is None else registry
+        )
+
+    def get(self, instance_hash: str) -> typing.Optional[str]:
+        """
+        Container id of the instance, None if unknown.
+
+        Author: Namah Shrestha
+        """
+        return self.registry.container_id(instance_hash)
+
+    def set(
+        self,
+        instance_hash: str,
+        container_id: typing.Optional[str],
+        instance_os: typing.Optional[str] = None,
+    ) -> None:
+        """
+        Set the container id of the instance. None removes it.
+
+        Author: Namah Shrestha
+        """
+        if container_id:
+            self.registry.set_container(instance_hash, container_id, instance_os)
+        else:
+            self.registry.remove(instance_hash)
+
+    def remove(self, instance_hash: str) -> None:
+        """
+        Forget the instance.
+
+        Author: Namah Shrestha
+        """
+        self.set(instance_hash, None)
+
+    def clear(self) -> None:
+        """
+        Forget every instance.
+
+        Author: Namah Shrestha
+        """
+        self.registry.clear()
+
+    def rebuild(self, shards: typing.Iterable[str] = ("",)) -> int:
+        """
+        Rebuild the index from one listing of the labelled containers.
+
+        Running containers named after a session are adopted, with the
+        creation time of their label. Paused ones are adopted as paused
+        sessions, the next EXEC or CREATE unpauses them like any other.
+        Pooled containers of the shards are left to their pools. Every
+        other labelled container is an orphan, stopped or left over, and
+        all of them are removed in one call.
+        Sessions created while the containers are listed are kept.
+        Returns the number of indexed instances.
+
+        Author: Namah Shrestha
+        """
+        since: float = time.time()
+        shards = set(shards)
+        containers: dict = {}
+        orphans: list = []
+        for container in db.get_backend().list_labelled_containers(
+            constants.LABEL_INSTANCE_OS
+        ):
+            instance_os: typing.Optional[str] = container.labels.get(
+                constants.LABEL_INSTANCE_OS
+            )
+            if container.running and instance_os in container_name_switch:
+                prefix: str = container_name_switch[instance_os].format("")
+                if container.name.startswith(prefix):
+                    instance_hash: str = (
+                        container.labels.get(constants.LABEL_INSTANCE_HASH)
+                        or container.name[len(prefix) :]
+                    )
+                    containers[instance_hash] = (
+                        instance_os,
+                        container.container_id,
+                        self.created_at(container, since),
+                        (
+                            constants.SESSION_PAUSED
+                            if container.paused
+                            else constants.SESSION_RUNNING
+                        ),
+                    )
+                    continue
+                if is_pooled(container.name, instance_os, shards):
+                    continue
+            orphans.append(container.container_id)
+        if orphans:
+            logger.info("Removing %d orphaned containers", len(orphans))
+            db.get_backend().remove_containers(orphans)
+        return self.registry.reconcile(containers, since)
+
+    def created_at(self, container: db.ContainerInfo, default: float) -> float:
+        """
+        Creation time of the label of the container, the default if unknown.
+
+        Author: Namah Shrestha
+        """
+        try:
+            return float(container.labels[constants.LABEL_CREATED_AT])
+        except (KeyError, ValueError):
+            return default
+
+
+container_index: ContainerIndex = ContainerIndex()
@@ -0,0 +1,271 @@
+"""
+This is the warm container pool.
+
+Building the image and running a container takes seconds to minutes.
+We keep a few pre-started, unassigned containers for every supported os.
+A CREATE takes one of them and binds it to the instance hash by renaming
+it to the container name of the instance.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import asyncio
+import collections
+import logging
+import threading
+import typing
+import uuid
+
+# modules
+import src.constants as constants
+import src.container_index as ci
+import src.docker_backend as db
+import src.executor as executor
+import src.image_cache as ic
+import src.tracing as tracing
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+"""
+Image specification of every supported os.
+(image name, image tag, dockerfile name)
+
+Author: Namah Shrestha
+"""
+image_switch: dict = {
+    constants.CENTOS: (
+        constants.CENTOS_IMAGE_NAME,
+        constants.CENTOS_IMAGE_TAG,
+        constants.CENTOS_DOCKERFILE_NAME,
+    ),
+    constants.UBUNTU: (
+        constants.UBUNTU_IMAGE_NAME,
+        constants.UBUNTU_IMAGE_TAG,
+        constants.UBUNTU_DOCKERFILE_NAME,
+    ),
+}
+
+
+class ContainerPool:
+    """
+    Pool of pre-started containers of one os.
+
+    acquire is called from the executor threads and refill from the
+    background refill task, so the idle containers are guarded by a lock.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        instance_os: str,
+        image_name: str,
+        image_tag: str,
+        dockerfile_name: str,
+        size: int,
+        shard: str = "",
+    ) -> None:
+        """
+        Create an empty pool.
+        The shard is part of the names of the pooled containers. Worker
+        processes have a shard each, so they never adopt each other's
+        containers.
+
+        Author: Namah Shrestha
+        """
+        self.instance_os: str = instance_os
+        self.image_name: str = image_name
+        self.image_tag: str = image_tag
+        self.dockerfile_name: str = dockerfile_name
+        self.size: int = size
+        self.shard: str = shard
+        self.hits: int = 0
+        self.misses: int = 0
+        self.idle: collections.deque = collections.deque()
+        self.lock: threading.Lock = threading.Lock()
+
+    def pool_container_prefix(self) -> str:
+        """
+        Name prefix of the pooled containers.
+
+        Author: Namah Shrestha
+        """
+        return constants.POOL_CONTAINER_NAME.format(self.instance_os, self.shard)
+
+    def adopt(self) -> None:
+        """
+        Take over pooled containers left running by a previous server process.
+
+        Author: Namah Shrestha
+        """
+        container_ids: list = list(
+            db.get_backend().list_containers(self.pool_container_prefix()).values()
+        )
+        with self.lock:
+            for container_id in container_ids:
+                if container_id not in self.idle:
+                    self.idle.append(container_id)
+
+    def start_container(self, image: str) -> typing.Optional[str]:
+        """
+        Start one unassigned container, labelled without instance hash.
+        The hash is in its name once a CREATE renamed it.
+        Returns the id of the container or None if it failed.
+
+        Author: Namah Shrestha
+        """
+        name: str = constants.POOL_CONTAINER_NAME.format(
+            self.instance_os, self.shard + uuid.uuid4().hex[:12]
+        )
+        return db.get_backend().run_container(
+            name, image, ci.container_labels(self.instance_os)
+        )
+
+    def refill(self) -> int:
+        """
+        Start containers until the pool has its configured size.
+        Returns the number of started containers.
+
+        Author: Namah Shrestha
+        """
+        if len(self.idle) >= self.size:
+            return 0
+        image: str = ic.image_cache.ensure_image(
+            self.image_name, self.image_tag, self.dockerfile_name
+        )
+        started: int = 0
+        while len(self.idle) < self.size:
+            container_id: typing.Optional[str] = self.start_container(image)
+            if container_id is None:
+                logger.warning("Pool %s: container start failed", self.instance_os)
+                ic.image_cache.invalidate(image)
+                break
+            with self.lock:
+                self.idle.append(container_id)
+            started += 1
+        return started
+
+    @tracing.traced("pool_acquire")
+    def acquire(self, container_name: str) -> typing.Optional[str]:
+        """
+        Bind a pooled container to the instance by renaming it.
+        Returns the container id, or None on a pool miss. The caller then
+        creates the container.
+        A pooled container that is gone is dropped and the next one tried.
+        One that still exists could not take the name, which no other
+        pooled container can either, so it is put back and the acquire
+        misses.
+
+        Author: Namah Shrestha
+        """
+        backend: db.DockerBackend = db.get_backend()
+        while True:
+            with self.lock:
+                if not self.idle:
+                    self.misses += 1
+                    return None
+                container_id: str = self.idle.popleft()
+            if backend.rename_container(container_id, container_name):
+                with self.lock:
+                    self.hits += 1
+                return container_id
+            if backend.container_exists(container_id):
+                logger.warning(
+                    "Pool %s: renaming to %s failed",
+                    self.instance_os,
+                    container_name,
+                )
+                with self.lock:
+                    self.idle.appendleft(container_id)
+                    self.misses += 1
+                return None
+            """ The pooled container is gone, try the next one """
+
+    def stats(self) -> dict:
+        """
+        Hit and miss counters of the pool, used to size the pool.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            return {
+                "instance_os": self.instance_os,
+                "size": self.size,
+                "idle": len(self.idle),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+"""
+The pools of the server. Empty until setup_pools is called,
+in which case CREATE always builds and runs.
+
+Author: Namah Shrestha
+"""
+pools: dict = {}
+
+
+def setup_pools(
+    size: int = constants.POOL_SIZE,
+    shard: str = "",
+    instance_oses: typing.Iterable[str] = constants.SUPPORTED_OS,
+) -> dict:
+    """
+    Create a pool for every os of the instance oses,
+    by default every supported os.
+
+    Author: Namah Shrestha
+    """
+    pools.clear()
+    if size <= 0:
+        return pools
+    for instance_os in instance_oses:
+        image_name, image_tag, dockerfile_name = image_switch[instance_os]
+        pools[instance_os] = ContainerPool(
+            instance_os, image_name, image_tag, dockerfile_name, size, shard
+        )
+    return pools
+
+
+def get_pool(instance_os: str) -> typing.Optional[ContainerPool]:
+    """
+    Get the pool of the os, None if pooling is disabled.
+
+    Author: Namah Shrestha
+    """
+    return pools.get(instance_os)
+
+
+def pool_stats() -> list:
+    """
+    Stats of every pool.
+
+    Author: Namah Shrestha
+    """
+    return [pool.stats() for pool in pools.values()]
+
+
+async def refill_pools(interval: float = constants.POOL_REFILL_INTERVAL) -> None:
+    """
+    Background task that keeps every pool at its configured size.
+
+    Author: Namah Shrestha
+    """
+    for pool in pools.values():
+        await executor.run_blocking(constants.CREATE, pool.adopt)
+    last_stats: dict = {}
+    while True:
+        for pool in list(pools.values()):
+            try:
+                await executor.run_blocking(constants.CREATE, pool.refill)
+            except Exception:
+                logger.exception("Pool %s: refill failed", pool.instance_os)
+            stats: dict = pool.stats()
+            if last_stats.get(pool.instance_os) != stats:
+                logger.info("Pool stats: %s", stats)
+                last_stats[pool.instance_os] = stats
+        await asyncio.sleep(interval)
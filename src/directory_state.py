@@ -2,12 +2,19 @@
 This is the current state of the directory.
 We need to change it as per the commands.
 
+The directory is the working directory of a session in its container.
+Paths are resolved in memory and checked against the container, never
+against the host, and the server process never changes its own working
+directory. Every session has its own state, so sessions running in the
+executor threads do not share anything.
+
 Author: Namah Shrestha
 """
 
 # builtins
-import os
+import posixpath
 import re
+import typing
 
 # modules
 import src.constants as constants
@@ -22,13 +29,15 @@ class DirectoryStateManager:
 
     def __init__(self) -> None:
         """
-        Set the default value of current working directory
+        Set the default value of current working directory,
+        the working directory of a new container.
+
         Author: Namah Shrestha
         """
-        self._curr_dir: str = os.path.abspath("")
+        self._curr_dir: str = constants.CONTAINER_WORKING_DIRECTORY
 
     @property
-    def curr_dir(self) -> None:
+    def curr_dir(self) -> str:
         """
         Get the value of current working directory.
         Author: Namah Shrestha
@@ -36,17 +45,14 @@ class DirectoryStateManager:
         return self._curr_dir
 
     @curr_dir.setter
-    def curr_dir(self, dirc: str) -> str:
+    def curr_dir(self, dirc: str) -> None:
         """
         Set the value of the current working directory.
-        Here we need to validate the dir first.
+        Only absolute paths are accepted. They are normalized.
         Author: Namah Shrestha
         """
-        if re.match(constants.CHANGE_DIRECTORY_CMD_PATTERN.split(" ")[-1], dirc):
-            """Repeatedly remove // until only one is found"""
-            while dirc.find("//") >= 0:
-                dirc = dirc.replace("//", "/")
-            self._curr_dir = dirc
+        if dirc.startswith("/"):
+            self._curr_dir = posixpath.normpath(dirc).replace("//", "/")
 
 
 class ChangeDirectoryHandler:
@@ -88,40 +94,39 @@ class ChangeDirectoryHandler:
             dirc = dirc.replace("//", "/")
         return dirc
 
-    def change_directory(self, cmd: str) -> str:
+    def resolve_directory(self, cmd: str) -> str:
         """
-        Change the directory based on the cd command
+        The absolute directory the cd command changes to,
+        resolved against the current working directory in memory.
+        ~ is the home directory of the container.
 
         Author: Namah Shrestha
         """
-        if not self.is_cd_command(cmd):
-            return ""
         dirc: str = self.parse_cd_command(cmd)
         if not dirc:
             return ""
+        if dirc == "~" or dirc.startswith("~/"):
+            dirc = constants.CONTAINER_HOME_DIRECTORY + dirc[1:]
+        return posixpath.normpath(posixpath.join(self.get_cwd(), dirc))
+
+    def change_directory(
+        self, cmd: str, check_directory: typing.Callable[[str], str]
+    ) -> str:
         """
-        Now use os.chdir without actually changing the directory
-        We do this by reseting the actual workdir to abspath.
-        We only change the curr_dir to the desired path.
-        """
-        # get the current working directory
-        current_dir: str = self.get_cwd()
-        os.chdir(current_dir)  # change to current_dir_value
-        try:
-            os.chdir(dirc)  # change directory relatively
-            self.dir_state_manager.curr_dir = (
-                os.getcwd()
-            )  # change the current directory to the change directory
-        except FileNotFoundError:
-            """
-            When there is an error in this step chdir.
-            Dont change curr_dir.
-            But continue with the remaining process
-            """
-            print("No such directory, will not set the value")
-        os.chdir(
-            constants.MAIN_WORKING_DIRECTORY
-        )  # re-set the actual working directory to the abspath
+        Change the directory based on the cd command.
+
+        check_directory asks the container. It returns the directory as
+        the container sees it, or an empty string if it does not exist.
+        A missing directory leaves the current working directory as it is.
+
+        Author: Namah Shrestha
+        """
+        dirc: str = self.resolve_directory(cmd)
+        if not dirc:
+            return ""
+        checked_dirc: str = check_directory(dirc)
+        if checked_dirc:
+            self.dir_state_manager.curr_dir = checked_dirc
         return self.get_cwd()
 
     def get_cwd(self) -> str:
@@ -131,3 +136,24 @@ class ChangeDirectoryHandler:
         Author: Namah Shrestha
         """
         return self.dir_state_manager.curr_dir
+
+    def workdir(self) -> typing.Optional[str]:
+        """
+        The working directory to run commands in.
+        None while it is the working directory of a new container,
+        so commands of sessions that never changed directory run as is.
+
+        Author: Namah Shrestha
+        """
+        cwd: str = self.get_cwd()
+        if cwd == constants.CONTAINER_WORKING_DIRECTORY:
+            return None
+        return cwd
+
+    def reset(self) -> None:
+        """
+        Go back to the working directory of a new container.
+
+        Author: Namah Shrestha
+        """
+        self.dir_state_manager = DirectoryStateManager()
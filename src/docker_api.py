@@ -0,0 +1,522 @@
+"""
+This is the docker engine api client.
+
+It talks HTTP to the docker daemon over its unix socket directly,
+instead of forking a shell and the docker cli for every operation.
+Connections are kept alive and reused from a small pool.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import contextlib
+import http.client
+import json
+import queue
+import socket
+import struct
+import threading
+import typing
+import urllib.parse
+
+# modules
+import src.constants as constants
+
+
+class DockerAPIError(Exception):
+    """
+    Raised when the docker daemon answers with an error status.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status: int = status
+        self.message: str = message
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a unix socket.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self, socket_path: str, timeout: typing.Optional[float] = None
+    ) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path: str = socket_path
+
+    def connect(self) -> None:
+        """
+        Connect to the unix socket instead of a tcp address.
+
+        Author: Namah Shrestha
+        """
+        sock: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+"""
+Errors of a kept alive connection that the daemon closed in the meantime.
+The request is retried once on a fresh connection.
+
+Author: Namah Shrestha
+"""
+STALE_CONNECTION_ERRORS: tuple = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+class DockerAPIClient:
+    """
+    Docker engine api client with a pool of kept alive connections.
+
+    The client is shared by the executor threads. Every request takes
+    an idle connection from the pool, or opens a new one, and gives it
+    back when the response has been read completely.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        socket_path: str = constants.DOCKER_SOCKET_PATH,
+        pool_size: int = constants.DOCKER_API_POOL_SIZE,
+        api_version: str = constants.DOCKER_API_VERSION,
+        timeout: typing.Optional[float] = constants.DOCKER_API_TIMEOUT,
+    ) -> None:
+        """
+        Create a client with an empty connection pool.
+
+        Author: Namah Shrestha
+        """
+        self.socket_path: str = socket_path
+        self.api_version: str = api_version
+        self.timeout: typing.Optional[float] = timeout
+        self.idle_connections: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+
+    def new_connection(self) -> UnixHTTPConnection:
+        """
+        Open a new connection to the daemon.
+
+        Author: Namah Shrestha
+        """
+        return UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+
+    @contextlib.contextmanager
+    def connection(self, fresh: bool = False) -> typing.Iterator[UnixHTTPConnection]:
+        """
+        Borrow a connection from the pool, or open a fresh one.
+        Connections that broke or were closed by the daemon are dropped.
+
+        Author: Namah Shrestha
+        """
+        conn: typing.Optional[UnixHTTPConnection] = None
+        if not fresh:
+            try:
+                conn = self.idle_connections.get_nowait()
+            except queue.Empty:
+                pass
+        if conn is None:
+            conn = self.new_connection()
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+        if conn.sock is None:
+            return
+        try:
+            self.idle_connections.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def path(self, path: str, query: typing.Optional[dict] = None) -> str:
+        """
+        Versioned api path with the url encoded query.
+
+        Author: Namah Shrestha
+        """
+        url: str = f"/{self.api_version}{path}"
+        if query:
+            url = f"{url}?{urllib.parse.urlencode(query)}"
+        return url
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: typing.Optional[dict] = None,
+        query: typing.Optional[dict] = None,
+    ) -> typing.Tuple[int, bytes]:
+        """
+        Send a request and read the whole response.
+        Returns the status and the body.
+
+        Author: Namah Shrestha
+        """
+        headers: dict = {}
+        payload: typing.Optional[bytes] = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            with self.connection(fresh=bool(attempt)) as conn:
+                reused: bool = conn.sock is not None
+                try:
+                    conn.request(
+                        method, self.path(path, query), body=payload, headers=headers
+                    )
+                    response: http.client.HTTPResponse = conn.getresponse()
+                    data: bytes = response.read()
+                    return response.status, data
+                except STALE_CONNECTION_ERRORS:
+                    conn.close()
+                    if not reused or attempt:
+                        raise
+
+    def json_request(
+        self,
+        method: str,
+        path: str,
+        body: typing.Optional[dict] = None,
+        query: typing.Optional[dict] = None,
+        expected: tuple = (200, 201, 204),
+    ) -> typing.Any:
+        """
+        Send a request and decode the json response.
+        Raise DockerAPIError on an unexpected status.
+
+        Author: Namah Shrestha
+        """
+        status, data = self.request(method, path, body=body, query=query)
+        if status not in expected:
+            try:
+                message: str = json.loads(data).get("message", "")
+            except ValueError:
+                message = data.decode(errors="replace")
+            raise DockerAPIError(status, message)
+        if not data:
+            return None
+        return json.loads(data)
+
+    def create_container(
+        self, image: str, name: typing.Optional[str] = None, **config: typing.Any
+    ) -> str:
+        """
+        Create a container and return its id.
+
+        Author: Namah Shrestha
+        """
+        query: typing.Optional[dict] = {"name": name} if name else None
+        body: dict = {"Image": image, **config}
+        return self.json_request("POST", "/containers/create", body, query)["Id"]
+
+    def start_container(self, container: str) -> None:
+        """
+        Start a created container.
+
+        Author: Namah Shrestha
+        """
+        self.json_request("POST", f"/containers/{container}/start", expected=(204, 304))
+
+    def pause_container(self, container: str) -> None:
+        """
+        Freeze every process of a running container.
+
+        Author: Namah Shrestha
+        """
+        self.json_request("POST", f"/containers/{container}/pause", expected=(204,))
+
+    def unpause_container(self, container: str) -> None:
+        """
+        Thaw the processes of a paused container.
+
+        Author: Namah Shrestha
+        """
+        self.json_request("POST", f"/containers/{container}/unpause", expected=(204,))
+
+    def inspect_container(self, container: str) -> dict:
+        """
+        Inspect a container.
+
+        Author: Namah Shrestha
+        """
+        return self.json_request("GET", f"/containers/{container}/json")
+
+    def remove_container(self, container: str, force: bool = True) -> None:
+        """
+        Remove a container, killing it first if force is set.
+
+        Author: Namah Shrestha
+        """
+        self.json_request(
+            "DELETE", f"/containers/{container}", query={"force": str(force).lower()}
+        )
+
+    def rename_container(self, container: str, name: str) -> None:
+        """
+        Rename a container.
+
+        Author: Namah Shrestha
+        """
+        self.json_request(
+            "POST", f"/containers/{container}/rename", query={"name": name}
+        )
+
+    def list_containers(
+        self, filters: typing.Optional[dict] = None, all: bool = False
+    ) -> list:
+        """
+        List containers matching the filters.
+        Filters map a filter name to a list of values, like the cli.
+
+        Author: Namah Shrestha
+        """
+        query: dict = {"all": str(all).lower()}
+        if filters:
+            query["filters"] = json.dumps(filters)
+        return self.json_request("GET", "/containers/json", query=query)
+
+    def open_events(
+        self, filters: dict
+    ) -> typing.Tuple[UnixHTTPConnection, http.client.HTTPResponse]:
+        """
+        Start streaming the events matching the filters, one json object
+        per line. Events can be far apart, so the stream has a connection
+        of its own without timeout. Returns the connection and the response.
+
+        Author: Namah Shrestha
+        """
+        conn: UnixHTTPConnection = UnixHTTPConnection(self.socket_path, timeout=None)
+        try:
+            conn.request("GET", self.path("/events", {"filters": json.dumps(filters)}))
+            response: http.client.HTTPResponse = conn.getresponse()
+            if response.status != 200:
+                raise DockerAPIError(
+                    response.status, response.read().decode(errors="replace")
+                )
+            return conn, response
+        except BaseException:
+            conn.close()
+            raise
+
+    def inspect_image(self, image: str) -> dict:
+        """
+        Inspect an image.
+
+        Author: Namah Shrestha
+        """
+        return self.json_request("GET", f"/images/{image}/json")
+
+    def commit_container(self, container: str, repo: str, tag: str) -> str:
+        """
+        Create an image of the repo and tag from the container.
+        Returns the image id.
+
+        Author: Namah Shrestha
+        """
+        return self.json_request(
+            "POST",
+            "/commit",
+            query={"container": container, "repo": repo, "tag": tag},
+        )["Id"]
+
+    def remove_image(self, image: str, force: bool = True) -> None:
+        """
+        Remove an image, or only its tag if a container still uses it
+        and force is set.
+
+        Author: Namah Shrestha
+        """
+        self.json_request(
+            "DELETE", f"/images/{image}", query={"force": str(force).lower()}
+        )
+
+    def create_exec(
+        self,
+        container: str,
+        cmd: list,
+        workdir: typing.Optional[str] = None,
+        stdin: bool = False,
+        env: typing.Optional[list] = None,
+    ) -> str:
+        """
+        Create an exec instance in the container and return its id.
+        The env is a list of "NAME=value" variables.
+
+        Author: Namah Shrestha
+        """
+        config: dict = {
+            "AttachStdin": stdin,
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Cmd": cmd,
+        }
+        if workdir:
+            config["WorkingDir"] = workdir
+        if env:
+            config["Env"] = env
+        return self.json_request("POST", f"/containers/{container}/exec", config)["Id"]
+
+    def exec_exit_code(self, exec_id: str) -> typing.Optional[int]:
+        """
+        Exit code of a finished exec instance.
+
+        Author: Namah Shrestha
+        """
+        return self.json_request("GET", f"/exec/{exec_id}/json")["ExitCode"]
+
+    def exec_container(
+        self,
+        container: str,
+        cmd: list,
+        workdir: typing.Optional[str] = None,
+    ) -> typing.Tuple[int, bytes, bytes]:
+        """
+        Run a command in the container.
+        Returns the exit code, stdout and stderr.
+
+        Author: Namah Shrestha
+        """
+        exec_id: str = self.create_exec(container, cmd, workdir)
+        status, data = self.request(
+            "POST", f"/exec/{exec_id}/start", {"Detach": False, "Tty": False}
+        )
+        if status != 200:
+            raise DockerAPIError(status, data.decode(errors="replace"))
+        stdout, stderr = demultiplex(data)
+        return self.exec_exit_code(exec_id), stdout, stderr
+
+    def stream_exec(self, exec_id: str) -> typing.Iterator[typing.Tuple[int, bytes]]:
+        """
+        Start the exec instance and yield (stream type, data) frames as they
+        arrive. A connection that was not read to the end is not reused.
+
+        Author: Namah Shrestha
+        """
+        with self.connection() as conn:
+            conn.request(
+                "POST",
+                self.path(f"/exec/{exec_id}/start"),
+                body=json.dumps({"Detach": False, "Tty": False}).encode(),
+                headers={"Content-Type": "application/json"},
+            )
+            response: http.client.HTTPResponse = conn.getresponse()
+            if response.status != 200:
+                raise DockerAPIError(
+                    response.status, response.read().decode(errors="replace")
+                )
+            while True:
+                header: bytes = response.read(8)
+                if len(header) < 8:
+                    break
+                stream_type, size = struct.unpack(">BxxxL", header)
+                yield stream_type, response.read(size)
+            response.read()
+
+    def attach_exec(self, exec_id: str) -> typing.Tuple[socket.socket, bytes]:
+        """
+        Start the exec instance with stdin attached.
+
+        The daemon hijacks the connection: after the response headers it
+        reads raw stdin and writes the multiplexed output. http.client
+        cannot hand over such a connection, so the request is written by
+        hand on a socket of its own. Returns the socket and the output
+        that arrived together with the headers.
+
+        Author: Namah Shrestha
+        """
+        body: bytes = json.dumps({"Detach": False, "Tty": False}).encode()
+        sock: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(
+                (
+                    f"POST {self.path(f'/exec/{exec_id}/start')} HTTP/1.1\r\n"
+                    "Host: localhost\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: Upgrade\r\n"
+                    "Upgrade: tcp\r\n\r\n"
+                ).encode()
+                + body
+            )
+            data: bytes = b""
+            while b"\r\n\r\n" not in data:
+                chunk: bytes = sock.recv(constants.STREAM_READ_SIZE)
+                if not chunk:
+                    raise http.client.RemoteDisconnected("Exec attach closed")
+                data += chunk
+            head, _, rest = data.partition(b"\r\n\r\n")
+            status: int = int(head.split(b" ", 2)[1])
+            if status not in (101, 200):
+                raise DockerAPIError(status, rest.decode(errors="replace"))
+            return sock, rest
+        except BaseException:
+            sock.close()
+            raise
+
+    def close(self) -> None:
+        """
+        Close every idle connection.
+
+        Author: Namah Shrestha
+        """
+        while True:
+            try:
+                self.idle_connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def demultiplex(data: bytes) -> typing.Tuple[bytes, bytes]:
+    """
+    Split the multiplexed exec stream into stdout and stderr.
+    Every frame has an 8 byte header: stream type, 3 zero bytes and
+    the big endian frame size.
+
+    Author: Namah Shrestha
+    """
+    stdout: bytearray = bytearray()
+    stderr: bytearray = bytearray()
+    offset: int = 0
+    while offset + 8 <= len(data):
+        stream_type, size = struct.unpack(">BxxxL", data[offset : offset + 8])
+        frame: bytes = data[offset + 8 : offset + 8 + size]
+        if stream_type == 2:
+            stderr.extend(frame)
+        else:
+            stdout.extend(frame)
+        offset += 8 + size
+    return bytes(stdout), bytes(stderr)
+
+
+"""
+One client per server process, created on first use.
+
+Author: Namah Shrestha
+"""
+_client: typing.Optional[DockerAPIClient] = None
+_client_lock: threading.Lock = threading.Lock()
+
+
+def get_client() -> DockerAPIClient:
+    """
+    Get the shared client.
+
+    Author: Namah Shrestha
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = DockerAPIClient()
+        return _client
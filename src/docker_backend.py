@@ -0,0 +1,2128 @@
+"""
+These are the docker backends of the application.
+
+Every docker operation of the instance manager, instance exec, warm pool
+and image cache goes through a backend. The cli backend forks the docker
+cli like the application always did. The api backend talks to the docker
+daemon over its unix socket and spawns no processes at all. The fake
+backend keeps containers in memory, with a configurable latency per
+operation, so the server can be tested and benchmarked without docker.
+
+Every backend implements DockerBackend. The backend is selected with
+constants.DOCKER_BACKEND.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import gzip
+import json
+import os
+import posixpath
+import queue
+import re
+import shlex
+import shutil
+import socket
+import struct
+import subprocess
+import threading
+import time
+import typing
+import uuid
+
+# modules
+import src.constants as constants
+import src.docker_api as docker_api
+import src.metrics as metrics
+
+
+class ContainerNotFoundError(Exception):
+    """
+    Raised when a known container id does not exist anymore.
+
+    Author: Namah Shrestha
+    """
+
+
+class ExecStream:
+    """
+    Output of a running exec.
+
+    Iterating yields stdout chunks as soon as the command writes them.
+    The exit code is set once the stream is exhausted, and the working
+    directory the command left behind if the stream knows it.
+    Closing the stream early stops reading and releases the exec.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self) -> None:
+        self.exit_code: typing.Optional[int] = None
+        self.cwd: typing.Optional[str] = None
+
+    def __iter__(self) -> typing.Iterator[bytes]:
+        return self.read()
+
+    def read(self) -> typing.Iterator[bytes]:
+        """
+        Yield the stdout chunks.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Stop the stream.
+
+        Author: Namah Shrestha
+        """
+        pass
+
+
+class CompletedExecStream(ExecStream):
+    """
+    Output of a command that already finished.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, output: bytes, exit_code: int) -> None:
+        super().__init__()
+        self.output: bytes = output
+        self.final_exit_code: int = exit_code
+
+    def read(self) -> typing.Iterator[bytes]:
+        """
+        Yield the output once.
+
+        Author: Namah Shrestha
+        """
+        if self.output:
+            yield self.output
+        self.exit_code = self.final_exit_code
+
+
+class CLIExecStream(ExecStream):
+    """
+    Streams the stdout of a docker cli process.
+
+    The docker cli fails the same way for a stale container id and for a
+    failing command. If the process failed without any output, is_stale
+    tells if the container id was stale, and ContainerNotFoundError is
+    raised at the end of the stream.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        command: str,
+        is_stale: typing.Optional[typing.Callable[[], bool]] = None,
+    ) -> None:
+        super().__init__()
+        self.process: subprocess.Popen = subprocess.Popen(
+            command, shell=True, stdout=subprocess.PIPE
+        )
+        self.is_stale: typing.Optional[typing.Callable[[], bool]] = is_stale
+
+    def read(self) -> typing.Iterator[bytes]:
+        """
+        Yield whatever the process wrote since the last read.
+
+        Author: Namah Shrestha
+        """
+        output: bool = False
+        try:
+            while True:
+                data: bytes = os.read(
+                    self.process.stdout.fileno(), constants.STREAM_READ_SIZE
+                )
+                if not data:
+                    break
+                output = True
+                yield data
+        finally:
+            self.process.stdout.close()
+            self.exit_code = self.process.wait()
+        if self.exit_code and not output and self.is_stale and self.is_stale():
+            raise ContainerNotFoundError()
+
+    def close(self) -> None:
+        """
+        Kill the docker cli process.
+
+        Author: Namah Shrestha
+        """
+        if self.process.poll() is None:
+            self.process.kill()
+
+
+class APIExecStream(ExecStream):
+    """
+    Streams the stdout frames of an exec instance of the engine api.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, client: docker_api.DockerAPIClient, exec_id: str) -> None:
+        super().__init__()
+        self.client: docker_api.DockerAPIClient = client
+        self.exec_id: str = exec_id
+        self.frames: typing.Iterator[typing.Tuple[int, bytes]] = client.stream_exec(
+            exec_id
+        )
+
+    def read(self) -> typing.Iterator[bytes]:
+        """
+        Yield the stdout frames.
+
+        Author: Namah Shrestha
+        """
+        for stream_type, data in self.frames:
+            if stream_type != 2:
+                yield data
+        self.exit_code = self.client.exec_exit_code(self.exec_id)
+
+    def close(self) -> None:
+        """
+        Drop the streaming connection.
+
+        Author: Namah Shrestha
+        """
+        self.frames.close()
+
+
+class ExecChannel:
+    """
+    Stdin and stdout of an interactive exec.
+
+    Stderr is discarded. Once recv returns no more data the exec has
+    ended and the exit code is set.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self) -> None:
+        self.exit_code: typing.Optional[int] = None
+
+    def send(self, data: bytes) -> None:
+        """
+        Write to stdin. Raise OSError if the exec has ended.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def recv(self) -> bytes:
+        """
+        Read the next stdout data, empty once the exec has ended.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        End the exec.
+
+        Author: Namah Shrestha
+        """
+        pass
+
+
+class CLIExecChannel(ExecChannel):
+    """
+    Pipes of an interactive docker cli exec process.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, command: str) -> None:
+        super().__init__()
+        self.process: subprocess.Popen = subprocess.Popen(
+            command,
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def send(self, data: bytes) -> None:
+        """
+        Write to the stdin pipe.
+
+        Author: Namah Shrestha
+        """
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+    def recv(self) -> bytes:
+        """
+        Read whatever the process wrote since the last read.
+
+        Author: Namah Shrestha
+        """
+        data: bytes = os.read(self.process.stdout.fileno(), constants.STREAM_READ_SIZE)
+        if not data:
+            self.exit_code = self.process.wait()
+        return data
+
+    def close(self) -> None:
+        """
+        Kill the process and close its pipes.
+
+        Author: Namah Shrestha
+        """
+        if self.process.poll() is None:
+            self.process.kill()
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        self.process.wait()
+
+
+class APIExecChannel(ExecChannel):
+    """
+    Hijacked connection of an exec instance of the engine api.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, client: docker_api.DockerAPIClient, exec_id: str) -> None:
+        super().__init__()
+        self.client: docker_api.DockerAPIClient = client
+        self.exec_id: str = exec_id
+        self.sock, buffered = client.attach_exec(exec_id)
+        self.buffer: bytearray = bytearray(buffered)
+
+    def send(self, data: bytes) -> None:
+        """
+        Write raw stdin to the connection.
+
+        Author: Namah Shrestha
+        """
+        self.sock.sendall(data)
+
+    def recv(self) -> bytes:
+        """
+        Read the next stdout frame. Stderr frames are skipped.
+
+        Author: Namah Shrestha
+        """
+        while True:
+            if len(self.buffer) >= 8:
+                stream_type, size = struct.unpack(">BxxxL", self.buffer[:8])
+                if len(self.buffer) >= 8 + size:
+                    data: bytes = bytes(self.buffer[8 : 8 + size])
+                    del self.buffer[: 8 + size]
+                    if stream_type != 2 and data:
+                        return data
+                    continue
+            chunk: bytes = self.sock.recv(constants.STREAM_READ_SIZE)
+            if not chunk:
+                self.exit_code = self.client.exec_exit_code(self.exec_id)
+                return b""
+            self.buffer.extend(chunk)
+
+    def close(self) -> None:
+        """
+        Close the connection, which ends the exec.
+
+        Author: Namah Shrestha
+        """
+        self.sock.close()
+
+
+class ContainerInfo:
+    """
+    A container of a listing. A paused container is running.
+
+    Author: Namah Shrestha
+    """
+
+    __slots__ = ("container_id", "name", "running", "labels", "paused")
+
+    def __init__(
+        self,
+        container_id: str,
+        name: str,
+        running: bool,
+        labels: dict,
+        paused: bool = False,
+    ) -> None:
+        self.container_id: str = container_id
+        self.name: str = name
+        self.running: bool = running
+        self.labels: dict = labels
+        self.paused: bool = paused
+
+
+class ContainerEvent:
+    """
+    A lifecycle event of a container, like create, start, die or destroy.
+
+    Author: Namah Shrestha
+    """
+
+    __slots__ = ("action", "container_id", "name")
+
+    def __init__(self, action: str, container_id: str, name: str = "") -> None:
+        self.action: str = action
+        self.container_id: str = container_id
+        self.name: str = name
+
+
+def parse_event(event: dict) -> typing.Optional[ContainerEvent]:
+    """
+    The container event of a decoded docker event, None if it is not one.
+    Exec actions carry their command after a colon, it is dropped.
+
+    Author: Namah Shrestha
+    """
+    actor: dict = event.get("Actor") or {}
+    action: str = (event.get("Action") or event.get("status") or "").split(":")[0]
+    container_id: str = actor.get("ID") or event.get("id") or ""
+    if not action or not container_id:
+        return None
+    return ContainerEvent(
+        action, container_id, (actor.get("Attributes") or {}).get("name", "")
+    )
+
+
+class EventStream:
+    """
+    Container events of the daemon as they happen.
+    Iterating blocks until the next event and ends with the stream.
+    Closing the stream from another thread ends the iteration.
+
+    Author: Namah Shrestha
+    """
+
+    def __iter__(self) -> typing.Iterator[ContainerEvent]:
+        return self.read()
+
+    def read(self) -> typing.Iterator[ContainerEvent]:
+        """
+        Yield the events.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Stop the stream.
+
+        Author: Namah Shrestha
+        """
+
+
+class CLIEventStream(EventStream):
+    """
+    Events of a docker events cli process, one json object per line.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, command: str) -> None:
+        self.process: subprocess.Popen = subprocess.Popen(
+            command, shell=True, stdout=subprocess.PIPE
+        )
+
+    def read(self) -> typing.Iterator[ContainerEvent]:
+        """
+        Yield the event of every line.
+
+        Author: Namah Shrestha
+        """
+        try:
+            for line in self.process.stdout:
+                try:
+                    event: typing.Optional[ContainerEvent] = parse_event(
+                        json.loads(line)
+                    )
+                except ValueError:
+                    continue
+                if event is not None:
+                    yield event
+        finally:
+            self.process.stdout.close()
+            self.process.wait()
+
+    def close(self) -> None:
+        """
+        Kill the docker cli process.
+
+        Author: Namah Shrestha
+        """
+        if self.process.poll() is None:
+            self.process.kill()
+
+
+class APIEventStream(EventStream):
+    """
+    Events of the events endpoint of the engine api.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, client: docker_api.DockerAPIClient, filters: dict) -> None:
+        self.connection, self.response = client.open_events(filters)
+
+    def read(self) -> typing.Iterator[ContainerEvent]:
+        """
+        Yield the event of every line.
+
+        Author: Namah Shrestha
+        """
+        try:
+            for line in self.response:
+                try:
+                    event: typing.Optional[ContainerEvent] = parse_event(
+                        json.loads(line)
+                    )
+                except ValueError:
+                    continue
+                if event is not None:
+                    yield event
+        except (OSError, ValueError):
+            """The stream was closed"""
+        finally:
+            self.connection.close()
+
+    def close(self) -> None:
+        """
+        Shut the connection down, which wakes up a blocked read.
+
+        Author: Namah Shrestha
+        """
+        if self.connection.sock is not None:
+            try:
+                self.connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class FakeEventStream(EventStream):
+    """
+    Events published by the fake backend.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, backend: "DockerFakeBackend") -> None:
+        self.backend: DockerFakeBackend = backend
+        self.events: queue.Queue = queue.Queue()
+
+    def read(self) -> typing.Iterator[ContainerEvent]:
+        """
+        Yield the published events until the stream is closed.
+
+        Author: Namah Shrestha
+        """
+        while True:
+            event: typing.Optional[ContainerEvent] = self.events.get()
+            if event is None:
+                return
+            yield event
+
+    def close(self) -> None:
+        """
+        Stop receiving events.
+
+        Author: Namah Shrestha
+        """
+        with self.backend.lock:
+            if self in self.backend.event_streams:
+                self.backend.event_streams.remove(self)
+        self.events.put(None)
+
+
+def parse_labels(labels: str) -> dict:
+    """
+    Labels in the key=value,key=value format of the docker cli.
+
+    Author: Namah Shrestha
+    """
+    parsed: dict = {}
+    for label in labels.split(","):
+        key, _, value = label.partition("=")
+        if key:
+            parsed[key] = value
+    return parsed
+
+
+class DockerBackend:
+    """
+    The container operations of the application.
+
+    The instance manager, instance exec, warm pool and image cache only
+    talk to a backend, never to docker directly. Implementations are the
+    docker cli, the docker engine api and an in-memory fake.
+
+    Author: Namah Shrestha
+    """
+
+    def image_exists(self, image: str) -> bool:
+        """
+        Check if the image exists.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def build_image(self, context_dir: str, tags: list, dockerfile_name: str) -> bool:
+        """
+        Build the image with every tag. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def run_container(
+        self, name: str, image: str, labels: typing.Optional[dict] = None
+    ) -> typing.Optional[str]:
+        """
+        Create and start a container with the labels.
+        Returns the container id or None if it failed.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def commit_container(self, container_id: str, image: str) -> bool:
+        """
+        Create the image from the files of the container.
+        Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def save_image(self, image: str, path: str) -> bool:
+        """
+        Write the image to the path as a gzip compressed archive.
+        Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def load_image(self, path: str) -> bool:
+        """
+        Load the image of an archive written by save_image.
+        Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def remove_image(self, image: str) -> None:
+        """
+        Force remove the image. If a container still uses it, only the
+        tag is removed.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def rename_container(self, container: str, name: str) -> bool:
+        """
+        Rename a container. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def container_exists(self, container: str) -> bool:
+        """
+        Check if the container exists, running or not.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def remove_container(
+        self, name: str, container_id: typing.Optional[str] = None
+    ) -> None:
+        """
+        Force remove the container, by id if known, otherwise by name.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def pause_container(self, container_id: str) -> bool:
+        """
+        Freeze the processes of the container with the cgroup freezer.
+        Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def unpause_container(self, container_id: str) -> bool:
+        """
+        Thaw the processes of a paused container. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def list_container_ids(self, name: str) -> list:
+        """
+        Ids of the running containers matching the name filter.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def find_container(self, name: str) -> str:
+        """
+        Id of the named container, empty if it does not exist.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def list_containers(self, prefix: str) -> dict:
+        """
+        Running containers whose name starts with the prefix.
+        Returns a map of container name to container id.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def list_labelled_containers(self, label: str) -> list:
+        """
+        Every container with the label, running or not, in one listing.
+        Returns a list of ContainerInfo.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def remove_containers(self, container_ids: list) -> None:
+        """
+        Force remove every container of the list at once.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def watch_events(self, label: str, actions: tuple) -> EventStream:
+        """
+        Start following the events of the actions of the containers
+        with the label.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def exec_container(
+        self,
+        name: str,
+        exec_command: str,
+        container_id: typing.Optional[str] = None,
+        workdir: typing.Optional[str] = None,
+    ) -> str:
+        """
+        Run the command in the container and return its output.
+        Raise ContainerNotFoundError if the known id is stale.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def stream_exec(
+        self,
+        name: str,
+        exec_command: str,
+        container_id: typing.Optional[str] = None,
+        workdir: typing.Optional[str] = None,
+        exec_id: typing.Optional[str] = None,
+    ) -> ExecStream:
+        """
+        Start the command in the container and stream its output.
+        With an exec id the command is tagged with it, see kill_exec.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def open_shell(
+        self,
+        name: str,
+        container_id: typing.Optional[str] = None,
+        exec_id: typing.Optional[str] = None,
+    ) -> ExecChannel:
+        """
+        Start an interactive shell in the container.
+        With an exec id the shell is tagged with it, see kill_exec.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+    def kill_exec(
+        self, name: str, container_id: typing.Optional[str], exec_id: str
+    ) -> None:
+        """
+        Kill every process in the container tagged with the exec id.
+        The tag is the environment variable constants.EXEC_TAG_VARIABLE,
+        which the children of the tagged exec inherit.
+
+        Author: Namah Shrestha
+        """
+        raise NotImplementedError
+
+
+class DockerCLIBackend(DockerBackend):
+    """
+    Docker backend that forks the docker cli.
+
+    Author: Namah Shrestha
+    """
+
+    def filter_container_command(self, name: str) -> str:
+        """
+        The command listing the id of the named container.
+
+        Author: Namah Shrestha
+        """
+        return constants.FILTER_CONTAINER_COMMAND.format(name)
+
+    @metrics.docker_operation("inspect")
+    def image_exists(self, image: str) -> bool:
+        """
+        Check if the image exists.
+
+        Author: Namah Shrestha
+        """
+        return os.system(f"docker image inspect {image} > /dev/null 2>&1") == 0
+
+    @metrics.docker_operation("build", failure_result=False)
+    def build_image(self, context_dir: str, tags: list, dockerfile_name: str) -> bool:
+        """
+        Build the image with every tag. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        tag_options: str = " ".join(f"-t {tag}" for tag in tags)
+        return (
+            os.system(
+                f"docker image build {context_dir} {tag_options} -f {dockerfile_name}"
+            )
+            == 0
+        )
+
+    @metrics.docker_operation("run", failure_result=None)
+    def run_container(
+        self, name: str, image: str, labels: typing.Optional[dict] = None
+    ) -> typing.Optional[str]:
+        """
+        Create and start a detached container with the labels.
+        Returns the container id or None if it failed.
+
+        Author: Namah Shrestha
+        """
+        label_options: str = "".join(
+            f"--label {shlex.quote(f'{key}={value}')} "
+            for key, value in (labels or {}).items()
+        )
+        pipe: os._wrap_close = os.popen(
+            f"docker container run --name {name} {label_options}-d {image}"
+        )
+        container_id: str = pipe.read().strip()
+        if pipe.close() is not None:
+            return None
+        return container_id or None
+
+    @metrics.docker_operation("commit", failure_result=False)
+    def commit_container(self, container_id: str, image: str) -> bool:
+        """
+        Commit the container to the image. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        return os.system(f"docker container commit {container_id} {image}") == 0
+
+    @metrics.docker_operation("save", failure_result=False)
+    def save_image(self, image: str, path: str) -> bool:
+        """
+        Compress the archive docker image save streams into the path.
+        Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        process: subprocess.Popen = subprocess.Popen(
+            ["docker", "image", "save", image], stdout=subprocess.PIPE
+        )
+        try:
+            with gzip.open(
+                path, "wb", compresslevel=constants.SNAPSHOT_COMPRESSION
+            ) as archive:
+                shutil.copyfileobj(process.stdout, archive)
+        finally:
+            process.stdout.close()
+        return process.wait() == 0
+
+    @metrics.docker_operation("load", failure_result=False)
+    def load_image(self, path: str) -> bool:
+        """
+        Load the image, docker image load reads compressed archives.
+        Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        return os.system(f"docker image load -q -i {shlex.quote(path)}") == 0
+
+    @metrics.docker_operation("rmi")
+    def remove_image(self, image: str) -> None:
+        """
+        Force remove the image.
+
+        Author: Namah Shrestha
+        """
+        os.system(f"docker image rm -f {image}")
+
+    @metrics.docker_operation("rename", failure_result=False)
+    def rename_container(self, container: str, name: str) -> bool:
+        """
+        Rename a container. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        return os.system(f"docker container rename {container} {name}") == 0
+
+    @metrics.docker_operation("inspect")
+    def container_exists(self, container: str) -> bool:
+        """
+        Check if the container exists, running or not.
+
+        Author: Namah Shrestha
+        """
+        return os.system(f"docker container inspect {container} > /dev/null 2>&1") == 0
+
+    @metrics.docker_operation("rm")
+    def remove_container(
+        self, name: str, container_id: typing.Optional[str] = None
+    ) -> None:
+        """
+        Force remove the container.
+        Without a known id the container is looked up in a subshell.
+
+        Author: Namah Shrestha
+        """
+        container: str = container_id or f"$({self.filter_container_command(name)})"
+        os.system(f"docker container rm -f {container}")
+
+    @metrics.docker_operation("pause", failure_result=False)
+    def pause_container(self, container_id: str) -> bool:
+        """
+        Pause the container. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        return os.system(f"docker container pause {container_id}") == 0
+
+    @metrics.docker_operation("unpause", failure_result=False)
+    def unpause_container(self, container_id: str) -> bool:
+        """
+        Unpause the container. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        return os.system(f"docker container unpause {container_id}") == 0
+
+    @metrics.docker_operation("ls")
+    def list_container_ids(self, name: str) -> list:
+        """
+        Ids of the running containers matching the name filter.
+
+        Author: Namah Shrestha
+        """
+        return os.popen(self.filter_container_command(name)).read().split()
+
+    @metrics.docker_operation("ls")
+    def find_container(self, name: str) -> str:
+        """
+        Id of the named container, empty if it does not exist.
+
+        Author: Namah Shrestha
+        """
+        return os.popen(self.filter_container_command(name)).read().strip()
+
+    @metrics.docker_operation("ls")
+    def list_containers(self, prefix: str) -> dict:
+        """
+        Running containers whose name starts with the prefix.
+        Returns a map of container name to container id.
+
+        Author: Namah Shrestha
+        """
+        output: str = os.popen(
+            f"docker container ls --format '{{{{.Names}}}} {{{{.ID}}}}' "
+            f"--filter 'name={prefix}'"
+        ).read()
+        containers: dict = {}
+        for line in output.split("\n"):
+            name, _, container_id = line.partition(" ")
+            if name.startswith(prefix) and container_id:
+                containers[name] = container_id
+        return containers
+
+    @metrics.docker_operation("ls")
+    def list_labelled_containers(self, label: str) -> list:
+        """
+        Every container with the label, running or not, in one listing.
+
+        Author: Namah Shrestha
+        """
+        output: str = os.popen(
+            "docker container ls -a --no-trunc "
+            "--format '{{.ID}} {{.Names}} {{.State}} {{.Labels}}' "
+            f"--filter {shlex.quote(f'label={label}')}"
+        ).read()
+        containers: list = []
+        for line in output.split("\n"):
+            fields: list = line.split(" ", 3)
+            if len(fields) < 3:
+                continue
+            containers.append(
+                ContainerInfo(
+                    fields[0],
+                    fields[1],
+                    fields[2] in ("running", "paused"),
+                    parse_labels(fields[3] if len(fields) > 3 else ""),
+                    fields[2] == "paused",
+                )
+            )
+        return containers
+
+    @metrics.docker_operation("rm")
+    def remove_containers(self, container_ids: list) -> None:
+        """
+        Force remove every container of the list with one docker call.
+
+        Author: Namah Shrestha
+        """
+        if container_ids:
+            os.system(f"docker container rm -f {' '.join(container_ids)}")
+
+    @metrics.docker_operation("events")
+    def watch_events(self, label: str, actions: tuple) -> EventStream:
+        """
+        Follow the events with a docker events process.
+
+        Author: Namah Shrestha
+        """
+        event_filters: str = "".join(f" --filter event={action}" for action in actions)
+        return CLIEventStream(
+            "docker events --format '{{json .}}' --filter type=container "
+            f"--filter {shlex.quote(f'label={label}')}{event_filters}"
+        )
+
+    def exec_options(
+        self,
+        name: str,
+        container_id: typing.Optional[str],
+        workdir: typing.Optional[str],
+        exec_id: typing.Optional[str] = None,
+    ) -> str:
+        """
+        The container argument of docker container exec, with the working
+        directory and exec tag options if there are any.
+
+        Author: Namah Shrestha
+        """
+        container: str = container_id or f"$({self.filter_container_command(name)})"
+        if exec_id:
+            container = f"-e {constants.EXEC_TAG_VARIABLE}={exec_id} {container}"
+        if workdir:
+            return f"-w {shlex.quote(workdir)} {container}"
+        return container
+
+    @metrics.docker_operation("exec")
+    def exec_container(
+        self,
+        name: str,
+        exec_command: str,
+        container_id: typing.Optional[str] = None,
+        workdir: typing.Optional[str] = None,
+    ) -> str:
+        """
+        Run the command in the container and return its output.
+        Without a known id the container is looked up in a subshell.
+
+        A failed command with a known id might mean the id is stale.
+        Only then we check the id and raise ContainerNotFoundError.
+
+        Author: Namah Shrestha
+        """
+        pipe: os._wrap_close = os.popen(
+            "docker container exec "
+            f"{self.exec_options(name, container_id, workdir)} {exec_command}"
+        )
+        output: str = pipe.read()
+        if (
+            pipe.close() is not None
+            and container_id
+            and self.find_container(name) != container_id
+        ):
+            raise ContainerNotFoundError(container_id)
+        return output
+
+    @metrics.docker_operation("exec")
+    def stream_exec(
+        self,
+        name: str,
+        exec_command: str,
+        container_id: typing.Optional[str] = None,
+        workdir: typing.Optional[str] = None,
+        exec_id: typing.Optional[str] = None,
+    ) -> ExecStream:
+        """
+        Start the command in the container and stream its output.
+        A stale known id raises ContainerNotFoundError at the end
+        of the stream, like in exec_container.
+
+        Author: Namah Shrestha
+        """
+        return CLIExecStream(
+            "docker container exec "
+            f"{self.exec_options(name, container_id, workdir, exec_id)} {exec_command}",
+            (lambda: self.find_container(name) != container_id)
+            if container_id
+            else None,
+        )
+
+    @metrics.docker_operation("exec")
+    def open_shell(
+        self,
+        name: str,
+        container_id: typing.Optional[str] = None,
+        exec_id: typing.Optional[str] = None,
+    ) -> ExecChannel:
+        """
+        Start an interactive shell in the container.
+
+        Author: Namah Shrestha
+        """
+        return CLIExecChannel(
+            "docker container exec -i "
+            f"{self.exec_options(name, container_id, None, exec_id)} "
+            f"{constants.SHELL_COMMAND}"
+        )
+
+    @metrics.docker_operation("kill")
+    def kill_exec(
+        self, name: str, container_id: typing.Optional[str], exec_id: str
+    ) -> None:
+        """
+        Kill the processes of the exec with a docker exec of the kill command.
+
+        Author: Namah Shrestha
+        """
+        kill_command: str = constants.EXEC_KILL_COMMAND.format(
+            constants.EXEC_TAG_VARIABLE, exec_id
+        )
+        os.system(
+            "docker container exec "
+            f"{self.exec_options(name, container_id, None)} "
+            f"/bin/sh -c {shlex.quote(kill_command)}"
+        )
+
+
+class DockerAPIBackend(DockerBackend):
+    """
+    Docker backend that talks to the docker engine api.
+
+    Image builds need the build context as a tar stream. They happen once
+    per content change, so they are delegated to the cli.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self, client: typing.Optional[docker_api.DockerAPIClient] = None
+    ) -> None:
+        """
+        Use the given client or the shared one.
+
+        Author: Namah Shrestha
+        """
+        self.client: docker_api.DockerAPIClient = client or docker_api.get_client()
+        self.cli: DockerCLIBackend = DockerCLIBackend()
+
+    @metrics.docker_operation("inspect")
+    def image_exists(self, image: str) -> bool:
+        """
+        Check if the image exists.
+
+        Author: Namah Shrestha
+        """
+        try:
+            self.client.inspect_image(image)
+            return True
+        except docker_api.DockerAPIError as e:
+            if e.status == 404:
+                return False
+            raise
+
+    def build_image(self, context_dir: str, tags: list, dockerfile_name: str) -> bool:
+        """
+        Build the image with the cli, which counts the operation.
+
+        Author: Namah Shrestha
+        """
+        return self.cli.build_image(context_dir, tags, dockerfile_name)
+
+    @metrics.docker_operation("run", failure_result=None)
+    def run_container(
+        self, name: str, image: str, labels: typing.Optional[dict] = None
+    ) -> typing.Optional[str]:
+        """
+        Create and start a container with the labels.
+        Returns the container id or None if it failed.
+
+        Author: Namah Shrestha
+        """
+        try:
+            container_id: str = self.client.create_container(
+                image, name=name, Labels=labels or {}
+            )
+            self.client.start_container(container_id)
+            return container_id
+        except docker_api.DockerAPIError:
+            return None
+
+    @metrics.docker_operation("commit", failure_result=False)
+    def commit_container(self, container_id: str, image: str) -> bool:
+        """
+        Commit the container to the image. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        repo, _, tag = image.rpartition(":")
+        try:
+            self.client.commit_container(container_id, repo, tag)
+            return True
+        except docker_api.DockerAPIError:
+            return False
+
+    def save_image(self, image: str, path: str) -> bool:
+        """
+        Save the image with the cli, which streams the archive
+        instead of holding it in memory, and counts the operation.
+
+        Author: Namah Shrestha
+        """
+        return self.cli.save_image(image, path)
+
+    def load_image(self, path: str) -> bool:
+        """
+        Load the image with the cli, which counts the operation, like builds.
+
+        Author: Namah Shrestha
+        """
+        return self.cli.load_image(path)
+
+    @metrics.docker_operation("rmi")
+    def remove_image(self, image: str) -> None:
+        """
+        Force remove the image. A missing image is removed already.
+
+        Author: Namah Shrestha
+        """
+        try:
+            self.client.remove_image(image)
+        except docker_api.DockerAPIError as e:
+            if e.status != 404:
+                raise
+
+    @metrics.docker_operation("rename", failure_result=False)
+    def rename_container(self, container: str, name: str) -> bool:
+        """
+        Rename a container. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        try:
+            self.client.rename_container(container, name)
+            return True
+        except docker_api.DockerAPIError:
+            return False
+
+    @metrics.docker_operation("inspect")
+    def container_exists(self, container: str) -> bool:
+        """
+        Check if the container exists, running or not.
+
+        Author: Namah Shrestha
+        """
+        try:
+            self.client.inspect_container(container)
+            return True
+        except docker_api.DockerAPIError as e:
+            if e.status != 404:
+                raise
+            return False
+
+    @metrics.docker_operation("ls")
+    def list_container_ids(self, name: str) -> list:
+        """
+        Ids of the running containers matching the name filter.
+
+        Author: Namah Shrestha
+        """
+        return [
+            container["Id"]
+            for container in self.client.list_containers({"name": [name]})
+        ]
+
+    @metrics.docker_operation("rm")
+    def remove_container(
+        self, name: str, container_id: typing.Optional[str] = None
+    ) -> None:
+        """
+        Force remove the container.
+        Without a known id the container is looked up by name.
+
+        Author: Namah Shrestha
+        """
+        container_ids: list = (
+            [container_id] if container_id else self.list_container_ids(name)
+        )
+        for container in container_ids:
+            try:
+                self.client.remove_container(container)
+            except docker_api.DockerAPIError as e:
+                if e.status != 404:
+                    raise
+
+    @metrics.docker_operation("pause", failure_result=False)
+    def pause_container(self, container_id: str) -> bool:
+        """
+        Pause the container. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        try:
+            self.client.pause_container(container_id)
+            return True
+        except docker_api.DockerAPIError:
+            return False
+
+    @metrics.docker_operation("unpause", failure_result=False)
+    def unpause_container(self, container_id: str) -> bool:
+        """
+        Unpause the container. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        try:
+            self.client.unpause_container(container_id)
+            return True
+        except docker_api.DockerAPIError:
+            return False
+
+    @metrics.docker_operation("ls")
+    def find_container(self, name: str) -> str:
+        """
+        Id of the named container, empty if it does not exist.
+
+        Author: Namah Shrestha
+        """
+        container_ids: list = self.list_container_ids(name)
+        return container_ids[0] if container_ids else ""
+
+    @metrics.docker_operation("ls")
+    def list_containers(self, prefix: str) -> dict:
+        """
+        Running containers whose name starts with the prefix.
+        Returns a map of container name to container id.
+
+        Author: Namah Shrestha
+        """
+        containers: dict = {}
+        for container in self.client.list_containers({"name": [prefix]}):
+            for name in container.get("Names", []):
+                if name.lstrip("/").startswith(prefix):
+                    containers[name.lstrip("/")] = container["Id"]
+        return containers
+
+    @metrics.docker_operation("ls")
+    def list_labelled_containers(self, label: str) -> list:
+        """
+        Every container with the label, running or not, in one listing.
+
+        Author: Namah Shrestha
+        """
+        return [
+            ContainerInfo(
+                container["Id"],
+                (container.get("Names") or [""])[0].lstrip("/"),
+                container.get("State") in ("running", "paused"),
+                container.get("Labels") or {},
+                container.get("State") == "paused",
+            )
+            for container in self.client.list_containers({"label": [label]}, all=True)
+        ]
+
+    @metrics.docker_operation("rm")
+    def remove_containers(self, container_ids: list) -> None:
+        """
+        Force remove every container of the list.
+        The api removes one container per request, the requests share
+        the keep-alive connection of the client.
+
+        Author: Namah Shrestha
+        """
+        for container_id in container_ids:
+            try:
+                self.client.remove_container(container_id)
+            except docker_api.DockerAPIError as e:
+                if e.status != 404:
+                    raise
+
+    @metrics.docker_operation("events")
+    def watch_events(self, label: str, actions: tuple) -> EventStream:
+        """
+        Follow the events on a streaming connection of the api.
+
+        Author: Namah Shrestha
+        """
+        return APIEventStream(
+            self.client,
+            {"type": ["container"], "label": [label], "event": list(actions)},
+        )
+
+    @metrics.docker_operation("exec")
+    def exec_container(
+        self,
+        name: str,
+        exec_command: str,
+        container_id: typing.Optional[str] = None,
+        workdir: typing.Optional[str] = None,
+    ) -> str:
+        """
+        Run the command in the container and return its output.
+        The command runs in a shell, like it would in a terminal.
+        Raise ContainerNotFoundError if the known id is stale.
+
+        Author: Namah Shrestha
+        """
+        container: str = container_id or self.find_container(name)
+        if not container:
+            return ""
+        try:
+            exit_code, stdout, stderr = self.client.exec_container(
+                container, ["/bin/sh", "-c", exec_command], workdir
+            )
+        except docker_api.DockerAPIError as e:
+            if e.status == 404 and container_id:
+                raise ContainerNotFoundError(container_id)
+            raise
+        return stdout.decode(errors="replace")
+
+    def exec_env(self, exec_id: typing.Optional[str]) -> typing.Optional[list]:
+        """
+        The environment tagging an exec with the exec id, if there is one.
+
+        Author: Namah Shrestha
+        """
+        if not exec_id:
+            return None
+        return [f"{constants.EXEC_TAG_VARIABLE}={exec_id}"]
+
+    @metrics.docker_operation("exec")
+    def stream_exec(
+        self,
+        name: str,
+        exec_command: str,
+        container_id: typing.Optional[str] = None,
+        workdir: typing.Optional[str] = None,
+        exec_id: typing.Optional[str] = None,
+    ) -> ExecStream:
+        """
+        Start the command in the container and stream its output.
+        Raise ContainerNotFoundError if the known id is stale.
+
+        Author: Namah Shrestha
+        """
+        container: str = container_id or self.find_container(name)
+        if not container:
+            raise ContainerNotFoundError(name)
+        try:
+            api_exec_id: str = self.client.create_exec(
+                container,
+                ["/bin/sh", "-c", exec_command],
+                workdir,
+                env=self.exec_env(exec_id),
+            )
+        except docker_api.DockerAPIError as e:
+            if e.status == 404:
+                raise ContainerNotFoundError(container)
+            raise
+        return APIExecStream(self.client, api_exec_id)
+
+    @metrics.docker_operation("exec")
+    def open_shell(
+        self,
+        name: str,
+        container_id: typing.Optional[str] = None,
+        exec_id: typing.Optional[str] = None,
+    ) -> ExecChannel:
+        """
+        Start an interactive shell in the container.
+        Raise ContainerNotFoundError if the container does not exist.
+
+        Author: Namah Shrestha
+        """
+        container: str = container_id or self.find_container(name)
+        if not container:
+            raise ContainerNotFoundError(name)
+        try:
+            api_exec_id: str = self.client.create_exec(
+                container,
+                [constants.SHELL_COMMAND],
+                stdin=True,
+                env=self.exec_env(exec_id),
+            )
+        except docker_api.DockerAPIError as e:
+            if e.status == 404:
+                raise ContainerNotFoundError(container)
+            raise
+        return APIExecChannel(self.client, api_exec_id)
+
+    @metrics.docker_operation("kill")
+    def kill_exec(
+        self, name: str, container_id: typing.Optional[str], exec_id: str
+    ) -> None:
+        """
+        Kill the processes of the exec with an exec of the kill command.
+        A container that is gone has nothing left to kill.
+
+        Author: Namah Shrestha
+        """
+        container: str = container_id or self.find_container(name)
+        if not container:
+            return
+        try:
+            self.client.exec_container(
+                container,
+                [
+                    "/bin/sh",
+                    "-c",
+                    constants.EXEC_KILL_COMMAND.format(
+                        constants.EXEC_TAG_VARIABLE, exec_id
+                    ),
+                ],
+            )
+        except docker_api.DockerAPIError as e:
+            if e.status not in (404, 409):
+                raise
+
+
+def parse_latency(spec: str) -> dict:
+    """
+    Parse a latency spec like "build=2,run=0.5,exec=0.01" into a map
+    of operation to seconds.
+    Raise ValueError on a malformed spec.
+
+    Author: Namah Shrestha
+    """
+    latency: dict = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        operation, separator, seconds = item.partition("=")
+        if not separator:
+            raise ValueError(f"Invalid fake latency: {item}")
+        latency[operation.strip()] = float(seconds)
+    return latency
+
+
+class FakeExecChannel(ExecChannel):
+    """
+    Shell of a fake container.
+
+    It speaks the protocol of the persistent shell: every line written
+    is answered right away with the fake output of its command, followed
+    by the marker line. Nothing runs.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, backend: "DockerFakeBackend", workdir: str) -> None:
+        super().__init__()
+        self.backend: DockerFakeBackend = backend
+        self.workdir: str = workdir
+        self.pending: bytearray = bytearray()
+
+    def send(self, data: bytes) -> None:
+        """
+        Answer every command line.
+        Raise BrokenPipeError if the shell has ended.
+
+        Author: Namah Shrestha
+        """
+        if self.exit_code is not None:
+            raise BrokenPipeError()
+        for line in data.decode(errors="replace").splitlines():
+            match: typing.Optional[re.Match] = FAKE_SHELL_LINE_PATTERN.match(line)
+            if match is None:
+                continue
+            command: str = shlex.split(match.group(1))[0]
+            if command == "exit" or command.startswith("exit "):
+                self.exit_code = int(command[5:] or 0)
+                return
+            if command.startswith("cd "):
+                target: str = command[3:].strip()
+                if target == "~" or target.startswith("~/"):
+                    target = constants.CONTAINER_HOME_DIRECTORY + target[1:]
+                self.workdir = posixpath.normpath(posixpath.join(self.workdir, target))
+            self.backend.simulate("exec")
+            exit_code, output = self.backend.fake_output(command, self.workdir)
+            self.pending += output.encode()
+            self.pending += f"{match.group(2)} {exit_code} {self.workdir}\n".encode()
+
+    def recv(self) -> bytes:
+        """
+        The pending output, empty once the shell has ended.
+
+        Author: Namah Shrestha
+        """
+        data: bytes = bytes(self.pending)
+        self.pending.clear()
+        return data
+
+    def close(self) -> None:
+        """
+        End the shell.
+
+        Author: Namah Shrestha
+        """
+        if self.exit_code is None:
+            self.exit_code = 0
+
+
+"""
+A command line written into the persistent shell, see src.shell.
+
+Author: Namah Shrestha
+"""
+FAKE_SHELL_LINE_PATTERN: re.Pattern = re.compile(
+    r"^eval (.*) < /dev/null; printf '%s %d %s\\n' (\S+) \$\? \"\$PWD\"$"
+)
+
+
+"""
+Markers of a batch script, see InstanceExec.batch_script.
+
+Author: Namah Shrestha
+"""
+FAKE_BATCH_MARKER_PATTERN: re.Pattern = re.compile(r"__zod_[0-9a-f]+_[0-9]+__")
+
+
+class DockerFakeBackend(DockerBackend):
+    """
+    Docker backend that keeps images and containers in memory.
+
+    It lets the server run on a machine without docker, for tests and
+    load tests of the server itself. Every command succeeds and prints
+    itself. Batch scripts print the marker of every command.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, latency: typing.Optional[dict] = None) -> None:
+        """
+        Create a fake daemon without images and containers.
+        Latency maps an operation, like build, run, exec, rm or ls,
+        to the seconds it takes. Shell commands take the exec latency.
+
+        Author: Namah Shrestha
+        """
+        self.latency: dict = (
+            parse_latency(constants.FAKE_LATENCY) if latency is None else latency
+        )
+        self.images: set = set()
+        self.containers: dict = {}
+        self.labels: dict = {}
+        self.stopped: set = set()
+        self.paused: set = set()
+        self.event_streams: list = []
+        self.killed: list = []
+        self.lock: threading.Lock = threading.Lock()
+
+    def publish(self, container_id: str, name: str, *actions: str) -> None:
+        """
+        Send the events of the actions to every event stream.
+        Called with the lock held.
+
+        Author: Namah Shrestha
+        """
+        if constants.LABEL_INSTANCE_OS not in self.labels.get(container_id, {}):
+            return
+        for action in actions:
+            for stream in self.event_streams:
+                stream.events.put(ContainerEvent(action, container_id, name))
+
+    def kill_container(self, container_id: str) -> None:
+        """
+        Stop the container like the daemon would when its main process
+        dies, outside of the control of the server.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            for name, known_id in self.containers.items():
+                if known_id == container_id:
+                    self.stopped.add(container_id)
+                    self.publish(container_id, name, "die")
+
+    def simulate(self, operation: str) -> None:
+        """
+        Block for the latency of the operation, like the daemon would.
+
+        Author: Namah Shrestha
+        """
+        delay: float = self.latency.get(operation, 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def fake_output(self, exec_command: str, workdir: str) -> typing.Tuple[int, str]:
+        """
+        The exit code and output of a command.
+
+        Author: Namah Shrestha
+        """
+        markers: list = FAKE_BATCH_MARKER_PATTERN.findall(exec_command)
+        if markers:
+            return 0, "".join(f"{marker} 0\n" for marker in markers)
+        if exec_command.strip() == "pwd":
+            return 0, f"{workdir}\n"
+        return 0, f"{exec_command}\n"
+
+    @metrics.docker_operation("inspect")
+    def image_exists(self, image: str) -> bool:
+        """
+        Check if the image exists.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("inspect")
+        with self.lock:
+            return image in self.images
+
+    @metrics.docker_operation("build", failure_result=False)
+    def build_image(self, context_dir: str, tags: list, dockerfile_name: str) -> bool:
+        """
+        Tag the image with every tag, nothing is built.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("build")
+        with self.lock:
+            self.images.update(tags)
+        return True
+
+    @metrics.docker_operation("run", failure_result=None)
+    def run_container(
+        self, name: str, image: str, labels: typing.Optional[dict] = None
+    ) -> typing.Optional[str]:
+        """
+        Create a running container with the labels.
+        Returns the container id or None if the image does not exist
+        or the name is taken.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("run")
+        with self.lock:
+            if image not in self.images or name in self.containers:
+                return None
+            container_id: str = uuid.uuid4().hex
+            self.containers[name] = container_id
+            self.labels[container_id] = dict(labels or {})
+            self.publish(container_id, name, "create", "start")
+            return container_id
+
+    @metrics.docker_operation("commit", failure_result=False)
+    def commit_container(self, container_id: str, image: str) -> bool:
+        """
+        Tag the image if the container exists, nothing is committed.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("commit")
+        with self.lock:
+            if container_id not in self.containers.values():
+                return False
+            self.images.add(image)
+            return True
+
+    @metrics.docker_operation("save", failure_result=False)
+    def save_image(self, image: str, path: str) -> bool:
+        """
+        Write the name of a known image to a compressed archive.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("save")
+        with self.lock:
+            if image not in self.images:
+                return False
+        with gzip.open(path, "wb") as archive:
+            archive.write(image.encode())
+        return True
+
+    @metrics.docker_operation("load", failure_result=False)
+    def load_image(self, path: str) -> bool:
+        """
+        Tag the image named in the archive.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("load")
+        try:
+            with gzip.open(path, "rb") as archive:
+                image: str = archive.read().decode()
+        except OSError:
+            return False
+        with self.lock:
+            self.images.add(image)
+        return True
+
+    @metrics.docker_operation("rmi")
+    def remove_image(self, image: str) -> None:
+        """
+        Forget the image.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("rmi")
+        with self.lock:
+            self.images.discard(image)
+
+    @metrics.docker_operation("rename", failure_result=False)
+    def rename_container(self, container: str, name: str) -> bool:
+        """
+        Rename a container. Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("rename")
+        with self.lock:
+            for old_name, container_id in list(self.containers.items()):
+                if (
+                    container in (old_name, container_id)
+                    and name not in self.containers
+                ):
+                    self.containers[name] = self.containers.pop(old_name)
+                    return True
+            return False
+
+    @metrics.docker_operation("inspect")
+    def container_exists(self, container: str) -> bool:
+        """
+        Check if the container exists, running or not.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("inspect")
+        with self.lock:
+            return container in self.containers or container in set(
+                self.containers.values()
+            )
+
+    @metrics.docker_operation("rm")
+    def remove_container(
+        self, name: str, container_id: typing.Optional[str] = None
+    ) -> None:
+        """
+        Remove the container by name or id.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("rm")
+        with self.lock:
+            for old_name, old_id in list(self.containers.items()):
+                if old_name == name or old_id == container_id:
+                    self.remove_locked(old_name)
+
+    @metrics.docker_operation("pause", failure_result=False)
+    def pause_container(self, container_id: str) -> bool:
+        """
+        Pause a running container. Returns False if it does not run
+        or is paused already.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("pause")
+        with self.lock:
+            if (
+                container_id not in self.containers.values()
+                or container_id in self.stopped
+                or container_id in self.paused
+            ):
+                return False
+            self.paused.add(container_id)
+            return True
+
+    @metrics.docker_operation("unpause", failure_result=False)
+    def unpause_container(self, container_id: str) -> bool:
+        """
+        Unpause a paused container. Returns False if it is not paused.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("unpause")
+        with self.lock:
+            if container_id not in self.paused:
+                return False
+            self.paused.discard(container_id)
+            return True
+
+    @metrics.docker_operation("rm")
+    def remove_containers(self, container_ids: list) -> None:
+        """
+        Remove every container of the list at once.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("rm")
+        with self.lock:
+            for old_name, old_id in list(self.containers.items()):
+                if old_id in container_ids:
+                    self.remove_locked(old_name)
+
+    def remove_locked(self, name: str) -> None:
+        """
+        Remove the named container. Called with the lock held.
+
+        Author: Namah Shrestha
+        """
+        container_id: str = self.containers.pop(name)
+        if container_id not in self.stopped:
+            self.publish(container_id, name, "die")
+        self.publish(container_id, name, "destroy")
+        self.stopped.discard(container_id)
+        self.paused.discard(container_id)
+        self.labels.pop(container_id, None)
+
+    @metrics.docker_operation("ls")
+    def find_container(self, name: str) -> str:
+        """
+        Id of the named container, empty if it does not exist.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("ls")
+        with self.lock:
+            return self.containers.get(name, "")
+
+    @metrics.docker_operation("ls")
+    def list_container_ids(self, name: str) -> list:
+        """
+        Ids of the containers whose name contains the name, like the
+        name filter of docker.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("ls")
+        with self.lock:
+            return [
+                container_id
+                for container_name, container_id in self.containers.items()
+                if name in container_name
+            ]
+
+    @metrics.docker_operation("ls")
+    def list_containers(self, prefix: str) -> dict:
+        """
+        Containers whose name starts with the prefix.
+        Returns a map of container name to container id.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("ls")
+        with self.lock:
+            return {
+                name: container_id
+                for name, container_id in self.containers.items()
+                if name.startswith(prefix)
+            }
+
+    @metrics.docker_operation("ls")
+    def list_labelled_containers(self, label: str) -> list:
+        """
+        Every container with the label.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("ls")
+        with self.lock:
+            return [
+                ContainerInfo(
+                    container_id,
+                    name,
+                    container_id not in self.stopped,
+                    dict(self.labels[container_id]),
+                    container_id in self.paused,
+                )
+                for name, container_id in self.containers.items()
+                if label in self.labels.get(container_id, {})
+            ]
+
+    @metrics.docker_operation("events")
+    def watch_events(self, label: str, actions: tuple) -> EventStream:
+        """
+        Follow the events the fake publishes. Only the actions of
+        constants.CONTAINER_EVENTS of labelled containers are published.
+
+        Author: Namah Shrestha
+        """
+        stream: FakeEventStream = FakeEventStream(self)
+        with self.lock:
+            self.event_streams.append(stream)
+        return stream
+
+    def check_container(self, name: str, container_id: typing.Optional[str]) -> None:
+        """
+        Raise ContainerNotFoundError if the container does not exist
+        or does not run.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            if container_id and container_id not in self.containers.values():
+                raise ContainerNotFoundError(container_id)
+            if not container_id and name not in self.containers:
+                raise ContainerNotFoundError(name)
+            if (container_id or self.containers[name]) in self.stopped:
+                raise ContainerNotFoundError(container_id or name)
+
+    @metrics.docker_operation("exec")
+    def exec_container(
+        self,
+        name: str,
+        exec_command: str,
+        container_id: typing.Optional[str] = None,
+        workdir: typing.Optional[str] = None,
+    ) -> str:
+        """
+        Fake output of the command.
+        Raise ContainerNotFoundError if the known id is stale.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("exec")
+        try:
+            self.check_container(name, container_id)
+        except ContainerNotFoundError:
+            if container_id:
+                raise
+            return ""
+        return self.fake_output(exec_command, workdir or "/")[1]
+
+    @metrics.docker_operation("exec")
+    def stream_exec(
+        self,
+        name: str,
+        exec_command: str,
+        container_id: typing.Optional[str] = None,
+        workdir: typing.Optional[str] = None,
+        exec_id: typing.Optional[str] = None,
+    ) -> ExecStream:
+        """
+        Stream the fake output of the command.
+        Raise ContainerNotFoundError if the container does not exist.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("exec")
+        self.check_container(name, container_id)
+        exit_code, output = self.fake_output(exec_command, workdir or "/")
+        return CompletedExecStream(output.encode(), exit_code)
+
+    @metrics.docker_operation("exec")
+    def open_shell(
+        self,
+        name: str,
+        container_id: typing.Optional[str] = None,
+        exec_id: typing.Optional[str] = None,
+    ) -> ExecChannel:
+        """
+        Start a fake shell in the container.
+        Raise ContainerNotFoundError if the container does not exist.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("exec")
+        self.check_container(name, container_id)
+        return FakeExecChannel(self, constants.CONTAINER_WORKING_DIRECTORY)
+
+    @metrics.docker_operation("kill")
+    def kill_exec(
+        self, name: str, container_id: typing.Optional[str], exec_id: str
+    ) -> None:
+        """
+        Remember the killed exec id. Fake commands finish right away,
+        there is nothing to kill.
+
+        Author: Namah Shrestha
+        """
+        self.simulate("exec")
+        with self.lock:
+            self.killed.append(exec_id)
+
+
+backend_switch: dict = {
+    constants.CLI_BACKEND: DockerCLIBackend,
+    constants.API_BACKEND: DockerAPIBackend,
+    constants.FAKE_BACKEND: DockerFakeBackend,
+}
+
+
+"""
+One backend per server process, created on first use.
+
+Author: Namah Shrestha
+"""
+_backend: typing.Optional[DockerBackend] = None
+_backend_lock: threading.Lock = threading.Lock()
+
+
+def get_backend() -> DockerBackend:
+    """
+    Get the backend selected by constants.DOCKER_BACKEND.
+
+    Author: Namah Shrestha
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            backend_name: str = constants.DOCKER_BACKEND
+            if backend_name not in backend_switch:
+                raise ValueError(f"Unsupported docker backend: {backend_name}")
+            _backend = backend_switch[backend_name]()
+        return _backend
+
+
+def set_backend(backend: typing.Optional[DockerBackend]) -> None:
+    """
+    Replace the backend of the process. None selects it again on next use.
+
+    Author: Namah Shrestha
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
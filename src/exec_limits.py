@@ -0,0 +1,168 @@
+"""
+This is the limits of an EXEC.
+
+A command like `sleep 1000` holds an executor thread for as long as it
+runs, and `yes` also grows the memory of the server without bound.
+Every EXEC runs under a wall clock timeout and an output byte cap, and
+the client can cancel it. A command that hits a limit is killed inside
+the container, so it stops using the container too, and the response
+tells how it ended.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import logging
+import threading
+import typing
+
+# modules
+import src.constants as constants
+import src.docker_backend as db
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class ExecLimits:
+    """
+    Timeout and output cap of one EXEC, and the reason it was stopped.
+
+    The timeout fires in a timer thread and a cancel comes from the event
+    loop, while the output is read in an executor thread. The first
+    reason to stop wins and kills the command once.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        timeout: float = constants.EXEC_TIMEOUT,
+        max_output: int = constants.EXEC_MAX_OUTPUT,
+    ) -> None:
+        """
+        Create the limits of an EXEC that has not started yet.
+
+        Author: Namah Shrestha
+        """
+        self.timeout: float = timeout
+        self.max_output: int = max_output
+        self.reason: typing.Optional[str] = None
+        self.kill: typing.Optional[typing.Callable[[], None]] = None
+        self.timer: typing.Optional[threading.Timer] = None
+        self.lock: threading.Lock = threading.Lock()
+
+    @property
+    def stopped(self) -> bool:
+        """
+        Check if the command was stopped.
+
+        Author: Namah Shrestha
+        """
+        return self.reason is not None
+
+    def start(self, kill: typing.Callable[[], None]) -> None:
+        """
+        Start the clock. The kill function kills the running command
+        inside the container.
+
+        Author: Namah Shrestha
+        """
+        self.kill = kill
+        self.timer = threading.Timer(self.timeout, self.stop, (constants.TIMED_OUT,))
+        self.timer.daemon = True
+        self.timer.start()
+
+    def finish(self) -> None:
+        """
+        Stop the clock once the command ended.
+
+        Author: Namah Shrestha
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+
+    def stop(self, reason: str) -> bool:
+        """
+        Stop the command for the reason and kill it.
+        Returns False if it was stopped already.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+        self.finish()
+        if self.kill is not None:
+            try:
+                self.kill()
+            except Exception:
+                logger.exception("Killing the stopped command failed")
+        return True
+
+    def cancel(self) -> bool:
+        """
+        Stop the command on request of the client.
+
+        Author: Namah Shrestha
+        """
+        return self.stop(constants.CANCELLED)
+
+    def read(self, stream: db.ExecStream) -> typing.Iterator[bytes]:
+        """
+        Yield the output of the stream up to the byte cap.
+        The command is stopped once its output goes past the cap.
+        Reading ends with the output read when the command was stopped.
+
+        Author: Namah Shrestha
+        """
+        remaining: int = self.max_output
+        for data in stream:
+            if len(data) > remaining:
+                if remaining:
+                    yield data[:remaining]
+                self.stop(constants.TRUNCATED)
+                return
+            remaining -= len(data)
+            yield data
+            if self.stopped:
+                return
+
+    def flags(self) -> dict:
+        """
+        The flag of the reason the command was stopped, if any,
+        like {"timed_out": true}.
+
+        Author: Namah Shrestha
+        """
+        return {self.reason: True} if self.reason is not None else {}
+
+    def notice(self) -> typing.Optional[str]:
+        """
+        The line telling why the command was stopped, if it was.
+
+        Author: Namah Shrestha
+        """
+        if self.reason == constants.TIMED_OUT:
+            return f"[timed out after {self.timeout:g}s]"
+        if self.reason == constants.TRUNCATED:
+            return f"[output truncated at {self.max_output} bytes]"
+        if self.reason == constants.CANCELLED:
+            return "[cancelled]"
+        return None
+
+
+def requested_limits(
+    timeout: typing.Optional[float] = None, max_output: typing.Optional[int] = None
+) -> ExecLimits:
+    """
+    The limits a message asked for. A client can lower the server limits,
+    never raise them.
+
+    Author: Namah Shrestha
+    """
+    return ExecLimits(
+        min(timeout or constants.EXEC_TIMEOUT, constants.EXEC_TIMEOUT),
+        min(max_output or constants.EXEC_MAX_OUTPUT, constants.EXEC_MAX_OUTPUT),
+    )
@@ -0,0 +1,72 @@
+"""
+This is the execution layer of the application.
+
+Docker operations are blocking calls. Running them inside the socket
+handler coroutine stops every other client on the server. Here we run
+them in bounded thread pools which the event loop awaits.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import typing
+
+# modules
+import src.constants as constants
+
+
+"""
+Create and delete build images and start containers, they can take minutes.
+Exec commands are short. Therefore, they get separate pools.
+Cancelling kills a command stuck in the exec pool, it cannot queue there.
+
+Author: Namah Shrestha
+"""
+lifecycle_executor: concurrent.futures.ThreadPoolExecutor = (
+    concurrent.futures.ThreadPoolExecutor(
+        max_workers=constants.LIFECYCLE_WORKERS,
+        thread_name_prefix="zod_lifecycle",
+    )
+)
+exec_executor: concurrent.futures.ThreadPoolExecutor = (
+    concurrent.futures.ThreadPoolExecutor(
+        max_workers=constants.EXEC_WORKERS,
+        thread_name_prefix="zod_exec",
+    )
+)
+cancel_executor: concurrent.futures.ThreadPoolExecutor = (
+    concurrent.futures.ThreadPoolExecutor(
+        max_workers=constants.CANCEL_WORKERS,
+        thread_name_prefix="zod_cancel",
+    )
+)
+executor_switch: dict = {
+    constants.CREATE: lifecycle_executor,
+    constants.EXECUTE: exec_executor,
+    constants.DELETE: lifecycle_executor,
+    constants.CANCEL: cancel_executor,
+}
+
+
+async def run_blocking(
+    command: str, func: typing.Callable, *args: typing.Any
+) -> typing.Any:
+    """
+    Run the blocking function in the pool of the command and await the result.
+    It runs in a copy of the context of the caller, so the trace of the
+    request follows it into the thread.
+
+    Author: Namah Shrestha
+    """
+    executor: concurrent.futures.ThreadPoolExecutor = executor_switch.get(
+        command, exec_executor
+    )
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    context: contextvars.Context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        executor, functools.partial(context.run, func, *args)
+    )
@@ -0,0 +1,215 @@
+"""
+This is the content addressed image build cache.
+
+An image only depends on its dockerfile and the files the dockerfile
+copies from the build context. We hash exactly those and tag the image
+with the hash. The image is built at most once per content change and
+never when the tagged image already exists.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import fnmatch
+import hashlib
+import os
+import re
+import shlex
+import threading
+import typing
+
+# modules
+import src.constants as constants
+import src.docker_backend as db
+import src.tracing as tracing
+
+
+"""
+COPY and ADD instructions, the sources of which come from the build context.
+
+Author: Namah Shrestha
+"""
+CONTEXT_INSTRUCTION_PATTERN: re.Pattern = re.compile(
+    r"^\s*(COPY|ADD)\s+(.*)$", re.IGNORECASE
+)
+
+
+class ImageCache:
+    """
+    Builds images on content change only.
+
+    File digests are memoized on modification time and size, so computing
+    the key of an unchanged context costs one stat per file.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, context_dir: str = ".") -> None:
+        """
+        Create an empty cache for the build context directory.
+
+        Author: Namah Shrestha
+        """
+        self.context_dir: str = context_dir
+        self.built: set = set()
+        self.file_digests: dict = {}
+        self.lock: threading.Lock = threading.Lock()
+        self.build_locks: dict = {}
+
+    def ignore_patterns(self) -> list:
+        """
+        Patterns of the .dockerignore file of the build context.
+
+        Author: Namah Shrestha
+        """
+        path: str = os.path.join(self.context_dir, ".dockerignore")
+        if not os.path.isfile(path):
+            return []
+        with open(path) as dockerignore:
+            return [
+                line.strip().rstrip("/")
+                for line in dockerignore
+                if line.strip() and not line.strip().startswith("#")
+            ]
+
+    def is_ignored(self, relative_path: str, patterns: list) -> bool:
+        """
+        Check the path and every parent directory against the ignore patterns.
+
+        Author: Namah Shrestha
+        """
+        parts: list = relative_path.split(os.sep)
+        for index in range(1, len(parts) + 1):
+            prefix: str = "/".join(parts[:index])
+            if any(fnmatch.fnmatch(prefix, pattern) for pattern in patterns):
+                return True
+        return False
+
+    def context_sources(self, dockerfile_name: str) -> list:
+        """
+        The context paths used by COPY and ADD instructions of the dockerfile.
+        Copies from other build stages and remote urls are not part of the
+        context.
+
+        Author: Namah Shrestha
+        """
+        sources: list = []
+        with open(os.path.join(self.context_dir, dockerfile_name)) as dockerfile:
+            for line in dockerfile:
+                match: typing.Optional[re.Match] = CONTEXT_INSTRUCTION_PATTERN.match(
+                    line
+                )
+                if not match:
+                    continue
+                arguments: list = shlex.split(match.group(2))
+                if any(argument.startswith("--from") for argument in arguments):
+                    continue
+                paths: list = [
+                    argument for argument in arguments if not argument.startswith("--")
+                ]
+                sources.extend(path for path in paths[:-1] if "://" not in path)
+        return sources
+
+    def context_files(self, dockerfile_name: str) -> list:
+        """
+        Every file of the context that ends up in the image, sorted.
+
+        Author: Namah Shrestha
+        """
+        patterns: list = self.ignore_patterns()
+        files: set = set()
+        for source in self.context_sources(dockerfile_name):
+            source_path: str = os.path.normpath(os.path.join(self.context_dir, source))
+            if os.path.isfile(source_path):
+                files.add(source_path)
+                continue
+            for root, dirs, names in os.walk(source_path):
+                for name in names:
+                    files.add(os.path.join(root, name))
+        return sorted(
+            path
+            for path in files
+            if not self.is_ignored(os.path.relpath(path, self.context_dir), patterns)
+        )
+
+    def file_digest(self, path: str) -> str:
+        """
+        Digest of one file, memoized on modification time and size.
+
+        Author: Namah Shrestha
+        """
+        stat: os.stat_result = os.stat(path)
+        key: tuple = (stat.st_mtime_ns, stat.st_size)
+        cached: typing.Optional[tuple] = self.file_digests.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        digest: hashlib._Hash = hashlib.sha256()
+        with open(path, "rb") as context_file:
+            for block in iter(lambda: context_file.read(65536), b""):
+                digest.update(block)
+        self.file_digests[path] = (key, digest.hexdigest())
+        return digest.hexdigest()
+
+    def context_digest(self, dockerfile_name: str) -> str:
+        """
+        Hash of the dockerfile and every context file it uses.
+
+        Author: Namah Shrestha
+        """
+        digest: hashlib._Hash = hashlib.sha256()
+        dockerfile_path: str = os.path.join(self.context_dir, dockerfile_name)
+        digest.update(self.file_digest(dockerfile_path).encode())
+        for path in self.context_files(dockerfile_name):
+            digest.update(os.path.relpath(path, self.context_dir).encode())
+            digest.update(self.file_digest(path).encode())
+        return digest.hexdigest()[: constants.IMAGE_DIGEST_LENGTH]
+
+    def image_exists(self, image: str) -> bool:
+        """
+        Check if the tagged image exists in the docker daemon.
+
+        Author: Namah Shrestha
+        """
+        return db.get_backend().image_exists(image)
+
+    @tracing.traced("ensure_image")
+    def ensure_image(
+        self, image_name: str, image_tag: str, dockerfile_name: str
+    ) -> str:
+        """
+        Return the content tagged image, building it only if it does not exist.
+        Concurrent calls for the same content build once.
+        The image tag keeps pointing at the latest build.
+
+        Author: Namah Shrestha
+        """
+        image: str = f"{image_name}:{self.context_digest(dockerfile_name)}"
+        if image in self.built:
+            return image
+        with self.lock:
+            build_lock: threading.Lock = self.build_locks.setdefault(
+                image, threading.Lock()
+            )
+        with build_lock:
+            if image in self.built:
+                return image
+            if not self.image_exists(image):
+                if not db.get_backend().build_image(
+                    self.context_dir,
+                    [image, f"{image_name}:{image_tag}"],
+                    dockerfile_name,
+                ):
+                    raise Exception(f"Image build failed: {image}")
+            self.built.add(image)
+        return image
+
+    def invalidate(self, image: str) -> None:
+        """
+        Forget a built image, for example after it was removed externally.
+
+        Author: Namah Shrestha
+        """
+        self.built.discard(image)
+
+
+image_cache: ImageCache = ImageCache()
@@ -11,9 +11,21 @@ Author: Namah Shrestha
 # modules
 import src
 import src.constants as constants
+import src.container_events as ce
+import src.container_index as ci
+import src.docker_backend as db
+import src.directory_state as ds
+import src.exec_limits as el
+import src.executor as executor
+import src.shell as sh
+import src.tracing as tracing
 
 # builtins
-import os
+import asyncio
+import codecs
+import shlex
+import uuid
+import threading
 import typing
 
 
@@ -28,11 +40,14 @@ class InstanceExec(src.Instance):
     Author: Namah Shrestha
     """
 
+    instance_os: typing.Optional[str] = None
+
     def __init__(
         self,
         command: str,
         instance_hash: str,
         filter_container_command: str,
+        container_id: typing.Optional[str] = None,
     ) -> None:
         """
         NOTE:
@@ -50,12 +65,34 @@ class InstanceExec(src.Instance):
         before we delete it and things like that.
         All of that will be handled with exceptions.
 
+        The container id is optional. When the session already knows it,
+        we skip the container lookup subshell on every command.
+
+        With keep_shell set, commands run in the persistent shell of the
+        session instead of a docker exec each. The session hands its shell
+        over in the shell attribute and takes it back afterwards.
+
+        The session also hands over its change directory handler.
+        Commands then run in the working directory of the session.
+
+        Commands run within the limits, the server limits unless the
+        message asked for lower ones. The exec id tags the running
+        docker exec, so that it can be killed.
+
         Author: Namah Shrestha
         """
         super().__init__(instance_hash)
         self.command: str = command
         self.filter_container_command: str = filter_container_command
+        self.container_id: typing.Optional[str] = container_id
+        self.exit_code: typing.Optional[int] = None
+        self.keep_shell: bool = False
+        self.shell: typing.Optional[sh.PersistentShell] = None
+        self.change_directory_handler: typing.Optional[ds.ChangeDirectoryHandler] = None
+        self.limits: el.ExecLimits = el.ExecLimits()
+        self.exec_id: typing.Optional[str] = None
 
+    @tracing.traced("parse_output")
     def parse_command_result(self, command_result: str) -> list:
         """
         Parse command result.
@@ -71,30 +108,477 @@ class InstanceExec(src.Instance):
         res: str = command_result.split("\n")
         return res
 
+    def batch_script(self, exec_commands: list, stop_on_error: bool = True) -> tuple:
+        """
+        One shell script running every command of the batch.
+        Every command is followed by a printf of its own marker and its
+        exit status. With stop_on_error the next command only runs if
+        the previous one succeeded.
+        Returns the script and the markers.
+
+        Author: Namah Shrestha
+        """
+        batch_id: str = uuid.uuid4().hex
+        markers: list = [
+            constants.SHELL_MARKER.format(f"{batch_id}_{index}")
+            for index in range(len(exec_commands))
+        ]
+        steps: list = [
+            f"eval {shlex.quote(exec_command)} < /dev/null; set -- $?; "
+            f"printf '%s %d\\n' {marker} $1"
+            for exec_command, marker in zip(exec_commands, markers)
+        ]
+        if not stop_on_error:
+            return "; ".join(steps), markers
+        script: str = steps[-1]
+        for step in reversed(steps[:-1]):
+            script = f"{step}; [ $1 -eq 0 ] && {{ {script}; }}"
+        return script, markers
+
+    def parse_batch_result(
+        self, exec_commands: list, markers: list, batch_result: str
+    ) -> list:
+        """
+        Split the batch output at the markers into the output lines and
+        exit code of every command. Commands that did not run because an
+        earlier one failed are left out.
+
+        A command stopped by the limits gets the rest of the output,
+        no exit code and the flag of the reason, and ends the results.
+
+        Author: Namah Shrestha
+        """
+        results: list = []
+        position: int = 0
+        for exec_command, marker in zip(exec_commands, markers):
+            index: int = batch_result.find(marker, position)
+            if index < 0:
+                break
+            status, _, _ = batch_result[index + len(marker) :].partition("\n")
+            results.append(
+                {
+                    constants.EXEC_COMMAND: exec_command,
+                    constants.BATCH_OUTPUT: self.parse_command_result(
+                        batch_result[position:index]
+                    ),
+                    constants.BATCH_EXIT_CODE: int(status),
+                }
+            )
+            position = index + len(marker) + len(status) + 1
+        if self.limits.stopped and len(results) < len(exec_commands):
+            results.append(
+                {
+                    constants.EXEC_COMMAND: exec_commands[len(results)],
+                    constants.BATCH_OUTPUT: self.parse_command_result(
+                        batch_result[position:]
+                    ),
+                    constants.BATCH_EXIT_CODE: None,
+                    **self.limits.flags(),
+                }
+            )
+        return results
+
+    @tracing.traced("exec_batch")
+    def exec_batch(self, exec_commands: list, stop_on_error: bool = True) -> list:
+        """
+        Run every command of the batch in one exec, or one write into the
+        persistent shell, and return the result of every command.
+
+        Author: Namah Shrestha
+        """
+        script, markers = self.batch_script(exec_commands, stop_on_error)
+        if not self.keep_shell:
+            script = f"{constants.BATCH_SHELL_COMMAND} -c {shlex.quote(script)}"
+        return self.parse_batch_result(
+            exec_commands, markers, self.exec_instance(script)
+        )
+
+    def resolve_container_id(self) -> str:
+        """
+        Find the container id of the instance.
+        Returns an empty string if the container does not exist.
+
+        Author: Namah Shrestha
+        """
+        try:
+            return db.get_backend().find_container(self.container_name)
+        except Exception as e:
+            raise Exception(e)
+
+    @tracing.traced("container_lookup")
+    def ensure_container_id(self) -> None:
+        """
+        Take the container id from the container index if we do not know it.
+        If the instance is not indexed the container is resolved once
+        and the index updated.
+
+        Author: Namah Shrestha
+        """
+        if not self.container_id:
+            self.container_id = ci.container_index.get(self.instance_hash)
+            self.check_container()
+        if not self.container_id:
+            self.reresolve_container_id()
+
+    def check_container(self) -> None:
+        """
+        Raise ce.ContainerGoneError if the known container of the
+        instance is dead or removed, from the container states in memory.
+
+        Author: Namah Shrestha
+        """
+        if ce.container_states.is_gone(self.container_id):
+            raise ce.ContainerGoneError(self.instance_hash)
+
+    def reresolve_container_id(self) -> None:
+        """
+        Resolve the container again and update the index.
+        Used when the known id turns out to be stale.
+
+        Author: Namah Shrestha
+        """
+        self.container_id = self.resolve_container_id() or None
+        ci.container_index.set(self.instance_hash, self.container_id, self.instance_os)
+
+    def workdir(self) -> typing.Optional[str]:
+        """
+        The working directory of the session to run commands in, if any.
+
+        Author: Namah Shrestha
+        """
+        if self.change_directory_handler is None:
+            return None
+        return self.change_directory_handler.workdir()
+
+    def is_cd_command(self, exec_command: typing.Optional[str]) -> bool:
+        """
+        Check if the command only changes the directory of the session.
+        In the persistent shell cd is a command like any other.
+
+        Author: Namah Shrestha
+        """
+        return (
+            not self.keep_shell
+            and self.change_directory_handler is not None
+            and self.change_directory_handler.is_cd_command(exec_command or "")
+        )
+
+    def check_directory(self, dirc: str) -> str:
+        """
+        Ask the container for the directory.
+        Returns the directory as the container sees it,
+        or an empty string if it does not exist.
+
+        Author: Namah Shrestha
+        """
+        self.ensure_container_id()
+        return (
+            db.get_backend()
+            .exec_container(self.container_name, "pwd", self.container_id, dirc)
+            .strip()
+        )
+
+    def change_directory(self, exec_command: str) -> None:
+        """
+        Change the working directory of the session.
+        No command runs for it, later commands run in the new directory.
+        The exit code tells if the directory exists.
+
+        Author: Namah Shrestha
+        """
+        previous_dirc: str = self.change_directory_handler.get_cwd()
+        dirc: str = self.change_directory_handler.resolve_directory(exec_command)
+        self.change_directory_handler.change_directory(
+            exec_command, self.check_directory
+        )
+        changed: bool = self.change_directory_handler.get_cwd() != previous_dirc
+        self.exit_code = 0 if changed or dirc == previous_dirc else 1
+
+    def track_directory(self, stream: db.ExecStream) -> None:
+        """
+        Take the working directory the command left the shell in.
+
+        Author: Namah Shrestha
+        """
+        if stream.cwd and self.change_directory_handler is not None:
+            self.change_directory_handler.dir_state_manager.curr_dir = stream.cwd
+
     def exec_instance(self, exec_command: typing.Optional[str] = None) -> str:
         """
         Run the docker command capture the output and return the result
 
+        The container id comes from the container index. If the instance
+        is not indexed, or its id turns out to be stale, the container is
+        resolved once and the index updated.
+
+        A container known to be gone raises ce.ContainerGoneError.
+
         Author: Namah Shrestha
         """
         try:
-            result: str = os.popen(
-                f"docker container exec $({self.filter_container_command})"
-                f" {exec_command}"
-            ).read()
-            return result
+            self.check_container()
+            output: bytes = b"".join(self.read_stream(exec_command))
+            return output.decode(errors="replace")
+        except ce.ContainerGoneError:
+            raise
         except Exception as e:
             raise Exception(e)
 
+    def kill(self) -> None:
+        """
+        Kill the running command inside the container, by the tag of its
+        docker exec. In the persistent shell the shell is killed with it,
+        the next command starts a new one.
+
+        Author: Namah Shrestha
+        """
+        shell: typing.Optional[sh.PersistentShell] = self.shell
+        exec_id: typing.Optional[str] = (
+            shell.exec_id if self.keep_shell and shell is not None else self.exec_id
+        )
+        if exec_id:
+            db.get_backend().kill_exec(self.container_name, self.container_id, exec_id)
+
+    def read_stream(
+        self, exec_command: typing.Optional[str] = None
+    ) -> typing.Iterator[bytes]:
+        """
+        Start the docker command and yield its output within the limits.
+        The exit code is set once the output is exhausted.
+
+        The clock of the timeout starts here. A command that hits a limit
+        or is cancelled is killed and its output ends, also if it was
+        stopped while it started.
+        A stale container id the stream only finds out at its end is
+        resolved again once, like in start_stream.
+
+        Author: Namah Shrestha
+        """
+        self.limits.start(self.kill)
+        stopped: bool = self.limits.stopped
+        stream: db.ExecStream = self.start_stream(exec_command)
+        if self.limits.stopped and not stopped:
+            self.kill()
+        try:
+            try:
+                yield from self.limits.read(stream)
+            except db.ContainerNotFoundError:
+                stream.close()
+                self.reresolve_container_id()
+                stream = self.start_stream(exec_command)
+                yield from self.limits.read(stream)
+            self.exit_code = stream.exit_code
+            self.track_directory(stream)
+        finally:
+            stream.close()
+            self.limits.finish()
+
+    def open_shell(self) -> None:
+        """
+        Start the persistent shell in the container, in the working
+        directory of the session. A stale container id is resolved again once.
+
+        Author: Namah Shrestha
+        """
+        self.ensure_container_id()
+        exec_id: str = uuid.uuid4().hex
+        try:
+            self.shell = sh.PersistentShell(
+                db.get_backend().open_shell(
+                    self.container_name, self.container_id, exec_id
+                ),
+                self.workdir(),
+                exec_id,
+            )
+        except (db.ContainerNotFoundError, sh.ShellClosedError):
+            self.reresolve_container_id()
+            self.shell = sh.PersistentShell(
+                db.get_backend().open_shell(
+                    self.container_name, self.container_id, exec_id
+                ),
+                self.workdir(),
+                exec_id,
+            )
+
+    def start_shell_stream(
+        self, exec_command: typing.Optional[str] = None
+    ) -> db.ExecStream:
+        """
+        Write the command into the persistent shell and return its output
+        stream. A shell that ended in the meantime is started again.
+
+        Author: Namah Shrestha
+        """
+        if self.shell is None or self.shell.closed:
+            self.open_shell()
+            return self.shell.stream(exec_command)
+        try:
+            return self.shell.stream(exec_command)
+        except sh.ShellClosedError:
+            self.open_shell()
+            return self.shell.stream(exec_command)
+
+    @tracing.traced("start_stream")
+    def start_stream(self, exec_command: typing.Optional[str] = None) -> db.ExecStream:
+        """
+        Start the docker command and return its output stream.
+        A stale container id is resolved again once, like in exec_instance.
+        A command stopped before it started does not start at all.
+
+        Author: Namah Shrestha
+        """
+        self.check_container()
+        if self.limits.stopped:
+            return db.CompletedExecStream(b"", None)
+        if self.keep_shell:
+            return self.start_shell_stream(exec_command)
+        if self.is_cd_command(exec_command):
+            self.change_directory(exec_command)
+            return db.CompletedExecStream(b"", self.exit_code)
+        self.ensure_container_id()
+        self.exec_id = uuid.uuid4().hex
+        try:
+            return db.get_backend().stream_exec(
+                self.container_name,
+                exec_command,
+                self.container_id,
+                self.workdir(),
+                self.exec_id,
+            )
+        except db.ContainerNotFoundError:
+            self.reresolve_container_id()
+            return db.get_backend().stream_exec(
+                self.container_name,
+                exec_command,
+                self.container_id,
+                self.workdir(),
+                self.exec_id,
+            )
+
+    def chunk_lines(self, lines: list) -> typing.Iterator[list]:
+        """
+        Group lines into chunks of at most constants.STREAM_CHUNK_LINES lines
+        and about constants.STREAM_CHUNK_BYTES characters.
+
+        Author: Namah Shrestha
+        """
+        chunk: list = []
+        chunk_size: int = 0
+        for line in lines:
+            if chunk and (
+                len(chunk) >= constants.STREAM_CHUNK_LINES
+                or chunk_size + len(line) > constants.STREAM_CHUNK_BYTES
+            ):
+                yield chunk
+                chunk, chunk_size = [], 0
+            chunk.append(line)
+            chunk_size += len(line)
+        if chunk:
+            yield chunk
+
+    def stream_instance(
+        self, exec_command: typing.Optional[str] = None
+    ) -> typing.Iterator[list]:
+        """
+        Run the docker command and yield its output in chunks of lines
+        while it runs. The exit code is set once the output is exhausted.
+
+        Complete lines are sent as soon as they are read. A partial line
+        is held back until its newline arrives, or sent as it is once it
+        grows past constants.STREAM_CHUNK_BYTES. The last chunk carries
+        the rest of the output, so that the chunks together are the lines
+        of the non streaming response.
+
+        Closing the generator stops the command.
+
+        Author: Namah Shrestha
+        """
+        decoder: codecs.IncrementalDecoder = codecs.getincrementaldecoder("utf-8")(
+            errors="replace"
+        )
+        pending: str = ""
+        output: typing.Iterator[bytes] = self.read_stream(exec_command)
+        try:
+            for data in output:
+                lines: list = (pending + decoder.decode(data)).split("\n")
+                pending = lines.pop()
+                if len(pending) >= constants.STREAM_CHUNK_BYTES:
+                    lines.append(pending)
+                    pending = ""
+                yield from self.chunk_lines(lines)
+            yield [pending + decoder.decode(b"", final=True)]
+        finally:
+            output.close()
+
+    async def async_stream(
+        self,
+        send_chunk: typing.Callable[[list], typing.Awaitable[None]],
+        exec_command: typing.Optional[str] = None,
+    ) -> typing.Optional[int]:
+        """
+        Stream the docker command from the exec pool and await send_chunk
+        for every chunk on the event loop. Returns the exit code.
+
+        The executor thread hands chunks over through a bounded queue, so
+        a slow client slows the reading down instead of buffering the
+        whole output. If sending fails the command is stopped and the
+        executor thread released.
+
+        Author: Namah Shrestha
+        """
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue(maxsize=constants.STREAM_QUEUE_SIZE)
+        cancelled: threading.Event = threading.Event()
+
+        def put(chunk: typing.Optional[list]) -> None:
+            asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop).result()
+
+        def produce() -> None:
+            try:
+                for chunk in self.stream_instance(exec_command):
+                    if cancelled.is_set():
+                        break
+                    put(chunk)
+            finally:
+                put(None)
+
+        producer: asyncio.Future = asyncio.ensure_future(
+            executor.run_blocking(self.command, produce)
+        )
+        try:
+            while True:
+                chunk: typing.Optional[list] = await chunks.get()
+                if chunk is None:
+                    break
+                await send_chunk(chunk)
+            await producer
+        finally:
+            if not producer.done():
+                cancelled.set()
+                while not chunks.empty():
+                    chunks.get_nowait()
+                producer.add_done_callback(
+                    lambda future: future.cancelled() or future.exception()
+                )
+        return self.exit_code
+
+    @tracing.traced("exec")
     def handle(self, exec_command: typing.Optional[str] = None) -> list:
         """
-        Run the docker command capture the output and return the result
+        Run the docker command capture the output and return the result.
+        A command stopped by the limits ends with a line telling why.
 
         Author: Namah Shrestha
         """
         try:
             exec_result: list = self.exec_instance(exec_command)
-            return self.parse_command_result(exec_result)
+            lines: list = self.parse_command_result(exec_result)
+            notice: typing.Optional[str] = self.limits.notice()
+            if notice is not None:
+                lines.append(notice)
+            return lines
+        except ce.ContainerGoneError:
+            raise
         except Exception as e:
             raise Exception(e)
 
@@ -106,7 +590,14 @@ class CentosInstanceExec(InstanceExec):
     Author: Namah Shrestha
     """
 
-    def __init__(self, command: str, instance_hash: str) -> None:
+    instance_os: str = constants.CENTOS
+
+    def __init__(
+        self,
+        command: str,
+        instance_hash: str,
+        container_id: typing.Optional[str] = None,
+    ) -> None:
         self.command: str = command
         self.instance_hash: str = instance_hash
         self.container_name: str = constants.CENTOS_CONTAINER_NAME.format(
@@ -119,4 +610,5 @@ class CentosInstanceExec(InstanceExec):
             self.command,
             self.instance_hash,
             self.filter_container_command,
+            container_id,
         )
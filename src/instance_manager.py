@@ -6,12 +6,20 @@ Author: Namah Shrestha
 """
 
 # builtins
-import os
+import time
 import typing
 
 # module
 import src
 import src.constants as constants
+import src.container_events as ce
+import src.container_index as ci
+import src.container_pool as cp
+import src.docker_backend as db
+import src.image_cache as ic
+import src.session_registry as sr
+import src.session_snapshot as sn
+import src.tracing as tracing
 
 
 class InstanceManager(src.Instance):
@@ -23,6 +31,8 @@ class InstanceManager(src.Instance):
     Author: Namah Shrestha
     """
 
+    instance_os: typing.Optional[str] = None
+
     def __init__(
         self,
         command: str,
@@ -59,52 +69,149 @@ class InstanceManager(src.Instance):
         self.dockerfile_name: str = dockerfile_name
         self.filter_container_command: str = filter_container_command
 
+    def running_container(self) -> typing.Optional[str]:
+        """
+        The container id of the session if it runs already, from the
+        session registry and the container states in memory.
+        No docker call is made.
+
+        Author: Namah Shrestha
+        """
+        record: typing.Optional[sr.SessionRecord] = sr.session_registry.get(
+            self.instance_hash
+        )
+        if (
+            record is None
+            or record.state != constants.SESSION_RUNNING
+            or not record.container_id
+            or ce.container_states.is_gone(record.container_id)
+        ):
+            return None
+        return record.container_id
+
+    def claim_session(self) -> bool:
+        """
+        Claim the creation of the session in the session registry.
+        While another worker process creates or deletes the session this
+        waits for it, at most for the create wait.
+        Returns False if the session is held by another worker once it
+        is done, for example created by it.
+
+        Author: Namah Shrestha
+        """
+        start: float = time.monotonic()
+        while True:
+            old_id: typing.Optional[str] = ci.container_index.get(self.instance_hash)
+            if sr.session_registry.claim(
+                self.instance_hash,
+                self.instance_os,
+                old_id if ce.container_states.is_gone(old_id) else None,
+            ):
+                return True
+            record: typing.Optional[sr.SessionRecord] = sr.session_registry.get(
+                self.instance_hash
+            )
+            if record is None:
+                continue
+            if record.state not in (
+                constants.SESSION_CREATING,
+                constants.SESSION_DELETING,
+            ):
+                return False
+            if time.monotonic() - start >= constants.CREATE_WAIT:
+                raise Exception(
+                    f"Session {self.instance_hash} is busy in another worker"
+                )
+            time.sleep(constants.CREATE_POLL_INTERVAL)
+
+    @tracing.traced("create_instance")
     def create_instance(self) -> None:
         """
-        1. Build the image from the dockerfile.
-        2. Create a container from the image.
+        0. Take a pre-started container from the warm pool if there is one.
+        1. Build the image from the dockerfile, only if its content changed.
+        2. Create a container from the image, labelled with the instance.
         3. Run the container.
+        4. Index the container id of the instance.
+
+        The session is claimed as creating until its container runs, so
+        only one worker process creates it, see claim_session.
+        A session whose container could not be created is forgotten and
+        the CREATE fails.
+        A dead container of the session is removed first, so that its
+        name is free again. A session that runs already is left alone.
 
         Author: Namah Shrestha
         """
+        if self.running_container() is not None or not self.claim_session():
+            return
         try:
-            os.system(
-                f"docker image build . -t "
-                f"{self.image_name}:{self.image_tag} -f "
-                f"{self.dockerfile_name}"
-            )
-            os.system(
-                f"docker container run --name {self.container_name} -d "
-                f"{self.image_name}:{self.image_tag}"
-            )
+            old_id: typing.Optional[str] = ci.container_index.get(self.instance_hash)
+            if ce.container_states.is_gone(old_id):
+                if not ce.container_states.is_removed(old_id):
+                    db.get_backend().remove_container(self.container_name, old_id)
+            pool: typing.Optional[cp.ContainerPool] = cp.get_pool(self.instance_os)
+            container_id: typing.Optional[str] = None
+            if pool is not None:
+                container_id = pool.acquire(self.container_name)
+            if container_id is None:
+                image: str = ic.image_cache.ensure_image(
+                    self.image_name, self.image_tag, self.dockerfile_name
+                )
+                container_id = db.get_backend().run_container(
+                    self.container_name,
+                    image,
+                    ci.container_labels(self.instance_os, self.instance_hash),
+                )
+                if container_id is None:
+                    ic.image_cache.invalidate(image)
+                    raise Exception(f"Container run failed: {self.container_name}")
+            ci.container_index.set(self.instance_hash, container_id, self.instance_os)
         except Exception as e:
+            ci.container_index.remove(self.instance_hash)
             raise Exception(e)
 
+    @tracing.traced("delete_instance")
     def delete_instance(self) -> None:
         """
         1. Stop the running container
         2. Delete the container
-        3. Delete the image
+
+        The image is shared by every session and stays cached.
+        The snapshot of a saved session is deleted with it.
+        The session is deleting until its container is gone. If the
+        deletion fails it is back in its previous state. A container
+        known to be removed already is not removed again.
 
         Author: Namah Shrestha
         """
+        record: typing.Optional[sr.SessionRecord] = sr.session_registry.get(
+            self.instance_hash
+        )
         try:
-            os.system(
-                f"docker container rm -f "
-                f"$({self.filter_container_command.format(self.instance_hash)})"
+            sr.session_registry.set_state(
+                self.instance_hash, constants.SESSION_DELETING
             )
-            os.system(f"docker image rm -f {self.image_name}:{self.image_tag}")
+            container_id: typing.Optional[str] = ci.container_index.get(
+                self.instance_hash
+            )
+            if not ce.container_states.is_removed(container_id):
+                db.get_backend().remove_container(self.container_name, container_id)
+            sn.remove_snapshot(self.instance_hash)
+            ci.container_index.remove(self.instance_hash)
         except Exception as e:
+            if record is not None:
+                sr.session_registry.set_state(self.instance_hash, record.state)
             raise Exception(e)
 
     def list_container(self) -> list:
         """
-        1. List the container
+        1. List the container ids matching the container name.
+        Like the lines of the cli listing, the list ends with an empty entry.
 
         Author: Namah Shrestha
         """
         try:
-            return os.popen(f"{self.filter_container_command}").read().split("\n")
+            return db.get_backend().list_container_ids(self.container_name) + [""]
         except Exception as e:
             raise Exception(e)
 
@@ -129,6 +236,8 @@ class CentosInstanceManager(InstanceManager):
     Author: Namah Shrestha
     """
 
+    instance_os: str = constants.CENTOS
+
     def __init__(self, command: str, instance_hash: str) -> None:
         self.command: str = command
         self.instance_hash: str = instance_hash
@@ -0,0 +1,193 @@
+"""
+This is the message parsing of the application.
+
+Every websocket message is decoded and validated in one step into a
+small message object. Handlers read its attributes instead of looking
+keys up in a dictionary again.
+
+orjson decodes faster than the json module. It is used when installed.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import json
+import re
+import typing
+
+# modules
+import src.constants as constants
+
+try:
+    import orjson
+
+    loads: typing.Callable[[typing.Union[str, bytes]], typing.Any] = orjson.loads
+except ImportError:  # pragma: no cover
+    loads = json.loads
+
+
+INVALID_MESSAGE_ERROR: str = (
+    "Invalid message body format."
+    "Message should have 'instance_os',"
+    " 'command', 'instance_hash', 'exec_command<optional>'"
+)
+INVALID_JSON_ERROR: str = "Please provide proper json format."
+
+"""
+Instance hashes end up in container names and docker commands.
+
+Author: Namah Shrestha
+"""
+INSTANCE_HASH_PATTERN: re.Pattern = re.compile(r"^[A-Za-z0-9_.-]+$")
+MESSAGE_FIELDS: frozenset = frozenset(
+    [
+        constants.INSTANCE_OS,
+        constants.COMMAND,
+        constants.INSTANCE_HASH,
+        constants.EXEC_COMMAND,
+        constants.STREAM,
+        constants.EXEC_COMMANDS,
+        constants.ON_ERROR,
+        constants.TIMEOUT,
+        constants.MAX_OUTPUT,
+    ]
+)
+
+
+class Message:
+    """
+    A validated message.
+
+    Author: Namah Shrestha
+    """
+
+    __slots__ = (
+        "instance_os",
+        "command",
+        "instance_hash",
+        "exec_command",
+        "stream",
+        "exec_commands",
+        "stop_on_error",
+        "timeout",
+        "max_output",
+    )
+
+    def __init__(
+        self,
+        instance_os: str,
+        command: str,
+        instance_hash: str,
+        exec_command: typing.Optional[str] = None,
+        stream: bool = False,
+        exec_commands: typing.Optional[list] = None,
+        stop_on_error: bool = True,
+        timeout: typing.Optional[float] = None,
+        max_output: typing.Optional[int] = None,
+    ) -> None:
+        self.instance_os: str = instance_os
+        self.command: str = command
+        self.instance_hash: str = instance_hash
+        self.exec_command: typing.Optional[str] = exec_command
+        self.stream: bool = stream
+        self.exec_commands: typing.Optional[list] = exec_commands
+        self.stop_on_error: bool = stop_on_error
+        self.timeout: typing.Optional[float] = timeout
+        self.max_output: typing.Optional[int] = max_output
+
+
+def parse_message(message: typing.Union[str, bytes]) -> Message:
+    """
+    Decode and validate the message.
+    Raise ValueError with the reason if the message is not valid.
+
+    Author: Namah Shrestha
+    """
+    try:
+        fields: typing.Any = loads(message)
+    except ValueError:
+        raise ValueError(INVALID_JSON_ERROR)
+    if not isinstance(fields, dict):
+        raise ValueError(INVALID_MESSAGE_ERROR)
+    instance_os: typing.Any = fields.get(constants.INSTANCE_OS)
+    command: typing.Any = fields.get(constants.COMMAND)
+    instance_hash: typing.Any = fields.get(constants.INSTANCE_HASH)
+    if not (
+        isinstance(instance_os, str)
+        and isinstance(command, str)
+        and isinstance(instance_hash, str)
+    ):
+        raise ValueError(INVALID_MESSAGE_ERROR)
+    if not MESSAGE_FIELDS.issuperset(fields):
+        raise ValueError(
+            f"Unknown message fields: {', '.join(sorted(set(fields) - MESSAGE_FIELDS))}"
+        )
+    if instance_os not in constants.SUPPORTED_OS:
+        raise ValueError(f"Unsupported instance os: {instance_os}")
+    if command not in constants.SUPPORTED_COMMANDS:
+        raise ValueError(f"Unsupported command: {command}")
+    if not INSTANCE_HASH_PATTERN.match(instance_hash):
+        raise ValueError(f"Invalid instance hash: {instance_hash}")
+    exec_command: typing.Any = fields.get(constants.EXEC_COMMAND)
+    if exec_command is not None and not isinstance(exec_command, str):
+        raise ValueError("exec_command should be a string")
+    exec_commands: typing.Any = fields.get(constants.EXEC_COMMANDS)
+    if exec_commands is not None and not (
+        isinstance(exec_commands, list)
+        and 0 < len(exec_commands) <= constants.MAX_BATCH_COMMANDS
+        and all(isinstance(item, str) and item for item in exec_commands)
+    ):
+        raise ValueError(
+            "exec_commands should be a list of 1 to "
+            f"{constants.MAX_BATCH_COMMANDS} commands"
+        )
+    if exec_command and exec_commands:
+        raise ValueError("Send either exec_command or exec_commands")
+    if command == constants.EXECUTE and not (exec_command or exec_commands):
+        raise ValueError(f"{constants.EXECUTE} needs an exec_command")
+    stream: typing.Any = fields.get(constants.STREAM, False)
+    if not isinstance(stream, bool):
+        raise ValueError("stream should be true or false")
+    if stream and exec_commands:
+        raise ValueError("exec_commands cannot be streamed")
+    on_error: typing.Any = fields.get(constants.ON_ERROR, constants.STOP_ON_ERROR)
+    if on_error not in (constants.STOP_ON_ERROR, constants.CONTINUE_ON_ERROR):
+        raise ValueError(
+            f"on_error should be {constants.STOP_ON_ERROR}"
+            f" or {constants.CONTINUE_ON_ERROR}"
+        )
+    timeout: typing.Any = fields.get(constants.TIMEOUT)
+    if timeout is not None and not (
+        isinstance(timeout, (int, float))
+        and not isinstance(timeout, bool)
+        and timeout > 0
+    ):
+        raise ValueError("timeout should be a positive number of seconds")
+    max_output: typing.Any = fields.get(constants.MAX_OUTPUT)
+    if max_output is not None and not (
+        isinstance(max_output, int)
+        and not isinstance(max_output, bool)
+        and max_output > 0
+    ):
+        raise ValueError("max_output should be a positive number of bytes")
+    return Message(
+        instance_os,
+        command,
+        instance_hash,
+        exec_command,
+        stream,
+        exec_commands,
+        on_error == constants.STOP_ON_ERROR,
+        timeout,
+        max_output,
+    )
+
+
+def is_cancel(message_obj: typing.Optional[Message]) -> bool:
+    """
+    Check if the parsed message asks to cancel the running EXEC.
+    None, for a message that is not valid, is not a CANCEL.
+
+    Author: Namah Shrestha
+    """
+    return message_obj is not None and message_obj.command == constants.CANCEL
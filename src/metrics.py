@@ -0,0 +1,547 @@
+"""
+This is the metrics registry of the application.
+
+It records where the time goes between receiving a message and sending
+its response: request latency per command and os, the duration of every
+docker operation, in flight and error counts. The warm pools, the reaper
+and the admission controller report their stats as collectors.
+
+Everything is served in the prometheus text format from a small http
+endpoint next to the web socket server.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import asyncio
+import contextlib
+import functools
+import logging
+import math
+import threading
+import time
+import typing
+
+# modules
+import src.constants as constants
+import src.tracing as tracing
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class Metric:
+    """
+    A metric family with one value per combination of label values.
+
+    Metrics are updated from the event loop and the executor threads,
+    so every update takes the lock of the metric.
+
+    Author: Namah Shrestha
+    """
+
+    metric_type: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        """
+        Create a metric without values.
+
+        Author: Namah Shrestha
+        """
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: tuple = tuple(labelnames)
+        self.values: dict = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def label_values(self, labels: tuple) -> tuple:
+        """
+        Check the number of label values.
+
+        Author: Namah Shrestha
+        """
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}")
+        return tuple(str(label) for label in labels)
+
+    def get(self, *labels: typing.Any) -> typing.Any:
+        """
+        Current value of the labels.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            return self.values.get(self.label_values(labels), 0)
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, dict, float]]:
+        """
+        Yield (name, labels, value) of every sample.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            items: list = list(self.values.items())
+        for labels, value in items:
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+    def render(self) -> str:
+        """
+        The metric in the prometheus text format.
+
+        Author: Namah Shrestha
+        """
+        lines: list = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """
+    A value that only goes up.
+
+    Author: Namah Shrestha
+    """
+
+    metric_type: str = "counter"
+
+    def inc(self, *labels: typing.Any, amount: float = 1) -> None:
+        """
+        Increment the value of the labels.
+
+        Author: Namah Shrestha
+        """
+        key: tuple = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down.
+
+    Author: Namah Shrestha
+    """
+
+    metric_type: str = "gauge"
+
+    def set(self, value: float, *labels: typing.Any) -> None:
+        """
+        Set the value of the labels.
+
+        Author: Namah Shrestha
+        """
+        key: tuple = self.label_values(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, *labels: typing.Any, amount: float = 1) -> None:
+        """
+        Increment the value of the labels.
+
+        Author: Namah Shrestha
+        """
+        key: tuple = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, *labels: typing.Any, amount: float = 1) -> None:
+        """
+        Decrement the value of the labels.
+
+        Author: Namah Shrestha
+        """
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    """
+    Counts of observations per bucket, with their sum and count.
+
+    Author: Namah Shrestha
+    """
+
+    metric_type: str = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = constants.METRICS_LATENCY_BUCKETS,
+    ) -> None:
+        """
+        Create a histogram with the upper bounds of the buckets.
+
+        Author: Namah Shrestha
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets: tuple = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, *labels: typing.Any) -> None:
+        """
+        Count the value in its bucket.
+
+        Author: Namah Shrestha
+        """
+        key: tuple = self.label_values(labels)
+        with self.lock:
+            counts: typing.Optional[list] = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-1] += value
+
+    def get(self, *labels: typing.Any) -> dict:
+        """
+        Count and sum of the observations of the labels.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            counts: list = self.values.get(self.label_values(labels))
+            if counts is None:
+                return {"count": 0, "sum": 0.0}
+            return {"count": sum(counts[:-1]), "sum": counts[-1]}
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, dict, float]]:
+        """
+        Yield the cumulative buckets, the sum and the count.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            items: list = [
+                (labels, list(counts)) for labels, counts in self.values.items()
+            ]
+        for labels, counts in items:
+            label_dict: dict = dict(zip(self.labelnames, labels))
+            cumulative: int = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    {**label_dict, "le": format_value(float(bound))},
+                    cumulative,
+                )
+            yield f"{self.name}_sum", label_dict, counts[-1]
+            yield f"{self.name}_count", label_dict, cumulative
+
+
+def format_value(value: float) -> str:
+    """
+    A sample value in the prometheus text format.
+
+    Author: Namah Shrestha
+    """
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def format_labels(labels: dict) -> str:
+    """
+    Labels in the prometheus text format, with escaped values.
+
+    Author: Namah Shrestha
+    """
+    if not labels:
+        return ""
+    pairs: list = []
+    for name, value in labels.items():
+        escaped: str = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Registry:
+    """
+    The metrics of the server and the collectors reporting stats.
+
+    A collector is called on every scrape and returns metrics
+    filled in from the stats of its component.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self) -> None:
+        """
+        Create an empty registry.
+
+        Author: Namah Shrestha
+        """
+        self.metrics: dict = {}
+        self.collectors: list = []
+        self.lock: threading.Lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add a metric. Raise ValueError if its name is taken.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = constants.METRICS_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(
+        self, collector: typing.Callable[[], typing.Iterable[Metric]]
+    ) -> None:
+        """
+        Add a collector.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Every metric in the prometheus text format.
+        A failing collector is logged and skipped.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            metrics: list = list(self.metrics.values())
+            collectors: list = list(self.collectors)
+        for collector in collectors:
+            try:
+                metrics.extend(collector())
+            except Exception:
+                logger.exception("Metrics: collector %s failed", collector)
+        return "".join(metric.render() for metric in metrics)
+
+
+"""
+The registry of the server and the metrics recorded by the application.
+
+Author: Namah Shrestha
+"""
+registry: Registry = Registry()
+request_latency: Histogram = registry.histogram(
+    "zod_request_duration_seconds",
+    "Time from receiving a message to sending its response.",
+    ("command", "instance_os"),
+)
+requests_in_flight: Gauge = registry.gauge(
+    "zod_requests_in_flight",
+    "Messages being handled.",
+    ("command", "instance_os"),
+)
+request_errors: Counter = registry.counter(
+    "zod_request_errors_total",
+    "Messages answered with an error.",
+    ("command", "instance_os", "error"),
+)
+invalid_messages: Counter = registry.counter(
+    "zod_invalid_messages_total",
+    "Messages rejected before dispatch.",
+)
+docker_latency: Histogram = registry.histogram(
+    "zod_docker_operation_duration_seconds",
+    "Duration of docker operations.",
+    ("operation",),
+)
+docker_in_flight: Gauge = registry.gauge(
+    "zod_docker_operations_in_flight",
+    "Docker operations running.",
+    ("operation",),
+)
+docker_errors: Counter = registry.counter(
+    "zod_docker_operation_errors_total",
+    "Failed docker operations.",
+    ("operation",),
+)
+session_resume_latency: Histogram = registry.histogram(
+    "zod_session_resume_duration_seconds",
+    "Time to unpause a paused session before its EXEC runs.",
+)
+session_restore_latency: Histogram = registry.histogram(
+    "zod_session_restore_duration_seconds",
+    "Time to restore a saved session from its snapshot.",
+)
+
+
+@contextlib.contextmanager
+def track_request(command: str, instance_os: str) -> typing.Iterator[None]:
+    """
+    Count the request in flight, record its latency and its error, if any.
+
+    Author: Namah Shrestha
+    """
+    requests_in_flight.inc(command, instance_os)
+    start: float = time.perf_counter()
+    try:
+        yield
+    except BaseException as error:
+        request_errors.inc(command, instance_os, type(error).__name__)
+        raise
+    finally:
+        request_latency.observe(time.perf_counter() - start, command, instance_os)
+        requests_in_flight.dec(command, instance_os)
+
+
+"""
+Marks a docker operation without a failure result.
+
+Author: Namah Shrestha
+"""
+NO_FAILURE_RESULT: object = object()
+
+
+def docker_operation(
+    operation: str, failure_result: typing.Any = NO_FAILURE_RESULT
+) -> typing.Callable:
+    """
+    Decorate a backend method to record the duration of the operation.
+    It fails when it raises or returns the failure result.
+    In a traced request the operation is a span of its own.
+
+    Author: Namah Shrestha
+    """
+
+    def decorator(func: typing.Callable) -> typing.Callable:
+        @functools.wraps(func)
+        def wrapper(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+            docker_in_flight.inc(operation)
+            start: float = time.perf_counter()
+            try:
+                with tracing.span(f"docker.{operation}"):
+                    result: typing.Any = func(*args, **kwargs)
+            except BaseException:
+                docker_errors.inc(operation)
+                raise
+            finally:
+                docker_latency.observe(time.perf_counter() - start, operation)
+                docker_in_flight.dec(operation)
+            if failure_result is not NO_FAILURE_RESULT and result is failure_result:
+                docker_errors.inc(operation)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def stats_collector(
+    name: str, documentation: str, labelnames: tuple, stats: typing.Callable
+) -> typing.Callable[[], list]:
+    """
+    A collector turning stats into one gauge per stats key.
+
+    The stats function returns a list of (label values, stats dict).
+    Every numeric key becomes the gauge {name}_{key}.
+
+    Author: Namah Shrestha
+    """
+
+    def collect() -> list:
+        gauges: dict = {}
+        for labels, values in stats():
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if key not in gauges:
+                    gauges[key] = Gauge(f"{name}_{key}", documentation, labelnames)
+                gauges[key].set(value, *labels)
+        return list(gauges.values())
+
+    return collect
+
+
+class MetricsServer:
+    """
+    Serves the registry on GET /metrics over plain http.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, metrics_registry: Registry = registry) -> None:
+        self.registry: Registry = metrics_registry
+        self.server: typing.Optional[asyncio.AbstractServer] = None
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Answer one request and close the connection.
+
+        Author: Namah Shrestha
+        """
+        try:
+            request_line: bytes = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts: list = request_line.decode("latin-1").split()
+            if (
+                len(parts) >= 2
+                and parts[0] == "GET"
+                and (parts[1] == "/metrics" or parts[1].startswith("/metrics?"))
+            ):
+                status: str = "200 OK"
+                body: bytes = self.registry.render().encode()
+            else:
+                status = "404 Not Found"
+                body = b"Not found\n"
+            writer.write(
+                (
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: {constants.METRICS_CONTENT_TYPE}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode()
+                + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str, port: int) -> asyncio.AbstractServer:
+        """
+        Start listening.
+
+        Author: Namah Shrestha
+        """
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def stop(self) -> None:
+        """
+        Stop listening.
+
+        Author: Namah Shrestha
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
@@ -0,0 +1,338 @@
+"""
+This is the idle session reaper.
+
+Users close the browser without sending DELETE, so their containers
+would run forever. The last activity of every session is recorded in
+the session registry, and the sessions that were idle for longer than
+the ttl are deleted. When there are more containers than the container
+cap, the least recently used sessions are deleted first. With a pause
+idle time, sessions idle for shorter than the ttl but longer than the
+pause idle time are paused, see src.session_pause. With a snapshot idle
+time, sessions idle for longer are saved to disk and their container
+removed before the ttl deletes them, see src.session_snapshot.
+
+The registry is shared, so one reaper sees the activity recorded by
+every worker process, and skips the sessions running an EXEC in any
+of them.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import asyncio
+import logging
+import time
+import typing
+
+# modules
+import src.admission as admission
+import src.constants as constants
+import src.executor as executor
+import src.session_pause as sp
+import src.session_registry as sr
+import src.session_snapshot as sn
+import src.single_flight as sf
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class SessionReaper:
+    """
+    Deletes idle sessions and keeps the number of containers under the cap.
+
+    Only running and paused sessions, and dead ones whose container
+    stopped, are reaped. Sessions being created, paused, saved or
+    deleted are left alone. Deletions, pauses and snapshots run in the
+    lifecycle executor like a DELETE.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        instance_manager_switch: dict,
+        idle_ttl: float = constants.SESSION_IDLE_TTL,
+        max_containers: int = constants.MAX_CONTAINERS,
+        registry: typing.Optional[sr.SessionRegistry] = None,
+        pause_after: float = constants.PAUSE_IDLE_AFTER,
+        snapshot_after: float = constants.SNAPSHOT_IDLE_AFTER,
+        snapshot_ttl: float = constants.SNAPSHOT_TTL,
+    ) -> None:
+        """
+        Create a reaper deleting sessions of the registry with the instance
+        managers of the switch. A ttl or cap of 0 disables it.
+        The shared session registry is used if none is given.
+        Sessions idle for longer than pause after are paused and the ones
+        idle for longer than snapshot after are saved to snapshots, which
+        are deleted once unused for the snapshot ttl. 0 disables pausing
+        and snapshots.
+
+        Author: Namah Shrestha
+        """
+        self.instance_manager_switch: dict = instance_manager_switch
+        self.idle_ttl: float = idle_ttl
+        self.max_containers: int = max_containers
+        self.registry: sr.SessionRegistry = (
+            sr.session_registry if registry is None else registry
+        )
+        self.pause_after: float = pause_after
+        self.pauser: sp.SessionPauser = sp.SessionPauser(self.registry)
+        self.snapshot_after: float = snapshot_after
+        self.snapshot_ttl: float = snapshot_ttl
+        self.snapshots: sn.SessionSnapshots = sn.SessionSnapshots(self.registry)
+        self.evicted_idle: int = 0
+        self.evicted_lru: int = 0
+        self.failures: int = 0
+        self.wakeup: typing.Optional[asyncio.Event] = None
+
+    def __contains__(self, instance_hash: str) -> bool:
+        return self.registry.get(instance_hash) is not None
+
+    def __len__(self) -> int:
+        return self.registry.count()
+
+    def begin_exec(self, instance_hash: str) -> None:
+        """
+        Record an EXEC starting in the session. Until it ends the session
+        is not paused, saved or deleted for being idle.
+
+        Author: Namah Shrestha
+        """
+        self.registry.begin_exec(instance_hash)
+
+    def end_exec(self, instance_hash: str) -> None:
+        """
+        Record the end of an EXEC of the session.
+
+        Author: Namah Shrestha
+        """
+        self.registry.end_exec(instance_hash)
+
+    def idle_sessions(self, now: float) -> list:
+        """
+        Instance hashes idle for longer than the ttl, least recent first.
+
+        Author: Namah Shrestha
+        """
+        if self.idle_ttl <= 0:
+            return []
+        return self.registry.idle(now - self.idle_ttl)
+
+    def lru_sessions(self) -> list:
+        """
+        Least recently used instance hashes above the container cap.
+
+        Author: Namah Shrestha
+        """
+        if self.max_containers <= 0:
+            return []
+        return self.registry.lru(
+            self.registry.count(*sr.REAPABLE_STATES) - self.max_containers
+        )
+
+    def idle_before(self, now: float, idle_after: float) -> typing.Optional[float]:
+        """
+        Sessions last used before this time are idle for longer than idle
+        after. None if idle after is 0.
+
+        Author: Namah Shrestha
+        """
+        if idle_after <= 0:
+            return None
+        return now - idle_after
+
+    async def pause(self, instance_hash: str, idle_before: float) -> bool:
+        """
+        Pause the session if it is still idle.
+        A failed pause leaves it running, the next round retries it.
+
+        Author: Namah Shrestha
+        """
+        try:
+            return await executor.run_blocking(
+                constants.DELETE, self.pauser.pause, instance_hash, idle_before
+            )
+        except Exception:
+            logger.exception("Reaper: pausing %s failed", instance_hash)
+            self.pauser.failures += 1
+            return False
+
+    async def save(self, instance_hash: str, idle_before: float) -> bool:
+        """
+        Save the session to its snapshot if it is still idle.
+        A failed snapshot leaves it running, the next round retries it.
+
+        Author: Namah Shrestha
+        """
+        try:
+            return await executor.run_blocking(
+                constants.DELETE, self.snapshots.save, instance_hash, idle_before
+            )
+        except Exception:
+            logger.exception("Reaper: saving %s failed", instance_hash)
+            self.snapshots.failures += 1
+            return False
+
+    async def restore(self, instance_hash: str) -> bool:
+        """
+        Restore the session from its snapshot if it is saved, before it
+        is used. Returns True if the container of the session was replaced.
+        Raise sn.SnapshotError if it could not be restored.
+
+        Author: Namah Shrestha
+        """
+        if not await executor.run_blocking(
+            constants.EXECUTE, self.snapshots.is_saved, instance_hash
+        ):
+            return False
+        return await executor.run_blocking(
+            constants.CREATE, self.snapshots.restore, instance_hash
+        )
+
+    async def resume(self, instance_hash: str) -> bool:
+        """
+        Unpause the session if it is paused, before it is used. Sessions
+        adopted paused at startup are resumed even with pausing disabled.
+
+        Author: Namah Shrestha
+        """
+        return await executor.run_blocking(
+            constants.EXECUTE, self.pauser.resume, instance_hash
+        )
+
+    async def reap(self, instance_hash: str, idle_before: float) -> bool:
+        """
+        Delete the session like a DELETE would, if it is still reapable,
+        last used before idle before and not running an EXEC. The session
+        is claimed as deleting first, so an EXEC starting in the meantime
+        keeps it. The deletion shares the flight of a DELETE of the hash.
+        A failed deletion keeps the session as it was,
+        so the next round retries it.
+
+        Author: Namah Shrestha
+        """
+        record: typing.Optional[sr.SessionRecord] = self.registry.get(instance_hash)
+        if record is None or record.state not in sr.REAPABLE_STATES:
+            return False
+        instance_manager_class: typing.Optional[
+            type
+        ] = self.instance_manager_switch.get(record.instance_os)
+        if instance_manager_class is None or not self.registry.change_state(
+            instance_hash,
+            constants.SESSION_DELETING,
+            sr.REAPABLE_STATES,
+            idle_before,
+        ):
+            return False
+        instance_manager = instance_manager_class(constants.DELETE, instance_hash)
+
+        async def delete() -> None:
+            async with admission.admission_controller.admit(constants.DELETE):
+                await instance_manager.async_handle()
+
+        try:
+            await sf.lifecycle_flights.run(instance_hash, constants.DELETE, delete)
+            return True
+        except Exception:
+            logger.exception("Reaper: deleting %s failed", instance_hash)
+            self.failures += 1
+            self.registry.change_state(
+                instance_hash, record.state, (constants.SESSION_DELETING,)
+            )
+            return False
+
+    async def reap_once(self, now: typing.Optional[float] = None) -> None:
+        """
+        Save the long idle sessions, delete the idle ones, then the least
+        recently used ones above the container cap, then pause the idle
+        running sessions. Finally delete the expired snapshots.
+        EXECs running for longer than the exec timeout were killed by it,
+        so their worker died before it recorded their end. They are
+        forgotten first.
+
+        Author: Namah Shrestha
+        """
+        now = time.time() if now is None else now
+        self.registry.clear_execs(now - constants.EXEC_TIMEOUT)
+        snapshot_before: typing.Optional[float] = self.idle_before(
+            now, self.snapshot_after
+        )
+        if snapshot_before is not None:
+            for instance_hash in self.registry.idle(
+                snapshot_before, (constants.SESSION_RUNNING, constants.SESSION_PAUSED)
+            ):
+                await self.save(instance_hash, snapshot_before)
+        for instance_hash in self.idle_sessions(now):
+            if await self.reap(instance_hash, now - self.idle_ttl):
+                self.evicted_idle += 1
+        for instance_hash in self.lru_sessions():
+            if await self.reap(instance_hash, now):
+                self.evicted_lru += 1
+        pause_before: typing.Optional[float] = self.idle_before(now, self.pause_after)
+        if pause_before is not None:
+            for instance_hash in self.registry.idle(
+                pause_before, (constants.SESSION_RUNNING,)
+            ):
+                await self.pause(instance_hash, pause_before)
+        if self.snapshot_ttl > 0:
+            for instance_hash in self.registry.idle(
+                now - self.snapshot_ttl, (constants.SESSION_SAVED,)
+            ):
+                if await executor.run_blocking(
+                    constants.DELETE,
+                    self.snapshots.expire,
+                    instance_hash,
+                    now - self.snapshot_ttl,
+                ):
+                    logger.info("Reaper: snapshot of %s expired", instance_hash)
+
+    def wake(self) -> None:
+        """
+        Run a round right away, for example after a CREATE.
+
+        Author: Namah Shrestha
+        """
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def stats(self) -> dict:
+        """
+        Eviction, pause and snapshot metrics.
+
+        Author: Namah Shrestha
+        """
+        return {
+            "sessions": len(self),
+            "sessions_paused": self.registry.count(constants.SESSION_PAUSED),
+            "sessions_saved": self.registry.count(constants.SESSION_SAVED),
+            "evicted_idle": self.evicted_idle,
+            "evicted_lru": self.evicted_lru,
+            "failures": self.failures,
+            **self.pauser.stats(),
+            **self.snapshots.stats(),
+        }
+
+    async def run(self, interval: float = constants.REAPER_INTERVAL) -> None:
+        """
+        Background task reaping every interval, or when woken up.
+        The running containers are in the registry since its rebuild.
+
+        Author: Namah Shrestha
+        """
+        self.wakeup = asyncio.Event()
+        last_stats: dict = {}
+        while True:
+            try:
+                await self.reap_once()
+            except Exception:
+                logger.exception("Reaper: round failed")
+            stats: dict = self.stats()
+            if stats != last_stats:
+                logger.info("Reaper stats: %s", stats)
+                last_stats = stats
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
@@ -0,0 +1,135 @@
+"""
+This is the per connection session state.
+
+A websocket connection is a session. The session is tied to one
+instance hash and holds everything that should live for the whole
+connection, like the working directory and the resolved container id,
+and the limits of the EXEC running, so that a CANCEL can stop it.
+The working directory is also recorded in the session registry, so a
+new connection to the session, on any worker, continues in it.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import typing
+
+# modules
+import src.constants as constants
+import src.directory_state as ds
+import src.exec_limits as el
+import src.session_registry as sr
+import src.shell as sh
+
+
+class Session:
+    """
+    State of one websocket connection.
+
+    The session gets bound to the instance hash and instance os of the
+    first valid message. Every message after that must target the same
+    instance hash.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self) -> None:
+        """
+        Create an unbound session.
+
+        Author: Namah Shrestha
+        """
+        self.instance_hash: typing.Optional[str] = None
+        self.instance_os: typing.Optional[str] = None
+        self.container_id: typing.Optional[str] = None
+        self.shell: typing.Optional[sh.PersistentShell] = None
+        self.change_directory_handler: ds.ChangeDirectoryHandler = (
+            ds.ChangeDirectoryHandler()
+        )
+        self.recorded_cwd: str = constants.CONTAINER_WORKING_DIRECTORY
+        self.limits: typing.Optional[el.ExecLimits] = None
+
+    def bind(self, instance_hash: str, instance_os: str) -> bool:
+        """
+        Bind the session to an instance hash.
+        Returns True if it was unbound, its working directory is then
+        loaded with load_cwd.
+        Raise ValueError if the session is already bound to another hash.
+
+        Author: Namah Shrestha
+        """
+        if self.instance_hash is None:
+            self.instance_hash = instance_hash
+            self.instance_os = instance_os
+            return True
+        if self.instance_hash != instance_hash:
+            raise ValueError(f"Session is bound to instance hash: {self.instance_hash}")
+        return False
+
+    def load_cwd(self) -> None:
+        """
+        Continue a known session in its recorded working directory.
+
+        Author: Namah Shrestha
+        """
+        record: typing.Optional[sr.SessionRecord] = sr.session_registry.get(
+            self.instance_hash
+        )
+        if record is not None:
+            self.change_directory_handler.dir_state_manager.curr_dir = record.cwd
+            self.recorded_cwd = self.change_directory_handler.get_cwd()
+
+    def invalidate_container(self) -> None:
+        """
+        Forget the resolved container id and end the shell running in it.
+        A new container starts in its own working directory.
+        Called whenever the container is created or deleted, or stopped.
+
+        Author: Namah Shrestha
+        """
+        self.container_id = None
+        self.close_shell()
+        self.change_directory_handler.reset()
+        self.recorded_cwd = self.change_directory_handler.get_cwd()
+
+    def forget_container(self) -> None:
+        """
+        Forget the resolved container id and end the shell running in it,
+        in the working directory of the session.
+        Called when the container is restored from a snapshot.
+
+        Author: Namah Shrestha
+        """
+        self.container_id = None
+        self.close_shell()
+
+    def record_cwd(self) -> None:
+        """
+        Record the working directory in the session registry, if it changed.
+
+        Author: Namah Shrestha
+        """
+        cwd: str = self.change_directory_handler.get_cwd()
+        if self.instance_hash is not None and cwd != self.recorded_cwd:
+            sr.session_registry.set_cwd(self.instance_hash, cwd)
+            self.recorded_cwd = cwd
+
+    def cancel_exec(self) -> bool:
+        """
+        Cancel the EXEC running in the session.
+        Returns False if there is nothing to cancel.
+
+        Author: Namah Shrestha
+        """
+        limits: typing.Optional[el.ExecLimits] = self.limits
+        return limits is not None and limits.cancel()
+
+    def close_shell(self) -> None:
+        """
+        End the persistent shell of the session, if any.
+
+        Author: Namah Shrestha
+        """
+        if self.shell is not None:
+            self.shell.close()
+            self.shell = None
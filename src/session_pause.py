@@ -0,0 +1,149 @@
+"""
+This is the idle session pauser.
+
+Between two commands a session container still runs its shell and
+whatever the user left in the background, and its memory cannot be
+reclaimed. A session idle for a while is paused with the cgroup freezer:
+its processes stop, it uses no cpu and its memory can be swapped out,
+but nothing is lost. The next EXEC unpauses it, which takes milliseconds
+instead of the seconds of a new container.
+
+Pausing and resuming go through the session registry, so every worker
+process agrees on the state of the session. A session being paused is
+pausing until its container is frozen, then paused. Every change is
+compared and swapped, so a pause racing with an EXEC never freezes
+a session in use.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import logging
+import time
+import typing
+
+# modules
+import src.constants as constants
+import src.docker_backend as db
+import src.metrics as metrics
+import src.session_registry as sr
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class SessionPauser:
+    """
+    Pauses idle sessions and resumes them on demand.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        registry: typing.Optional[sr.SessionRegistry] = None,
+        wait: float = constants.PAUSE_WAIT,
+    ) -> None:
+        """
+        Create a pauser of the sessions of the registry, the shared session
+        registry if none is given. A resume waits at most wait seconds for
+        a pause in progress.
+
+        Author: Namah Shrestha
+        """
+        self.registry: sr.SessionRegistry = (
+            sr.session_registry if registry is None else registry
+        )
+        self.wait: float = wait
+        self.paused: int = 0
+        self.resumed: int = 0
+        self.failures: int = 0
+
+    def pause(self, instance_hash: str, idle_before: float) -> bool:
+        """
+        Pause the container of a running session last used before
+        idle before. A session used in the meantime is left alone, and a
+        session resumed or deleted while it was being paused is unpaused.
+        Returns True if the session is paused.
+
+        Author: Namah Shrestha
+        """
+        record: typing.Optional[sr.SessionRecord] = self.registry.get(instance_hash)
+        if (
+            record is None
+            or not record.container_id
+            or not self.registry.change_state(
+                instance_hash,
+                constants.SESSION_PAUSING,
+                (constants.SESSION_RUNNING,),
+                idle_before,
+            )
+        ):
+            return False
+        try:
+            paused: bool = db.get_backend().pause_container(record.container_id)
+        except Exception:
+            self.registry.change_state(
+                instance_hash, constants.SESSION_RUNNING, (constants.SESSION_PAUSING,)
+            )
+            raise
+        if paused and self.registry.change_state(
+            instance_hash, constants.SESSION_PAUSED, (constants.SESSION_PAUSING,)
+        ):
+            self.paused += 1
+            return True
+        if paused:
+            db.get_backend().unpause_container(record.container_id)
+        else:
+            self.failures += 1
+        self.registry.change_state(
+            instance_hash, constants.SESSION_RUNNING, (constants.SESSION_PAUSING,)
+        )
+        return False
+
+    def resume(self, instance_hash: str) -> bool:
+        """
+        Unpause the session if it is paused, and record how long it took.
+        A pause in progress is waited for, at most for the wait.
+        Returns True if this call resumed the session.
+
+        Author: Namah Shrestha
+        """
+        start: float = time.perf_counter()
+        while True:
+            record: typing.Optional[sr.SessionRecord] = self.registry.get(instance_hash)
+            if record is None or record.state not in (
+                constants.SESSION_PAUSING,
+                constants.SESSION_PAUSED,
+            ):
+                return False
+            if (
+                record.state == constants.SESSION_PAUSING
+                and time.perf_counter() - start < self.wait
+            ):
+                time.sleep(constants.PAUSE_POLL_INTERVAL)
+                continue
+            if self.registry.change_state(
+                instance_hash,
+                constants.SESSION_RUNNING,
+                (constants.SESSION_PAUSING, constants.SESSION_PAUSED),
+            ):
+                break
+        if not db.get_backend().unpause_container(record.container_id):
+            logger.warning("Unpausing session %s failed", instance_hash)
+            self.failures += 1
+        self.resumed += 1
+        metrics.session_resume_latency.observe(time.perf_counter() - start)
+        return True
+
+    def stats(self) -> dict:
+        """
+        Pause metrics.
+
+        Author: Namah Shrestha
+        """
+        return {
+            "paused": self.paused,
+            "resumed": self.resumed,
+            "pause_failures": self.failures,
+        }
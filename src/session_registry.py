@@ -0,0 +1,533 @@
+"""
+This is the shared session registry.
+
+Every session is recorded by instance hash with its container id, os,
+working directory, creation and last use times, state and number of
+running EXECs. The registry lives in SQLite in WAL mode, so every worker
+process, and replicas on the same host, read and write one view of the
+sessions. Readers never wait for writers and every update is a single
+atomic statement, so no worker has to ask docker for bookkeeping.
+
+Times are wall clock times, because they are shared between processes.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+# modules
+import src.constants as constants
+
+
+SCHEMA: tuple = (
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        instance_hash TEXT PRIMARY KEY,
+        container_id TEXT,
+        instance_os TEXT,
+        cwd TEXT NOT NULL,
+        state TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_used REAL NOT NULL,
+        execs INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (state, last_used)",
+)
+COLUMNS: str = (
+    "instance_hash, container_id, instance_os, cwd, state, created_at, last_used"
+)
+REAPABLE_STATES: tuple = (
+    constants.SESSION_RUNNING,
+    constants.SESSION_PAUSED,
+    constants.SESSION_DEAD,
+)
+
+
+class SessionRecord:
+    """
+    A session as recorded in the registry.
+
+    Author: Namah Shrestha
+    """
+
+    __slots__ = (
+        "instance_hash",
+        "container_id",
+        "instance_os",
+        "cwd",
+        "state",
+        "created_at",
+        "last_used",
+    )
+
+    def __init__(
+        self,
+        instance_hash: str,
+        container_id: typing.Optional[str],
+        instance_os: typing.Optional[str],
+        cwd: str,
+        state: str,
+        created_at: float,
+        last_used: float,
+    ) -> None:
+        self.instance_hash: str = instance_hash
+        self.container_id: typing.Optional[str] = container_id
+        self.instance_os: typing.Optional[str] = instance_os
+        self.cwd: str = cwd
+        self.state: str = state
+        self.created_at: float = created_at
+        self.last_used: float = last_used
+
+
+class SessionRegistry:
+    """
+    Sessions by instance hash in SQLite.
+
+    Every process opens its own connection on first use, a forked worker
+    never uses the connection of its parent. The connection is shared by
+    the threads of the process behind a lock.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, path: str = constants.SESSION_REGISTRY_PATH) -> None:
+        """
+        Create a registry in the database file of the path.
+        It is opened on first use.
+
+        Author: Namah Shrestha
+        """
+        self.path: str = path
+        self.lock: threading.Lock = threading.Lock()
+        self.connection: typing.Optional[sqlite3.Connection] = None
+        self.pid: typing.Optional[int] = None
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        The connection of this process. Called with the lock held.
+
+        Author: Namah Shrestha
+        """
+        if self.connection is None or self.pid != os.getpid():
+            connection: sqlite3.Connection = sqlite3.connect(
+                self.path,
+                timeout=constants.SESSION_REGISTRY_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self.connection = connection
+            self.pid = os.getpid()
+        return self.connection
+
+    def close(self) -> None:
+        """
+        Close the connection of this process. The next use opens it again.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            if self.connection is not None and self.pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+
+    def query(self, sql: str, parameters: tuple = ()) -> list:
+        """
+        Rows of a select.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            return self.connect().execute(sql, parameters).fetchall()
+
+    def execute(self, sql: str, parameters: tuple = ()) -> int:
+        """
+        Run one statement atomically. Returns the number of changed rows.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            return self.connect().execute(sql, parameters).rowcount
+
+    @contextlib.contextmanager
+    def transaction(self) -> typing.Iterator[sqlite3.Connection]:
+        """
+        Run several statements atomically.
+        The write lock is taken right away, so concurrent writers wait
+        instead of failing halfway.
+
+        Author: Namah Shrestha
+        """
+        with self.lock:
+            connection: sqlite3.Connection = self.connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def get(self, instance_hash: str) -> typing.Optional[SessionRecord]:
+        """
+        The record of the session, None if unknown.
+
+        Author: Namah Shrestha
+        """
+        rows: list = self.query(
+            f"SELECT {COLUMNS} FROM sessions WHERE instance_hash = ?",
+            (instance_hash,),
+        )
+        return SessionRecord(*rows[0]) if rows else None
+
+    def container_id(self, instance_hash: str) -> typing.Optional[str]:
+        """
+        Container id of the session, None if unknown.
+
+        Author: Namah Shrestha
+        """
+        rows: list = self.query(
+            "SELECT container_id FROM sessions WHERE instance_hash = ?",
+            (instance_hash,),
+        )
+        return rows[0][0] if rows else None
+
+    def register(
+        self,
+        instance_hash: str,
+        instance_os: typing.Optional[str],
+        state: str = constants.SESSION_CREATING,
+        now: typing.Optional[float] = None,
+    ) -> None:
+        """
+        Record a session that is being created.
+        A known session only changes its state.
+
+        Author: Namah Shrestha
+        """
+        now = time.time() if now is None else now
+        self.execute(
+            f"INSERT INTO sessions ({COLUMNS}) VALUES (?, NULL, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (instance_hash) DO UPDATE SET state = excluded.state",
+            (
+                instance_hash,
+                instance_os,
+                constants.CONTAINER_WORKING_DIRECTORY,
+                state,
+                now,
+                now,
+            ),
+        )
+
+    def claim(
+        self,
+        instance_hash: str,
+        instance_os: typing.Optional[str],
+        stale_container_id: typing.Optional[str] = None,
+        now: typing.Optional[float] = None,
+    ) -> bool:
+        """
+        Record a session that this process is about to create, unless
+        another one creates, deletes or holds it. Unknown and dead sessions
+        are claimed, and running ones whose container is the stale
+        container id. Concurrent claims by other processes cannot
+        interleave, only one of them wins. Returns True if claimed.
+
+        Author: Namah Shrestha
+        """
+        now = time.time() if now is None else now
+        return bool(
+            self.execute(
+                f"INSERT INTO sessions ({COLUMNS}) VALUES (?, NULL, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (instance_hash) DO UPDATE SET state = excluded.state "
+                "WHERE state = ? OR (state = ? AND container_id IS ?)",
+                (
+                    instance_hash,
+                    instance_os,
+                    constants.CONTAINER_WORKING_DIRECTORY,
+                    constants.SESSION_CREATING,
+                    now,
+                    now,
+                    constants.SESSION_DEAD,
+                    constants.SESSION_RUNNING,
+                    stale_container_id,
+                ),
+            )
+        )
+
+    def set_container(
+        self,
+        instance_hash: str,
+        container_id: str,
+        instance_os: typing.Optional[str] = None,
+        now: typing.Optional[float] = None,
+    ) -> None:
+        """
+        Record the container of a running session, used right now.
+        A container replacing another one starts over in the working
+        directory of a new container, with the time it was created.
+
+        Author: Namah Shrestha
+        """
+        now = time.time() if now is None else now
+        self.execute(
+            f"INSERT INTO sessions ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (instance_hash) DO UPDATE SET "
+            "cwd = CASE WHEN COALESCE(container_id, excluded.container_id) "
+            "IS excluded.container_id "
+            "THEN cwd ELSE excluded.cwd END, "
+            "created_at = CASE WHEN COALESCE(container_id, excluded.container_id) "
+            "IS excluded.container_id "
+            "THEN created_at ELSE excluded.created_at END, "
+            "container_id = excluded.container_id, "
+            "instance_os = COALESCE(excluded.instance_os, instance_os), "
+            "state = excluded.state, "
+            "last_used = excluded.last_used",
+            (
+                instance_hash,
+                container_id,
+                instance_os,
+                constants.CONTAINER_WORKING_DIRECTORY,
+                constants.SESSION_RUNNING,
+                now,
+                now,
+            ),
+        )
+
+    def set_state(self, instance_hash: str, state: str) -> bool:
+        """
+        Change the state of a known session. Returns False if it is unknown.
+
+        Author: Namah Shrestha
+        """
+        return bool(
+            self.execute(
+                "UPDATE sessions SET state = ? WHERE instance_hash = ?",
+                (state, instance_hash),
+            )
+        )
+
+    def change_state(
+        self,
+        instance_hash: str,
+        state: str,
+        from_states: tuple,
+        idle_before: typing.Optional[float] = None,
+    ) -> bool:
+        """
+        Change the state of the session only if it is in one of the from
+        states, and if idle before is given, last used before it and not
+        running an EXEC. Concurrent changes by other processes cannot
+        interleave, only one of them wins. Returns True if the state changed.
+
+        Author: Namah Shrestha
+        """
+        sql: str = (
+            "UPDATE sessions SET state = ? WHERE instance_hash = ? "
+            f"AND state IN ({', '.join('?' * len(from_states))})"
+        )
+        parameters: tuple = (state, instance_hash, *from_states)
+        if idle_before is not None:
+            sql += " AND last_used < ? AND execs = 0"
+            parameters += (idle_before,)
+        return bool(self.execute(sql, parameters))
+
+    def set_cwd(self, instance_hash: str, cwd: str) -> None:
+        """
+        Record the working directory of the session.
+
+        Author: Namah Shrestha
+        """
+        self.execute(
+            "UPDATE sessions SET cwd = ? WHERE instance_hash = ?", (cwd, instance_hash)
+        )
+
+    def begin_exec(
+        self, instance_hash: str, now: typing.Optional[float] = None
+    ) -> None:
+        """
+        Record an EXEC starting in a known session, which is used right now.
+
+        Author: Namah Shrestha
+        """
+        now = time.time() if now is None else now
+        self.execute(
+            "UPDATE sessions SET execs = execs + 1, last_used = ? "
+            "WHERE instance_hash = ?",
+            (now, instance_hash),
+        )
+
+    def end_exec(self, instance_hash: str, now: typing.Optional[float] = None) -> None:
+        """
+        Record the end of an EXEC of the session, which is used right now.
+
+        Author: Namah Shrestha
+        """
+        now = time.time() if now is None else now
+        self.execute(
+            "UPDATE sessions SET execs = MAX(execs - 1, 0), last_used = ? "
+            "WHERE instance_hash = ?",
+            (now, instance_hash),
+        )
+
+    def clear_execs(self, before: float) -> int:
+        """
+        Forget the EXECs of sessions last used before the time. They were
+        left behind by a worker process that died while running them.
+        Returns the number of changed sessions.
+
+        Author: Namah Shrestha
+        """
+        return self.execute(
+            "UPDATE sessions SET execs = 0 WHERE execs > 0 AND last_used < ?",
+            (before,),
+        )
+
+    def remove(self, instance_hash: str) -> None:
+        """
+        Forget the session.
+
+        Author: Namah Shrestha
+        """
+        self.execute("DELETE FROM sessions WHERE instance_hash = ?", (instance_hash,))
+
+    def clear(self) -> None:
+        """
+        Forget every session.
+
+        Author: Namah Shrestha
+        """
+        self.execute("DELETE FROM sessions")
+
+    def mark_dead(self, container_id: str) -> int:
+        """
+        Record that the container of running or paused sessions stopped
+        outside of our control. Short and full container ids both match.
+        Returns the number of changed sessions.
+
+        Author: Namah Shrestha
+        """
+        return self.execute(
+            "UPDATE sessions SET state = ? "
+            "WHERE substr(container_id, 1, 12) = ? AND state IN (?, ?, ?)",
+            (
+                constants.SESSION_DEAD,
+                container_id[:12],
+                constants.SESSION_RUNNING,
+                constants.SESSION_PAUSING,
+                constants.SESSION_PAUSED,
+            ),
+        )
+
+    def count(self, *states: str) -> int:
+        """
+        Number of sessions, of the states if given.
+
+        Author: Namah Shrestha
+        """
+        if not states:
+            return self.query("SELECT COUNT(*) FROM sessions")[0][0]
+        rows: list = self.query(
+            "SELECT COUNT(*) FROM sessions "
+            f"WHERE state IN ({', '.join('?' * len(states))})",
+            states,
+        )
+        return rows[0][0]
+
+    def idle(self, before: float, states: tuple = REAPABLE_STATES) -> list:
+        """
+        Sessions of the states last used before the time and not running
+        an EXEC, least recent first. Running, paused and dead sessions by
+        default.
+
+        Author: Namah Shrestha
+        """
+        return [
+            row[0]
+            for row in self.query(
+                "SELECT instance_hash FROM sessions "
+                f"WHERE state IN ({', '.join('?' * len(states))}) "
+                "AND last_used < ? AND execs = 0 ORDER BY last_used, rowid",
+                (*states, before),
+            )
+        ]
+
+    def lru(self, limit: int) -> list:
+        """
+        The least recently used running, paused and dead sessions,
+        at most limit of them.
+
+        Author: Namah Shrestha
+        """
+        if limit <= 0:
+            return []
+        return [
+            row[0]
+            for row in self.query(
+                "SELECT instance_hash FROM sessions "
+                "WHERE state IN (?, ?, ?) ORDER BY last_used, rowid LIMIT ?",
+                (*REAPABLE_STATES, limit),
+            )
+        ]
+
+    def reconcile(self, containers: dict, since: float) -> int:
+        """
+        Bring the registry in line with the running containers, a dict of
+        instance hash to (instance os, container id, created at, state)
+        listed at since.
+
+        Sessions of running containers are recorded in their state,
+        running or paused, the ones the registry did not know as used
+        right now. Sessions without a container are forgotten, unless they
+        were created after the listing. Sessions saved to a snapshot have
+        no container and are kept. Returns the number of sessions.
+
+        Author: Namah Shrestha
+        """
+        now: float = time.time()
+        with self.transaction() as connection:
+            for instance_hash, (
+                instance_os,
+                container_id,
+                created_at,
+                state,
+            ) in containers.items():
+                connection.execute(
+                    f"INSERT INTO sessions ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (instance_hash) DO UPDATE SET "
+                    "container_id = excluded.container_id, "
+                    "instance_os = excluded.instance_os, state = excluded.state",
+                    (
+                        instance_hash,
+                        container_id,
+                        instance_os,
+                        constants.CONTAINER_WORKING_DIRECTORY,
+                        state,
+                        created_at,
+                        now,
+                    ),
+                )
+            gone: list = [
+                (row[0],)
+                for row in connection.execute(
+                    "SELECT instance_hash FROM sessions "
+                    "WHERE created_at < ? AND state != ?",
+                    (since, constants.SESSION_SAVED),
+                )
+                if row[0] not in containers
+            ]
+            connection.executemany("DELETE FROM sessions WHERE instance_hash = ?", gone)
+            return connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+session_registry: SessionRegistry = SessionRegistry()
@@ -0,0 +1,311 @@
+"""
+This is the idle session snapshot store.
+
+The reaper deletes sessions idle for longer than the ttl, and with them
+the files of the user. With snapshots, a session idle for long is saved
+to disk instead: its container is committed to an image, the image is
+written as a gzip compressed archive named after the instance hash, and
+the container and image are removed. The session then holds no memory
+and no container layers, only its archive.
+
+The next EXEC or CREATE of the session restores it transparently: the
+archive is loaded and a container of the image started under the name
+and labels of the session, in its last working directory. The processes
+of the session are not restored, only its files.
+
+Like pausing, every state change goes through the session registry and
+is compared and swapped, so every worker process agrees on the session.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import hashlib
+import logging
+import os
+import time
+import typing
+
+# modules
+import src.constants as constants
+import src.container_index as ci
+import src.docker_backend as db
+import src.metrics as metrics
+import src.session_registry as sr
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def snapshot_path(
+    instance_hash: str, directory: str = constants.SNAPSHOT_DIRECTORY
+) -> str:
+    """
+    Path of the snapshot archive of the instance hash.
+
+    Author: Namah Shrestha
+    """
+    return os.path.join(directory, f"{instance_hash}{constants.SNAPSHOT_FILE_SUFFIX}")
+
+
+def snapshot_image(instance_hash: str) -> str:
+    """
+    Image of the snapshot of the instance hash. The tag is a digest of
+    the hash, every instance hash is not a valid tag.
+
+    Author: Namah Shrestha
+    """
+    digest: str = hashlib.sha256(instance_hash.encode()).hexdigest()[:32]
+    return f"{constants.SNAPSHOT_IMAGE_NAME}:{digest}"
+
+
+def remove_snapshot(
+    instance_hash: str, directory: str = constants.SNAPSHOT_DIRECTORY
+) -> bool:
+    """
+    Delete the snapshot archive of the instance hash, if there is one.
+    Returns True if it existed.
+
+    Author: Namah Shrestha
+    """
+    try:
+        os.remove(snapshot_path(instance_hash, directory))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+class SnapshotError(Exception):
+    """
+    Raised when a saved session could not be restored.
+    Its snapshot is kept, the next request tries again.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, instance_hash: str) -> None:
+        super().__init__(f"Restoring session {instance_hash} failed, try again.")
+        self.instance_hash: str = instance_hash
+
+
+class SessionSnapshots:
+    """
+    Saves idle sessions to snapshots and restores them on demand.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        registry: typing.Optional[sr.SessionRegistry] = None,
+        directory: str = constants.SNAPSHOT_DIRECTORY,
+        wait: float = constants.SNAPSHOT_WAIT,
+    ) -> None:
+        """
+        Create a snapshot store of the sessions of the registry, the shared
+        session registry if none is given, in the directory. A restore
+        waits at most wait seconds for a snapshot in progress.
+
+        Author: Namah Shrestha
+        """
+        self.registry: sr.SessionRegistry = (
+            sr.session_registry if registry is None else registry
+        )
+        self.directory: str = directory
+        self.wait: float = wait
+        self.saved: int = 0
+        self.restored: int = 0
+        self.expired: int = 0
+        self.failures: int = 0
+
+    def is_saved(self, instance_hash: str) -> bool:
+        """
+        Check if the session is saved, or being saved or restored.
+
+        Author: Namah Shrestha
+        """
+        record: typing.Optional[sr.SessionRecord] = self.registry.get(instance_hash)
+        return record is not None and record.state in (
+            constants.SESSION_SAVING,
+            constants.SESSION_SAVED,
+            constants.SESSION_RESTORING,
+        )
+
+    def save(self, instance_hash: str, idle_before: float) -> bool:
+        """
+        Save the running or paused session last used before idle before
+        to its snapshot and remove its container. A session used in the
+        meantime is left alone. A failed snapshot leaves the session
+        running. Returns True if the session is saved.
+
+        Author: Namah Shrestha
+        """
+        record: typing.Optional[sr.SessionRecord] = self.registry.get(instance_hash)
+        if (
+            record is None
+            or not record.container_id
+            or record.instance_os not in ci.container_name_switch
+            or not self.registry.change_state(
+                instance_hash,
+                constants.SESSION_SAVING,
+                (constants.SESSION_RUNNING, constants.SESSION_PAUSED),
+                idle_before,
+            )
+        ):
+            return False
+        written: bool = False
+        saved: bool = False
+        try:
+            written = self.write(record)
+            if written:
+                db.get_backend().remove_container(
+                    ci.container_name_switch[record.instance_os].format(instance_hash),
+                    record.container_id,
+                )
+                saved = True
+        finally:
+            if not saved:
+                self.failures += 1
+                if written:
+                    remove_snapshot(instance_hash, self.directory)
+                self.registry.change_state(
+                    instance_hash,
+                    constants.SESSION_RUNNING,
+                    (constants.SESSION_SAVING,),
+                )
+        if not saved:
+            return False
+        if not self.registry.change_state(
+            instance_hash, constants.SESSION_SAVED, (constants.SESSION_SAVING,)
+        ):
+            remove_snapshot(instance_hash, self.directory)
+            return False
+        self.saved += 1
+        return True
+
+    def write(self, record: sr.SessionRecord) -> bool:
+        """
+        Commit the container of the session and write its archive.
+        The archive is written next to its path and moved there once it
+        is complete, a failed snapshot leaves no archive behind.
+        Returns True on success.
+
+        Author: Namah Shrestha
+        """
+        backend: db.DockerBackend = db.get_backend()
+        image: str = snapshot_image(record.instance_hash)
+        path: str = snapshot_path(record.instance_hash, self.directory)
+        partial_path: str = f"{path}.partial"
+        if record.state == constants.SESSION_PAUSED:
+            backend.unpause_container(record.container_id)
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            if not backend.commit_container(record.container_id, image):
+                return False
+            try:
+                if not backend.save_image(image, partial_path):
+                    return False
+            finally:
+                backend.remove_image(image)
+            os.replace(partial_path, path)
+            return True
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    def restore(self, instance_hash: str) -> bool:
+        """
+        Restore the container of a saved session from its snapshot, in the
+        working directory it was left in, and record how long it took.
+        A snapshot or restore in progress is waited for, at most for the
+        wait. A session whose archive is lost is forgotten, so it can be
+        created again. Returns True if the container of the session was
+        replaced, by this call or the one waited for.
+        Raise SnapshotError if the snapshot could not be restored.
+
+        Author: Namah Shrestha
+        """
+        start: float = time.perf_counter()
+        waited: bool = False
+        while True:
+            record: typing.Optional[sr.SessionRecord] = self.registry.get(instance_hash)
+            if record is None or record.state not in (
+                constants.SESSION_SAVING,
+                constants.SESSION_SAVED,
+                constants.SESSION_RESTORING,
+            ):
+                return waited and record is not None
+            if record.state != constants.SESSION_SAVED:
+                if time.perf_counter() - start >= self.wait:
+                    raise SnapshotError(instance_hash)
+                waited = True
+                time.sleep(constants.SNAPSHOT_POLL_INTERVAL)
+                continue
+            if self.registry.change_state(
+                instance_hash, constants.SESSION_RESTORING, (constants.SESSION_SAVED,)
+            ):
+                break
+        path: str = snapshot_path(instance_hash, self.directory)
+        if not os.path.exists(path):
+            logger.warning("Snapshot of session %s is lost", instance_hash)
+            self.registry.remove(instance_hash)
+            return False
+        backend: db.DockerBackend = db.get_backend()
+        image: str = snapshot_image(instance_hash)
+        container_id: typing.Optional[str] = None
+        try:
+            if backend.load_image(path):
+                container_id = backend.run_container(
+                    ci.container_name_switch[record.instance_os].format(instance_hash),
+                    image,
+                    ci.container_labels(record.instance_os, instance_hash),
+                )
+        finally:
+            if container_id is None:
+                self.failures += 1
+                self.registry.change_state(
+                    instance_hash,
+                    constants.SESSION_SAVED,
+                    (constants.SESSION_RESTORING,),
+                )
+        if container_id is None:
+            raise SnapshotError(instance_hash)
+        self.registry.set_container(instance_hash, container_id, record.instance_os)
+        self.registry.set_cwd(instance_hash, record.cwd)
+        backend.remove_image(image)
+        remove_snapshot(instance_hash, self.directory)
+        self.restored += 1
+        metrics.session_restore_latency.observe(time.perf_counter() - start)
+        return True
+
+    def expire(self, instance_hash: str, unused_before: float) -> bool:
+        """
+        Delete the snapshot of a saved session unused since unused before,
+        and forget the session. Returns True if it was deleted.
+
+        Author: Namah Shrestha
+        """
+        if not self.registry.change_state(
+            instance_hash,
+            constants.SESSION_DELETING,
+            (constants.SESSION_SAVED,),
+            unused_before,
+        ):
+            return False
+        remove_snapshot(instance_hash, self.directory)
+        self.registry.remove(instance_hash)
+        self.expired += 1
+        return True
+
+    def stats(self) -> dict:
+        """
+        Snapshot metrics.
+
+        Author: Namah Shrestha
+        """
+        return {
+            "saved": self.saved,
+            "restored": self.restored,
+            "snapshots_expired": self.expired,
+            "snapshot_failures": self.failures,
+        }
@@ -0,0 +1,167 @@
+"""
+This is the persistent shell of a session.
+
+Starting a docker exec for every command costs a process setup in the
+container and a new shell, and the shell state is lost in between.
+A session keeps one interactive shell running in its container instead
+and writes every command into it.
+
+Every command is followed by a printf of a unique marker, the exit
+status and the working directory. The output up to the marker is the
+output of the command. The working directory keeps the directory state
+of the session up to date without asking the container again.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import shlex
+import typing
+import uuid
+
+# modules
+import src.constants as constants
+import src.docker_backend as db
+
+
+class ShellClosedError(Exception):
+    """
+    Raised when the shell is not running anymore.
+
+    Author: Namah Shrestha
+    """
+
+
+class PersistentShell:
+    """
+    A shell running in the container for the whole session.
+
+    Commands run one after another, so the shell is never shared
+    between threads. The shell state, like the working directory,
+    exported variables and aliases, stays between commands.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        channel: db.ExecChannel,
+        workdir: typing.Optional[str] = None,
+        exec_id: typing.Optional[str] = None,
+    ) -> None:
+        """
+        Wrap the channel of an interactive shell exec and change to the
+        working directory, if given.
+        The exec id is the tag the shell was started with. Killing it
+        kills the shell with the command running in it.
+        Raise ShellClosedError if the shell does not answer.
+
+        Author: Namah Shrestha
+        """
+        self.channel: db.ExecChannel = channel
+        self.exec_id: typing.Optional[str] = exec_id
+        self.closed: bool = False
+        self.cwd: typing.Optional[str] = None
+        stream: ShellStream = self.stream(
+            f"cd {shlex.quote(workdir)}" if workdir else "true"
+        )
+        try:
+            for _ in stream:
+                pass
+        finally:
+            stream.close()
+        if not stream.done or self.closed:
+            self.close()
+            raise ShellClosedError("Shell did not start")
+
+    def stream(self, command: str) -> "ShellStream":
+        """
+        Write the command into the shell and return its output stream.
+        Raise ShellClosedError if the shell is not running.
+
+        Author: Namah Shrestha
+        """
+        if self.closed:
+            raise ShellClosedError("Shell is closed")
+        return ShellStream(self, command)
+
+    def close(self) -> None:
+        """
+        End the shell.
+
+        Author: Namah Shrestha
+        """
+        self.closed = True
+        self.channel.close()
+
+
+class ShellStream(db.ExecStream):
+    """
+    Output of one command of the persistent shell.
+
+    The command is evaluated with stdin from /dev/null, so it cannot
+    read the commands that follow it. Exiting the shell ends the stream
+    with the exit code of the shell.
+
+    A stream closed before its marker leaves the shell out of sync,
+    so the shell is closed too.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, shell: PersistentShell, command: str) -> None:
+        super().__init__()
+        self.shell: PersistentShell = shell
+        self.marker: bytes = constants.SHELL_MARKER.format(uuid.uuid4().hex).encode()
+        self.done: bool = False
+        try:
+            shell.channel.send(
+                f"eval {shlex.quote(command)} < /dev/null; "
+                f"printf '%s %d %s\\n' {self.marker.decode()} $? \"$PWD\"\n".encode()
+            )
+        except OSError:
+            shell.close()
+            raise ShellClosedError("Shell is closed")
+
+    def read(self) -> typing.Iterator[bytes]:
+        """
+        Yield the output until the marker line.
+        A tail that might be the start of the marker is held back.
+
+        Author: Namah Shrestha
+        """
+        buffer: bytes = b""
+        keep: int = len(self.marker) - 1
+        while True:
+            index: int = buffer.find(self.marker)
+            if index >= 0:
+                line, newline, _ = buffer[index + len(self.marker) :].partition(b"\n")
+                if newline:
+                    if index:
+                        yield buffer[:index]
+                    status, _, cwd = line.lstrip(b" ").partition(b" ")
+                    self.exit_code = int(status)
+                    self.cwd = self.shell.cwd = cwd.decode(errors="replace")
+                    self.done = True
+                    return
+            elif len(buffer) > keep:
+                yield buffer[: len(buffer) - keep]
+                buffer = buffer[len(buffer) - keep :]
+            data: bytes = self.shell.channel.recv()
+            if not data:
+                if buffer:
+                    yield buffer
+                self.exit_code = self.shell.channel.exit_code
+                self.done = True
+                self.shell.close()
+                return
+            buffer += data
+
+    def close(self) -> None:
+        """
+        Close the shell if the command did not finish.
+
+        Author: Namah Shrestha
+        """
+        if not self.done:
+            self.shell.close()
@@ -0,0 +1,113 @@
+"""
+This is the single flight of the lifecycle commands.
+
+A client that retries, or a user that clicks twice, sends a second
+CREATE while the first one is still building. Both would build the
+image and the second container run fails on the taken name.
+Lifecycle commands of one instance hash run one at a time. A command
+arriving while the same command of the hash is in flight waits for it
+and shares its result. Another command waits for the flight to land
+and then starts its own.
+
+The flights only span one process. Across worker processes a CREATE
+claims the session in the shared session registry first, see
+InstanceManager.claim_session, and the flights keep the common case of
+one process off the database.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import asyncio
+import typing
+
+
+class Flight:
+    """
+    One lifecycle command of an instance hash in flight.
+
+    Author: Namah Shrestha
+    """
+
+    __slots__ = ("command", "future")
+
+    def __init__(self, command: str, future: asyncio.Future) -> None:
+        self.command: str = command
+        self.future: asyncio.Future = future
+
+
+class SingleFlight:
+    """
+    The flights in progress per instance hash.
+
+    The flights are only used from the event loop, so they need no lock.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self) -> None:
+        """
+        Create an empty registry of flights.
+
+        Author: Namah Shrestha
+        """
+        self.flights: dict = {}
+        self.started: int = 0
+        self.shared: int = 0
+
+    async def run(
+        self,
+        instance_hash: str,
+        command: str,
+        func: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> typing.Any:
+        """
+        Await func for the command of the instance hash, or the result of
+        the same command in flight. Its error is raised to every waiter.
+        A waiter that is cancelled does not cancel the flight.
+
+        Author: Namah Shrestha
+        """
+        while True:
+            flight: typing.Optional[Flight] = self.flights.get(instance_hash)
+            if flight is None:
+                break
+            if flight.command == command:
+                self.shared += 1
+                return await asyncio.shield(flight.future)
+            await asyncio.wait({flight.future})
+        future: asyncio.Future = asyncio.ensure_future(func())
+        self.flights[instance_hash] = Flight(command, future)
+        self.started += 1
+        future.add_done_callback(
+            lambda done: self.land(instance_hash, done),
+        )
+        return await asyncio.shield(future)
+
+    def land(self, instance_hash: str, future: asyncio.Future) -> None:
+        """
+        Forget the flight once it is done and retrieve its error, which
+        its waiters have seen already.
+
+        Author: Namah Shrestha
+        """
+        flight: typing.Optional[Flight] = self.flights.get(instance_hash)
+        if flight is not None and flight.future is future:
+            del self.flights[instance_hash]
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> dict:
+        """
+        Single flight metrics.
+
+        Author: Namah Shrestha
+        """
+        return {
+            "in_flight": len(self.flights),
+            "started": self.started,
+            "shared": self.shared,
+        }
+
+
+lifecycle_flights: SingleFlight = SingleFlight()
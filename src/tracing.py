@@ -0,0 +1,414 @@
+"""
+This is the request tracing of the application.
+
+The metrics tell how long requests take on average, a trace tells where
+the time of one request went: message validation, admission, the
+container lookup, the docker operations and the parsing of the output.
+
+A sampled share of the requests gets a trace id and a tree of timed
+spans. The current span follows the request through the event loop and
+into the executor threads as a context variable, so spans nest without
+being passed around. Requests that are not sampled cost one random
+number and a context variable lookup per span.
+
+Finished spans are queued and written in batches by a background thread,
+one json object per line, to a file that is rotated at its max size.
+When the queue is full spans are dropped instead of slowing requests down.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import typing
+
+# modules
+import src.constants as constants
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+current_span: contextvars.ContextVar = contextvars.ContextVar(
+    "zod_current_span", default=None
+)
+
+
+class Span:
+    """
+    One timed step of a traced request.
+
+    Author: Namah Shrestha
+    """
+
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "name",
+        "attributes",
+        "timestamp",
+        "start",
+        "duration",
+    )
+
+    def __init__(
+        self,
+        trace_id: str,
+        parent_id: typing.Optional[str],
+        name: str,
+        attributes: dict,
+    ) -> None:
+        self.trace_id: str = trace_id
+        self.span_id: str = f"{random.getrandbits(64):016x}"
+        self.parent_id: typing.Optional[str] = parent_id
+        self.name: str = name
+        self.attributes: dict = attributes
+        self.timestamp: float = time.time()
+        self.start: float = time.perf_counter()
+        self.duration: typing.Optional[float] = None
+
+    def set(self, **attributes: typing.Any) -> None:
+        """
+        Add attributes to the span.
+
+        Author: Namah Shrestha
+        """
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        """
+        Record the duration of the span.
+
+        Author: Namah Shrestha
+        """
+        self.duration = time.perf_counter() - self.start
+
+    def to_dict(self) -> dict:
+        """
+        The span as written to the trace file.
+
+        Author: Namah Shrestha
+        """
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "duration": self.duration,
+            "attributes": self.attributes,
+        }
+
+
+class TraceExporter:
+    """
+    Writes finished spans to a rotating JSONL file in a background thread.
+
+    Spans are only queued while the exporter runs. The thread writes
+    a batch once it has constants.TRACE_BATCH_SIZE spans, or every
+    constants.TRACE_FLUSH_INTERVAL with what it has.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        path: str = constants.TRACE_FILE,
+        max_bytes: int = constants.TRACE_MAX_BYTES,
+        backups: int = constants.TRACE_BACKUPS,
+        queue_size: int = constants.TRACE_QUEUE_SIZE,
+    ) -> None:
+        """
+        Create an exporter to the file of the path. It writes nothing
+        until it is started.
+
+        Author: Namah Shrestha
+        """
+        self.path: str = path
+        self.max_bytes: int = max_bytes
+        self.backups: int = backups
+        self.spans: queue.Queue = queue.Queue(queue_size)
+        self.file: typing.Optional[typing.BinaryIO] = None
+        self.thread: typing.Optional[threading.Thread] = None
+        self.exported: int = 0
+        self.dropped: int = 0
+        self.rotations: int = 0
+
+    @property
+    def running(self) -> bool:
+        """
+        Check if the exporter takes spans.
+
+        Author: Namah Shrestha
+        """
+        return self.thread is not None
+
+    def export(self, span: Span) -> None:
+        """
+        Queue the finished span, or drop it if the queue is full.
+
+        Author: Namah Shrestha
+        """
+        if not self.running:
+            return
+        try:
+            self.spans.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def next_batch(self) -> typing.Optional[list]:
+        """
+        Wait for the next batch of spans.
+        Returns None once the exporter is stopped and the queue drained.
+
+        Author: Namah Shrestha
+        """
+        batch: list = []
+        deadline: float = time.monotonic() + constants.TRACE_FLUSH_INTERVAL
+        while len(batch) < constants.TRACE_BATCH_SIZE:
+            try:
+                span: typing.Optional[Span] = self.spans.get(
+                    timeout=max(deadline - time.monotonic(), 0)
+                )
+            except queue.Empty:
+                break
+            if span is None:
+                self.write(batch)
+                return None
+            batch.append(span)
+        return batch
+
+    def write(self, batch: list) -> None:
+        """
+        Append the spans to the file, rotating it first if it would grow
+        past the max size.
+
+        Author: Namah Shrestha
+        """
+        if not batch:
+            return
+        data: bytes = "".join(
+            json.dumps(span.to_dict(), default=str) + "\n" for span in batch
+        ).encode()
+        if self.file is None:
+            self.file = open(self.path, "ab")
+        if self.file.tell() and self.file.tell() + len(data) > self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+        self.file.flush()
+        self.exported += len(batch)
+
+    def rotate(self) -> None:
+        """
+        Move the file to path.1, path.1 to path.2 and so on, keeping
+        the backups, and start a new file.
+
+        Author: Namah Shrestha
+        """
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "ab")
+        self.rotations += 1
+
+    def run(self) -> None:
+        """
+        Write batches until the exporter is stopped.
+
+        Author: Namah Shrestha
+        """
+        while True:
+            batch: typing.Optional[list] = self.next_batch()
+            if batch is None:
+                return
+            try:
+                self.write(batch)
+            except OSError:
+                logger.exception("Writing %d spans failed", len(batch))
+                self.dropped += len(batch)
+
+    def start(self, path: typing.Optional[str] = None) -> None:
+        """
+        Start writing spans, to the path if given.
+
+        Author: Namah Shrestha
+        """
+        if path is not None:
+            self.path = path
+        self.thread = threading.Thread(
+            target=self.run, name="zod_trace_exporter", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self, timeout: float = constants.TRACE_FLUSH_INTERVAL * 5) -> None:
+        """
+        Write the queued spans and stop.
+
+        Author: Namah Shrestha
+        """
+        if self.thread is None:
+            return
+        thread: threading.Thread = self.thread
+        self.thread = None
+        self.spans.put(None)
+        thread.join(timeout)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stats(self) -> dict:
+        """
+        Exporter metrics.
+
+        Author: Namah Shrestha
+        """
+        return {
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+            "queued": self.spans.qsize(),
+        }
+
+
+class Tracer:
+    """
+    Starts traces for a sampled share of the requests and spans in them.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        exporter: TraceExporter,
+        sample_rate: float = constants.TRACE_SAMPLE_RATE,
+    ) -> None:
+        """
+        Create a tracer sending its spans to the exporter.
+
+        Author: Namah Shrestha
+        """
+        self.exporter: TraceExporter = exporter
+        self.sample_rate: float = sample_rate
+        self.traces: int = 0
+
+    def sampled(self) -> bool:
+        """
+        Decide if a new request is traced.
+
+        Author: Namah Shrestha
+        """
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextlib.contextmanager
+    def trace(
+        self, name: str, **attributes: typing.Any
+    ) -> typing.Iterator[typing.Optional[Span]]:
+        """
+        Start the root span of a new trace if the request is sampled.
+        Yields the span, None if it is not sampled.
+
+        Author: Namah Shrestha
+        """
+        if not self.sampled():
+            yield None
+            return
+        self.traces += 1
+        with self.record(
+            Span(f"{random.getrandbits(128):032x}", None, name, attributes)
+        ) as span:
+            yield span
+
+    @contextlib.contextmanager
+    def span(
+        self, name: str, **attributes: typing.Any
+    ) -> typing.Iterator[typing.Optional[Span]]:
+        """
+        Start a span in the current trace. Yields the span,
+        None outside of a traced request.
+
+        Author: Namah Shrestha
+        """
+        parent: typing.Optional[Span] = current_span.get()
+        if parent is None:
+            yield None
+            return
+        with self.record(
+            Span(parent.trace_id, parent.span_id, name, attributes)
+        ) as span:
+            yield span
+
+    @contextlib.contextmanager
+    def record(self, span: Span) -> typing.Iterator[Span]:
+        """
+        Make the span current while the block runs, then export it
+        with its duration and the name of its error, if any.
+
+        Author: Namah Shrestha
+        """
+        token: contextvars.Token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.attributes["error"] = type(error).__name__
+            raise
+        finally:
+            span.finish()
+            current_span.reset(token)
+            self.exporter.export(span)
+
+    def stats(self) -> dict:
+        """
+        Tracing metrics.
+
+        Author: Namah Shrestha
+        """
+        return {"traces": self.traces, **self.exporter.stats()}
+
+
+"""
+The tracer of the server.
+
+Author: Namah Shrestha
+"""
+exporter: TraceExporter = TraceExporter()
+tracer: Tracer = Tracer(exporter)
+
+
+def span(name: str, **attributes: typing.Any) -> typing.ContextManager:
+    """
+    Start a span of the tracer of the server in the current trace.
+
+    Author: Namah Shrestha
+    """
+    return tracer.span(name, **attributes)
+
+
+def traced(name: str) -> typing.Callable:
+    """
+    Decorate a function to run in a span of the current trace.
+
+    Author: Namah Shrestha
+    """
+
+    def decorator(func: typing.Callable) -> typing.Callable:
+        @functools.wraps(func)
+        def wrapper(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+            with tracer.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
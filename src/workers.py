@@ -0,0 +1,255 @@
+"""
+This is the multi process mode of the server.
+
+One event loop does all the json handling, output splitting and framing
+on one core. With more than one worker the supervisor starts that many
+server processes on the same port and restarts the ones that die.
+
+The port is shared with SO_REUSEPORT where the kernel has it: every
+worker binds its own socket and the kernel balances the connections.
+Otherwise the supervisor binds one listening socket before forking and
+every worker accepts on it.
+
+Author: Namah Shrestha
+"""
+
+# builtins
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import socket
+import time
+import typing
+
+# modules
+import src.constants as constants
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+STOP_SIGNALS: set = {signal.SIGTERM, signal.SIGINT}
+
+
+def reuse_port_supported() -> bool:
+    """
+    Check if the kernel lets several sockets bind the same port.
+
+    Author: Namah Shrestha
+    """
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def listening_socket(host: str, port: int) -> socket.socket:
+    """
+    Bind the listening socket shared by the forked workers.
+
+    Author: Namah Shrestha
+    """
+    sock: socket.socket = socket.create_server(
+        (host, port), backlog=constants.LISTEN_BACKLOG
+    )
+    sock.setblocking(False)
+    return sock
+
+
+def worker_share(total: int, workers: int, index: int) -> int:
+    """
+    Share of a limit of the whole server for the worker of the index.
+    The shares add up to the limit, the first workers get the remainder.
+    A worker gets at least 1, so with more workers than the limit
+    it is exceeded by as many workers as there are more.
+
+    Author: Namah Shrestha
+    """
+    return max(1, total // workers + (index < total % workers))
+
+
+class WorkerSupervisor:
+    """
+    Starts the worker processes and keeps them running.
+
+    A worker is started with its index and the shared listening socket,
+    which is None when the workers bind with SO_REUSEPORT themselves.
+    A worker that dies is restarted with the same index. Workers that
+    keep dying right after their start are restarted with a growing delay.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        target: typing.Callable[[int, typing.Optional[socket.socket]], None],
+        workers: int = constants.WORKERS,
+        host: str = constants.SERVER_HOST,
+        port: int = constants.SERVER_PORT,
+        reuse_port: typing.Optional[bool] = None,
+    ) -> None:
+        """
+        Create a supervisor of the worker target.
+
+        Author: Namah Shrestha
+        """
+        self.target: typing.Callable = target
+        self.workers: int = workers
+        self.host: str = host
+        self.port: int = port
+        self.reuse_port: bool = (
+            constants.REUSE_PORT and reuse_port_supported()
+            if reuse_port is None
+            else reuse_port
+        )
+        self.context: multiprocessing.context.BaseContext = multiprocessing.get_context(
+            "fork"
+        )
+        self.sock: typing.Optional[socket.socket] = None
+        self.processes: dict = {}
+        self.started_at: dict = {}
+        self.restart_delays: dict = {}
+        self.restarts: int = 0
+        self.stopping: bool = False
+
+    def start_worker(self, index: int) -> None:
+        """
+        Fork the worker with the index.
+        The stop signals are blocked while forking, so that the worker
+        cannot be stopped before it installed its own handlers.
+
+        Author: Namah Shrestha
+        """
+        process: multiprocessing.Process = self.context.Process(
+            target=self.run_worker,
+            args=(index, self.sock),
+            name=f"zod_worker_{index}",
+            daemon=False,
+        )
+        previous_mask: set = signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        try:
+            process.start()
+        finally:
+            signal.pthread_sigmask(signal.SIG_SETMASK, previous_mask)
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        logger.info("Worker %d started, pid %d", index, process.pid)
+
+    def run_worker(self, index: int, sock: typing.Optional[socket.socket]) -> None:
+        """
+        Entry point of a worker process. The signal handlers of the
+        supervisor are inherited by the fork, so they are replaced first.
+        SIGTERM interrupts the worker like SIGINT, so that it shuts down
+        its event loop cleanly. A stop signal that arrived while forking
+        ends the worker before it starts.
+
+        Author: Namah Shrestha
+        """
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        try:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        except KeyboardInterrupt:
+            return
+        self.target(index, sock)
+
+    def start(self) -> None:
+        """
+        Bind the shared socket, unless SO_REUSEPORT is used, and start
+        every worker.
+
+        Author: Namah Shrestha
+        """
+        if not self.reuse_port:
+            self.sock = listening_socket(self.host, self.port)
+        for index in range(self.workers):
+            self.start_worker(index)
+
+    def restart_delay(self, index: int) -> float:
+        """
+        Delay before restarting the worker. It doubles while the worker
+        dies within the restart window, and resets once it ran longer.
+
+        Author: Namah Shrestha
+        """
+        uptime: float = time.monotonic() - self.started_at.get(index, 0)
+        if uptime > constants.WORKER_RESTART_WINDOW:
+            self.restart_delays[index] = 0.0
+            return 0.0
+        delay: float = min(
+            max(
+                self.restart_delays.get(index, 0.0) * 2, constants.WORKER_RESTART_DELAY
+            ),
+            constants.WORKER_RESTART_MAX_DELAY,
+        )
+        self.restart_delays[index] = delay
+        return delay
+
+    def supervise_once(self, timeout: typing.Optional[float] = None) -> list:
+        """
+        Wait for workers to exit and restart them.
+        Returns the indexes of the restarted workers.
+
+        Author: Namah Shrestha
+        """
+        sentinels: dict = {
+            process.sentinel: index for index, process in self.processes.items()
+        }
+        ready: list = multiprocessing.connection.wait(list(sentinels), timeout)
+        restarted: list = []
+        for sentinel in ready:
+            index: int = sentinels[sentinel]
+            process: multiprocessing.Process = self.processes[index]
+            process.join()
+            if self.stopping:
+                continue
+            delay: float = self.restart_delay(index)
+            logger.warning(
+                "Worker %d exited with %s, restarting in %.1fs",
+                index,
+                process.exitcode,
+                delay,
+            )
+            if delay:
+                time.sleep(delay)
+            if self.stopping:
+                continue
+            self.restarts += 1
+            self.start_worker(index)
+            restarted.append(index)
+        return restarted
+
+    def stop(self, timeout: float = constants.WORKER_STOP_TIMEOUT) -> None:
+        """
+        Terminate every worker, killing the ones that do not exit in time.
+
+        Author: Namah Shrestha
+        """
+        self.stopping = True
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline: float = time.monotonic() + timeout
+        for process in self.processes.values():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def run(self) -> None:
+        """
+        Start the workers and supervise them until SIGTERM or SIGINT.
+
+        Author: Namah Shrestha
+        """
+
+        def request_stop(signum: int, frame: typing.Any) -> None:
+            self.stopping = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        self.start()
+        try:
+            while not self.stopping:
+                self.supervise_once(timeout=1.0)
+        finally:
+            self.stop()
@@ -0,0 +1,330 @@
+"""
+A fake docker daemon listening on a unix socket.
+
+It implements the part of the docker engine api used by the application
+and keeps its containers in memory. Unit tests of the api client and
+backend run against it instead of a real daemon.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import http.server
+import json
+import os
+import re
+import shlex
+import socketserver
+import struct
+import tempfile
+import threading
+import typing
+import urllib.parse
+import uuid
+
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles the api requests of one connection.
+    HTTP/1.1 keeps the connection alive between requests.
+
+    Author: Namah Shrestha
+    """
+
+    protocol_version: str = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        pass
+
+    def send_json(self, status: int, body: typing.Any = None) -> None:
+        data: bytes = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self) -> typing.Any:
+        length: int = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def route(self, method: str) -> None:
+        url: urllib.parse.ParseResult = urllib.parse.urlparse(self.path)
+        query: dict = {
+            key: values[0] for key, values in urllib.parse.parse_qs(url.query).items()
+        }
+        parts: list = url.path.strip("/").split("/")[1:]
+        body: typing.Any = self.read_body()
+        self.server.requests.append((method, "/" + "/".join(parts), query))
+        status, response = self.server.dispatch(method, parts, query, body)
+        if status == 101:
+            self.hijack(response)
+            return
+        if isinstance(response, bytes):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+            return
+        self.send_json(status, response)
+
+    def hijack(self, exec_config: dict) -> None:
+        """
+        Serve an interactive shell exec on the hijacked connection.
+
+        Author: Namah Shrestha
+        """
+        self.send_response(101)
+        self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Upgrade", "tcp")
+        self.end_headers()
+        self.close_connection = True
+        for line in self.rfile:
+            exit_code, stdout, stderr = self.server.shell_reply(line)
+            if stdout is None:
+                exec_config["ExitCode"] = exit_code
+                return
+            self.wfile.write(frame(1, stdout) + frame(2, stderr))
+
+    def do_GET(self) -> None:
+        self.route("GET")
+
+    def do_POST(self) -> None:
+        self.route("POST")
+
+    def do_DELETE(self) -> None:
+        self.route("DELETE")
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    In memory docker daemon.
+
+    Exec runs nothing. The output of a command is looked up in
+    exec_outputs, which maps a command to (exit code, stdout, stderr).
+
+    Author: Namah Shrestha
+    """
+
+    daemon_threads: bool = True
+
+    def __init__(self) -> None:
+        self.directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.socket_path: str = os.path.join(self.directory.name, "docker.sock")
+        super().__init__(self.socket_path, FakeDockerHandler)
+        self.lock: threading.Lock = threading.Lock()
+        self.connections: int = 0
+        self.requests: list = []
+        self.images: set = set()
+        self.containers: dict = {}
+        self.execs: dict = {}
+        self.exec_outputs: dict = {}
+        self.events: list = []
+        self.thread: threading.Thread = threading.Thread(
+            target=self.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+        )
+
+    def start(self) -> "FakeDockerServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        self.directory.cleanup()
+
+    def find(self, reference: str) -> typing.Optional[dict]:
+        for container in self.containers.values():
+            if reference in (container["Id"], container["Name"]):
+                return container
+        return None
+
+    def dispatch(
+        self, method: str, parts: list, query: dict, body: typing.Any
+    ) -> typing.Tuple[int, typing.Any]:
+        with self.lock:
+            return self.dispatch_locked(method, parts, query, body)
+
+    def dispatch_locked(
+        self, method: str, parts: list, query: dict, body: typing.Any
+    ) -> typing.Tuple[int, typing.Any]:
+        not_found: tuple = (404, {"message": "No such object"})
+        if parts[0] == "images" and method == "GET":
+            return (200, {"Id": parts[1]}) if parts[1] in self.images else not_found
+        if parts == ["containers", "create"]:
+            if body["Image"] not in self.images:
+                return 404, {"message": f"No such image: {body['Image']}"}
+            container_id: str = uuid.uuid4().hex
+            self.containers[container_id] = {
+                "Id": container_id,
+                "Name": query.get("name", container_id[:12]),
+                "Image": body["Image"],
+                "Labels": body.get("Labels") or {},
+                "State": "created",
+            }
+            return 201, {"Id": container_id}
+        if parts == ["containers", "json"]:
+            filters: dict = json.loads(query.get("filters", "{}"))
+            names: list = filters.get("name", [])
+            labels: list = filters.get("label", [])
+            return 200, [
+                {
+                    "Id": container["Id"],
+                    "Names": ["/" + container["Name"]],
+                    "State": container["State"],
+                    "Labels": container["Labels"],
+                }
+                for container in self.containers.values()
+                if (query.get("all") == "true" or container["State"] == "running")
+                and all(name in container["Name"] for name in names)
+                and all(label in container["Labels"] for label in labels)
+            ]
+        if parts[0] == "containers":
+            container: typing.Optional[dict] = self.find(parts[1])
+            if container is None:
+                return not_found
+            action: str = parts[2] if len(parts) > 2 else ""
+            if method == "DELETE":
+                del self.containers[container["Id"]]
+                return 204, None
+            if action == "start":
+                container["State"] = "running"
+                return 204, None
+            if action in ("pause", "unpause"):
+                if container["State"] != ("running" if action == "pause" else "paused"):
+                    return 409, {"message": f"Container is not {action}able"}
+                container["State"] = "paused" if action == "pause" else "running"
+                return 204, None
+            if action == "rename":
+                container["Name"] = query["name"]
+                return 204, None
+            if action == "json":
+                return 200, {
+                    "Id": container["Id"],
+                    "Name": "/" + container["Name"],
+                    "State": {"Status": container["State"]},
+                }
+            if action == "exec":
+                exec_id: str = uuid.uuid4().hex
+                self.execs[exec_id] = {"Container": container["Id"], **body}
+                return 201, {"Id": exec_id}
+        if parts == ["events"]:
+            return 200, b"".join(
+                json.dumps(event).encode() + b"\n" for event in self.events
+            )
+        if parts[0] == "exec":
+            exec_config: typing.Optional[dict] = self.execs.get(parts[1])
+            if exec_config is None:
+                return not_found
+            exit_code, stdout, stderr = self.exec_outputs.get(
+                exec_config["Cmd"][-1], (0, b"", b"")
+            )
+            if parts[2] == "start" and exec_config.get("AttachStdin"):
+                return 101, exec_config
+            if parts[2] == "start":
+                exec_config["ExitCode"] = exit_code
+                return 200, frame(1, stdout) + frame(2, stderr)
+            return 200, {"ExitCode": exec_config.get("ExitCode")}
+        return 404, {"message": "page not found"}
+
+    def shell_reply(
+        self, line: bytes
+    ) -> typing.Tuple[int, typing.Optional[bytes], bytes]:
+        with self.lock:
+            return shell_reply(self.exec_outputs, line)
+
+
+def frame(stream_type: int, data: bytes) -> bytes:
+    """
+    One frame of the multiplexed exec stream.
+
+    Author: Namah Shrestha
+    """
+    if not data:
+        return b""
+    return struct.pack(">BxxxL", stream_type, len(data)) + data
+
+
+"""
+A command line written into the persistent shell.
+
+Author: Namah Shrestha
+"""
+SHELL_LINE_PATTERN: re.Pattern = re.compile(
+    r"^eval (.*) < /dev/null; printf '%s %d %s\\n' (\S+) \$\? \"\$PWD\"$"
+)
+
+
+def shell_reply(
+    exec_outputs: dict, line: bytes
+) -> typing.Tuple[int, typing.Optional[bytes], bytes]:
+    """
+    What the shell answers to a command line: the exit code, stdout with
+    the marker line and stderr. Stdout is None if the command exits the
+    shell.
+
+    Author: Namah Shrestha
+    """
+    match: typing.Optional[re.Match] = SHELL_LINE_PATTERN.match(line.decode().strip())
+    command: str = shlex.split(match.group(1))[0]
+    if command.split(" ")[0] == "exit":
+        return int(command.split(" ")[-1]) if " " in command else 0, None, b""
+    exit_code, stdout, stderr = exec_outputs.get(command, (0, b"", b""))
+    return exit_code, stdout + f"{match.group(2)} {exit_code} /\n".encode(), stderr
+
+
+class FakeShellChannel:
+    """
+    Stands in for the channel of a persistent shell.
+    Output of a command is looked up in exec_outputs like in the daemon.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self, exec_outputs: typing.Optional[dict] = None) -> None:
+        self.exec_outputs: dict = exec_outputs or {}
+        self.exit_code: typing.Optional[int] = None
+        self.commands: list = []
+        self.pending: list = []
+        self.closed: bool = False
+
+    def send(self, data: bytes) -> None:
+        if self.closed or self.exit_code is not None:
+            raise BrokenPipeError()
+        for line in data.splitlines():
+            exit_code, stdout, _ = shell_reply(self.exec_outputs, line)
+            self.commands.append(shlex.split(line.decode()[5:])[0])
+            if stdout is None:
+                self.exit_code = exit_code
+                return
+            self.pending.append(stdout)
+
+    def recv(self) -> bytes:
+        if self.pending:
+            return self.pending.pop(0)
+        return b""
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class ClosedSocket:
+    """
+    Stands in for the socket of a connection the daemon already closed.
+
+    Author: Namah Shrestha
+    """
+
+    def sendall(self, data: bytes) -> None:
+        raise BrokenPipeError()
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,152 @@
+"""
+Unit tests for the admission control.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import asyncio
+import unittest
+
+# modules
+import src.admission as admission
+import src.constants as constants
+
+
+class TestLimiter(unittest.TestCase):
+    """
+    Test Limiter class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def test_limit_and_fifo_handoff(self) -> None:
+        """
+        1. Requests above the limit wait.
+        2. Released slots go to the waiters in order.
+
+        Author: Namah Shrestha
+        """
+        limiter: admission.Limiter = admission.Limiter(constants.CREATE, 1, 2, 5)
+        order: list = []
+
+        async def request(name: str) -> None:
+            await limiter.acquire()
+            order.append(name)
+            await asyncio.sleep(0)
+            limiter.release()
+
+        async def run() -> None:
+            await limiter.acquire()
+            tasks: list = [asyncio.ensure_future(request(n)) for n in "ab"]
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.stats()["queued"], 2)
+            self.assertEqual(order, [])
+            limiter.release()
+            await asyncio.gather(*tasks)
+
+        asyncio.run(run())
+        self.assertEqual(order, ["a", "b"])
+        stats: dict = limiter.stats()
+        self.assertEqual((stats["active"], stats["queued"]), (0, 0))
+        self.assertEqual(stats["admitted"], 3)
+
+    def test_queue_full(self) -> None:
+        """
+        A request is rejected busy right away when the queue is full.
+
+        Author: Namah Shrestha
+        """
+        limiter: admission.Limiter = admission.Limiter(constants.CREATE, 1, 1, 5)
+
+        async def run() -> None:
+            await limiter.acquire()
+            waiter: asyncio.Task = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            with self.assertRaises(admission.BusyError) as context:
+                await limiter.acquire()
+            self.assertEqual(context.exception.reason, "queue full")
+            self.assertEqual(str(context.exception), admission.BUSY_ERROR)
+            limiter.release()
+            await waiter
+            limiter.release()
+
+        asyncio.run(run())
+        self.assertEqual(limiter.stats()["rejected"], 1)
+        self.assertEqual(limiter.active, 0)
+
+    def test_queue_timeout(self) -> None:
+        """
+        A request waiting longer than the timeout is rejected busy
+        and leaves the queue.
+
+        Author: Namah Shrestha
+        """
+        limiter: admission.Limiter = admission.Limiter(constants.DELETE, 1, 4, 0.01)
+
+        async def run() -> None:
+            await limiter.acquire()
+            with self.assertRaises(admission.BusyError) as context:
+                await limiter.acquire()
+            self.assertEqual(context.exception.reason, "queue timeout")
+            limiter.release()
+
+        asyncio.run(run())
+        stats: dict = limiter.stats()
+        self.assertEqual(stats["timed_out"], 1)
+        self.assertEqual((stats["active"], stats["queued"]), (0, 0))
+
+    def test_cancelled_waiter(self) -> None:
+        """
+        A cancelled waiter leaves the queue and the slot goes to the next one.
+
+        Author: Namah Shrestha
+        """
+        limiter: admission.Limiter = admission.Limiter(constants.EXECUTE, 1, 4, 5)
+
+        async def run() -> None:
+            await limiter.acquire()
+            cancelled: asyncio.Task = asyncio.ensure_future(limiter.acquire())
+            waiting: asyncio.Task = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            await asyncio.sleep(0)
+            limiter.release()
+            await waiting
+            limiter.release()
+
+        asyncio.run(run())
+        self.assertEqual((limiter.active, len(limiter.waiters)), (0, 0))
+
+
+class TestAdmissionController(unittest.TestCase):
+    """
+    Test AdmissionController class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def test_separate_limits(self) -> None:
+        """
+        1. Every command has its own limit.
+        2. Commands without a limiter are always admitted.
+
+        Author: Namah Shrestha
+        """
+        controller: admission.AdmissionController = admission.AdmissionController(
+            {constants.CREATE: 1, constants.EXECUTE: 1}, queue_size=0, timeout=1
+        )
+
+        async def run() -> None:
+            async with controller.admit(constants.CREATE):
+                async with controller.admit(constants.EXECUTE):
+                    async with controller.admit(constants.DELETE):
+                        pass
+                with self.assertRaises(admission.BusyError):
+                    async with controller.admit(constants.CREATE):
+                        pass
+
+        asyncio.run(run())
+        stats: dict = controller.stats()
+        self.assertEqual(stats[constants.CREATE]["rejected"], 1)
+        self.assertEqual(stats[constants.CREATE]["active"], 0)
+        self.assertEqual(stats[constants.EXECUTE]["admitted"], 1)
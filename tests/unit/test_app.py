@@ -4,6 +4,9 @@ Unit test for the main web socket application.
 Author: Namah Shrestha
 """
 # builtins
+import threading
+import time
+import typing
 import unittest
 import unittest.mock as mock
 import json
@@ -12,6 +15,14 @@ import json
 import app
 import asyncio
 import src.constants as constants
+import src.image_cache as ic
+import src.container_index as ci
+import src.docker_backend as db
+import src.session_snapshot as sn
+import tests.unit.fake_docker as fake_docker
+
+# third party
+import websockets.exceptions
 
 
 class TestApp(unittest.TestCase):
@@ -39,59 +50,113 @@ class TestApp(unittest.TestCase):
             constants.EXEC_COMMAND: "ls",
         }
 
+    def set_messages(self, *messages: str) -> None:
+        """
+        The socket handler keeps receiving until the connection is closed.
+        So we receive the messages one after another and then close.
+
+        Author: Namah Shrestha
+        """
+        self.mock_handler.recv.side_effect = list(messages) + [
+            websockets.exceptions.ConnectionClosedOK(None, None)
+        ]
+
     def test_socket_handler_with_nondecodable_string(self) -> None:
         """
-        Invalid message format: non decodable string should raise TypeError
+        Invalid message format: non decodable string should send the TypeError
+        message and keep the session open.
 
         Author: Namah Shrestha
         """
-        self.mock_handler.recv.return_value = "test_message"
-        async_handler: mock.MagicMock = app.socket_handler(self.mock_handler)
-        try:
-            asyncio.run(async_handler)
-        except TypeError as e:
-            self.assertEqual(isinstance(e, TypeError), True)
+        self.set_messages("test_message")
+        asyncio.run(app.socket_handler(self.mock_handler))
+        self.mock_handler.send.assert_called_once()
 
     def test_socket_handler_with_invalid_message_format(self) -> None:
         """
-        Invalid message format: improper schema should raise ValueError
+        Invalid message format: improper schema should send the ValueError message
 
         Author: Namah Shrestha
         """
-        self.mock_handler.recv.return_value = '{"x": 1}'
-        async_handler: mock.MagicMock = app.socket_handler(self.mock_handler)
-        try:
-            asyncio.run(async_handler)
-        except ValueError as e:
-            self.assertEqual(isinstance(e, ValueError), True)
+        self.set_messages('{"x": 1}')
+        asyncio.run(app.socket_handler(self.mock_handler))
+        self.mock_handler.send.assert_called_once_with(app.INVALID_MESSAGE_ERROR)
 
     def test_unsupported_instance_os(self) -> None:
         """
-        Valid message format but unsupported OS command should raise ValueError
+        Valid message format but unsupported OS command should send ValueError
 
         Author: Namah Shrestha
         """
         self.dummy_return_value[constants.INSTANCE_OS] = "unsupported_dummy_os"
-        self.mock_handler.recv.return_value = json.dumps(self.dummy_return_value)
-        async_handler: mock.MagicMock = app.socket_handler(self.mock_handler)
-        try:
-            asyncio.run(async_handler)
-        except ValueError as e:
-            self.assertEqual(isinstance(e, ValueError), True)
+        self.set_messages(json.dumps(self.dummy_return_value))
+        asyncio.run(app.socket_handler(self.mock_handler))
+        self.mock_handler.send.assert_called_once_with(
+            "Unsupported instance os: unsupported_dummy_os"
+        )
 
     def test_unsupported_command(self) -> None:
         """
-        Valid message format but unsupported command should raise ValueError
+        Valid message format but unsupported command should send ValueError
 
         Author: Namah Shrestha
         """
         self.dummy_return_value[constants.COMMAND] = "unsupported_dummy_command"
-        self.mock_handler.recv.return_value = json.dumps(self.dummy_return_value)
-        async_handler: mock.MagicMock = app.socket_handler(self.mock_handler)
-        try:
-            asyncio.run(async_handler)
-        except ValueError as e:
-            self.assertEqual(isinstance(e, ValueError), True)
+        self.set_messages(json.dumps(self.dummy_return_value))
+        asyncio.run(app.socket_handler(self.mock_handler))
+        self.mock_handler.send.assert_called_once_with(
+            "Unsupported command: unsupported_dummy_command"
+        )
+
+    def test_busy_response(self) -> None:
+        """
+        A request that is not admitted gets the busy response
+        and the session goes on.
+
+        Author: Namah Shrestha
+        """
+        controller: app.admission.AdmissionController = (
+            app.admission.AdmissionController({constants.CREATE: 1}, queue_size=0)
+        )
+        controller.limiters[constants.CREATE].active = 1
+        self.set_messages(json.dumps(self.dummy_return_value), "test_message")
+        with mock.patch.object(app.admission, "admission_controller", controller):
+            asyncio.run(app.socket_handler(self.mock_handler))
+            metrics_text: str = app.metrics.registry.render()
+        self.assertEqual(
+            self.mock_handler.send.call_args_list[0],
+            mock.call(app.admission.BUSY_ERROR),
+        )
+        self.assertEqual(self.mock_handler.send.call_count, 2)
+        self.assertNotIn("test_hash", app.reaper)
+        self.assertGreaterEqual(
+            app.metrics.request_errors.get(
+                constants.CREATE, constants.CENTOS, "BusyError"
+            ),
+            1,
+        )
+        self.assertIn('zod_admission_rejected{command="CREATE"} 1\n', metrics_text)
+
+    def test_failed_restore(self) -> None:
+        """
+        A session whose restore failed gets the error and the session goes
+        on, so the next request retries.
+
+        Author: Namah Shrestha
+        """
+        self.dummy_return_value[constants.COMMAND] = constants.EXECUTE
+        self.set_messages(json.dumps(self.dummy_return_value), "test_message")
+        with mock.patch.object(
+            app.reaper,
+            "restore",
+            mock.AsyncMock(side_effect=sn.SnapshotError("test_hash")),
+        ):
+            asyncio.run(app.socket_handler(self.mock_handler))
+        self.assertEqual(
+            self.mock_handler.send.call_args_list[0],
+            mock.call(str(sn.SnapshotError("test_hash"))),
+        )
+        self.assertEqual(self.mock_handler.send.call_count, 2)
 
 
 class TestAppCentos(TestApp):
@@ -113,70 +178,278 @@ class TestAppCentos(TestApp):
         self.image_name: str = constants.CENTOS_IMAGE_NAME
         self.image_tag: str = constants.CENTOS_IMAGE_TAG
 
+    def tearDown(self) -> None:
+        ci.container_index.clear()
+
+    @mock.patch.object(ic, "image_cache", ic.ImageCache())
+    @mock.patch.object(ci.time, "time", mock.MagicMock(return_value=100.0))
+    @mock.patch("os.popen")
     @mock.patch("os.system")
-    def test_instance_manager_call(self, mock_system) -> None:
+    def test_instance_manager_call(self, mock_system, mock_popen) -> None:
         """
         Check if instance manager commands are called upon setting appropriate commands
         and instance os.
+        Both commands are sent on the same connection.
+
+        Author: Namah Shrestha
+        """
+        create_message: str = json.dumps(self.dummy_return_value)
+        self.dummy_return_value[constants.COMMAND] = constants.DELETE
+        delete_message: str = json.dumps(self.dummy_return_value)
+        self.set_messages(create_message, delete_message)
+        mock_system.return_value = 0
+        mock_popen.return_value.read.return_value = "test_id\n"
+        mock_popen.return_value.close.return_value = None
+        image: str = (
+            f"{self.image_name}:"
+            f"{ic.image_cache.context_digest(constants.CENTOS_DOCKERFILE_NAME)}"
+        )
+        with mock.patch.object(app.reaper, "begin_exec") as mock_begin_exec:
+            asyncio.run(app.socket_handler(self.mock_handler))
+        mock_begin_exec.assert_not_called()
+        self.assertNotIn(self.instance_hash, app.reaper)
+        """
+        This shows that instance_manager handle was called which inturn called
+        instance_manager.create_instance and delete_instance methods.
+        """
+        mock_popen.assert_called_once_with(
+            f"docker container run --name {self.container_name} "
+            "--label zod.instance_os=centos --label zod.created_at=100.000 "
+            f"--label zod.instance_hash={self.instance_hash} -d {image}"
+        )
+        mock_system.assert_called_with("docker container rm -f test_id")
+        self.assertEqual(
+            self.mock_handler.send.call_args_list,
+            [mock.call("[0]"), mock.call("[2]")],
+        )
+
+    @mock.patch("src.image_cache.ImageCache.ensure_image")
+    @mock.patch("src.docker_backend.DockerCLIBackend.run_container")
+    def test_concurrent_create(
+        self, mock_run_container: mock.MagicMock, mock_ensure_image: mock.MagicMock
+    ) -> None:
+        """
+        1. Concurrent CREATE of one instance hash runs one container.
+        2. A CREATE of a running session makes no docker call.
 
         Author: Namah Shrestha
         """
-        self.dummy_return_value[constants.COMMAND] = constants.CREATE
-        self.mock_handler.recv.return_value = json.dumps(self.dummy_return_value)
-        async_handler: mock.MagicMock = app.socket_handler(self.mock_handler)
-        try:
-            asyncio.run(async_handler)
-        except Exception:
-            """
-            This shows that instance_manager handle was called which inturn called
-            instance_manager.create_instance method.
 
-            Author: Namah Shrestha
-            """
-            mock_system.assert_called_with(
-                f"docker container run --name "
-                f"{self.container_name} -d "
-                f"{self.image_name}:{self.image_tag}"
+        def run_container(*args: typing.Any) -> str:
+            time.sleep(0.05)
+            return "test_id"
+
+        mock_run_container.side_effect = run_container
+        mock_ensure_image.return_value = "centos-demo:test"
+        create_message: str = json.dumps(self.dummy_return_value)
+        websockets_: list = []
+        for _ in range(3):
+            websocket: mock.MagicMock = mock.MagicMock()
+            websocket.recv = mock.AsyncMock(
+                side_effect=[
+                    create_message,
+                    websockets.exceptions.ConnectionClosedOK(None, None),
+                ]
             )
+            websocket.send = mock.AsyncMock()
+            websockets_.append(websocket)
 
-        self.dummy_return_value[constants.COMMAND] = constants.DELETE
-        self.mock_handler.recv.return_value = json.dumps(self.dummy_return_value)
-        async_handler: mock.MagicMock = app.socket_handler(self.mock_handler)
-        try:
-            asyncio.run(async_handler)
-        except Exception:
-            """
-            This shows that instance_manager handle was called which inturn called
-            instance_manager.delete_instance method.
-
-            Author: Namah Shrestha
-            """
-            mock_system.assert_called_with(
-                f"docker image rm -f {self.image_name}:{self.image_tag}"
+        async def run() -> None:
+            await asyncio.gather(
+                *(app.socket_handler(websocket) for websocket in websockets_[:2])
             )
+            await app.socket_handler(websockets_[2])
+
+        with mock.patch.object(app.reaper, "wake"):
+            asyncio.run(run())
+        mock_run_container.assert_called_once()
+        mock_ensure_image.assert_called_once()
+        for websocket in websockets_:
+            websocket.send.assert_called_once_with("[0]")
 
+    @mock.patch.object(constants, "PERSISTENT_SHELL", False)
+    @mock.patch("src.docker_backend.DockerCLIBackend.stream_exec")
     @mock.patch("os.popen")
-    def test_instance_exec_call(self, mock_popen) -> None:
+    def test_instance_exec_call(
+        self, mock_popen: mock.MagicMock, mock_stream_exec: mock.MagicMock
+    ) -> None:
         """
         Check if instance exec command is called upon setting appropriate commands
         and instance os.
+        The container id is resolved once for the whole session.
+        Every EXEC is recorded as running until it ends.
 
         Author: Namah Shrestha
         """
+        mock_popen.return_value.read.return_value = "test_id\n"
+        mock_popen.return_value.close.return_value = None
+        mock_stream_exec.side_effect = [
+            db.CompletedExecStream(b"a\nb", 0),
+            db.CompletedExecStream(b"c", 0),
+        ]
         self.dummy_return_value[constants.COMMAND] = constants.EXECUTE
-        self.mock_handler.recv.return_value = json.dumps(self.dummy_return_value)
-        async_handler: mock.MagicMock = app.socket_handler(self.mock_handler)
-        try:
-            asyncio.run(async_handler)
-        except Exception:
-            """
-            This shows that intance_exec handle was called which inturn called
-            instance_exec.exec_instance method.
-
-            Author: Namah Shrestha
-            """
-            mock_popen.assert_called_with(
-                f"docker container exec "
-                f"$({self.filter_container_command}) "
-                f"{self.dummy_return_value[constants.EXEC_COMMAND]}"
-            )
+        self.set_messages(
+            json.dumps(self.dummy_return_value), json.dumps(self.dummy_return_value)
+        )
+        with mock.patch.object(app.reaper, "end_exec") as mock_end_exec:
+            asyncio.run(app.socket_handler(self.mock_handler))
+        self.assertEqual(
+            mock_end_exec.call_args_list, [mock.call(self.instance_hash)] * 2
+        )
+        mock_popen.assert_called_once_with(self.filter_container_command)
+        self.assertEqual(
+            mock_stream_exec.call_args_list,
+            [mock.call(self.container_name, "ls", "test_id", None, mock.ANY)] * 2,
+        )
+        self.assertEqual(
+            self.mock_handler.send.call_args_list,
+            [mock.call('["a", "b"]'), mock.call('["c"]')],
+        )
+
+    @mock.patch.object(constants, "PERSISTENT_SHELL", False)
+    @mock.patch("os.popen")
+    def test_session_bound_to_instance_hash(self, mock_popen) -> None:
+        """
+        A session only serves the instance hash of its first message.
+
+        Author: Namah Shrestha
+        """
+        mock_popen.return_value.read.return_value = ""
+        self.dummy_return_value[constants.COMMAND] = constants.EXECUTE
+        first_message: str = json.dumps(self.dummy_return_value)
+        self.dummy_return_value[constants.INSTANCE_HASH] = "other_hash"
+        self.set_messages(first_message, json.dumps(self.dummy_return_value))
+        asyncio.run(app.socket_handler(self.mock_handler))
+        self.mock_handler.send.assert_called_with(
+            f"Session is bound to instance hash: {self.instance_hash}"
+        )
+
+    @mock.patch.object(constants, "PERSISTENT_SHELL", False)
+    @mock.patch("src.docker_backend.DockerCLIBackend.kill_exec")
+    @mock.patch("src.docker_backend.DockerCLIBackend.stream_exec")
+    def test_cancel_exec(
+        self, mock_stream_exec: mock.MagicMock, mock_kill_exec: mock.MagicMock
+    ) -> None:
+        """
+        1. A CANCEL while an EXEC runs kills it by its exec id,
+           and the EXEC answers that it was cancelled.
+        2. A CANCEL with nothing running is answered.
+
+        Author: Namah Shrestha
+        """
+        killed: threading.Event = threading.Event()
+
+        def blocking_output() -> typing.Iterator[bytes]:
+            yield b"a\n"
+            killed.wait(5)
+
+        stream: mock.MagicMock = mock.MagicMock()
+        stream.__iter__.side_effect = blocking_output
+        stream.exit_code = None
+        mock_stream_exec.return_value = stream
+        mock_kill_exec.side_effect = lambda *args: killed.set()
+        ci.container_index.set(self.instance_hash, "test_id")
+        self.dummy_return_value[constants.COMMAND] = constants.EXECUTE
+        exec_message: str = json.dumps(self.dummy_return_value)
+        self.dummy_return_value[constants.COMMAND] = constants.CANCEL
+        cancel_message: str = json.dumps(self.dummy_return_value)
+        messages: list = [exec_message, cancel_message, cancel_message]
+
+        async def recv() -> str:
+            if not messages:
+                raise websockets.exceptions.ConnectionClosedOK(None, None)
+            while messages[0] == cancel_message and not mock_stream_exec.called:
+                await asyncio.sleep(0.01)
+            if len(messages) == 1:
+                while self.mock_handler.send.call_count == 0:
+                    await asyncio.sleep(0.01)
+            return messages.pop(0)
+
+        self.mock_handler.recv.side_effect = recv
+        asyncio.run(app.socket_handler(self.mock_handler))
+        mock_kill_exec.assert_called_once_with(
+            self.container_name, "test_id", mock_stream_exec.call_args.args[4]
+        )
+        self.assertEqual(
+            self.mock_handler.send.call_args_list,
+            [
+                mock.call('["a", "", "[cancelled]"]'),
+                mock.call(constants.NOTHING_TO_CANCEL),
+            ],
+        )
+
+    @mock.patch.object(constants, "PERSISTENT_SHELL", False)
+    @mock.patch("src.docker_backend.DockerCLIBackend.stream_exec")
+    def test_stream_exec(self, mock_stream_exec: mock.MagicMock) -> None:
+        """
+        A streaming EXEC sends output frames and then the exit frame.
+
+        Author: Namah Shrestha
+        """
+        stream: mock.MagicMock = mock.MagicMock()
+        stream.__iter__.return_value = iter([b"a\nb\n", b"c"])
+        stream.exit_code = 2
+        mock_stream_exec.return_value = stream
+        ci.container_index.set(self.instance_hash, "test_id")
+        self.dummy_return_value[constants.COMMAND] = constants.EXECUTE
+        self.dummy_return_value[constants.STREAM] = True
+        self.set_messages(json.dumps(self.dummy_return_value))
+        asyncio.run(app.socket_handler(self.mock_handler))
+        self.assertEqual(
+            self.mock_handler.send.call_args_list,
+            [
+                mock.call('{"type": "output", "data": ["a", "b"]}'),
+                mock.call('{"type": "output", "data": ["c"]}'),
+                mock.call('{"type": "exit", "exit_code": 2}'),
+            ],
+        )
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.open_shell")
+    def test_exec_in_session_shell(self, mock_open_shell: mock.MagicMock) -> None:
+        """
+        Every EXEC of a session runs in one shell, closed with the session.
+
+        Author: Namah Shrestha
+        """
+        channel: fake_docker.FakeShellChannel = fake_docker.FakeShellChannel(
+            {"ls": (0, b"a\nb", b"")}
+        )
+        mock_open_shell.return_value = channel
+        ci.container_index.set(self.instance_hash, "test_id")
+        self.dummy_return_value[constants.COMMAND] = constants.EXECUTE
+        self.set_messages(
+            json.dumps(self.dummy_return_value), json.dumps(self.dummy_return_value)
+        )
+        asyncio.run(app.socket_handler(self.mock_handler))
+        mock_open_shell.assert_called_once_with(
+            self.container_name, "test_id", mock.ANY
+        )
+        self.assertEqual(channel.commands, ["true", "ls", "ls"])
+        self.assertEqual(
+            self.mock_handler.send.call_args_list,
+            [mock.call('["a", "b"]'), mock.call('["a", "b"]')],
+        )
+        self.assertTrue(channel.closed)
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.open_shell")
+    def test_exec_batch(self, mock_open_shell: mock.MagicMock) -> None:
+        """
+        A batch EXEC answers with the result of every command in one response.
+        A local shell stands in for the container.
+
+        Author: Namah Shrestha
+        """
+        mock_open_shell.side_effect = lambda *args: db.CLIExecChannel("/bin/bash")
+        ci.container_index.set(self.instance_hash, "test_id")
+        self.dummy_return_value[constants.COMMAND] = constants.EXECUTE
+        del self.dummy_return_value[constants.EXEC_COMMAND]
+        self.dummy_return_value[constants.EXEC_COMMANDS] = ["echo a", "false", "echo b"]
+        self.set_messages(json.dumps(self.dummy_return_value))
+        asyncio.run(app.socket_handler(self.mock_handler))
+        self.assertEqual(
+            json.loads(self.mock_handler.send.call_args.args[0]),
+            [
+                {"exec_command": "echo a", "output": ["a", ""], "exit_code": 0},
+                {"exec_command": "false", "output": [""], "exit_code": 1},
+            ],
+        )
@@ -0,0 +1,161 @@
+"""
+Unit tests for the container lifecycle tracker.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import time
+import typing
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.constants as constants
+import src.container_events as ce
+import src.container_index as ci
+import src.docker_backend as db
+import src.image_cache as ic
+import src.instance_exec as ie
+import src.instance_manager as im
+import src.session_registry as sr
+
+
+def wait_for(condition: typing.Callable[[], bool], timeout: float = 5.0) -> None:
+    """
+    Wait until the condition holds, fail after the timeout.
+
+    Author: Namah Shrestha
+    """
+    deadline: float = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not reached in time")
+        time.sleep(0.01)
+
+
+class TestContainerStates(unittest.TestCase):
+    """
+    Test ContainerStates class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def test_states(self) -> None:
+        """
+        1. Nothing is known until the states are reset live.
+        2. Events move containers through their lifecycle,
+           short and full ids match.
+        3. Only the latest removed containers are remembered.
+
+        Author: Namah Shrestha
+        """
+        states: ce.ContainerStates = ce.ContainerStates(history=1)
+        full_id: str = "a" * 64
+        states.apply(db.ContainerEvent("create", full_id))
+        self.assertIsNone(states.state(full_id))
+        states.reset([db.ContainerInfo(full_id, "x", False, {})], live=True)
+        self.assertEqual(states.state(full_id[:12]), constants.CONTAINER_DEAD)
+        self.assertTrue(states.is_gone(full_id))
+        self.assertFalse(states.is_removed(full_id))
+        self.assertEqual(
+            states.apply(db.ContainerEvent("start", full_id)),
+            constants.CONTAINER_RUNNING,
+        )
+        self.assertFalse(states.is_gone(full_id))
+        self.assertIsNone(states.apply(db.ContainerEvent("exec_start", full_id)))
+        self.assertFalse(states.is_gone(None))
+        states.apply(db.ContainerEvent("destroy", full_id))
+        self.assertTrue(states.is_removed(full_id))
+        states.apply(db.ContainerEvent("destroy", "b" * 64))
+        self.assertIsNone(states.state(full_id))
+        self.assertEqual(
+            states.stats(),
+            {"created": 0, "running": 0, "dead": 0, "removed": 1},
+        )
+        states.reset((), live=False)
+        self.assertIsNone(states.state("b" * 64))
+
+
+class TestContainerEventWatcher(unittest.TestCase):
+    """
+    Test ContainerEventWatcher class with the fake backend. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Follow the events of a fake backend with a running session.
+
+        Author: Namah Shrestha
+        """
+        self.backend: db.DockerFakeBackend = db.DockerFakeBackend()
+        db.set_backend(self.backend)
+        self.instance_hash: str = "events_test"
+        self.container_name: str = constants.CENTOS_CONTAINER_NAME.format(
+            self.instance_hash
+        )
+        im.CentosInstanceManager(constants.CREATE, self.instance_hash).handle()
+        self.container_id: str = ci.container_index.get(self.instance_hash)
+        self.watcher: ce.ContainerEventWatcher = ce.ContainerEventWatcher(
+            ce.container_states
+        )
+        self.watcher.start()
+        wait_for(lambda: ce.container_states.live)
+
+    def tearDown(self) -> None:
+        self.watcher.stop()
+        db.set_backend(None)
+        ci.container_index.clear()
+        ic.image_cache.built.clear()
+
+    def test_died_container(self) -> None:
+        """
+        1. A container that dies outside of our control marks its session
+           dead at once, and EXEC tells the client to CREATE again.
+        2. CREATE replaces the dead container under the same name.
+        3. DELETE skips a container that is removed already.
+
+        Author: Namah Shrestha
+        """
+        self.backend.kill_container(self.container_id)
+        wait_for(
+            lambda: sr.session_registry.get(self.instance_hash).state
+            == constants.SESSION_DEAD
+        )
+        self.assertEqual(self.watcher.invalidated, 1)
+        with self.assertRaises(ce.ContainerGoneError):
+            ie.CentosInstanceExec(constants.EXECUTE, self.instance_hash).handle("ls")
+        im.CentosInstanceManager(constants.CREATE, self.instance_hash).handle()
+        new_id: str = ci.container_index.get(self.instance_hash)
+        self.assertNotEqual(new_id, self.container_id)
+        self.assertEqual(self.backend.find_container(self.container_name), new_id)
+        wait_for(lambda: ce.container_states.state(new_id) is not None)
+        self.assertEqual(
+            sr.session_registry.get(self.instance_hash).state,
+            constants.SESSION_RUNNING,
+        )
+        self.assertEqual(
+            ie.CentosInstanceExec(constants.EXECUTE, self.instance_hash).handle("true"),
+            ["true", ""],
+        )
+        self.backend.remove_container(self.container_name, new_id)
+        wait_for(lambda: ce.container_states.is_removed(new_id))
+        with mock.patch.object(self.backend, "remove_container") as mock_remove:
+            im.CentosInstanceManager(constants.DELETE, self.instance_hash).handle()
+        mock_remove.assert_not_called()
+        self.assertIsNone(sr.session_registry.get(self.instance_hash))
+
+    def test_stop(self) -> None:
+        """
+        Stopping the watcher forgets every state.
+
+        Author: Namah Shrestha
+        """
+        self.assertEqual(
+            ce.container_states.state(self.container_id), constants.CONTAINER_RUNNING
+        )
+        self.watcher.stop()
+        self.assertFalse(ce.container_states.live)
+        self.assertIsNone(self.watcher.thread)
+        self.assertEqual(self.backend.event_streams, [])
@@ -0,0 +1,119 @@
+"""
+Unit tests for the container id index.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import time
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.constants as constants
+import src.container_index as ci
+import src.docker_backend as db
+import src.session_registry as sr
+
+
+class TestContainerIndex(unittest.TestCase):
+    """
+    Test ContainerIndex class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Create an empty index in a registry of its own.
+
+        Author: Namah Shrestha
+        """
+        self.registry: sr.SessionRegistry = sr.SessionRegistry(":memory:")
+        self.index: ci.ContainerIndex = ci.ContainerIndex(self.registry)
+
+    def test_set_get_remove(self) -> None:
+        """
+        1. Set ids are returned.
+        2. Setting None or removing forgets the instance.
+
+        Author: Namah Shrestha
+        """
+        self.index.set("test_hash", "test_id", constants.CENTOS)
+        self.assertEqual(self.index.get("test_hash"), "test_id")
+        self.assertEqual(self.registry.get("test_hash").instance_os, constants.CENTOS)
+        self.index.set("test_hash", None)
+        self.assertIsNone(self.index.get("test_hash"))
+        self.index.set("test_hash", "test_id")
+        self.index.remove("test_hash")
+        self.assertIsNone(self.index.get("test_hash"))
+
+    def test_rebuild(self) -> None:
+        """
+        1. One listing adopts the running containers of every os by
+           instance hash, with the creation time of their label.
+        2. Pooled containers of the shards are kept.
+        3. Stopped, unknown and other shard containers are removed together.
+        4. Sessions without container are forgotten, unless created since.
+        5. Paused session containers are adopted as paused sessions.
+
+        Author: Namah Shrestha
+        """
+        backend: mock.MagicMock = mock.MagicMock()
+        centos: dict = {constants.LABEL_INSTANCE_OS: constants.CENTOS}
+        backend.list_labelled_containers.return_value = [
+            db.ContainerInfo(
+                "id_a",
+                "centos_demo_hash_a",
+                True,
+                {**centos, constants.LABEL_CREATED_AT: "10.5"},
+            ),
+            db.ContainerInfo(
+                "id_c",
+                "ubuntu_demo_hash_c",
+                True,
+                {constants.LABEL_INSTANCE_OS: constants.UBUNTU},
+                paused=True,
+            ),
+            db.ContainerInfo(
+                "id_pool", "zod_pool_centos_w1_0123456789ab", True, centos
+            ),
+            db.ContainerInfo(
+                "id_shard", "zod_pool_centos_w2_0123456789ab", True, centos
+            ),
+            db.ContainerInfo("id_exited", "centos_demo_hash_b", False, centos),
+            db.ContainerInfo("id_other", "renamed", True, centos),
+        ]
+        db.set_backend(backend)
+        self.addCleanup(db.set_backend, None)
+        self.registry.set_container("gone_hash", "gone_id", now=0)
+        self.registry.register("new_hash", constants.CENTOS, now=time.time() + 60)
+        self.assertEqual(self.index.rebuild(["w0_", "w1_"]), 3)
+        backend.list_labelled_containers.assert_called_once_with(
+            constants.LABEL_INSTANCE_OS
+        )
+        backend.remove_containers.assert_called_once_with(
+            ["id_shard", "id_exited", "id_other"]
+        )
+        backend.unpause_container.assert_not_called()
+        self.assertIsNone(self.index.get("gone_hash"))
+        self.assertEqual(self.index.get("hash_a"), "id_a")
+        self.assertEqual(self.registry.get("hash_a").created_at, 10.5)
+        self.assertEqual(self.registry.get("hash_c").instance_os, constants.UBUNTU)
+        self.assertEqual(self.registry.count(constants.SESSION_RUNNING), 1)
+        self.assertEqual(self.registry.get("hash_c").state, constants.SESSION_PAUSED)
+
+    def test_container_labels(self) -> None:
+        """
+        Session containers are labelled with their hash, pooled ones are not.
+
+        Author: Namah Shrestha
+        """
+        labels: dict = ci.container_labels(constants.CENTOS, "test_hash")
+        self.assertEqual(labels[constants.LABEL_INSTANCE_HASH], "test_hash")
+        self.assertEqual(labels[constants.LABEL_INSTANCE_OS], constants.CENTOS)
+        self.assertAlmostEqual(
+            float(labels[constants.LABEL_CREATED_AT]), time.time(), delta=60
+        )
+        self.assertNotIn(
+            constants.LABEL_INSTANCE_HASH, ci.container_labels(constants.CENTOS)
+        )
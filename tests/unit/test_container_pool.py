@@ -0,0 +1,193 @@
+"""
+Unit tests for the warm container pool.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.container_index as ci
+import src.container_pool as cp
+import src.docker_backend as db
+import src.image_cache as ic
+import src.instance_manager as im
+import src.constants as constants
+
+
+class TestContainerPool(unittest.TestCase):
+    """
+    Test ContainerPool class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Create a centos pool of size 2.
+
+        Author: Namah Shrestha
+        """
+        self.pool: cp.ContainerPool = cp.ContainerPool(
+            constants.CENTOS,
+            constants.CENTOS_IMAGE_NAME,
+            constants.CENTOS_IMAGE_TAG,
+            constants.CENTOS_DOCKERFILE_NAME,
+            2,
+        )
+
+    @mock.patch.object(ic, "image_cache", ic.ImageCache())
+    @mock.patch("os.popen")
+    @mock.patch("os.system")
+    def test_refill(
+        self, mock_system: mock.MagicMock, mock_popen: mock.MagicMock
+    ) -> None:
+        """
+        1. Refill starts containers from the cached image up to the size.
+        2. A full pool starts nothing.
+
+        Author: Namah Shrestha
+        """
+        mock_system.return_value = 0
+        mock_popen.return_value.read.side_effect = ["id_1\n", "id_2\n"]
+        mock_popen.return_value.close.return_value = None
+        self.assertEqual(self.pool.refill(), 2)
+        self.assertEqual(list(self.pool.idle), ["id_1", "id_2"])
+        self.assertEqual(self.pool.refill(), 0)
+        self.assertEqual(mock_popen.call_count, 2)
+
+    @mock.patch.object(ic, "image_cache", ic.ImageCache())
+    @mock.patch("os.popen")
+    @mock.patch("os.system")
+    def test_refill_failed_start(
+        self, mock_system: mock.MagicMock, mock_popen: mock.MagicMock
+    ) -> None:
+        """
+        A failed start stops the refill and checks the image again next time.
+
+        Author: Namah Shrestha
+        """
+        mock_system.return_value = 0
+        mock_popen.return_value.close.return_value = 256
+        self.assertEqual(self.pool.refill(), 0)
+        self.assertEqual(ic.image_cache.built, set())
+
+    @mock.patch("os.system")
+    def test_acquire(self, mock_system: mock.MagicMock) -> None:
+        """
+        1. Acquire renames a pooled container and counts a hit.
+        2. An empty pool counts a miss.
+
+        Author: Namah Shrestha
+        """
+        mock_system.return_value = 0
+        self.pool.idle.append("test_id")
+        self.assertEqual(self.pool.acquire("centos_demo_test_hash"), "test_id")
+        mock_system.assert_called_with(
+            "docker container rename test_id centos_demo_test_hash"
+        )
+        self.assertIsNone(self.pool.acquire("centos_demo_test_hash"))
+        self.assertEqual(
+            self.pool.stats(),
+            {
+                "instance_os": constants.CENTOS,
+                "size": 2,
+                "idle": 0,
+                "hits": 1,
+                "misses": 1,
+            },
+        )
+
+    @mock.patch("os.system")
+    def test_acquire_skips_gone_containers(self, mock_system: mock.MagicMock) -> None:
+        """
+        A pooled container that can not be renamed is skipped.
+
+        Author: Namah Shrestha
+        """
+        mock_system.side_effect = [1, 1, 0]
+        self.pool.idle.extend(["gone_id", "test_id"])
+        self.assertEqual(self.pool.acquire("centos_demo_test_hash"), "test_id")
+        self.assertEqual(self.pool.hits, 1)
+        mock_system.assert_any_call("docker container inspect gone_id > /dev/null 2>&1")
+
+    def test_acquire_name_conflict(self) -> None:
+        """
+        A name taken by another container misses without draining the pool
+        or leaking its containers.
+
+        Author: Namah Shrestha
+        """
+        backend: db.DockerFakeBackend = db.DockerFakeBackend()
+        backend.build_image(".", ["image"], "x")
+        db.set_backend(backend)
+        self.addCleanup(db.set_backend, None)
+        for _ in range(3):
+            self.pool.idle.append(self.pool.start_container("image"))
+        pooled: list = list(self.pool.idle)
+        backend.run_container("centos_demo_test_hash", "image")
+        self.assertIsNone(self.pool.acquire("centos_demo_test_hash"))
+        self.assertEqual(list(self.pool.idle), pooled)
+        self.assertEqual((self.pool.hits, self.pool.misses), (0, 1))
+        backend.remove_container("centos_demo_test_hash")
+        self.assertEqual(self.pool.acquire("centos_demo_test_hash"), pooled[0])
+        self.assertEqual(list(self.pool.idle), pooled[1:])
+
+    @mock.patch("os.popen")
+    def test_adopt(self, mock_popen: mock.MagicMock) -> None:
+        """
+        Running pooled containers of a previous process are adopted.
+
+        Author: Namah Shrestha
+        """
+        mock_popen.return_value.read.return_value = "zod_pool_centos_abc test_id\n"
+        self.pool.adopt()
+        self.assertEqual(list(self.pool.idle), ["test_id"])
+
+
+class TestPoolCreateInstance(unittest.TestCase):
+    """
+    Test the pool usage of the instance manager. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def tearDown(self) -> None:
+        cp.pools.clear()
+        ci.container_index.clear()
+
+    @mock.patch("os.system")
+    def test_create_instance_pool_hit(self, mock_system: mock.MagicMock) -> None:
+        """
+        On a pool hit no image is built and no container is run.
+        The pooled container is indexed for the instance.
+
+        Author: Namah Shrestha
+        """
+        mock_system.return_value = 0
+        cp.setup_pools(1)
+        cp.get_pool(constants.CENTOS).idle.append("test_id")
+        im.CentosInstanceManager(constants.CREATE, "test_hash").create_instance()
+        mock_system.assert_called_once_with(
+            "docker container rename test_id centos_demo_test_hash"
+        )
+        self.assertEqual(ci.container_index.get("test_hash"), "test_id")
+
+    def test_setup_pools_disabled(self) -> None:
+        """
+        Size zero disables pooling.
+
+        Author: Namah Shrestha
+        """
+        cp.setup_pools(0)
+        self.assertIsNone(cp.get_pool(constants.CENTOS))
+
+    def test_setup_pools_served(self) -> None:
+        """
+        Only the instance oses get a pool.
+
+        Author: Namah Shrestha
+        """
+        cp.setup_pools(1, instance_oses=[constants.CENTOS])
+        self.assertEqual(list(cp.pools), [constants.CENTOS])
@@ -1,11 +1,8 @@
 """
 Tests the directory state management. Unit.
 
-We are not mocking external calls,
-because the external operations are not costly.
-They do not create containers or anything.
-Therefore, we are testing them like integration tests,
-by testing the actual results.
+The container is asked for directories through a callback.
+Here a set of directories stands in for the container.
 
 Author: Namah Shrestha
 """
@@ -41,27 +38,27 @@ class TestDirectoryStateManager(unittest.TestCase):
         Author: Namah Shrestha
         """
         self.assertEqual(
-            self.dir_state_manager.curr_dir, constants.MAIN_WORKING_DIRECTORY
+            self.dir_state_manager.curr_dir, constants.CONTAINER_WORKING_DIRECTORY
         )
 
     def test_set_curr_dir(self) -> None:
         """
         Test the setting of curr directory value.
 
-        1. Invalid directory value should not change.
-        2. Valid directory value should only change.
+        1. Relative directory value should not change.
+        2. Absolute directory value should change, normalized.
 
         Author: Namah Shrestha
         """
-        self.dir_state_manager.curr_dir = "asd qasd"  # invalid directory
+        self.dir_state_manager.curr_dir = "asd/"  # relative directory
         # should not change value
         self.assertEqual(
-            self.dir_state_manager.curr_dir, constants.MAIN_WORKING_DIRECTORY
+            self.dir_state_manager.curr_dir, constants.CONTAINER_WORKING_DIRECTORY
         )
-        # valid directory
-        self.dir_state_manager.curr_dir = "asd/"
+        # absolute directory
+        self.dir_state_manager.curr_dir = "//asd//qwe/../"
         # should change value.
-        self.assertEqual(self.dir_state_manager.curr_dir, "asd/")
+        self.assertEqual(self.dir_state_manager.curr_dir, "/asd")
 
 
 class TestChangeDirectoryHandler(unittest.TestCase):
@@ -122,78 +119,61 @@ class TestChangeDirectoryHandler(unittest.TestCase):
     def test_initial_value(self) -> None:
         """
         Test the initial value of the current working directory
-        should be the absolute path.
+        should be the working directory of a new container.
+        Commands then run without a working directory option.
 
         Author: Namah Shrestha
         """
-        self.assertEqual(self.chdh.get_cwd(), constants.MAIN_WORKING_DIRECTORY)
+        self.assertEqual(self.chdh.get_cwd(), constants.CONTAINER_WORKING_DIRECTORY)
+        self.assertIsNone(self.chdh.workdir())
 
-    def test_get_cwd(self) -> None:
+    def test_resolve_directory(self) -> None:
         """
-        Test the get cwd method.
-        At first test the actual value.
-        Then go one step back.
-        Then test the changed value.
+        Test that directories are resolved in memory against the current one.
 
         Author: Namah Shrestha
         """
-        self.assertEqual(self.chdh.get_cwd(), constants.MAIN_WORKING_DIRECTORY)
-        self.chdh.change_directory("cd ../")
-        self.assertEqual(
-            self.chdh.get_cwd(),
-            "/".join(constants.MAIN_WORKING_DIRECTORY.split("/")[:-1]),
-        )
+        self.chdh.dir_state_manager.curr_dir = "/usr/local"
+        self.assertEqual(self.chdh.resolve_directory("cd"), "")
+        self.assertEqual(self.chdh.resolve_directory("cd ../"), "/usr")
+        self.assertEqual(self.chdh.resolve_directory("cd ./bin//"), "/usr/local/bin")
+        self.assertEqual(self.chdh.resolve_directory("cd /etc/../var"), "/var")
+        self.assertEqual(self.chdh.resolve_directory("cd ~/.ssh"), "/root/.ssh")
+        self.assertEqual(self.chdh.resolve_directory("cd ../../../.."), "/")
 
     def test_change_directory(self) -> None:
         """
         Test cases for change directory.
         0. Invalid directory command returns "".
-        1. Go one step back and test value.
-        2. Go one step forward and test value.
-        3. Going one step back and going to invalid directory
-            should not change the curr_dir value.
+        1. Go one step forward and test value.
+        2. Go to a directory missing in the container,
+            the curr_dir value should not change.
+        3. The container may answer with another path, like for symlinks.
         4. The actual current working directory should not change
             at last no matter what.
 
         Author: Namah Shrestha
         """
-        """
-        0. Invalid directory command returns ""
-        """
-        self.assertEqual(
-            self.chdh.change_directory("cd"),
-            "",
-        )
-        """
-        1. one step back
-        """
+        container_dirs: dict = {"/": "/", "/home": "/home", "/link": "/home"}
+        checked: list = []
+
+        def check_directory(dirc: str) -> str:
+            checked.append(dirc)
+            return container_dirs.get(dirc, "")
+
+        cwd: str = os.getcwd()
+        self.assertEqual(self.chdh.change_directory("cd", check_directory), "")
         self.assertEqual(
-            self.chdh.change_directory("cd ../"),
-            "/".join(constants.MAIN_WORKING_DIRECTORY.split("/")[:-1]),
+            self.chdh.change_directory("cd home", check_directory), "/home"
         )
-        """
-        2. one step forward to a valid directory
-        """
+        self.assertEqual(self.chdh.workdir(), "/home")
         self.assertEqual(
-            self.chdh.change_directory("cd ./zodcentos"),
-            constants.MAIN_WORKING_DIRECTORY,
+            self.chdh.change_directory("cd zodcentos", check_directory), "/home"
         )
-        """
-        3. one step forward to invalid directory
-
-        NOTE: We are already at zodcentos directory which is the main_work_dir.
-                If we go to zodcentos again, there is no such directory,
-                we should get an error.
-                This will not change the value of the curr_dir
-                Therefore we get the value of main_working_dir.
-        """
         self.assertEqual(
-            self.chdh.change_directory("cd ./zodcentos"),
-            constants.MAIN_WORKING_DIRECTORY,
+            self.chdh.change_directory("cd /link", check_directory), "/home"
         )
-        """
-        4. Actual work dir should not change no matter what.
-           Despite changing the current working directory to one step back.
-        """
-        self.chdh.change_directory("cd ../")
-        self.assertEqual(os.getcwd(), constants.MAIN_WORKING_DIRECTORY)
+        self.assertEqual(checked, ["/home", "/home/zodcentos", "/link"])
+        self.chdh.reset()
+        self.assertEqual(self.chdh.get_cwd(), constants.CONTAINER_WORKING_DIRECTORY)
+        self.assertEqual(os.getcwd(), cwd)
@@ -0,0 +1,128 @@
+"""
+Unit tests for the docker engine api client.
+
+The client talks to a fake docker daemon on a temporary unix socket.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import unittest
+
+# modules
+import src.docker_api as docker_api
+import tests.unit.fake_docker as fake_docker
+
+
+class TestDockerAPIClient(unittest.TestCase):
+    """
+    Test DockerAPIClient class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Start the fake daemon and create a client for it.
+
+        Author: Namah Shrestha
+        """
+        self.server: fake_docker.FakeDockerServer = (
+            fake_docker.FakeDockerServer().start()
+        )
+        self.server.images.add("centos-demo:test")
+        self.client: docker_api.DockerAPIClient = docker_api.DockerAPIClient(
+            self.server.socket_path, pool_size=2, timeout=5
+        )
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.stop()
+
+    def test_container_lifecycle(self) -> None:
+        """
+        Create, start, inspect, rename, list and remove a container.
+
+        Author: Namah Shrestha
+        """
+        container_id: str = self.client.create_container(
+            "centos-demo:test", name="centos_demo_test_hash"
+        )
+        self.client.start_container(container_id)
+        self.assertEqual(
+            self.client.inspect_container(container_id)["State"]["Status"],
+            "running",
+        )
+        self.client.rename_container(container_id, "centos_demo_other_hash")
+        self.assertEqual(
+            [
+                container["Id"]
+                for container in self.client.list_containers(
+                    {"name": ["centos_demo_other_hash"]}
+                )
+            ],
+            [container_id],
+        )
+        self.client.remove_container(container_id)
+        self.assertEqual(self.client.list_containers(all=True), [])
+
+    def test_error_status(self) -> None:
+        """
+        Error statuses raise DockerAPIError with the daemon message.
+
+        Author: Namah Shrestha
+        """
+        with self.assertRaises(docker_api.DockerAPIError) as context:
+            self.client.inspect_container("missing")
+        self.assertEqual(context.exception.status, 404)
+        self.assertEqual(context.exception.message, "No such object")
+
+    def test_exec_container(self) -> None:
+        """
+        Exec returns the exit code and the demultiplexed output.
+
+        Author: Namah Shrestha
+        """
+        self.server.exec_outputs["ls"] = (2, b"a\nb\n", b"error\n")
+        container_id: str = self.client.create_container("centos-demo:test")
+        self.client.start_container(container_id)
+        self.assertEqual(
+            self.client.exec_container(container_id, ["/bin/sh", "-c", "ls"]),
+            (2, b"a\nb\n", b"error\n"),
+        )
+
+    def test_connection_reuse(self) -> None:
+        """
+        Sequential requests reuse one kept alive connection.
+
+        Author: Namah Shrestha
+        """
+        for _ in range(10):
+            self.client.list_containers()
+        self.assertEqual(self.server.connections, 1)
+
+    def test_stale_connection_retry(self) -> None:
+        """
+        A pooled connection closed by the daemon is replaced transparently.
+
+        Author: Namah Shrestha
+        """
+        self.client.list_containers()
+        stale: docker_api.UnixHTTPConnection = self.client.idle_connections.get()
+        stale.sock.close()
+        stale.sock = fake_docker.ClosedSocket()
+        self.client.idle_connections.put(stale)
+        self.assertEqual(self.client.list_containers(), [])
+        self.assertEqual(self.server.connections, 2)
+
+    def test_demultiplex(self) -> None:
+        """
+        Frames are split by their stream type.
+
+        Author: Namah Shrestha
+        """
+        data: bytes = (
+            fake_docker.frame(1, b"out1")
+            + fake_docker.frame(2, b"err")
+            + fake_docker.frame(1, b"out2")
+        )
+        self.assertEqual(docker_api.demultiplex(data), (b"out1out2", b"err"))
@@ -0,0 +1,564 @@
+"""
+Unit tests for the docker backends.
+
+The cli backend is tested with mocked process calls,
+the api backend against the fake docker daemon.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import subprocess
+import typing
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.constants as constants
+import src.container_index as ci
+import src.docker_api as docker_api
+import src.docker_backend as db
+import src.instance_exec as ie
+import src.metrics as metrics
+import src.shell as sh
+import tests.unit.fake_docker as fake_docker
+
+
+class TestDockerCLIBackend(unittest.TestCase):
+    """
+    Test DockerCLIBackend class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        self.backend: db.DockerCLIBackend = db.DockerCLIBackend()
+
+    @mock.patch("os.system")
+    def test_build_image(self, mock_system: mock.MagicMock) -> None:
+        """
+        Every tag is passed to the build.
+
+        Author: Namah Shrestha
+        """
+        mock_system.return_value = 0
+        self.assertTrue(self.backend.build_image(".", ["a:1", "a:latest"], "Df"))
+        mock_system.assert_called_with("docker image build . -t a:1 -t a:latest -f Df")
+
+    @mock.patch("os.popen")
+    def test_list_containers(self, mock_popen: mock.MagicMock) -> None:
+        """
+        Only names starting with the prefix are returned.
+
+        Author: Namah Shrestha
+        """
+        mock_popen.return_value.read.return_value = (
+            "zod_pool_a id_a\nx_zod_pool_b id_b\n"
+        )
+        self.assertEqual(
+            self.backend.list_containers("zod_pool_"), {"zod_pool_a": "id_a"}
+        )
+
+    @mock.patch("os.popen")
+    def test_run_container(self, mock_popen: mock.MagicMock) -> None:
+        """
+        Run returns the id of the container, None on failure.
+
+        Author: Namah Shrestha
+        """
+        mock_popen.return_value.read.return_value = "test_id\n"
+        mock_popen.return_value.close.side_effect = [None, 256]
+        self.assertEqual(
+            self.backend.run_container("name", "image", {"a": "1", "b": "x y"}),
+            "test_id",
+        )
+        mock_popen.assert_called_with(
+            "docker container run --name name --label a=1 --label 'b=x y' -d image"
+        )
+        self.assertIsNone(self.backend.run_container("name", "image"))
+
+    @mock.patch("os.system")
+    @mock.patch("os.popen")
+    def test_labelled_containers(
+        self, mock_popen: mock.MagicMock, mock_system: mock.MagicMock
+    ) -> None:
+        """
+        1. One listing returns every labelled container with its state
+           and labels.
+        2. Several containers are removed with one call.
+
+        Author: Namah Shrestha
+        """
+        mock_popen.return_value.read.return_value = (
+            "id_a centos_demo_a running zod.instance_os=centos,zod.created_at=1\n"
+            "id_b zod_pool_centos_x exited zod.instance_os=centos\n"
+            "id_c centos_demo_c paused zod.instance_os=centos\n"
+        )
+        containers: list = self.backend.list_labelled_containers("zod.instance_os")
+        mock_popen.assert_called_once_with(
+            "docker container ls -a --no-trunc "
+            "--format '{{.ID}} {{.Names}} {{.State}} {{.Labels}}' "
+            "--filter label=zod.instance_os"
+        )
+        self.assertEqual(
+            [
+                (info.container_id, info.name, info.running, info.labels)
+                for info in containers
+            ],
+            [
+                (
+                    "id_a",
+                    "centos_demo_a",
+                    True,
+                    {"zod.instance_os": "centos", "zod.created_at": "1"},
+                ),
+                ("id_b", "zod_pool_centos_x", False, {"zod.instance_os": "centos"}),
+                ("id_c", "centos_demo_c", True, {"zod.instance_os": "centos"}),
+            ],
+        )
+        self.assertEqual([info.paused for info in containers], [False, False, True])
+        self.backend.remove_containers(["id_a", "id_b"])
+        self.backend.remove_containers([])
+        mock_system.assert_called_once_with("docker container rm -f id_a id_b")
+
+    def test_cli_exec_stream(self) -> None:
+        """
+        The stream yields the output of the process and then has its exit code.
+
+        Author: Namah Shrestha
+        """
+        stream: db.ExecStream = db.CLIExecStream("printf 'a\\nb'; exit 3")
+        self.assertEqual(b"".join(stream), b"a\nb")
+        self.assertEqual(stream.exit_code, 3)
+
+    @mock.patch("os.system")
+    def test_stream_exec_tagged(self, mock_system: mock.MagicMock) -> None:
+        """
+        1. A failing exec without output of a stale id raises
+           ContainerNotFoundError at the end of the stream.
+        2. The exec is tagged with the exec id, and killed by it.
+
+        Author: Namah Shrestha
+        """
+        popen: typing.Callable = subprocess.Popen
+        with mock.patch("subprocess.Popen") as mock_popen, mock.patch.object(
+            self.backend, "find_container", return_value="new_id"
+        ):
+            mock_popen.side_effect = lambda command, **kwargs: popen("exit 1", **kwargs)
+            stream: db.ExecStream = self.backend.stream_exec(
+                "centos_demo_x", "ls", "stale_id", None, "abc"
+            )
+            with self.assertRaises(db.ContainerNotFoundError):
+                b"".join(stream)
+        mock_popen.assert_called_once_with(
+            "docker container exec -e ZOD_EXEC_ID=abc stale_id ls",
+            shell=True,
+            stdout=mock.ANY,
+        )
+        self.backend.kill_exec("centos_demo_x", "new_id", "abc")
+        kill_command: str = mock_system.call_args.args[0]
+        self.assertTrue(kill_command.startswith("docker container exec new_id /bin/sh"))
+        self.assertIn("ZOD_EXEC_ID=abc", kill_command)
+
+    def test_watch_events(self) -> None:
+        """
+        1. The events of the labelled containers are followed with
+           one docker events process.
+        2. Every json line is one event, other lines are skipped.
+
+        Author: Namah Shrestha
+        """
+        with mock.patch("subprocess.Popen") as mock_popen:
+            self.backend.watch_events("zod.instance_os", ("die", "destroy"))
+        mock_popen.assert_called_once_with(
+            "docker events --format '{{json .}}' --filter type=container "
+            "--filter label=zod.instance_os --filter event=die --filter event=destroy",
+            shell=True,
+            stdout=mock.ANY,
+        )
+        stream: db.EventStream = db.CLIEventStream(
+            'echo \'{"Action": "die", "Actor": {"ID": "id_a", '
+            '"Attributes": {"name": "centos_demo_a"}}}\'; echo garbage; '
+            'echo \'{"status": "destroy", "id": "id_b"}\''
+        )
+        self.assertEqual(
+            [(event.action, event.container_id, event.name) for event in stream],
+            [("die", "id_a", "centos_demo_a"), ("destroy", "id_b", "")],
+        )
+
+
+class TestDockerAPIBackend(unittest.TestCase):
+    """
+    Test DockerAPIBackend class against the fake daemon. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Start the fake daemon and use an api backend for it.
+
+        Author: Namah Shrestha
+        """
+        self.server: fake_docker.FakeDockerServer = (
+            fake_docker.FakeDockerServer().start()
+        )
+        self.server.images.add("centos-demo:test")
+        self.client: docker_api.DockerAPIClient = docker_api.DockerAPIClient(
+            self.server.socket_path, timeout=5
+        )
+        self.backend: db.DockerAPIBackend = db.DockerAPIBackend(self.client)
+
+    def tearDown(self) -> None:
+        db.set_backend(None)
+        ci.container_index.clear()
+        self.client.close()
+        self.server.stop()
+
+    def test_lifecycle(self) -> None:
+        """
+        Run, find, rename, list and remove containers.
+
+        Author: Namah Shrestha
+        """
+        self.assertTrue(self.backend.image_exists("centos-demo:test"))
+        self.assertFalse(self.backend.image_exists("centos-demo:missing"))
+        self.assertFalse(self.backend.run_container("x", "centos-demo:missing"))
+        container_id: str = self.backend.run_container("zod_pool_a", "centos-demo:test")
+        self.assertEqual(
+            self.backend.list_containers("zod_pool_"), {"zod_pool_a": container_id}
+        )
+        self.assertTrue(self.backend.rename_container(container_id, "centos_demo_h"))
+        self.assertEqual(self.backend.find_container("centos_demo_h"), container_id)
+        self.assertTrue(self.backend.container_exists(container_id))
+        self.backend.remove_container("centos_demo_h")
+        self.assertEqual(self.backend.find_container("centos_demo_h"), "")
+        self.assertFalse(self.backend.container_exists(container_id))
+
+    @mock.patch("os.system")
+    def test_cli_operations_counted_once(self, mock_system: mock.MagicMock) -> None:
+        """
+        An operation run with the cli is recorded once.
+
+        Author: Namah Shrestha
+        """
+        mock_system.return_value = 0
+        before: int = metrics.docker_latency.get("build")["count"]
+        self.assertTrue(self.backend.build_image(".", ["centos-demo:test"], "x"))
+        self.assertEqual(metrics.docker_latency.get("build")["count"], before + 1)
+
+    def test_pause(self) -> None:
+        """
+        1. A running container is paused and unpaused.
+        2. Paused containers are listed as running and paused.
+        3. Pausing twice fails.
+
+        Author: Namah Shrestha
+        """
+        labels: dict = {"zod.instance_os": "centos"}
+        container_id: str = self.backend.run_container("a", "centos-demo:test", labels)
+        self.assertTrue(self.backend.pause_container(container_id))
+        self.assertFalse(self.backend.pause_container(container_id))
+        (info,) = self.backend.list_labelled_containers("zod.instance_os")
+        self.assertEqual((info.running, info.paused), (True, True))
+        self.assertTrue(self.backend.unpause_container(container_id))
+        self.assertFalse(self.backend.unpause_container(container_id))
+        (info,) = self.backend.list_labelled_containers("zod.instance_os")
+        self.assertEqual((info.running, info.paused), (True, False))
+
+    def test_labelled_containers(self) -> None:
+        """
+        1. Containers are created with their labels.
+        2. Labelled containers are listed running or not, and removed
+           together.
+
+        Author: Namah Shrestha
+        """
+        labels: dict = {"zod.instance_os": "centos"}
+        running_id: str = self.backend.run_container("a", "centos-demo:test", labels)
+        created_id: str = self.client.create_container(
+            "centos-demo:test", name="b", Labels=labels
+        )
+        self.backend.run_container("c", "centos-demo:test")
+        self.assertEqual(
+            sorted(
+                (info.container_id, info.name, info.running, info.labels)
+                for info in self.backend.list_labelled_containers("zod.instance_os")
+            ),
+            sorted(
+                [
+                    (running_id, "a", True, labels),
+                    (created_id, "b", False, labels),
+                ]
+            ),
+        )
+        self.backend.remove_containers([running_id, created_id, "missing_id"])
+        self.assertEqual(self.backend.list_labelled_containers("zod.instance_os"), [])
+
+    def test_watch_events(self) -> None:
+        """
+        The events of the api stream are parsed, exec actions lose their
+        command, and the filters are sent along.
+
+        Author: Namah Shrestha
+        """
+        self.server.events = [
+            {"Action": "start", "Actor": {"ID": "id_a", "Attributes": {"name": "a"}}},
+            {"Action": "exec_start: sh -c ls", "Actor": {"ID": "id_a"}},
+            {"Action": "die", "Actor": {}},
+        ]
+        stream: db.EventStream = self.backend.watch_events(
+            "zod.instance_os", ("start", "die")
+        )
+        self.assertEqual(
+            [(event.action, event.container_id, event.name) for event in stream],
+            [("start", "id_a", "a"), ("exec_start", "id_a", "")],
+        )
+        stream.close()
+        self.assertEqual(
+            self.server.requests[-1][2],
+            {
+                "filters": (
+                    '{"type": ["container"], "label": ["zod.instance_os"], '
+                    '"event": ["start", "die"]}'
+                )
+            },
+        )
+
+    def test_exec_stale_container(self) -> None:
+        """
+        Exec with an id that does not exist raises ContainerNotFoundError.
+
+        Author: Namah Shrestha
+        """
+        with self.assertRaises(db.ContainerNotFoundError):
+            self.backend.exec_container("centos_demo_x", "ls", "stale_id")
+
+    def test_instance_exec_without_processes(self) -> None:
+        """
+        With the api backend EXEC spawns no process at all.
+
+        Author: Namah Shrestha
+        """
+        self.server.exec_outputs["ls"] = (0, b"bin\netc\n", b"")
+        self.backend.run_container("centos_demo_test_hash", "centos-demo:test")
+        db.set_backend(self.backend)
+        instance_exec: ie.InstanceExec = ie.CentosInstanceExec(
+            constants.EXECUTE, "test_hash"
+        )
+        with mock.patch("os.popen") as mock_popen, mock.patch(
+            "os.system"
+        ) as mock_system:
+            result: list = instance_exec.handle("ls")
+        self.assertEqual(result, ["bin", "etc", ""])
+        mock_popen.assert_not_called()
+        mock_system.assert_not_called()
+
+    def test_stream_exec(self) -> None:
+        """
+        The api stream yields stdout only and then has the exit code.
+        The connection read to the end goes back to the pool.
+
+        Author: Namah Shrestha
+        """
+        self.server.exec_outputs["ls"] = (3, b"bin\n", b"error")
+        container_id: str = self.backend.run_container(
+            "centos_demo_test_hash", "centos-demo:test"
+        )
+        stream: db.ExecStream = self.backend.stream_exec(
+            "centos_demo_test_hash", "ls", container_id
+        )
+        self.assertEqual(list(stream), [b"bin\n"])
+        self.assertEqual(stream.exit_code, 3)
+        self.assertEqual(self.server.connections, 1)
+        with self.assertRaises(db.ContainerNotFoundError):
+            self.backend.stream_exec("centos_demo_x", "ls", "stale_id")
+
+    def test_kill_exec(self) -> None:
+        """
+        1. The exec is created with the exec id in its environment.
+        2. Killing runs the kill command of the exec id in the container.
+        3. A missing container has nothing to kill.
+
+        Author: Namah Shrestha
+        """
+        container_id: str = self.backend.run_container(
+            "centos_demo_test_hash", "centos-demo:test"
+        )
+        b"".join(
+            self.backend.stream_exec("centos_demo_test_hash", "ls", None, None, "abc")
+        )
+        self.backend.kill_exec("centos_demo_test_hash", container_id, "abc")
+        execs: list = list(self.server.execs.values())
+        self.assertEqual(execs[0]["Env"], ["ZOD_EXEC_ID=abc"])
+        self.assertNotIn("Env", execs[1])
+        self.assertIn("ZOD_EXEC_ID=abc", execs[1]["Cmd"][-1])
+        self.backend.kill_exec("centos_demo_x", None, "abc")
+        self.assertEqual(len(self.server.execs), 2)
+
+    def test_open_shell(self) -> None:
+        """
+        The persistent shell runs over the hijacked exec connection.
+        Exiting the shell ends the exec with the exit code.
+
+        Author: Namah Shrestha
+        """
+        self.server.exec_outputs["ls"] = (1, b"bin\n", b"error")
+        container_id: str = self.backend.run_container(
+            "centos_demo_test_hash", "centos-demo:test"
+        )
+        shell: sh.PersistentShell = sh.PersistentShell(
+            self.backend.open_shell("centos_demo_test_hash", container_id)
+        )
+        for _ in range(2):
+            stream: db.ExecStream = shell.stream("ls")
+            self.assertEqual((b"".join(stream), stream.exit_code), (b"bin\n", 1))
+        stream = shell.stream("exit 3")
+        self.assertEqual((b"".join(stream), stream.exit_code), (b"", 3))
+        self.assertTrue(shell.closed)
+        with self.assertRaises(db.ContainerNotFoundError):
+            self.backend.open_shell("centos_demo_x", "stale_id")
+
+    def test_exec_missing_container(self) -> None:
+        """
+        Exec in a missing container returns no output.
+
+        Author: Namah Shrestha
+        """
+        self.assertEqual(self.backend.exec_container("centos_demo_x", "ls"), "")
+
+
+class TestDockerFakeBackend(unittest.TestCase):
+    """
+    Test DockerFakeBackend class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        self.backend: db.DockerFakeBackend = db.DockerFakeBackend()
+
+    def test_lifecycle(self) -> None:
+        """
+        1. Containers need a built image and a free name.
+        2. Renamed and removed containers are found by their new name only.
+
+        Author: Namah Shrestha
+        """
+        self.assertIsNone(self.backend.run_container("a", "centos-demo:test"))
+        self.assertTrue(self.backend.build_image(".", ["centos-demo:test"], "x"))
+        self.assertTrue(self.backend.image_exists("centos-demo:test"))
+        container_id: str = self.backend.run_container("a", "centos-demo:test")
+        self.assertIsNone(self.backend.run_container("a", "centos-demo:test"))
+        self.assertTrue(self.backend.rename_container(container_id, "b"))
+        self.assertEqual(self.backend.list_containers("b"), {"b": container_id})
+        self.assertEqual(self.backend.find_container("a"), "")
+        self.assertTrue(self.backend.container_exists(container_id))
+        self.backend.remove_container("b", container_id)
+        self.assertEqual(self.backend.list_containers(""), {})
+        self.assertFalse(self.backend.container_exists("b"))
+        labelled_id: str = self.backend.run_container(
+            "c", "centos-demo:test", {"zod.instance_os": "centos"}
+        )
+        self.backend.run_container("d", "centos-demo:test")
+        self.assertEqual(
+            [
+                info.container_id
+                for info in self.backend.list_labelled_containers("zod.instance_os")
+            ],
+            [labelled_id],
+        )
+        self.backend.remove_containers([labelled_id])
+        self.assertEqual(list(self.backend.list_containers("")), ["d"])
+        with self.assertRaises(db.ContainerNotFoundError):
+            self.backend.exec_container("b", "ls", container_id)
+
+    def test_shell_and_batch(self) -> None:
+        """
+        1. The fake shell answers the persistent shell protocol and keeps cd.
+        2. Batch scripts get the marker of every command.
+
+        Author: Namah Shrestha
+        """
+        self.backend.build_image(".", ["centos-demo:test"], "x")
+        self.backend.run_container("centos_demo_test_hash", "centos-demo:test")
+        shell: sh.PersistentShell = sh.PersistentShell(
+            self.backend.open_shell("centos_demo_test_hash"), "/tmp"
+        )
+        stream: db.ExecStream = shell.stream("echo hi")
+        self.assertEqual((b"".join(stream), stream.exit_code), (b"echo hi\n", 0))
+        self.assertEqual(shell.cwd, "/tmp")
+        b"".join(shell.stream("cd ~/work"))
+        self.assertEqual(shell.cwd, "/root/work")
+        db.set_backend(self.backend)
+        self.addCleanup(db.set_backend, None)
+        instance_exec: ie.InstanceExec = ie.CentosInstanceExec(
+            constants.EXECUTE, "test_hash"
+        )
+        instance_exec.keep_shell = True
+        instance_exec.shell = shell
+        result: list = instance_exec.exec_batch(["ls", "pwd"])
+        self.assertEqual([step[constants.BATCH_EXIT_CODE] for step in result], [0, 0])
+        stream = shell.stream("exit 2")
+        self.assertEqual((b"".join(stream), stream.exit_code), (b"", 2))
+
+    @mock.patch("time.sleep")
+    def test_latency(self, mock_sleep: mock.MagicMock) -> None:
+        """
+        1. Operations block for their configured latency.
+        2. The latency spec is parsed from the configuration format.
+
+        Author: Namah Shrestha
+        """
+        backend: db.DockerFakeBackend = db.DockerFakeBackend(
+            db.parse_latency("build=2, ls=0.5,")
+        )
+        backend.build_image(".", ["centos-demo:test"], "x")
+        backend.find_container("a")
+        backend.run_container("a", "centos-demo:test")
+        self.assertEqual(mock_sleep.call_args_list, [mock.call(2.0), mock.call(0.5)])
+        with self.assertRaises(ValueError):
+            db.parse_latency("build")
+
+    def test_backend_interface(self) -> None:
+        """
+        Every backend implements the whole interface.
+
+        Author: Namah Shrestha
+        """
+        operations: list = [
+            name for name in vars(db.DockerBackend) if not name.startswith("_")
+        ]
+        for backend_class in db.backend_switch.values():
+            self.assertTrue(issubclass(backend_class, db.DockerBackend))
+            for name in operations:
+                self.assertIsNot(
+                    getattr(backend_class, name), getattr(db.DockerBackend, name)
+                )
+
+
+class TestGetBackend(unittest.TestCase):
+    """
+    Test the backend selection. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def tearDown(self) -> None:
+        db.set_backend(None)
+
+    def test_get_backend(self) -> None:
+        """
+        1. The configured backend is created once.
+        2. Unsupported backends raise ValueError.
+
+        Author: Namah Shrestha
+        """
+        db.set_backend(None)
+        with mock.patch.object(constants, "DOCKER_BACKEND", constants.CLI_BACKEND):
+            backend: db.DockerCLIBackend = db.get_backend()
+            self.assertIsInstance(backend, db.DockerCLIBackend)
+            self.assertIs(db.get_backend(), backend)
+        db.set_backend(None)
+        with mock.patch.object(constants, "DOCKER_BACKEND", "unsupported"):
+            with self.assertRaises(ValueError):
+                db.get_backend()
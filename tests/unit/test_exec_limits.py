@@ -0,0 +1,106 @@
+"""
+Unit tests for the limits of an EXEC.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import threading
+import typing
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.constants as constants
+import src.docker_backend as db
+import src.exec_limits as el
+
+
+class BlockingExecStream(db.ExecStream):
+    """
+    Exec stream of a command that prints nothing until it is killed.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.killed: threading.Event = threading.Event()
+
+    def read(self) -> typing.Iterator[bytes]:
+        self.killed.wait(5)
+        return
+        yield
+
+
+class TestExecLimits(unittest.TestCase):
+    """
+    Test ExecLimits class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def test_timeout(self) -> None:
+        """
+        A command running past the timeout is killed and the reason kept.
+
+        Author: Namah Shrestha
+        """
+        stream: BlockingExecStream = BlockingExecStream()
+        limits: el.ExecLimits = el.ExecLimits(timeout=0.01)
+        limits.start(stream.killed.set)
+        self.assertEqual(list(limits.read(stream)), [])
+        limits.finish()
+        self.assertTrue(stream.killed.is_set())
+        self.assertEqual(limits.flags(), {constants.TIMED_OUT: True})
+        self.assertEqual(limits.notice(), "[timed out after 0.01s]")
+
+    def test_output_cap(self) -> None:
+        """
+        1. Output past the cap is cut off and the command killed.
+        2. Output within the cap is left alone.
+
+        Author: Namah Shrestha
+        """
+        kill: mock.MagicMock = mock.MagicMock()
+        limits: el.ExecLimits = el.ExecLimits(max_output=5)
+        limits.start(kill)
+        output: list = list(limits.read(db.CompletedExecStream(b"abcdefgh", 0)))
+        limits.finish()
+        self.assertEqual(output, [b"abcde"])
+        kill.assert_called_once_with()
+        self.assertEqual(limits.flags(), {constants.TRUNCATED: True})
+        limits = el.ExecLimits(max_output=5)
+        limits.start(kill)
+        output = list(limits.read(db.CompletedExecStream(b"abcde", 0)))
+        self.assertEqual(output, [b"abcde"])
+        limits.finish()
+        self.assertFalse(limits.stopped)
+        self.assertIsNone(limits.notice())
+
+    def test_cancel(self) -> None:
+        """
+        1. The first reason to stop wins and kills once.
+        2. A failing kill is logged, not raised.
+
+        Author: Namah Shrestha
+        """
+        kill: mock.MagicMock = mock.MagicMock(side_effect=OSError())
+        limits: el.ExecLimits = el.ExecLimits()
+        limits.start(kill)
+        self.assertTrue(limits.cancel())
+        self.assertFalse(limits.stop(constants.TIMED_OUT))
+        kill.assert_called_once_with()
+        self.assertEqual(limits.notice(), "[cancelled]")
+
+    @mock.patch.object(constants, "EXEC_MAX_OUTPUT", 100)
+    @mock.patch.object(constants, "EXEC_TIMEOUT", 10.0)
+    def test_requested_limits(self) -> None:
+        """
+        A message can lower the server limits but not raise them.
+
+        Author: Namah Shrestha
+        """
+        limits: el.ExecLimits = el.requested_limits(2, 1000)
+        self.assertEqual((limits.timeout, limits.max_output), (2, 100))
+        limits = el.requested_limits()
+        self.assertEqual((limits.timeout, limits.max_output), (10.0, 100))
@@ -0,0 +1,79 @@
+"""
+Unit tests for the execution layer.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import unittest
+import asyncio
+import threading
+
+# modules
+import src
+import src.executor as executor
+import src.constants as constants
+
+
+class TestExecutor(unittest.TestCase):
+    """
+    Test the bounded executor pools. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def test_run_blocking(self) -> None:
+        """
+        The blocking function runs outside the event loop thread
+        and its result is returned.
+
+        Author: Namah Shrestha
+        """
+
+        def blocking(a: int, b: int) -> tuple:
+            return a + b, threading.current_thread().name
+
+        result, thread_name = asyncio.run(
+            executor.run_blocking(constants.EXECUTE, blocking, 1, 2)
+        )
+        self.assertEqual(result, 3)
+        self.assertTrue(thread_name.startswith("zod_exec"))
+
+    def test_slow_create_does_not_block_exec(self) -> None:
+        """
+        Fill every lifecycle worker with a blocked create.
+        An exec should still finish.
+
+        Author: Namah Shrestha
+        """
+        release: threading.Event = threading.Event()
+
+        async def run() -> str:
+            creates: list = [
+                asyncio.ensure_future(
+                    executor.run_blocking(constants.CREATE, release.wait, 5)
+                )
+                for _ in range(constants.LIFECYCLE_WORKERS + 1)
+            ]
+            exec_result: str = await asyncio.wait_for(
+                executor.run_blocking(constants.EXECUTE, lambda: "done"), 1
+            )
+            release.set()
+            await asyncio.gather(*creates)
+            return exec_result
+
+        self.assertEqual(asyncio.run(run()), "done")
+
+    def test_async_handle(self) -> None:
+        """
+        async_handle awaits the handle method of the instance.
+
+        Author: Namah Shrestha
+        """
+
+        class DummyInstance(src.Instance):
+            def handle(self, exec_command: str = None) -> list:
+                return [exec_command]
+
+        instance: src.Instance = DummyInstance("test_hash")
+        instance.command = constants.EXECUTE
+        self.assertEqual(asyncio.run(instance.async_handle("ls")), ["ls"])
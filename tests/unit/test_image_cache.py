@@ -0,0 +1,151 @@
+"""
+Unit tests for the image build cache.
+
+The digests are computed on a temporary build context.
+Docker calls are mocked.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.image_cache as ic
+
+
+class TestImageCache(unittest.TestCase):
+    """
+    Test ImageCache class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Create a build context with a dockerfile that copies a directory.
+
+        Author: Namah Shrestha
+        """
+        self.context: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.write("Dockerfile.test", "FROM centos\nCOPY app /app\nRUN ls\n")
+        self.write("app/main.py", "print(1)\n")
+        self.write("app/fe_src/index.js", "1\n")
+        self.write("unused.txt", "unused\n")
+        self.write(".dockerignore", "app/fe_src/\n")
+        self.cache: ic.ImageCache = ic.ImageCache(self.context.name)
+
+    def tearDown(self) -> None:
+        self.context.cleanup()
+
+    def write(self, relative_path: str, content: str) -> None:
+        """
+        Write a file of the build context.
+
+        Author: Namah Shrestha
+        """
+        path: str = os.path.join(self.context.name, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as context_file:
+            context_file.write(content)
+
+    def test_context_files(self) -> None:
+        """
+        Only copied files count, ignored files do not.
+
+        Author: Namah Shrestha
+        """
+        self.assertEqual(
+            self.cache.context_files("Dockerfile.test"),
+            [os.path.join(self.context.name, "app", "main.py")],
+        )
+
+    def test_context_digest(self) -> None:
+        """
+        1. Unused and ignored files do not change the digest.
+        2. Copied files and the dockerfile change the digest.
+
+        Author: Namah Shrestha
+        """
+        digest: str = self.cache.context_digest("Dockerfile.test")
+        self.write("unused.txt", "changed\n")
+        self.write("app/fe_src/index.js", "changed\n")
+        self.assertEqual(self.cache.context_digest("Dockerfile.test"), digest)
+        self.write("app/main.py", "print(2)\n")
+        copied_digest: str = self.cache.context_digest("Dockerfile.test")
+        self.assertNotEqual(copied_digest, digest)
+        self.write("Dockerfile.test", "FROM centos\nCOPY app /app\n")
+        self.assertNotEqual(self.cache.context_digest("Dockerfile.test"), copied_digest)
+
+    @mock.patch("os.system")
+    def test_ensure_image_builds_once(self, mock_system: mock.MagicMock) -> None:
+        """
+        A missing image is built once, later calls do not touch docker.
+
+        Author: Namah Shrestha
+        """
+        mock_system.side_effect = [1, 0]
+        image: str = self.cache.ensure_image("test", "latest", "Dockerfile.test")
+        self.assertEqual(image, f"test:{self.cache.context_digest('Dockerfile.test')}")
+        self.assertEqual(
+            self.cache.ensure_image("test", "latest", "Dockerfile.test"), image
+        )
+        self.assertEqual(mock_system.call_count, 2)
+        mock_system.assert_called_with(
+            f"docker image build {self.context.name} -t {image} "
+            f"-t test:latest -f Dockerfile.test"
+        )
+
+    @mock.patch("os.system")
+    def test_ensure_image_existing(self, mock_system: mock.MagicMock) -> None:
+        """
+        An existing tagged image is not built.
+
+        Author: Namah Shrestha
+        """
+        mock_system.return_value = 0
+        self.cache.ensure_image("test", "latest", "Dockerfile.test")
+        mock_system.assert_called_once()
+
+    @mock.patch("os.system")
+    def test_ensure_image_failed_build(self, mock_system: mock.MagicMock) -> None:
+        """
+        A failed build raises and is not cached.
+
+        Author: Namah Shrestha
+        """
+        mock_system.return_value = 1
+        with self.assertRaises(Exception):
+            self.cache.ensure_image("test", "latest", "Dockerfile.test")
+        self.assertEqual(self.cache.built, set())
+
+    @mock.patch("os.system")
+    def test_ensure_image_concurrent(self, mock_system: mock.MagicMock) -> None:
+        """
+        Concurrent calls for the same content build once.
+
+        Author: Namah Shrestha
+        """
+
+        def system(command: str) -> int:
+            return 1 if "inspect" in command else 0
+
+        mock_system.side_effect = system
+        threads: list = [
+            threading.Thread(
+                target=self.cache.ensure_image,
+                args=("test", "latest", "Dockerfile.test"),
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        build_calls: list = [
+            call for call in mock_system.call_args_list if "image build" in call[0][0]
+        ]
+        self.assertEqual(len(build_calls), 1)
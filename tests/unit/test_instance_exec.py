@@ -4,12 +4,51 @@ Unit tests for instance exec
 Author: Namah Shrestha
 """
 # built-ins
+import asyncio
+import shlex
+import subprocess
+import typing
 import unittest
 import unittest.mock as mock
 
 # modules
 import src.instance_exec as ie
+import src.container_index as ci
 import src.constants as constants
+import src.directory_state as ds
+import src.docker_backend as db
+import src.exec_limits as el
+import tests.unit.fake_docker as fake_docker
+
+
+class FakeExecStream(db.ExecStream):
+    """
+    Exec stream yielding the given chunks with the given exit code,
+    or raising the given error at the end, like a stale container id.
+
+    Author: Namah Shrestha
+    """
+
+    def __init__(
+        self,
+        chunks: list,
+        exit_code: int = 0,
+        error: typing.Optional[Exception] = None,
+    ) -> None:
+        super().__init__()
+        self.chunks: list = chunks
+        self.final_exit_code: int = exit_code
+        self.error: typing.Optional[Exception] = error
+        self.closed: bool = False
+
+    def read(self) -> typing.Iterator[bytes]:
+        yield from self.chunks
+        if self.error is not None:
+            raise self.error
+        self.exit_code = self.final_exit_code
+
+    def close(self) -> None:
+        self.closed = True
 
 
 class BaseTestInstanceExec:
@@ -64,6 +103,10 @@ class TestCentosInstanceExec(unittest.TestCase, BaseTestInstanceExec):
         self.filter_container_command: str = constants.CENTOS_FILTER_CONTAINER.format(
             self.container_name
         )
+        ci.container_index.clear()
+
+    def tearDown(self) -> None:
+        ci.container_index.clear()
 
     def test_parse_command_result(self) -> None:
         """
@@ -79,26 +122,128 @@ class TestCentosInstanceExec(unittest.TestCase, BaseTestInstanceExec):
         res: list = self.instance_exec_obj.parse_command_result("a\nb")
         self.assertEqual(res, ["a", "b"])
 
+    @mock.patch("src.docker_backend.DockerCLIBackend.stream_exec")
     @mock.patch("os.popen")
-    def test_exec_instance(self, mock_popen: mock.MagicMock) -> None:
+    def test_exec_instance(
+        self, mock_popen: mock.MagicMock, mock_stream_exec: mock.MagicMock
+    ) -> None:
         """
         Test execution command for docker container exec
+        1. An unindexed container is resolved once and indexed.
+        2. A missing container falls back to the lookup subshell.
 
         Author: Namah Shrestha
         """
-        mock_popen.read = mock.MagicMock()
+        mock_popen.return_value.read.side_effect = ["test_id\n", ""]
+        mock_stream_exec.side_effect = lambda *args: FakeExecStream([b"a"])
         self.command = constants.EXECUTE
         self.exec_command = "ls"
         self.instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
             self.command, self.instance_hash
         )
         super(BaseTestInstanceExec, self).__init__()
+        self.assertEqual(self.instance_exec_obj.exec_instance(self.exec_command), "a")
+        mock_popen.assert_called_once_with(self.filter_container_command)
+        mock_stream_exec.assert_called_once_with(
+            self.container_name, self.exec_command, "test_id", None, mock.ANY
+        )
+        self.assertEqual(ci.container_index.get(self.instance_hash), "test_id")
+        ci.container_index.clear()
+        self.instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
+            self.command, self.instance_hash
+        )
+        self.instance_exec_obj.exec_instance(self.exec_command)
+        mock_stream_exec.assert_called_with(
+            self.container_name, self.exec_command, None, None, mock.ANY
+        )
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.stream_exec")
+    def test_exec_instance_indexed(self, mock_stream_exec: mock.MagicMock) -> None:
+        """
+        An indexed container is used without any lookup.
+        Every exec is tagged with an exec id of its own.
+
+        Author: Namah Shrestha
+        """
+        mock_stream_exec.side_effect = lambda *args: FakeExecStream([])
+        ci.container_index.set(self.instance_hash, "test_id")
+        with mock.patch("os.popen") as mock_popen:
+            for _ in range(2):
+                ie.CentosInstanceExec(
+                    constants.EXECUTE, self.instance_hash
+                ).exec_instance("ls")
+        mock_popen.assert_not_called()
+        mock_stream_exec.assert_called_with(
+            self.container_name, "ls", "test_id", None, mock.ANY
+        )
+        exec_ids: set = {call.args[4] for call in mock_stream_exec.call_args_list}
+        self.assertEqual(len(exec_ids), 2)
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.stream_exec")
+    @mock.patch("os.popen")
+    def test_exec_instance_stale_id(
+        self, mock_popen: mock.MagicMock, mock_stream_exec: mock.MagicMock
+    ) -> None:
+        """
+        A stale container id triggers one re-resolve and a retry.
+
+        Author: Namah Shrestha
+        """
+        mock_popen.return_value.read.return_value = "new_id\n"
+        stale_stream: FakeExecStream = FakeExecStream(
+            [], error=db.ContainerNotFoundError("stale_id")
+        )
+        mock_stream_exec.side_effect = [stale_stream, FakeExecStream([b"a"])]
+        ci.container_index.set(self.instance_hash, "stale_id")
+        instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
+            constants.EXECUTE, self.instance_hash
+        )
+        self.assertEqual(instance_exec_obj.exec_instance("ls"), "a")
+        self.assertEqual(
+            [call.args[:4] for call in mock_stream_exec.call_args_list],
+            [
+                (self.container_name, "ls", "stale_id", None),
+                (self.container_name, "ls", "new_id", None),
+            ],
+        )
+        mock_popen.assert_called_once_with(self.filter_container_command)
+        self.assertTrue(stale_stream.closed)
+        self.assertEqual(ci.container_index.get(self.instance_hash), "new_id")
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.stream_exec")
+    def test_exec_instance_with_container_id(
+        self, mock_stream_exec: mock.MagicMock
+    ) -> None:
+        """
+        With a known container id the lookup subshell is skipped.
+
+        Author: Namah Shrestha
+        """
+        mock_stream_exec.return_value = FakeExecStream([])
+        self.command = constants.EXECUTE
+        self.exec_command = "ls"
+        self.instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
+            self.command, self.instance_hash, "test_id"
+        )
         self.instance_exec_obj.exec_instance(self.exec_command)
-        mock_popen.assert_called_with(
-            f"docker container exec "
-            f"$({self.filter_container_command}) {self.exec_command}"
+        mock_stream_exec.assert_called_with(
+            self.container_name, self.exec_command, "test_id", None, mock.ANY
         )
 
+    @mock.patch("os.popen")
+    def test_resolve_container_id(self, mock_popen: mock.MagicMock) -> None:
+        """
+        Resolving the container id runs the filter command once.
+
+        Author: Namah Shrestha
+        """
+        mock_popen.return_value.read.return_value = "test_id\n"
+        self.instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
+            constants.EXECUTE, self.instance_hash
+        )
+        self.assertEqual(self.instance_exec_obj.resolve_container_id(), "test_id")
+        mock_popen.assert_called_with(self.filter_container_command)
+
     @mock.patch("src.instance_exec.InstanceExec.parse_command_result")
     @mock.patch("src.instance_exec.InstanceExec.exec_instance")
     def test_handle(
@@ -120,3 +265,287 @@ class TestCentosInstanceExec(unittest.TestCase, BaseTestInstanceExec):
         self.instance_exec_obj.handle(self.exec_command)
         mock_exec_instance.assert_called_with("ls")
         mock_parse_command_result.assert_called()
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.stream_exec")
+    def test_stream_instance(self, mock_stream_exec: mock.MagicMock) -> None:
+        """
+        1. Complete lines are yielded per read, partial lines held back.
+        2. A character split between reads is decoded whole.
+        3. Chunks are bounded by the line limit.
+        4. The last chunk carries the rest and the exit code is set.
+
+        Author: Namah Shrestha
+        """
+        stream: FakeExecStream = FakeExecStream(
+            [b"a\nb", b"c\n\xc3", b"\xa9\n1\n2\n3\nd"], exit_code=3
+        )
+        mock_stream_exec.return_value = stream
+        ci.container_index.set(self.instance_hash, "test_id")
+        instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
+            constants.EXECUTE, self.instance_hash
+        )
+        with mock.patch.object(constants, "STREAM_CHUNK_LINES", 2):
+            chunks: list = list(instance_exec_obj.stream_instance("ls"))
+        self.assertEqual(chunks, [["a"], ["bc"], ["\u00e9", "1"], ["2", "3"], ["d"]])
+        self.assertEqual(instance_exec_obj.exit_code, 3)
+        self.assertTrue(stream.closed)
+        mock_stream_exec.assert_called_once_with(
+            self.container_name, "ls", "test_id", None, mock.ANY
+        )
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.stream_exec")
+    def test_async_stream(self, mock_stream_exec: mock.MagicMock) -> None:
+        """
+        1. Every chunk is sent from the event loop and the exit code returned.
+        2. A failing send stops the stream.
+
+        Author: Namah Shrestha
+        """
+        mock_stream_exec.return_value = FakeExecStream([b"a\n", b"b"], exit_code=1)
+        ci.container_index.set(self.instance_hash, "test_id")
+        sent: list = []
+
+        async def send_chunk(chunk: list) -> None:
+            sent.append(chunk)
+
+        exit_code: int = asyncio.run(
+            ie.CentosInstanceExec(constants.EXECUTE, self.instance_hash).async_stream(
+                send_chunk, "ls"
+            )
+        )
+        self.assertEqual((sent, exit_code), ([["a"], ["b"]], 1))
+        stream: FakeExecStream = FakeExecStream([b"a\n"] * 100)
+        mock_stream_exec.return_value = stream
+
+        async def failing_send_chunk(chunk: list) -> None:
+            raise ConnectionError()
+
+        async def stream_and_wait() -> None:
+            with self.assertRaises(ConnectionError):
+                await ie.CentosInstanceExec(
+                    constants.EXECUTE, self.instance_hash
+                ).async_stream(failing_send_chunk, "ls")
+            for _ in range(100):
+                if stream.closed:
+                    return
+                await asyncio.sleep(0.01)
+
+        asyncio.run(stream_and_wait())
+        self.assertTrue(stream.closed)
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.open_shell")
+    def test_exec_instance_in_shell(self, mock_open_shell: mock.MagicMock) -> None:
+        """
+        1. With keep_shell the command runs in the persistent shell.
+        2. The shell is reused for the next command.
+        3. A shell that exited is started again.
+
+        Author: Namah Shrestha
+        """
+        channels: list = [
+            fake_docker.FakeShellChannel({"ls": (2, b"a\nb", b"")}),
+            fake_docker.FakeShellChannel({"ls": (0, b"c", b"")}),
+        ]
+        mock_open_shell.side_effect = channels
+        ci.container_index.set(self.instance_hash, "test_id")
+        shell = None
+        for exec_command, result, exit_code in [
+            ("ls", ["a", "b"], 2),
+            ("exit", [""], 0),
+            ("ls", ["c"], 0),
+        ]:
+            instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
+                constants.EXECUTE, self.instance_hash
+            )
+            instance_exec_obj.keep_shell = True
+            instance_exec_obj.shell = shell
+            self.assertEqual(instance_exec_obj.handle(exec_command), result)
+            self.assertEqual(instance_exec_obj.exit_code, exit_code)
+            shell = instance_exec_obj.shell
+        self.assertEqual(channels[0].commands, ["true", "ls", "exit"])
+        self.assertEqual(channels[1].commands, ["true", "ls"])
+        mock_open_shell.assert_called_with(self.container_name, "test_id", mock.ANY)
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.open_shell")
+    def test_exec_batch(self, mock_open_shell: mock.MagicMock) -> None:
+        """
+        Run against a local shell standing in for the container:
+        1. With stop on error the commands after a failure do not run.
+        2. With continue every command runs, in the same shell.
+
+        Author: Namah Shrestha
+        """
+        mock_open_shell.side_effect = lambda *args: db.CLIExecChannel("/bin/bash")
+        ci.container_index.set(self.instance_hash, "test_id")
+        exec_commands: list = ["cd /", "printf a; false", "pwd"]
+        instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
+            constants.EXECUTE, self.instance_hash
+        )
+        instance_exec_obj.keep_shell = True
+        self.assertEqual(
+            instance_exec_obj.exec_batch(exec_commands),
+            [
+                {"exec_command": "cd /", "output": [""], "exit_code": 0},
+                {"exec_command": "printf a; false", "output": ["a"], "exit_code": 1},
+            ],
+        )
+        self.assertEqual(
+            instance_exec_obj.exec_batch(exec_commands, stop_on_error=False)[2],
+            {"exec_command": "pwd", "output": ["/", ""], "exit_code": 0},
+        )
+        instance_exec_obj.shell.close()
+        mock_open_shell.assert_called_once()
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.kill_exec")
+    @mock.patch("src.docker_backend.DockerCLIBackend.open_shell")
+    def test_exec_limits_in_shell(
+        self, mock_open_shell: mock.MagicMock, mock_kill_exec: mock.MagicMock
+    ) -> None:
+        """
+        Run against a local shell standing in for the container:
+        1. A command past the timeout is killed with its shell and the
+           result tells it timed out.
+        2. Output past the cap is cut off and the batch result flagged.
+        3. The next command gets a new shell.
+
+        Author: Namah Shrestha
+        """
+        channels: list = []
+
+        def open_shell(*args: typing.Any) -> db.ExecChannel:
+            channels.append(db.CLIExecChannel("exec /bin/bash"))
+            return channels[-1]
+
+        mock_open_shell.side_effect = open_shell
+        mock_kill_exec.side_effect = lambda *args: subprocess.run(
+            f"pkill -KILL -P {channels[-1].process.pid}; kill -KILL "
+            f"{channels[-1].process.pid}",
+            shell=True,
+        )
+        ci.container_index.set(self.instance_hash, "test_id")
+        instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
+            constants.EXECUTE, self.instance_hash
+        )
+        instance_exec_obj.keep_shell = True
+        instance_exec_obj.limits = el.ExecLimits(timeout=0.2)
+        self.assertEqual(
+            instance_exec_obj.handle("echo a; sleep 10"),
+            ["a", "", "[timed out after 0.2s]"],
+        )
+        mock_kill_exec.assert_called_once_with(
+            self.container_name, "test_id", mock_open_shell.call_args.args[2]
+        )
+        instance_exec_obj.limits = el.ExecLimits(max_output=1000)
+        result: list = instance_exec_obj.exec_batch(["echo a", "yes", "pwd"])
+        self.assertEqual(
+            (result[1][constants.BATCH_EXIT_CODE], result[1][constants.TRUNCATED]),
+            (None, True),
+        )
+        self.assertEqual(set(result[1][constants.BATCH_OUTPUT][:-1]), {"y"})
+        self.assertEqual(len(result), 2)
+        instance_exec_obj.limits = el.ExecLimits()
+        self.assertEqual(instance_exec_obj.handle("echo b"), ["b", ""])
+        self.assertEqual(len(channels), 3)
+        instance_exec_obj.shell.close()
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.stream_exec")
+    def test_exec_batch_without_shell(self, mock_stream_exec: mock.MagicMock) -> None:
+        """
+        Without the persistent shell the batch runs in one docker exec.
+
+        Author: Namah Shrestha
+        """
+        mock_stream_exec.return_value = FakeExecStream([b"a\nm0 0\nm1 2\n"])
+        ci.container_index.set(self.instance_hash, "test_id")
+        instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
+            constants.EXECUTE, self.instance_hash
+        )
+        script, _ = instance_exec_obj.batch_script(["ls", "pwd"])
+        with mock.patch.object(
+            instance_exec_obj, "batch_script", return_value=(script, ["m0", "m1"])
+        ):
+            self.assertEqual(
+                [
+                    result["exit_code"]
+                    for result in instance_exec_obj.exec_batch(["ls", "pwd"])
+                ],
+                [0, 2],
+            )
+        mock_stream_exec.assert_called_once_with(
+            self.container_name,
+            f"/bin/sh -c {shlex.quote(script)}",
+            "test_id",
+            None,
+            mock.ANY,
+        )
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.stream_exec")
+    @mock.patch("os.popen")
+    def test_change_directory(
+        self, mock_popen: mock.MagicMock, mock_stream_exec: mock.MagicMock
+    ) -> None:
+        """
+        Without the persistent shell:
+        1. cd asks the container for the directory and runs nothing else.
+        2. Later commands run in the tracked directory.
+        3. A missing directory keeps the tracked one and fails.
+
+        Author: Namah Shrestha
+        """
+        mock_popen.return_value.read.side_effect = ["/tmp\n", ""]
+        mock_popen.return_value.close.return_value = None
+        mock_stream_exec.return_value = FakeExecStream([b"a"])
+        ci.container_index.set(self.instance_hash, "test_id")
+        handler: ds.ChangeDirectoryHandler = ds.ChangeDirectoryHandler()
+        for exec_command, result, exit_code in [
+            ("cd tmp", [""], 0),
+            ("ls", ["a"], 0),
+            ("cd missing", [""], 1),
+        ]:
+            instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
+                constants.EXECUTE, self.instance_hash
+            )
+            instance_exec_obj.change_directory_handler = handler
+            self.assertEqual(instance_exec_obj.handle(exec_command), result)
+            self.assertEqual(instance_exec_obj.exit_code, exit_code)
+        self.assertEqual(handler.get_cwd(), "/tmp")
+        self.assertEqual(
+            mock_popen.call_args_list,
+            [
+                mock.call("docker container exec -w /tmp test_id pwd"),
+                mock.call("docker container exec -w /tmp/missing test_id pwd"),
+            ],
+        )
+        mock_stream_exec.assert_called_once_with(
+            self.container_name, "ls", "test_id", "/tmp", mock.ANY
+        )
+
+    @mock.patch("src.docker_backend.DockerCLIBackend.open_shell")
+    def test_track_shell_directory(self, mock_open_shell: mock.MagicMock) -> None:
+        """
+        The shell reports its directory after every command.
+        A shell started again goes back to the tracked directory.
+        A local shell stands in for the container.
+
+        Author: Namah Shrestha
+        """
+        mock_open_shell.side_effect = lambda *args: db.CLIExecChannel("/bin/bash")
+        ci.container_index.set(self.instance_hash, "test_id")
+        handler: ds.ChangeDirectoryHandler = ds.ChangeDirectoryHandler()
+        shell = None
+        for exec_command, result in [
+            ("cd /tmp", [""]),
+            ("exit", [""]),
+            ("pwd", ["/tmp", ""]),
+        ]:
+            instance_exec_obj: ie.InstanceExec = ie.CentosInstanceExec(
+                constants.EXECUTE, self.instance_hash
+            )
+            instance_exec_obj.keep_shell = True
+            instance_exec_obj.shell = shell
+            instance_exec_obj.change_directory_handler = handler
+            self.assertEqual(instance_exec_obj.handle(exec_command), result)
+            shell = instance_exec_obj.shell
+        shell.close()
+        self.assertEqual(handler.get_cwd(), "/tmp")
+        self.assertEqual(mock_open_shell.call_count, 2)
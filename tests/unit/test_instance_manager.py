@@ -5,12 +5,18 @@ Author: Namah Shrestha
 """
 
 # built-ins
+import os
+import tempfile
+import threading
 import unittest
 import unittest.mock as mock
 import typing
 
 # modules
 import src.instance_manager as im
+import src.image_cache as ic
+import src.container_index as ci
+import src.session_registry as sr
 import src.constants as constants
 
 
@@ -79,13 +85,30 @@ class TestCentosInstanceManager(unittest.TestCase, BaseTestInstanceManager):
             self.container_name
         )
 
+    def tearDown(self) -> None:
+        ci.container_index.clear()
+
+    @mock.patch.object(ic, "image_cache", ic.ImageCache())
+    @mock.patch.object(ci.time, "time", mock.MagicMock(return_value=100.0))
+    @mock.patch("os.popen")
     @mock.patch("os.system")
-    def test_creation(self, mock_system: mock.MagicMock) -> None:
+    def test_creation(
+        self, mock_system: mock.MagicMock, mock_popen: mock.MagicMock
+    ) -> None:
         """
         Test creation of instances. Unit
+        The image does not exist yet, so it is built with its content tag.
+        The container is labelled with the instance and its id is indexed.
 
         Author: Namah Shrestha
         """
+        mock_system.side_effect = [1, 0]
+        mock_popen.return_value.read.return_value = "test_id\n"
+        mock_popen.return_value.close.return_value = None
+        image: str = (
+            f"{self.image_name}:"
+            f"{ic.image_cache.context_digest(self.dockerfile_name)}"
+        )
         self.command = constants.CREATE
         self.instance_mgr_obj: im.InstanceManager = im.CentosInstanceManager(
             self.command, self.instance_hash
@@ -97,18 +120,134 @@ class TestCentosInstanceManager(unittest.TestCase, BaseTestInstanceManager):
         self.assertEqual(
             result,
             [
-                f"docker image build . -t "
-                f"{self.image_name}:{self.image_tag} -f "
+                f"docker image inspect {image} > /dev/null 2>&1",
+                f"docker image build . -t {image} "
+                f"-t {self.image_name}:{self.image_tag} -f "
                 f"{self.dockerfile_name}",
-                f"docker container run --name "
-                f"{self.container_name} -d {self.image_name}:{self.image_tag}",
             ],
         )
+        mock_popen.assert_called_once_with(
+            f"docker container run --name {self.container_name} "
+            "--label zod.instance_os=centos --label zod.created_at=100.000 "
+            f"--label zod.instance_hash={self.instance_hash} -d {image}"
+        )
+        self.assertEqual(ci.container_index.get(self.instance_hash), "test_id")
+
+    @mock.patch.object(ic, "image_cache", ic.ImageCache())
+    @mock.patch("os.popen")
+    @mock.patch("os.system")
+    def test_creation_cached_image(
+        self, mock_system: mock.MagicMock, mock_popen: mock.MagicMock
+    ) -> None:
+        """
+        Test creation of instances when the image is cached. Unit
+        The second creation neither inspects nor builds the image.
+
+        Author: Namah Shrestha
+        """
+        mock_system.return_value = 0
+        mock_popen.return_value.read.return_value = "test_id\n"
+        mock_popen.return_value.close.return_value = None
+        for instance_hash in (self.instance_hash, f"{self.instance_hash}_2"):
+            im.CentosInstanceManager(constants.CREATE, instance_hash).create_instance()
+        result: typing.List = [call[0][0] for call in mock_system.call_args_list]
+        self.assertEqual(len([cmd for cmd in result if "image build" in cmd]), 0)
+        self.assertEqual(len([cmd for cmd in result if "image inspect" in cmd]), 1)
+        self.assertEqual(mock_popen.call_count, 2)
+
+    @mock.patch.object(ic, "image_cache", ic.ImageCache())
+    @mock.patch("os.popen")
+    @mock.patch("os.system")
+    def test_creation_failed(
+        self, mock_system: mock.MagicMock, mock_popen: mock.MagicMock
+    ) -> None:
+        """
+        A container that could not be run fails the creation,
+        and the session is forgotten.
+
+        Author: Namah Shrestha
+        """
+        mock_system.return_value = 0
+        mock_popen.return_value.read.return_value = ""
+        mock_popen.return_value.close.return_value = 256
+        with self.assertRaises(Exception):
+            im.CentosInstanceManager(
+                constants.CREATE, self.instance_hash
+            ).create_instance()
+        self.assertIsNone(ci.container_index.get(self.instance_hash))
+        self.assertEqual(ic.image_cache.built, set())
+
+    @mock.patch("os.popen")
+    @mock.patch("os.system")
+    def test_creation_running(
+        self, mock_system: mock.MagicMock, mock_popen: mock.MagicMock
+    ) -> None:
+        """
+        Creating a session that runs already makes no docker call.
+
+        Author: Namah Shrestha
+        """
+        ci.container_index.set(self.instance_hash, "test_id")
+        instance_mgr_obj: im.InstanceManager = im.CentosInstanceManager(
+            constants.CREATE, self.instance_hash
+        )
+        self.assertEqual(instance_mgr_obj.running_container(), "test_id")
+        instance_mgr_obj.create_instance()
+        mock_system.assert_not_called()
+        mock_popen.assert_not_called()
+        self.assertEqual(ci.container_index.get(self.instance_hash), "test_id")
+
+    @mock.patch.object(constants, "CREATE_POLL_INTERVAL", 0.01)
+    @mock.patch("os.popen")
+    @mock.patch("os.system")
+    def test_creation_in_other_worker(
+        self, mock_system: mock.MagicMock, mock_popen: mock.MagicMock
+    ) -> None:
+        """
+        A session another worker process is creating is waited for
+        and not created again.
+
+        Author: Namah Shrestha
+        """
+        directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path: str = os.path.join(directory.name, "sessions.db")
+        registry: sr.SessionRegistry = sr.SessionRegistry(path)
+        other: sr.SessionRegistry = sr.SessionRegistry(path)
+        self.addCleanup(registry.close)
+        self.addCleanup(other.close)
+        self.assertTrue(other.claim(self.instance_hash, constants.CENTOS))
+        worker: threading.Timer = threading.Timer(
+            0.05, other.set_container, (self.instance_hash, "other_id")
+        )
+        worker.start()
+        with mock.patch.object(sr, "session_registry", registry):
+            with mock.patch.object(ci.container_index, "registry", registry):
+                im.CentosInstanceManager(
+                    constants.CREATE, self.instance_hash
+                ).create_instance()
+        worker.join()
+        mock_system.assert_not_called()
+        mock_popen.assert_not_called()
+        self.assertEqual(registry.container_id(self.instance_hash), "other_id")
+
+    @mock.patch("os.system")
+    def test_deletion_indexed(self, mock_system: mock.MagicMock) -> None:
+        """
+        Deleting an indexed instance removes it by id and clears the index.
+
+        Author: Namah Shrestha
+        """
+        ci.container_index.set(self.instance_hash, "test_id")
+        im.CentosInstanceManager(constants.DELETE, self.instance_hash).delete_instance()
+        mock_system.assert_called_once_with("docker container rm -f test_id")
+        self.assertIsNone(ci.container_index.get(self.instance_hash))
 
     @mock.patch("os.system")
     def test_deletion(self, mock_system: mock.MagicMock) -> None:
         """
         Test deletion of instances. Unit.
+        The shared image is not removed.
 
         Author: Namah Shrestha
         """
@@ -124,7 +263,6 @@ class TestCentosInstanceManager(unittest.TestCase, BaseTestInstanceManager):
             result,
             [
                 f"docker container rm -f $({self.filter_container_command})",
-                f"docker image rm -f {self.image_name}:{self.image_tag}",
             ],
         )
 
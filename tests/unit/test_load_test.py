@@ -0,0 +1,57 @@
+"""
+Unit tests for the load test harness.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import asyncio
+import io
+import unittest
+import unittest.mock as mock
+
+# modules
+import benchmarks.load_test as load_test
+import src.constants as constants
+import src.container_index as ci
+import src.image_cache as ic
+
+
+class TestLoadTest(unittest.TestCase):
+    """
+    Test the load test against the fake backend. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def tearDown(self) -> None:
+        ci.container_index.clear()
+
+    def test_percentile(self) -> None:
+        ordered: list = list(range(1, 101))
+        self.assertEqual(load_test.percentile(ordered, 50), 50)
+        self.assertEqual(load_test.percentile(ordered, 99), 99)
+        self.assertEqual(load_test.percentile([7], 95), 7)
+
+    @mock.patch.object(ic, "image_cache", ic.ImageCache())
+    def test_fake_run(self) -> None:
+        """
+        Every session of every client runs CREATE, EXEC and DELETE
+        without errors and the report has a row per command.
+
+        Author: Namah Shrestha
+        """
+        options = load_test.parse_options(
+            ["--fake", "--clients", "3", "--sessions", "2", "--execs", "2"]
+        )
+        with mock.patch("sys.stdout", io.StringIO()) as stdout:
+            stats: load_test.LoadStats = asyncio.run(load_test.run_load(options))
+        self.assertEqual(stdout.getvalue(), "")
+        summary: dict = stats.summary()
+        self.assertEqual(summary[constants.CREATE]["count"], 6)
+        self.assertEqual(summary[constants.EXECUTE]["count"], 12)
+        self.assertEqual(summary[constants.DELETE]["count"], 6)
+        for row in summary.values():
+            self.assertEqual((row["errors"], row["busy"]), (0, 0))
+        report: str = load_test.report(stats)
+        self.assertIn("p99", report)
+        self.assertIn("24 messages", report)
@@ -0,0 +1,134 @@
+"""
+Unit tests for the message parsing.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import json
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.constants as constants
+import src.message as msg
+
+
+class TestParseMessage(unittest.TestCase):
+    """
+    Test parse_message function. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        self.fields: dict = {
+            constants.INSTANCE_OS: constants.CENTOS,
+            constants.COMMAND: constants.EXECUTE,
+            constants.INSTANCE_HASH: "test_hash",
+            constants.EXEC_COMMAND: "ls",
+        }
+
+    def assert_invalid(self, message: str, error: str) -> None:
+        with self.assertRaises(ValueError) as context:
+            msg.parse_message(message)
+        self.assertEqual(str(context.exception), error)
+
+    def test_valid_message(self) -> None:
+        """
+        A valid message becomes a message object, with and without orjson.
+
+        Author: Namah Shrestha
+        """
+        self.fields[constants.STREAM] = True
+        for loads in (msg.loads, json.loads):
+            with mock.patch.object(msg, "loads", loads):
+                message: msg.Message = msg.parse_message(json.dumps(self.fields))
+            self.assertEqual(
+                (
+                    message.instance_os,
+                    message.command,
+                    message.instance_hash,
+                    message.exec_command,
+                    message.stream,
+                ),
+                (constants.CENTOS, constants.EXECUTE, "test_hash", "ls", True),
+            )
+            self.assertFalse(hasattr(message, "__dict__"))
+
+    def test_invalid_message(self) -> None:
+        """
+        1. Non json and non object messages are rejected.
+        2. Missing or mistyped required fields are rejected.
+        3. Unknown fields, values and unsafe hashes are rejected.
+        4. EXEC needs an exec_command and stream needs a boolean.
+
+        Author: Namah Shrestha
+        """
+        self.assert_invalid("test_message", msg.INVALID_JSON_ERROR)
+        self.assert_invalid("[]", msg.INVALID_MESSAGE_ERROR)
+        for key, value, error in [
+            (constants.COMMAND, None, msg.INVALID_MESSAGE_ERROR),
+            (constants.INSTANCE_HASH, 1, msg.INVALID_MESSAGE_ERROR),
+            ("x", 1, "Unknown message fields: x"),
+            (constants.INSTANCE_OS, "os", "Unsupported instance os: os"),
+            (constants.COMMAND, "RUN", "Unsupported command: RUN"),
+            (constants.INSTANCE_HASH, "a;rm", "Invalid instance hash: a;rm"),
+            (constants.EXEC_COMMAND, ["ls"], "exec_command should be a string"),
+            (constants.EXEC_COMMAND, "", "EXEC needs an exec_command"),
+            (constants.STREAM, "yes", "stream should be true or false"),
+            (
+                constants.EXEC_COMMANDS,
+                ["ls"],
+                "Send either exec_command or exec_commands",
+            ),
+            (
+                constants.EXEC_COMMANDS,
+                [],
+                "exec_commands should be a list of 1 to 100 commands",
+            ),
+            (constants.ON_ERROR, "ignore", "on_error should be stop or continue"),
+            (constants.TIMEOUT, 0, "timeout should be a positive number of seconds"),
+            (
+                constants.MAX_OUTPUT,
+                1.5,
+                "max_output should be a positive number of bytes",
+            ),
+        ]:
+            fields: dict = {**self.fields, key: value}
+            if value is None:
+                del fields[key]
+            self.assert_invalid(json.dumps(fields), error)
+
+    def test_batch_message(self) -> None:
+        """
+        A batch carries the command list and the error mode.
+
+        Author: Namah Shrestha
+        """
+        del self.fields[constants.EXEC_COMMAND]
+        self.fields[constants.EXEC_COMMANDS] = ["ls", "pwd"]
+        message: msg.Message = msg.parse_message(json.dumps(self.fields))
+        self.assertEqual(message.exec_commands, ["ls", "pwd"])
+        self.assertTrue(message.stop_on_error)
+        self.fields[constants.ON_ERROR] = constants.CONTINUE_ON_ERROR
+        message = msg.parse_message(json.dumps(self.fields))
+        self.assertFalse(message.stop_on_error)
+        self.fields[constants.STREAM] = True
+        with self.assertRaises(ValueError):
+            msg.parse_message(json.dumps(self.fields))
+
+    def test_limits_and_cancel(self) -> None:
+        """
+        1. An EXEC can ask for a timeout and an output cap.
+        2. A CANCEL is recognized from the parsed message.
+
+        Author: Namah Shrestha
+        """
+        self.fields[constants.TIMEOUT] = 2.5
+        self.fields[constants.MAX_OUTPUT] = 100
+        message: msg.Message = msg.parse_message(json.dumps(self.fields))
+        self.assertEqual((message.timeout, message.max_output), (2.5, 100))
+        self.assertFalse(msg.is_cancel(message))
+        self.fields[constants.COMMAND] = constants.CANCEL
+        self.assertTrue(msg.is_cancel(msg.parse_message(json.dumps(self.fields))))
+        self.assertFalse(msg.is_cancel(None))
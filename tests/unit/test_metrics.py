@@ -0,0 +1,185 @@
+"""
+Unit tests for the metrics registry.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import asyncio
+import unittest
+
+# modules
+import src.constants as constants
+import src.metrics as metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Test the metric types and their text format. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        self.registry: metrics.Registry = metrics.Registry()
+
+    def test_counter_and_gauge(self) -> None:
+        """
+        1. Counters and gauges keep one value per label values.
+        2. They render in the prometheus text format.
+
+        Author: Namah Shrestha
+        """
+        counter: metrics.Counter = self.registry.counter(
+            "zod_test_total", "Test counter.", ("command",)
+        )
+        gauge: metrics.Gauge = self.registry.gauge("zod_test_gauge", "Test gauge.")
+        counter.inc(constants.CREATE)
+        counter.inc(constants.CREATE, amount=2)
+        gauge.inc()
+        gauge.dec()
+        gauge.set(5)
+        self.assertEqual(counter.get(constants.CREATE), 3)
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP zod_test_total Test counter.\n"
+            "# TYPE zod_test_total counter\n"
+            'zod_test_total{command="CREATE"} 3\n'
+            "# HELP zod_test_gauge Test gauge.\n"
+            "# TYPE zod_test_gauge gauge\n"
+            "zod_test_gauge 5\n",
+        )
+        with self.assertRaises(ValueError):
+            counter.inc()
+        with self.assertRaises(ValueError):
+            self.registry.counter("zod_test_total", "Taken.")
+
+    def test_histogram(self) -> None:
+        """
+        Buckets are cumulative and end with +Inf, followed by sum and count.
+
+        Author: Namah Shrestha
+        """
+        histogram: metrics.Histogram = self.registry.histogram(
+            "zod_test_seconds", "Test histogram.", ("os",), buckets=(0.1, 1)
+        )
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, constants.CENTOS)
+        self.assertEqual(histogram.get(constants.CENTOS), {"count": 3, "sum": 5.55})
+        self.assertIn(
+            'zod_test_seconds_bucket{os="centos",le="0.1"} 1\n'
+            'zod_test_seconds_bucket{os="centos",le="1.0"} 2\n'
+            'zod_test_seconds_bucket{os="centos",le="+Inf"} 3\n'
+            'zod_test_seconds_sum{os="centos"} 5.55\n'
+            'zod_test_seconds_count{os="centos"} 3\n',
+            self.registry.render(),
+        )
+
+    def test_label_escaping(self) -> None:
+        self.assertEqual(
+            metrics.format_labels({"error": 'a"b\\c\n'}), '{error="a\\"b\\\\c\\n"}'
+        )
+
+    def test_stats_collector(self) -> None:
+        """
+        1. Every numeric stats key becomes a gauge.
+        2. A failing collector does not break the scrape.
+
+        Author: Namah Shrestha
+        """
+        self.registry.register_collector(
+            metrics.stats_collector(
+                "zod_pool",
+                "Pool stats.",
+                ("instance_os",),
+                lambda: [(("centos",), {"instance_os": "centos", "idle": 2})],
+            )
+        )
+        self.registry.register_collector(lambda: 1 / 0)
+        with self.assertLogs(metrics.logger, "ERROR"):
+            text: str = self.registry.render()
+        self.assertIn('zod_pool_idle{instance_os="centos"} 2\n', text)
+        self.assertNotIn("zod_pool_instance_os", text)
+
+    def test_docker_operation(self) -> None:
+        """
+        1. Docker operations are timed.
+        2. Exceptions and failure results count as errors.
+
+        Author: Namah Shrestha
+        """
+
+        @metrics.docker_operation("test_op", failure_result=False)
+        def operation(result: bool) -> bool:
+            if result is None:
+                raise OSError("docker failed")
+            return result
+
+        before: dict = metrics.docker_latency.get("test_op")
+        operation(True)
+        operation(False)
+        with self.assertRaises(OSError):
+            operation(None)
+        self.assertEqual(
+            metrics.docker_latency.get("test_op")["count"], before["count"] + 3
+        )
+        self.assertEqual(metrics.docker_errors.get("test_op"), 2)
+        self.assertEqual(metrics.docker_in_flight.get("test_op"), 0)
+
+    def test_track_request(self) -> None:
+        """
+        Requests are counted in flight while they run and their errors by type.
+
+        Author: Namah Shrestha
+        """
+        with self.assertRaises(KeyError):
+            with metrics.track_request("TEST", constants.CENTOS):
+                self.assertEqual(
+                    metrics.requests_in_flight.get("TEST", constants.CENTOS), 1
+                )
+                raise KeyError()
+        self.assertEqual(metrics.requests_in_flight.get("TEST", constants.CENTOS), 0)
+        self.assertEqual(
+            metrics.request_errors.get("TEST", constants.CENTOS, "KeyError"), 1
+        )
+        self.assertEqual(
+            metrics.request_latency.get("TEST", constants.CENTOS)["count"], 1
+        )
+
+
+class TestMetricsServer(unittest.TestCase):
+    """
+    Test MetricsServer class over a local socket. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def test_scrape(self) -> None:
+        """
+        1. GET /metrics answers with the registry.
+        2. Any other path is not found.
+
+        Author: Namah Shrestha
+        """
+        registry: metrics.Registry = metrics.Registry()
+        registry.counter("zod_scrape_total", "Scrapes.").inc()
+        server: metrics.MetricsServer = metrics.MetricsServer(registry)
+
+        async def get(port: int, path: str) -> bytes:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            response: bytes = await reader.read()
+            writer.close()
+            return response
+
+        async def run() -> tuple:
+            listening = await server.start("127.0.0.1", 0)
+            port: int = listening.sockets[0].getsockname()[1]
+            try:
+                return await get(port, "/metrics"), await get(port, "/")
+            finally:
+                await server.stop()
+
+        found, not_found = asyncio.run(run())
+        self.assertTrue(found.startswith(b"HTTP/1.1 200 OK\r\n"))
+        self.assertIn(b"\r\n\r\n# HELP zod_scrape_total Scrapes.\n", found)
+        self.assertTrue(not_found.startswith(b"HTTP/1.1 404 Not Found\r\n"))
@@ -0,0 +1,309 @@
+"""
+Unit tests for the idle session reaper.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import asyncio
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.constants as constants
+import src.docker_backend as db
+import src.reaper as rp
+import src.session_registry as sr
+
+
+class TestSessionReaper(unittest.TestCase):
+    """
+    Test SessionReaper class. Unit.
+    Instance managers are mocked, their DELETE forgets the session.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Create a reaper with a ttl of 10 and a cap of 2 containers
+        on a registry of its own.
+
+        Author: Namah Shrestha
+        """
+        self.registry: sr.SessionRegistry = sr.SessionRegistry(":memory:")
+        self.failures: list = []
+        self.instance_manager: mock.MagicMock = mock.MagicMock(
+            side_effect=self.delete_manager
+        )
+        self.reaper: rp.SessionReaper = rp.SessionReaper(
+            {constants.CENTOS: self.instance_manager},
+            idle_ttl=10,
+            max_containers=2,
+            registry=self.registry,
+        )
+
+    def delete_manager(self, command: str, instance_hash: str) -> mock.MagicMock:
+        """
+        Instance manager whose DELETE forgets the session,
+        or fails while there are failures left.
+
+        Author: Namah Shrestha
+        """
+
+        async def handle() -> None:
+            if self.failures:
+                raise self.failures.pop(0)
+            self.registry.remove(instance_hash)
+
+        instance_manager: mock.MagicMock = mock.MagicMock()
+        instance_manager.async_handle = handle
+        return instance_manager
+
+    def start(self, instance_hash: str, now: float) -> None:
+        self.registry.set_container(
+            instance_hash, f"id_{instance_hash}", constants.CENTOS, now=now
+        )
+
+    def use(self, instance_hash: str, now: float) -> None:
+        self.registry.begin_exec(instance_hash, now=now)
+        self.registry.end_exec(instance_hash, now=now)
+
+    def deleted(self) -> list:
+        return [call.args for call in self.instance_manager.call_args_list]
+
+    def test_idle_ttl(self) -> None:
+        """
+        1. Sessions idle for longer than the ttl are deleted.
+        2. Activity keeps a session alive.
+
+        Author: Namah Shrestha
+        """
+        self.start("a", now=0)
+        self.start("b", now=5)
+        self.use("a", now=8)
+        asyncio.run(self.reaper.reap_once(now=16))
+        self.assertEqual(self.deleted(), [(constants.DELETE, "b")])
+        self.assertNotIn("b", self.reaper)
+        self.assertIn("a", self.reaper)
+        self.assertEqual(self.reaper.stats()["evicted_idle"], 1)
+
+    def test_lru_eviction(self) -> None:
+        """
+        Above the cap the least recently used sessions are deleted.
+
+        Author: Namah Shrestha
+        """
+        for now, instance_hash in enumerate(["a", "b", "c", "d"]):
+            self.start(instance_hash, now=now)
+        self.use("a", now=4)
+        asyncio.run(self.reaper.reap_once(now=5))
+        self.assertEqual(
+            self.deleted(), [(constants.DELETE, "b"), (constants.DELETE, "c")]
+        )
+        self.assertEqual(self.registry.lru(10), ["d", "a"])
+        self.assertEqual(self.reaper.stats()["evicted_lru"], 2)
+
+    def test_failed_deletion(self) -> None:
+        """
+        A failed deletion is counted and retried in the next round.
+
+        Author: Namah Shrestha
+        """
+        self.failures.append(Exception("docker"))
+        self.start("a", now=0)
+        asyncio.run(self.reaper.reap_once(now=20))
+        self.assertIn("a", self.reaper)
+        asyncio.run(self.reaper.reap_once(now=20))
+        self.assertNotIn("a", self.reaper)
+        self.assertEqual(
+            self.reaper.stats(),
+            {
+                "sessions": 0,
+                "sessions_paused": 0,
+                "sessions_saved": 0,
+                "evicted_idle": 1,
+                "evicted_lru": 0,
+                "failures": 1,
+                "paused": 0,
+                "resumed": 0,
+                "pause_failures": 0,
+                "saved": 0,
+                "restored": 0,
+                "snapshots_expired": 0,
+                "snapshot_failures": 0,
+            },
+        )
+
+    def test_used_since_listed(self) -> None:
+        """
+        A session whose EXEC started after it was listed as idle
+        is not deleted.
+
+        Author: Namah Shrestha
+        """
+        self.start("a", now=0)
+        self.reaper.max_containers = 0
+        idle_sessions = self.reaper.idle_sessions
+
+        def listed_then_used(now: float) -> list:
+            listed: list = idle_sessions(now)
+            self.registry.begin_exec("a", now=1)
+            return listed
+
+        with mock.patch.object(self.reaper, "idle_sessions", listed_then_used):
+            asyncio.run(self.reaper.reap_once(now=20))
+        self.assertEqual(self.deleted(), [])
+        self.assertEqual(self.registry.get("a").state, constants.SESSION_RUNNING)
+
+    def test_only_running(self) -> None:
+        """
+        Sessions being created or deleted are not reaped.
+
+        Author: Namah Shrestha
+        """
+        self.registry.register("a", constants.CENTOS, now=0)
+        self.start("b", now=0)
+        self.registry.set_state("b", constants.SESSION_DELETING)
+        asyncio.run(self.reaper.reap_once(now=100))
+        self.assertEqual(self.deleted(), [])
+        self.assertEqual(len(self.reaper), 2)
+
+    def test_pause_idle(self) -> None:
+        """
+        1. Sessions idle for longer than the pause idle time are paused,
+           however short it is, the others keep running.
+        2. A paused session is resumed once and still reaped after the ttl.
+
+        Author: Namah Shrestha
+        """
+        backend: db.DockerFakeBackend = db.DockerFakeBackend()
+        backend.build_image(".", ["image"], "x")
+        db.set_backend(backend)
+        self.addCleanup(db.set_backend, None)
+        self.reaper.pause_after = 2
+        for instance_hash, now in (("a", 0), ("b", 4)):
+            container_id: str = backend.run_container(instance_hash, "image")
+            self.registry.set_container(
+                instance_hash, container_id, constants.CENTOS, now=now
+            )
+        asyncio.run(self.reaper.reap_once(now=6))
+        self.assertEqual(self.registry.get("a").state, constants.SESSION_PAUSED)
+        self.assertEqual(self.registry.get("b").state, constants.SESSION_RUNNING)
+        self.assertEqual(backend.paused, {self.registry.container_id("a")})
+        self.assertTrue(asyncio.run(self.reaper.resume("a")))
+        self.assertFalse(asyncio.run(self.reaper.resume("a")))
+        self.assertEqual(backend.paused, set())
+        self.assertEqual(self.registry.get("a").state, constants.SESSION_RUNNING)
+        self.assertEqual(
+            (self.reaper.stats()["paused"], self.reaper.stats()["resumed"]), (1, 1)
+        )
+        self.registry.set_state("a", constants.SESSION_PAUSED)
+        asyncio.run(self.reaper.reap_once(now=12))
+        self.assertEqual(self.deleted(), [(constants.DELETE, "a")])
+
+    def test_resume_adopted(self) -> None:
+        """
+        A session adopted paused at startup is resumed with pausing disabled.
+
+        Author: Namah Shrestha
+        """
+        backend: db.DockerFakeBackend = db.DockerFakeBackend()
+        backend.build_image(".", ["image"], "x")
+        db.set_backend(backend)
+        self.addCleanup(db.set_backend, None)
+        container_id: str = backend.run_container("a", "image")
+        backend.pause_container(container_id)
+        self.registry.set_container("a", container_id, constants.CENTOS)
+        self.registry.set_state("a", constants.SESSION_PAUSED)
+        self.reaper.pause_after = 0
+        self.assertTrue(asyncio.run(self.reaper.resume("a")))
+        self.assertEqual(backend.paused, set())
+
+    @mock.patch.object(constants, "EXEC_TIMEOUT", 20.0)
+    def test_running_exec_not_paused(self) -> None:
+        """
+        1. A session running an EXEC is not paused, however long it runs.
+        2. It is paused once the EXEC ends and the session is idle again.
+        3. An EXEC whose end was never recorded is forgotten after the
+           exec timeout.
+
+        Author: Namah Shrestha
+        """
+        self.reaper.idle_ttl = 0
+        self.reaper.pause_after = 2
+        self.start("a", now=0)
+        self.start("b", now=0)
+        self.registry.begin_exec("a", now=1)
+        self.registry.begin_exec("b", now=1)
+        with mock.patch.object(self.reaper, "pause", mock.AsyncMock()) as pause:
+            asyncio.run(self.reaper.reap_once(now=10))
+            self.assertEqual(pause.call_args_list, [])
+            self.registry.end_exec("a", now=11)
+            asyncio.run(self.reaper.reap_once(now=12))
+            self.assertEqual(pause.call_args_list, [])
+            asyncio.run(self.reaper.reap_once(now=14))
+            self.assertEqual(pause.call_args_list, [mock.call("a", 12)])
+            asyncio.run(self.reaper.reap_once(now=22))
+            self.assertEqual(
+                pause.call_args_list[1:], [mock.call("b", 20), mock.call("a", 20)]
+            )
+
+    def test_snapshot_idle(self) -> None:
+        """
+        1. Sessions idle for longer than the snapshot idle time are saved
+           instead of deleted, the others keep running.
+        2. A saved session is restored once.
+        3. Snapshots unused for the snapshot ttl are deleted.
+
+        Author: Namah Shrestha
+        """
+        backend: db.DockerFakeBackend = db.DockerFakeBackend()
+        backend.build_image(".", ["image"], "x")
+        db.set_backend(backend)
+        self.addCleanup(db.set_backend, None)
+        directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.reaper.snapshots.directory = directory.name
+        self.reaper.snapshot_after = 2
+        self.reaper.snapshot_ttl = 20
+        for instance_hash, now in (("a", 0), ("b", 4)):
+            container_id: str = backend.run_container(
+                constants.CENTOS_CONTAINER_NAME.format(instance_hash), "image"
+            )
+            self.registry.set_container(
+                instance_hash, container_id, constants.CENTOS, now=now
+            )
+        asyncio.run(self.reaper.reap_once(now=6))
+        self.assertEqual(self.registry.get("a").state, constants.SESSION_SAVED)
+        self.assertEqual(self.registry.get("b").state, constants.SESSION_RUNNING)
+        self.assertEqual(self.deleted(), [])
+        self.assertTrue(asyncio.run(self.reaper.restore("a")))
+        self.assertFalse(asyncio.run(self.reaper.restore("a")))
+        self.assertEqual(self.registry.get("a").state, constants.SESSION_RUNNING)
+        self.assertEqual(len(backend.containers), 2)
+        asyncio.run(self.reaper.reap_once(now=10))
+        self.assertEqual(self.registry.get("b").state, constants.SESSION_SAVED)
+        asyncio.run(self.reaper.reap_once(now=30))
+        self.assertIsNone(self.registry.get("b"))
+        self.assertEqual(self.registry.get("a").state, constants.SESSION_RUNNING)
+        self.assertEqual(os.listdir(directory.name), [])
+        self.assertEqual(self.deleted(), [])
+        self.assertEqual(
+            (self.reaper.stats()["saved"], self.reaper.stats()["snapshots_expired"]),
+            (2, 1),
+        )
+
+    def test_disabled(self) -> None:
+        """
+        A ttl and cap of 0 never delete anything.
+
+        Author: Namah Shrestha
+        """
+        self.reaper.idle_ttl = 0
+        self.reaper.max_containers = 0
+        for now, instance_hash in enumerate(["a", "b", "c"]):
+            self.start(instance_hash, now=now)
+        asyncio.run(self.reaper.reap_once(now=100))
+        self.assertEqual(len(self.reaper), 3)
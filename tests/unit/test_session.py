@@ -0,0 +1,78 @@
+"""
+Unit tests for the per connection session.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import unittest
+
+# modules
+import src.session as ss
+import src.session_registry as sr
+import src.constants as constants
+
+
+class TestSession(unittest.TestCase):
+    """
+    Test Session class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Create an unbound session.
+
+        Author: Namah Shrestha
+        """
+        self.session: ss.Session = ss.Session()
+
+    def tearDown(self) -> None:
+        sr.session_registry.clear()
+
+    def test_bind(self) -> None:
+        """
+        1. The first bind sets the instance hash and os.
+        2. Binding the same hash again is fine.
+        3. Binding another hash raises ValueError.
+
+        Author: Namah Shrestha
+        """
+        self.assertTrue(self.session.bind("test_hash", constants.CENTOS))
+        self.assertEqual(self.session.instance_hash, "test_hash")
+        self.assertEqual(self.session.instance_os, constants.CENTOS)
+        self.assertFalse(self.session.bind("test_hash", constants.CENTOS))
+        with self.assertRaises(ValueError):
+            self.session.bind("other_hash", constants.CENTOS)
+
+    def test_invalidate_container(self) -> None:
+        """
+        Invalidating the container forgets the container id
+        and the working directory.
+
+        Author: Namah Shrestha
+        """
+        self.session.container_id = "test_id"
+        self.session.change_directory_handler.dir_state_manager.curr_dir = "/tmp"
+        self.session.invalidate_container()
+        self.assertIsNone(self.session.container_id)
+        self.assertIsNone(self.session.change_directory_handler.workdir())
+
+    def test_recorded_cwd(self) -> None:
+        """
+        1. A changed working directory is recorded in the session registry.
+        2. A new session of the instance hash continues in it.
+
+        Author: Namah Shrestha
+        """
+        sr.session_registry.set_container("test_hash", "test_id", constants.CENTOS)
+        self.session.bind("test_hash", constants.CENTOS)
+        self.session.load_cwd()
+        self.assertIsNone(self.session.change_directory_handler.workdir())
+        self.session.change_directory_handler.dir_state_manager.curr_dir = "/tmp"
+        self.session.record_cwd()
+        self.assertEqual(sr.session_registry.get("test_hash").cwd, "/tmp")
+        session: ss.Session = ss.Session()
+        session.bind("test_hash", constants.CENTOS)
+        session.load_cwd()
+        self.assertEqual(session.change_directory_handler.workdir(), "/tmp")
@@ -0,0 +1,117 @@
+"""
+Unit tests for the idle session pauser.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import threading
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.constants as constants
+import src.docker_backend as db
+import src.metrics as metrics
+import src.session_pause as sp
+import src.session_registry as sr
+
+
+class TestSessionPauser(unittest.TestCase):
+    """
+    Test SessionPauser class against the fake backend. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Run one session container, last used at 0.
+
+        Author: Namah Shrestha
+        """
+        self.backend: db.DockerFakeBackend = db.DockerFakeBackend()
+        self.backend.build_image(".", ["image"], "x")
+        db.set_backend(self.backend)
+        self.addCleanup(db.set_backend, None)
+        self.registry: sr.SessionRegistry = sr.SessionRegistry(":memory:")
+        self.pauser: sp.SessionPauser = sp.SessionPauser(self.registry, wait=1)
+        self.container_id: str = self.backend.run_container("a", "image")
+        self.registry.set_container("a", self.container_id, constants.CENTOS, now=0)
+
+    def state(self) -> str:
+        return self.registry.get("a").state
+
+    def test_pause_and_resume(self) -> None:
+        """
+        1. A session used since the idle time is not paused.
+        2. An idle session is paused, then resumed once,
+           and the resume latency is recorded.
+
+        Author: Namah Shrestha
+        """
+        self.assertFalse(self.pauser.pause("a", 0))
+        self.assertEqual(self.backend.paused, set())
+        self.assertTrue(self.pauser.pause("a", 1))
+        self.assertEqual(self.state(), constants.SESSION_PAUSED)
+        self.assertEqual(self.backend.paused, {self.container_id})
+        resumes: int = metrics.session_resume_latency.get()["count"]
+        self.assertTrue(self.pauser.resume("a"))
+        self.assertFalse(self.pauser.resume("a"))
+        self.assertEqual(self.state(), constants.SESSION_RUNNING)
+        self.assertEqual(self.backend.paused, set())
+        self.assertEqual(metrics.session_resume_latency.get()["count"], resumes + 1)
+        self.assertEqual(
+            self.pauser.stats(), {"paused": 1, "resumed": 1, "pause_failures": 0}
+        )
+
+    def test_resume_waits_for_pause(self) -> None:
+        """
+        A resume during a pause waits for the container to be frozen,
+        then thaws it.
+
+        Author: Namah Shrestha
+        """
+        pausing: threading.Event = threading.Event()
+        resumed: list = []
+        pause_container = self.backend.pause_container
+
+        def slow_pause(container_id: str) -> bool:
+            pausing.set()
+            resume.join(0.05)
+            return pause_container(container_id)
+
+        def run_resume() -> None:
+            pausing.wait(1)
+            resumed.append(self.pauser.resume("a"))
+
+        resume: threading.Thread = threading.Thread(target=run_resume)
+        resume.start()
+        with mock.patch.object(self.backend, "pause_container", slow_pause):
+            self.assertTrue(self.pauser.pause("a", 1))
+        resume.join(1)
+        self.assertEqual(resumed, [True])
+        self.assertEqual(self.state(), constants.SESSION_RUNNING)
+        self.assertEqual(self.backend.paused, set())
+
+    def test_deleted_while_pausing(self) -> None:
+        """
+        1. A session deleted while it is being paused is unpaused.
+        2. A failed pause leaves the session running.
+
+        Author: Namah Shrestha
+        """
+        pause_container = self.backend.pause_container
+
+        def pause_and_delete(container_id: str) -> bool:
+            self.registry.set_state("a", constants.SESSION_DELETING)
+            return pause_container(container_id)
+
+        with mock.patch.object(self.backend, "pause_container", pause_and_delete):
+            self.assertFalse(self.pauser.pause("a", 1))
+        self.assertEqual(self.state(), constants.SESSION_DELETING)
+        self.assertEqual(self.backend.paused, set())
+        self.registry.set_state("a", constants.SESSION_RUNNING)
+        with mock.patch.object(self.backend, "pause_container", return_value=False):
+            self.assertFalse(self.pauser.pause("a", 1))
+        self.assertEqual(self.state(), constants.SESSION_RUNNING)
+        self.assertEqual(self.pauser.stats()["pause_failures"], 1)
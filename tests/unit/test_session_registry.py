@@ -0,0 +1,239 @@
+"""
+Unit tests for the shared session registry.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+# modules
+import src.constants as constants
+import src.session_registry as sr
+
+
+def register_in_child(path: str) -> None:
+    """
+    Register a session from a forked process.
+
+    Author: Namah Shrestha
+    """
+    sr.SessionRegistry(path).set_container("child_hash", "child_id", constants.CENTOS)
+
+
+class TestSessionRegistry(unittest.TestCase):
+    """
+    Test SessionRegistry class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Create a registry in a database file of its own.
+
+        Author: Namah Shrestha
+        """
+        directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path: str = os.path.join(directory.name, "sessions.db")
+        self.registry: sr.SessionRegistry = sr.SessionRegistry(self.path)
+        self.addCleanup(self.registry.close)
+
+    def test_lifecycle(self) -> None:
+        """
+        1. A registered session is creating, without container.
+        2. Its container makes it running.
+        3. The working directory and last use are recorded.
+        4. A new container starts over in the default working directory.
+
+        Author: Namah Shrestha
+        """
+        self.registry.register("test_hash", constants.CENTOS, now=1)
+        record: sr.SessionRecord = self.registry.get("test_hash")
+        self.assertEqual(record.state, constants.SESSION_CREATING)
+        self.assertIsNone(record.container_id)
+        self.registry.set_container("test_hash", "test_id", now=2)
+        self.registry.set_cwd("test_hash", "/tmp")
+        self.registry.begin_exec("test_hash", now=4)
+        self.registry.end_exec("test_hash", now=5)
+        record = self.registry.get("test_hash")
+        self.assertEqual(
+            (
+                record.container_id,
+                record.instance_os,
+                record.cwd,
+                record.state,
+                record.created_at,
+                record.last_used,
+            ),
+            ("test_id", constants.CENTOS, "/tmp", constants.SESSION_RUNNING, 1, 5),
+        )
+        self.registry.set_container("test_hash", "new_id", now=6)
+        record = self.registry.get("test_hash")
+        self.assertEqual((record.cwd, record.created_at), ("/", 6))
+        self.registry.remove("test_hash")
+        self.assertIsNone(self.registry.get("test_hash"))
+        self.assertFalse(
+            self.registry.set_state("test_hash", constants.SESSION_RUNNING)
+        )
+
+    def test_idle_and_lru(self) -> None:
+        """
+        Only running and dead sessions are idle or least recently used,
+        least recent first.
+
+        Author: Namah Shrestha
+        """
+        self.registry.set_container("a", "id_a", now=3)
+        self.registry.set_container("b", "id_b", now=1)
+        self.registry.set_container("c", "id_c", now=2)
+        self.registry.register("d", constants.CENTOS, now=0)
+        self.assertEqual(self.registry.idle(2.5), ["b", "c"])
+        self.assertEqual(self.registry.lru(2), ["b", "c"])
+        self.assertEqual(self.registry.lru(0), [])
+        self.assertEqual(self.registry.count(), 4)
+        self.assertEqual(self.registry.count(constants.SESSION_RUNNING), 3)
+
+    def test_mark_dead(self) -> None:
+        """
+        1. The running sessions of a stopped container are dead,
+           its short id matches.
+        2. Dead sessions are still idle and least recently used.
+
+        Author: Namah Shrestha
+        """
+        self.registry.set_container("a", "a" * 64, now=1)
+        self.registry.set_container("b", "id_b", now=2)
+        self.registry.register("c", constants.CENTOS, now=0)
+        self.assertEqual(self.registry.mark_dead("a" * 12), 1)
+        self.assertEqual(self.registry.mark_dead("a" * 64), 0)
+        self.assertEqual(self.registry.get("a").state, constants.SESSION_DEAD)
+        self.assertEqual(
+            self.registry.count(constants.SESSION_RUNNING, constants.SESSION_DEAD), 2
+        )
+        self.assertEqual(self.registry.idle(3), ["a", "b"])
+        self.assertEqual(self.registry.lru(1), ["a"])
+
+    def test_change_state(self) -> None:
+        """
+        1. The state only changes from one of the given states.
+        2. With idle before, only a session idle since then changes.
+        3. Paused sessions are idle and can be marked dead.
+
+        Author: Namah Shrestha
+        """
+        self.registry.set_container("a", "id_a", now=5)
+        self.assertFalse(
+            self.registry.change_state(
+                "a", constants.SESSION_PAUSING, (constants.SESSION_RUNNING,), 5
+            )
+        )
+        self.assertTrue(
+            self.registry.change_state(
+                "a", constants.SESSION_PAUSING, (constants.SESSION_RUNNING,), 6
+            )
+        )
+        self.assertFalse(
+            self.registry.change_state(
+                "a", constants.SESSION_PAUSED, (constants.SESSION_RUNNING,)
+            )
+        )
+        self.assertEqual(self.registry.idle(6), [])
+        self.assertTrue(
+            self.registry.change_state(
+                "a", constants.SESSION_PAUSED, (constants.SESSION_PAUSING,)
+            )
+        )
+        self.assertEqual(self.registry.idle(6), ["a"])
+        self.assertEqual(self.registry.idle(6, (constants.SESSION_RUNNING,)), [])
+        self.assertEqual(self.registry.mark_dead("id_a"), 1)
+
+    def test_running_execs(self) -> None:
+        """
+        1. A session running an EXEC is not idle and its state does not
+           change for being idle, whatever its last use.
+        2. Once its EXECs end it is used right then.
+        3. EXECs of a session last used long ago are forgotten.
+
+        Author: Namah Shrestha
+        """
+        self.registry.set_container("a", "id_a", now=0)
+        self.registry.begin_exec("a", now=1)
+        self.registry.begin_exec("a", now=2)
+        self.assertEqual(self.registry.idle(10), [])
+        self.assertFalse(
+            self.registry.change_state(
+                "a", constants.SESSION_PAUSING, (constants.SESSION_RUNNING,), 10
+            )
+        )
+        self.registry.end_exec("a", now=3)
+        self.assertEqual(self.registry.idle(10), [])
+        self.registry.end_exec("a", now=4)
+        self.registry.end_exec("a", now=4)
+        self.assertEqual(self.registry.idle(4), [])
+        self.assertEqual(self.registry.idle(5), ["a"])
+        self.registry.begin_exec("a", now=5)
+        self.assertEqual(self.registry.clear_execs(5), 0)
+        self.assertEqual(self.registry.clear_execs(6), 1)
+        self.assertTrue(
+            self.registry.change_state(
+                "a", constants.SESSION_PAUSING, (constants.SESSION_RUNNING,), 6
+            )
+        )
+
+    def test_shared_between_processes(self) -> None:
+        """
+        1. The database is in WAL mode.
+        2. A session registered by a forked process is seen by its parent.
+
+        Author: Namah Shrestha
+        """
+        self.assertEqual(self.registry.query("PRAGMA journal_mode"), [("wal",)])
+        process: multiprocessing.Process = multiprocessing.get_context("fork").Process(
+            target=register_in_child, args=(self.path,)
+        )
+        process.start()
+        process.join(10)
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.registry.container_id("child_hash"), "child_id")
+
+    def test_claim(self) -> None:
+        """
+        1. Of two handles of one database only the first claims a session.
+        2. A running session is not claimed, unless its container is stale.
+        3. A dead session is claimed again.
+
+        Author: Namah Shrestha
+        """
+        other: sr.SessionRegistry = sr.SessionRegistry(self.path)
+        self.addCleanup(other.close)
+        self.assertTrue(self.registry.claim("a", constants.CENTOS))
+        self.assertFalse(other.claim("a", constants.CENTOS))
+        self.assertEqual(other.get("a").state, constants.SESSION_CREATING)
+        self.registry.set_container("a", "id_a")
+        self.assertFalse(other.claim("a", constants.CENTOS))
+        self.assertFalse(other.claim("a", constants.CENTOS, "id_b"))
+        self.assertTrue(other.claim("a", constants.CENTOS, "id_a"))
+        self.assertFalse(self.registry.claim("a", constants.CENTOS, "id_a"))
+        self.registry.set_container("a", "id_a")
+        self.registry.mark_dead("id_a")
+        self.assertTrue(self.registry.claim("a", constants.CENTOS))
+        self.assertEqual(self.registry.get("a").state, constants.SESSION_CREATING)
+
+    def test_transaction_rollback(self) -> None:
+        """
+        A failing transaction changes nothing.
+
+        Author: Namah Shrestha
+        """
+        with self.assertRaises(KeyError):
+            with self.registry.transaction() as connection:
+                connection.execute(
+                    "DELETE FROM sessions WHERE instance_hash = ?", ("a",)
+                )
+                raise KeyError()
+        self.registry.set_container("a", "id_a")
+        self.assertEqual(self.registry.count(), 1)
@@ -0,0 +1,128 @@
+"""
+Unit tests for the idle session snapshot store.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.constants as constants
+import src.docker_backend as db
+import src.metrics as metrics
+import src.session_registry as sr
+import src.session_snapshot as sn
+
+
+class TestSessionSnapshots(unittest.TestCase):
+    """
+    Test SessionSnapshots class against the fake backend. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Run one session container in /tmp, last used at 0,
+        with snapshots in a directory of their own.
+
+        Author: Namah Shrestha
+        """
+        directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory: str = os.path.join(directory.name, "snapshots")
+        self.backend: db.DockerFakeBackend = db.DockerFakeBackend()
+        self.backend.build_image(".", ["image"], "x")
+        db.set_backend(self.backend)
+        self.addCleanup(db.set_backend, None)
+        self.registry: sr.SessionRegistry = sr.SessionRegistry(":memory:")
+        self.snapshots: sn.SessionSnapshots = sn.SessionSnapshots(
+            self.registry, self.directory, wait=1
+        )
+        self.name: str = constants.CENTOS_CONTAINER_NAME.format("a")
+        self.container_id: str = self.backend.run_container(self.name, "image")
+        self.registry.set_container("a", self.container_id, constants.CENTOS, now=0)
+        self.registry.set_cwd("a", "/tmp")
+        self.path: str = sn.snapshot_path("a", self.directory)
+
+    def state(self) -> str:
+        return self.registry.get("a").state
+
+    def test_save_and_restore(self) -> None:
+        """
+        1. A session used since the idle time is not saved.
+        2. An idle session is saved to its archive and its container
+           and image are removed.
+        3. The next restore runs a container of the snapshot in the
+           working directory of the session and deletes the archive.
+
+        Author: Namah Shrestha
+        """
+        self.assertFalse(self.snapshots.save("a", 0))
+        self.assertTrue(self.snapshots.save("a", 1))
+        self.assertEqual(self.state(), constants.SESSION_SAVED)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(os.listdir(self.directory), ["a.tar.gz"])
+        self.assertEqual(self.backend.containers, {})
+        self.assertNotIn(sn.snapshot_image("a"), self.backend.images)
+        self.assertTrue(self.snapshots.is_saved("a"))
+        restores: int = metrics.session_restore_latency.get()["count"]
+        self.assertTrue(self.snapshots.restore("a"))
+        self.assertFalse(self.snapshots.restore("a"))
+        record: sr.SessionRecord = self.registry.get("a")
+        self.assertEqual(
+            (record.state, record.cwd), (constants.SESSION_RUNNING, "/tmp")
+        )
+        self.assertEqual(self.backend.containers, {self.name: record.container_id})
+        self.assertNotEqual(record.container_id, self.container_id)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(metrics.session_restore_latency.get()["count"], restores + 1)
+        self.assertEqual(
+            self.snapshots.stats(),
+            {
+                "saved": 1,
+                "restored": 1,
+                "snapshots_expired": 0,
+                "snapshot_failures": 0,
+            },
+        )
+
+    def test_failures(self) -> None:
+        """
+        1. A failed snapshot leaves the session running, without archive.
+        2. A failed restore keeps the snapshot and raises SnapshotError.
+        3. A session whose archive is lost is forgotten.
+
+        Author: Namah Shrestha
+        """
+        with mock.patch.object(self.backend, "save_image", return_value=False):
+            self.assertFalse(self.snapshots.save("a", 1))
+        self.assertEqual(self.state(), constants.SESSION_RUNNING)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self.backend.containers, {self.name: self.container_id})
+        self.assertTrue(self.snapshots.save("a", 1))
+        with mock.patch.object(self.backend, "run_container", return_value=None):
+            with self.assertRaises(sn.SnapshotError):
+                self.snapshots.restore("a")
+        self.assertEqual(self.state(), constants.SESSION_SAVED)
+        self.assertTrue(os.path.exists(self.path))
+        os.remove(self.path)
+        self.assertFalse(self.snapshots.restore("a"))
+        self.assertIsNone(self.registry.get("a"))
+        self.assertEqual(self.snapshots.stats()["snapshot_failures"], 2)
+
+    def test_expire(self) -> None:
+        """
+        A snapshot unused since the time is deleted with its session.
+
+        Author: Namah Shrestha
+        """
+        self.snapshots.save("a", 1)
+        self.assertFalse(self.snapshots.expire("a", 0))
+        self.assertTrue(self.snapshots.expire("a", 1))
+        self.assertIsNone(self.registry.get("a"))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(sn.remove_snapshot("a", self.directory))
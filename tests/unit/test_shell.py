@@ -0,0 +1,94 @@
+"""
+Unit tests for the persistent shell.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import unittest
+
+# modules
+import src.docker_backend as db
+import src.shell as sh
+import tests.unit.fake_docker as fake_docker
+
+
+class TestPersistentShell(unittest.TestCase):
+    """
+    Test PersistentShell class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def run_command(self, shell: sh.PersistentShell, command: str) -> tuple:
+        stream: db.ExecStream = shell.stream(command)
+        return b"".join(stream), stream.exit_code
+
+    def test_local_shell(self) -> None:
+        """
+        Against a real local shell:
+        1. Output without a trailing newline is split from the marker.
+        2. The exit status of the command is returned.
+        3. Shell state stays between commands.
+        4. Commands cannot read the following commands from stdin.
+        5. A syntax error does not end the shell.
+        6. Exiting the shell returns its exit code and closes it.
+
+        Author: Namah Shrestha
+        """
+        shell: sh.PersistentShell = sh.PersistentShell(db.CLIExecChannel("/bin/bash"))
+        self.assertEqual(self.run_command(shell, "printf a"), (b"a", 0))
+        self.assertEqual(self.run_command(shell, "false"), (b"", 1))
+        self.run_command(shell, "cd /tmp && export ZOD_TEST=x")
+        self.assertEqual(
+            self.run_command(shell, "pwd; echo $ZOD_TEST"), (b"/tmp\nx\n", 0)
+        )
+        self.assertEqual(self.run_command(shell, "cat"), (b"", 0))
+        self.assertEqual(self.run_command(shell, "echo 'a")[1], 2)
+        self.assertEqual(self.run_command(shell, "echo b"), (b"b\n", 0))
+        self.assertEqual(self.run_command(shell, "exit 3"), (b"", 3))
+        self.assertTrue(shell.closed)
+        with self.assertRaises(sh.ShellClosedError):
+            shell.stream("ls")
+
+    def test_marker_split_between_reads(self) -> None:
+        """
+        A marker arriving in pieces is still recognized.
+
+        Author: Namah Shrestha
+        """
+        channel: fake_docker.FakeShellChannel = fake_docker.FakeShellChannel()
+        shell: sh.PersistentShell = sh.PersistentShell(channel)
+        channel.exec_outputs["ls"] = (0, b"bin\n", b"")
+        stream: db.ExecStream = shell.stream("ls")
+        data: bytes = channel.pending.pop()
+        channel.pending.extend(data[i : i + 3] for i in range(0, len(data), 3))
+        self.assertEqual(b"".join(stream), b"bin\n")
+        self.assertEqual(channel.commands, ["true", "ls"])
+
+    def test_closed_stream(self) -> None:
+        """
+        A stream closed before its marker closes the shell.
+
+        Author: Namah Shrestha
+        """
+        channel: fake_docker.FakeShellChannel = fake_docker.FakeShellChannel(
+            {"yes": (0, b"y\n" * 1000, b"")}
+        )
+        shell: sh.PersistentShell = sh.PersistentShell(channel)
+        stream: db.ExecStream = shell.stream("yes")
+        next(iter(stream))
+        stream.close()
+        self.assertTrue(shell.closed)
+        self.assertTrue(channel.closed)
+
+    def test_shell_did_not_start(self) -> None:
+        """
+        A shell that ends right away raises ShellClosedError.
+
+        Author: Namah Shrestha
+        """
+        channel: fake_docker.FakeShellChannel = fake_docker.FakeShellChannel()
+        channel.exit_code = 1
+        with self.assertRaises(sh.ShellClosedError):
+            sh.PersistentShell(channel)
+        self.assertTrue(channel.closed)
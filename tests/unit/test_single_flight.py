@@ -0,0 +1,75 @@
+"""
+Unit tests for the single flight of the lifecycle commands.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import asyncio
+import unittest
+
+# modules
+import src.constants as constants
+import src.single_flight as sf
+
+
+class TestSingleFlight(unittest.TestCase):
+    """
+    Test SingleFlight class. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        self.flights: sf.SingleFlight = sf.SingleFlight()
+        self.calls: list = []
+
+    async def operation(self, name: str) -> list:
+        self.calls.append(name)
+        await asyncio.sleep(0.01)
+        if name == "fail":
+            raise ValueError(name)
+        return [name]
+
+    def test_shared_result(self) -> None:
+        """
+        1. The same command of one hash runs once and shares its result.
+        2. Other hashes fly on their own.
+
+        Author: Namah Shrestha
+        """
+
+        async def run() -> list:
+            return await asyncio.gather(
+                self.flights.run("a", constants.CREATE, lambda: self.operation("a1")),
+                self.flights.run("a", constants.CREATE, lambda: self.operation("a2")),
+                self.flights.run("b", constants.CREATE, lambda: self.operation("b1")),
+            )
+
+        self.assertEqual(asyncio.run(run()), [["a1"], ["a1"], ["b1"]])
+        self.assertEqual(self.calls, ["a1", "b1"])
+        self.assertEqual(
+            self.flights.stats(), {"in_flight": 0, "started": 2, "shared": 1}
+        )
+
+    def test_shared_error_and_other_command(self) -> None:
+        """
+        1. The error of the flight is raised to every waiter.
+        2. Another command of the hash waits for the flight to land.
+
+        Author: Namah Shrestha
+        """
+
+        async def run() -> list:
+            return await asyncio.gather(
+                self.flights.run("a", constants.CREATE, lambda: self.operation("fail")),
+                self.flights.run("a", constants.CREATE, lambda: self.operation("a2")),
+                self.flights.run("a", constants.DELETE, lambda: self.operation("d")),
+                return_exceptions=True,
+            )
+
+        first, second, third = asyncio.run(run())
+        self.assertIsInstance(first, ValueError)
+        self.assertIs(second, first)
+        self.assertEqual(third, ["d"])
+        self.assertEqual(self.calls, ["fail", "d"])
+        self.assertEqual(self.flights.flights, {})
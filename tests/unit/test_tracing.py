@@ -0,0 +1,133 @@
+"""
+Unit tests for the request tracing.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.constants as constants
+import src.executor as executor
+import src.metrics as metrics
+import src.tracing as tracing
+
+
+class TestTracer(unittest.TestCase):
+    """
+    Test Tracer and TraceExporter classes. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def setUp(self) -> None:
+        """
+        Trace every request to a file of its own.
+
+        Author: Namah Shrestha
+        """
+        directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path: str = os.path.join(directory.name, "traces.jsonl")
+        self.exporter: tracing.TraceExporter = tracing.TraceExporter(self.path)
+        self.tracer: tracing.Tracer = tracing.Tracer(self.exporter, sample_rate=1)
+
+    def read_spans(self, path: str) -> dict:
+        """
+        The spans written to the file, by name.
+
+        Author: Namah Shrestha
+        """
+        with open(path) as trace_file:
+            return {span["name"]: span for span in map(json.loads, trace_file)}
+
+    def test_nested_spans(self) -> None:
+        """
+        1. Spans nest under the root span of the request, also in the
+           executor threads and around docker operations.
+        2. A failing span records its error.
+        3. Stopping the exporter writes the queued spans.
+
+        Author: Namah Shrestha
+        """
+
+        @metrics.docker_operation("test")
+        def docker_call() -> None:
+            with self.tracer.span("inner"):
+                pass
+
+        async def request() -> None:
+            with self.tracer.trace("request", command="EXEC"):
+                with mock.patch.object(tracing, "tracer", self.tracer):
+                    await executor.run_blocking(constants.EXECUTE, docker_call)
+                with self.assertRaises(KeyError):
+                    with self.tracer.span("failing"):
+                        raise KeyError()
+
+        self.exporter.start()
+        asyncio.run(request())
+        self.exporter.stop()
+        spans: dict = self.read_spans(self.path)
+        self.assertEqual(sorted(spans), ["docker.test", "failing", "inner", "request"])
+        root: dict = spans["request"]
+        self.assertIsNone(root["parent_id"])
+        self.assertEqual(root["attributes"], {"command": "EXEC"})
+        self.assertEqual(len(root["trace_id"]), 32)
+        self.assertEqual(
+            {span["trace_id"] for span in spans.values()}, {root["trace_id"]}
+        )
+        self.assertEqual(spans["docker.test"]["parent_id"], root["span_id"])
+        self.assertEqual(spans["inner"]["parent_id"], spans["docker.test"]["span_id"])
+        self.assertEqual(spans["failing"]["attributes"], {"error": "KeyError"})
+        self.assertGreaterEqual(root["duration"], spans["docker.test"]["duration"])
+        self.assertEqual(self.tracer.stats()["exported"], 4)
+
+    def test_sampling(self) -> None:
+        """
+        Requests that are not sampled and spans outside of a trace
+        record nothing.
+
+        Author: Namah Shrestha
+        """
+        self.exporter.start()
+        self.addCleanup(self.exporter.stop)
+        self.tracer.sample_rate = 0
+        with self.tracer.trace("request") as span:
+            self.assertIsNone(span)
+            with self.tracer.span("inner") as inner:
+                self.assertIsNone(inner)
+        self.assertEqual(self.tracer.stats()["traces"], 0)
+        self.assertEqual(self.exporter.spans.qsize(), 0)
+
+    def test_rotation_and_drops(self) -> None:
+        """
+        1. The file is rotated before it grows past the max size,
+           keeping the backups.
+        2. Spans are only queued while the exporter runs, and dropped
+           when the queue is full.
+
+        Author: Namah Shrestha
+        """
+        self.exporter.max_bytes = 1
+        self.exporter.backups = 1
+        for name in ("a", "b", "c"):
+            span: tracing.Span = tracing.Span("trace", None, name, {})
+            span.finish()
+            self.exporter.write([span])
+        self.exporter.file.close()
+        self.assertEqual(list(self.read_spans(self.path)), ["c"])
+        self.assertEqual(list(self.read_spans(f"{self.path}.1")), ["b"])
+        self.assertFalse(os.path.exists(f"{self.path}.2"))
+        self.assertEqual(self.exporter.rotations, 2)
+        exporter: tracing.TraceExporter = tracing.TraceExporter(self.path, queue_size=1)
+        exporter.export(span)
+        self.assertEqual(exporter.spans.qsize(), 0)
+        exporter.thread = mock.MagicMock()
+        exporter.export(span)
+        exporter.export(span)
+        self.assertEqual(exporter.dropped, 1)
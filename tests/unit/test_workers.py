@@ -0,0 +1,142 @@
+"""
+Unit tests for the multi process mode.
+
+Author: Namah Shrestha
+"""
+# built-ins
+import sys
+import time
+import unittest
+import unittest.mock as mock
+
+# modules
+import src.constants as constants
+import src.workers as wk
+
+
+def exit_with_socket_state(index: int, sock) -> None:
+    """
+    Worker that exits right away, with 3 if it got the shared socket.
+
+    Author: Namah Shrestha
+    """
+    sys.exit(3 if sock is not None else 4)
+
+
+def sleep_forever(index: int, sock) -> None:
+    """
+    Worker that runs until it is interrupted.
+
+    Author: Namah Shrestha
+    """
+    try:
+        time.sleep(60)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+class TestWorkerSupervisor(unittest.TestCase):
+    """
+    Test WorkerSupervisor class with forked workers. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def test_restart(self) -> None:
+        """
+        1. The workers get the shared listening socket.
+        2. A worker that exits is restarted with the same index.
+
+        Author: Namah Shrestha
+        """
+        supervisor: wk.WorkerSupervisor = wk.WorkerSupervisor(
+            exit_with_socket_state,
+            workers=1,
+            host="127.0.0.1",
+            port=0,
+            reuse_port=False,
+        )
+        self.addCleanup(supervisor.stop)
+        supervisor.start()
+        self.assertIsNotNone(supervisor.sock)
+        first = supervisor.processes[0]
+        with mock.patch.object(wk.time, "sleep") as mock_sleep:
+            self.assertEqual(supervisor.supervise_once(timeout=10), [0])
+        mock_sleep.assert_called_once_with(constants.WORKER_RESTART_DELAY)
+        self.assertEqual(first.exitcode, 3)
+        self.assertIsNot(supervisor.processes[0], first)
+        self.assertEqual(supervisor.restarts, 1)
+
+    def test_reuse_port(self) -> None:
+        """
+        With SO_REUSEPORT the workers bind the port themselves.
+
+        Author: Namah Shrestha
+        """
+        supervisor: wk.WorkerSupervisor = wk.WorkerSupervisor(
+            exit_with_socket_state, workers=1, reuse_port=True
+        )
+        self.addCleanup(supervisor.stop)
+        supervisor.start()
+        self.assertIsNone(supervisor.sock)
+        supervisor.stopping = True
+        self.assertEqual(supervisor.supervise_once(timeout=10), [])
+        self.assertEqual(supervisor.processes[0].exitcode, 4)
+
+    def test_stop(self) -> None:
+        """
+        Stopping interrupts every worker and closes the shared socket.
+
+        Author: Namah Shrestha
+        """
+        supervisor: wk.WorkerSupervisor = wk.WorkerSupervisor(
+            sleep_forever, workers=2, host="127.0.0.1", port=0, reuse_port=False
+        )
+        supervisor.start()
+        supervisor.stop(timeout=10)
+        self.assertEqual(
+            [process.exitcode for process in supervisor.processes.values()], [0, 0]
+        )
+        self.assertIsNone(supervisor.sock)
+
+    def test_restart_delay(self) -> None:
+        """
+        The delay doubles while a worker keeps dying right after its start,
+        up to the maximum, and resets once it ran long enough.
+
+        Author: Namah Shrestha
+        """
+        supervisor: wk.WorkerSupervisor = wk.WorkerSupervisor(sleep_forever)
+        supervisor.started_at[0] = time.monotonic()
+        delays: list = [supervisor.restart_delay(0) for _ in range(7)]
+        self.assertEqual(delays, [1.0, 2.0, 4.0, 8.0, 16.0, 30.0, 30.0])
+        supervisor.started_at[0] = time.monotonic() - 60
+        self.assertEqual(supervisor.restart_delay(0), 0.0)
+        supervisor.started_at[0] = time.monotonic()
+        self.assertEqual(supervisor.restart_delay(0), 1.0)
+
+
+class TestWorkerShare(unittest.TestCase):
+    """
+    Test worker_share function. Unit.
+
+    Author: Namah Shrestha
+    """
+
+    def test_worker_share(self) -> None:
+        """
+        1. The shares add up to the limit.
+        2. Every worker gets at least 1.
+
+        Author: Namah Shrestha
+        """
+        self.assertEqual(
+            [wk.worker_share(6, 4, index) for index in range(4)], [2, 2, 1, 1]
+        )
+        self.assertEqual([wk.worker_share(5, 2, index) for index in range(2)], [3, 2])
+        self.assertEqual(
+            [wk.worker_share(4, 4, index) for index in range(4)], [1, 1, 1, 1]
+        )
+        self.assertEqual(
+            [wk.worker_share(2, 3, index) for index in range(3)], [1, 1, 1]
+        )